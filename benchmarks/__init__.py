@@ -0,0 +1 @@
+"""ベンチマークモジュール"""
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+/api/control ベンチマーク
+
+FastAPIのルートとLeanControlAppの1リクエストあたりの処理時間を比較します。
+ネットワークを介さず、ASGIアプリケーションを直接呼び出して計測します。
+
+使用方法:
+    python -m benchmarks.bench_control_endpoint [--iterations 20000]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.http.lean import LeanControlApp  # noqa: E402
+from src.http.server import HTTPServer  # noqa: E402
+from src.tbbox.state import DeviceStateSnapshot  # noqa: E402
+from src.utils.logger import logger  # noqa: E402
+
+
+# 計測に使用するクエリ（成功・状態問い合わせ・パラメータエラー）
+QUERIES = [
+    b"alert=10109999&id=8942310222000544338",
+    b"alert=99999999&id=8942310222000544338",
+    b"alert=12349999&id=8942310222000544338",
+]
+
+
+def make_scope(query_string: bytes) -> Dict[str, Any]:
+    """GET /api/control のASGIスコープを作成"""
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/api/control",
+        "raw_path": b"/api/control",
+        "root_path": "",
+        "query_string": query_string,
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8080),
+    }
+
+
+async def run_app(app, query_string: bytes, iterations: int) -> float:
+    """
+    ASGIアプリを指定回数呼び出して1リクエストあたりの時間を返す
+
+    Returns:
+        float: 1リクエストあたりの処理時間（マイクロ秒）
+    """
+    scope = make_scope(query_string)
+    messages: List[Dict[str, Any]] = []
+
+    async def receive() -> Dict[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Dict[str, Any]) -> None:
+        messages.append(message)
+
+    # ウォームアップ
+    for _ in range(min(1000, iterations)):
+        await app(dict(scope), receive, send)
+
+    messages.clear()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await app(dict(scope), receive, send)
+    elapsed = time.perf_counter() - started
+
+    return elapsed / iterations * 1e6
+
+
+def main() -> int:
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description="/api/control ベンチマーク")
+    parser.add_argument("--iterations", type=int, default=20000, help="1ケースあたりの反復回数")
+    args = parser.parse_args()
+
+    # ログ出力のコストを除外してフレームワーク部分のみを比較する
+    logger.setLevel(logging.ERROR)
+
+    server = HTTPServer(callback=lambda alert: True, status_snapshot=DeviceStateSnapshot())
+    apps = {
+        "fastapi": server.get_app(),
+        "lean": LeanControlApp(server),
+    }
+
+    print(f"{'query':<45} {'fastapi (us)':>14} {'lean (us)':>12} {'speedup':>9}")
+    for query in QUERIES:
+        results = {
+            name: asyncio.run(run_app(app, query, args.iterations))
+            for name, app in apps.items()
+        }
+        speedup = results["fastapi"] / results["lean"]
+        print(
+            f"{query.decode():<45} {results['fastapi']:>14.1f} "
+            f"{results['lean']:>12.1f} {speedup:>8.1f}x"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""
+ホットパスのマイクロベンチマーク
+
+1件のalertの処理で通過する各段階（alertの検証、スイッチパターンの解析、
+プログラムIDの計算、コマンドのエンコード、TBBOXクライアントの送受信、ログ出力）を
+個別に計測し、1回あたりの処理時間（ns/op）とメモリ確保量（tracemalloc）を表示します。
+
+計測結果はリポジトリ内のベースライン（benchmarks/baseline.json）と比較し、
+許容範囲を超えて遅くなった・確保量が増えた段階があれば終了コード1で終了します。
+処理時間は基準処理（_calibration）との比で比較するため、ベースラインを記録した
+マシンと異なるマシン（開発機・Raspberry Pi）でも比較できます。
+
+使用方法:
+    python -m benchmarks.microbench
+    python -m benchmarks.microbench --tolerance 0.5 --stage parse_alert --stage encode_command
+    python -m benchmarks.microbench --update-baseline   # 意図した変更の後にベースラインを更新
+    python -m benchmarks.microbench --json
+"""
+import argparse
+import json
+import logging
+import platform
+import statistics
+import sys
+import timeit
+import tracemalloc
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import settings  # noqa: E402
+from src.http.server import HTTPServer  # noqa: E402
+from src.mapper.switch_mapper import SwitchMapper  # noqa: E402
+from src.tbbox.client import TBBOXClient  # noqa: E402
+from src.tbbox.protocol import encode_command  # noqa: E402
+from src.tbbox.simulator import ACTION_SWITCH, COMMAND_PLAYBACK, make_response  # noqa: E402
+from src.tbbox.transport import MemoryTransport  # noqa: E402
+from src.utils.logger import logger  # noqa: E402
+
+# ベースラインファイル
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+
+# デフォルトの許容範囲（ベースラインに対する増加率）
+DEFAULT_TOLERANCE = 0.3
+
+# メモリ確保量の比較で許容する絶対量（バイト）
+# 数十バイトの確保は内部キャッシュの状態などで前後するため、比率だけでは判定しない
+ALLOC_SLACK = 64
+
+# 計測に使用する値
+ALERT = "10109999"
+SIM_ID = "8942310222000544338"
+SWITCH_PATTERN = "1010"
+PROGRAM_ID = "11"
+
+
+@dataclass
+class Stage:
+    """計測する段階"""
+
+    name: str
+    description: str
+    # 計測対象の関数（引数なし）を作成する
+    setup: Callable[[], Callable[[], Any]]
+    # 計測中のログレベル（ログ出力の段階以外は出力しない）
+    log_level: int = logging.WARNING
+
+
+@dataclass
+class StageResult:
+    """1段階の計測結果"""
+
+    name: str
+    ns_per_op: float
+    alloc_bytes: float
+    retained_bytes: float
+    calibration_ns: float
+    baseline: Optional[Dict[str, float]] = None
+    regressions: List[str] = field(default_factory=list)
+
+    @property
+    def relative(self) -> float:
+        """基準処理に対する処理時間の比"""
+        return self.ns_per_op / self.calibration_ns
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ns_per_op": round(self.ns_per_op, 1),
+            "alloc_bytes": round(self.alloc_bytes, 1),
+            "retained_bytes": round(self.retained_bytes, 1),
+            "calibration_ns": round(self.calibration_ns, 1),
+            "relative": round(self.relative, 4),
+            "regressions": self.regressions,
+        }
+
+
+class _NullStream:
+    """書き込みを捨てるストリーム（ログ出力の計測用）"""
+
+    def write(self, text: str) -> int:
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+def _calibration() -> Callable[[], Any]:
+    """
+    基準処理
+
+    マシンの速度の違いを打ち消すため、各段階の処理時間はこの処理との比で比較する
+    """
+    table = {str(i): i for i in range(16)}
+
+    def run() -> int:
+        total = 0
+        for key in ("1", "5", "9", "13"):
+            total += table[key] * 2
+        return total + len("".join(("10", "10")))
+
+    return run
+
+
+def _validate_alert() -> Callable[[], Any]:
+    server = HTTPServer(callback=lambda alert: True)
+    return lambda: server._validate_alert(ALERT)
+
+
+def _parse_alert() -> Callable[[], Any]:
+    mapper = SwitchMapper()
+    return lambda: mapper.parse_alert(ALERT)
+
+
+def _calculate_program_id() -> Callable[[], Any]:
+    server = HTTPServer(callback=lambda alert: True)
+    return lambda: server._calculate_program_id(SWITCH_PATTERN)
+
+
+def _encode_command() -> Callable[[], Any]:
+    command = settings.PROGRAM_COMMANDS[PROGRAM_ID]
+    encode_command(command)
+    return lambda: encode_command(command)
+
+
+def _encode_command_uncached() -> Callable[[], Any]:
+    command = settings.PROGRAM_COMMANDS[PROGRAM_ID]
+    return lambda: encode_command.__wrapped__(command)
+
+
+def _send_raw_command() -> Callable[[], Any]:
+    # 固定の成功応答を即座に返す接続で、クライアント側の処理（エンコード・送信・
+    # 応答の解析・RTTの更新）だけを計測する
+    response = make_response(COMMAND_PLAYBACK, ACTION_SWITCH)
+
+    def handler_factory():
+        return lambda data: response
+
+    client = TBBOXClient(transport=MemoryTransport(handler_factory))
+    if not client.connect():
+        raise RuntimeError("メモリ内接続に失敗しました")
+    command = settings.PROGRAM_COMMANDS[PROGRAM_ID]
+    return lambda: client._send_raw_command(command)
+
+
+def _alert_log_lines() -> Callable[[], Any]:
+    """切り替えが成功した1件のalertで出力されるINFOログ"""
+    def run() -> None:
+        logger.info(f"リクエスト受信: alert={ALERT}, id={SIM_ID}")
+        logger.info(f"alertを受信しました: {ALERT}")
+        logger.info(f"パターン '{SWITCH_PATTERN}' → プログラムID '{PROGRAM_ID}'")
+        logger.info(f"プログラム切り替えリクエスト: プログラムID={PROGRAM_ID}")
+        logger.info(f"プログラム '{PROGRAM_ID}' への切り替えを実行します")
+        logger.info(f"プログラム '{PROGRAM_ID}' への切り替えが完了しました")
+        logger.info(f"プログラム切り替え成功: {PROGRAM_ID}")
+
+    return run
+
+
+# 計測する段階（ベースラインのキーと対応する）
+STAGES: List[Stage] = [
+    Stage("validate_alert", "HTTPServer._validate_alert", _validate_alert),
+    Stage("parse_alert", "SwitchMapper.parse_alert", _parse_alert),
+    Stage("calculate_program_id", "HTTPServer._calculate_program_id", _calculate_program_id),
+    Stage("encode_command", "encode_command（キャッシュ済み）", _encode_command),
+    Stage("encode_command_uncached", "encode_command（キャッシュなし）", _encode_command_uncached),
+    Stage("send_raw_command", "TBBOXClient._send_raw_command（メモリ内接続）", _send_raw_command),
+    Stage("log_per_alert", "1件のalertのINFOログ（7行）", _alert_log_lines, log_level=logging.INFO),
+    Stage("log_per_alert_filtered", "同上（WARNINGで抑制）", _alert_log_lines),
+]
+
+
+@contextmanager
+def _quiet_logger(level: int) -> Iterator[None]:
+    """
+    ログレベルを変更し、出力先を捨てるストリームに切り替える
+
+    上位のロガー（pytestのログ収集など）には伝播させず、アプリケーションのハンドラのみ計測する
+    """
+    saved_level = logger.level
+    saved_propagate = logger.propagate
+    saved_streams = [
+        (handler, handler.setStream(_NullStream()))
+        for handler in logger.handlers
+        if isinstance(handler, logging.StreamHandler)
+    ]
+    saved_handler_levels = [(handler, handler.level) for handler in logger.handlers]
+    logger.setLevel(level)
+    logger.propagate = False
+    for handler in logger.handlers:
+        handler.setLevel(level)
+    try:
+        yield
+    finally:
+        logger.setLevel(saved_level)
+        logger.propagate = saved_propagate
+        for handler, handler_level in saved_handler_levels:
+            handler.setLevel(handler_level)
+        for handler, stream in saved_streams:
+            handler.setStream(stream)
+
+
+def measure_time(
+    funcs: List[Callable[[], Any]],
+    min_time: float = 0.2,
+    repeat: int = 5
+) -> List[float]:
+    """
+    1回あたりの処理時間を計測
+
+    関数ごとに1回の計測がmin_time秒以上になる反復回数を求め、
+    各関数を交互にrepeat回計測した最小値を使う
+    （他のプロセスの負荷などによる速度の変動が、各関数に同じように影響するようにする）
+
+    Args:
+        funcs: 計測対象の関数
+        min_time: 1回の計測の最短時間（秒）
+        repeat: 計測回数
+
+    Returns:
+        List[float]: 関数ごとの1回あたりの処理時間（ナノ秒）
+    """
+    timers = []
+    for func in funcs:
+        timer = timeit.Timer(func)
+        number = 1
+        while timer.timeit(number) < min_time:
+            number *= 2
+        timers.append((timer, number))
+
+    best = [float("inf")] * len(funcs)
+    for _ in range(repeat):
+        for i, (timer, number) in enumerate(timers):
+            best[i] = min(best[i], timer.timeit(number) / number * 1e9)
+    return best
+
+
+def _trace(func: Callable[[], Any], iterations: int) -> Tuple[float, float]:
+    """tracemalloc有効中に呼び出して（ピークの中央値, 残存量の合計）を返す"""
+    # 計測値の保存でメモリを確保しないよう、事前に確保した配列に書き込む
+    peaks = array("q", bytes(8 * iterations))
+    start, _ = tracemalloc.get_traced_memory()
+    for i in range(iterations):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        peaks[i] = peak - before
+    end, _ = tracemalloc.get_traced_memory()
+    return statistics.median(peaks), end - start
+
+
+def measure_allocations(func: Callable[[], Any], iterations: int = 200) -> Dict[str, float]:
+    """
+    1回あたりのメモリ確保量を計測
+
+    計測自体（呼び出しとtracemallocの値の取得）による確保量は、
+    何もしない関数で計測した値を差し引いて除外する
+
+    Args:
+        func: 計測対象の関数
+        iterations: 計測回数
+
+    Returns:
+        Dict: alloc_bytes（1回の呼び出し中に確保されたメモリのピーク、中央値）、
+              retained_bytes（呼び出し後も解放されずに残ったメモリ、1回あたり）
+    """
+    # キャッシュなど初回のみの確保を除外する
+    for _ in range(10):
+        func()
+
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        overhead, overhead_retained = _trace(lambda: None, iterations)
+        peak, retained = _trace(func, iterations)
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+    return {
+        "alloc_bytes": max(0.0, peak - overhead),
+        "retained_bytes": max(0.0, (retained - overhead_retained) / iterations),
+    }
+
+
+def run_stage(stage: Stage, min_time: float = 0.2) -> StageResult:
+    """
+    1段階を計測
+
+    Args:
+        stage: 計測する段階
+        min_time: 1回の計測の最短時間（秒）
+
+    Returns:
+        StageResult: 計測結果
+    """
+    with _quiet_logger(stage.log_level):
+        func = stage.setup()
+        ns_per_op, calibration_ns = measure_time([func, _calibration()], min_time)
+        allocations = measure_allocations(func)
+
+    return StageResult(
+        name=stage.name,
+        ns_per_op=ns_per_op,
+        calibration_ns=calibration_ns,
+        **allocations
+    )
+
+
+def run_suite(names: Optional[List[str]] = None, min_time: float = 0.2) -> List[StageResult]:
+    """
+    段階を順に計測
+
+    Args:
+        names: 計測する段階の名前（省略時はすべて）
+        min_time: 1回の計測の最短時間（秒）
+
+    Returns:
+        List[StageResult]: 計測結果
+
+    Raises:
+        ValueError: 不明な段階の名前が指定された場合
+    """
+    known = {stage.name for stage in STAGES}
+    unknown = set(names or []) - known
+    if unknown:
+        raise ValueError(f"不明な段階です: {', '.join(sorted(unknown))}")
+
+    return [run_stage(stage, min_time) for stage in STAGES if not names or stage.name in names]
+
+
+def load_baseline(path: Path = BASELINE_FILE) -> Dict[str, Any]:
+    """ベースラインを読み込む（存在しない場合は空）"""
+    if not path.exists():
+        return {"stages": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(results: List[StageResult], path: Path = BASELINE_FILE) -> None:
+    """
+    計測結果をベースラインとして保存
+
+    指定しなかった段階の値と、段階ごとに設定した許容範囲（tolerance）は保持する
+    """
+    baseline = load_baseline(path)
+    stages = baseline.setdefault("stages", {})
+    for result in results:
+        entry = stages.setdefault(result.name, {})
+        entry.update(
+            relative=round(result.relative, 4),
+            ns_per_op=round(result.ns_per_op, 1),
+            alloc_bytes=round(result.alloc_bytes, 1),
+            retained_bytes=round(result.retained_bytes, 1),
+        )
+    baseline["recorded_on"] = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "calibration_ns": (
+            round(statistics.median(r.calibration_ns for r in results), 1) if results else None
+        ),
+    }
+    baseline["stages"] = {name: stages[name] for name in sorted(stages)}
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def compare(
+    results: List[StageResult],
+    baseline: Dict[str, Any],
+    tolerance: float = DEFAULT_TOLERANCE,
+    check_time: bool = True
+) -> List[StageResult]:
+    """
+    計測結果をベースラインと比較
+
+    処理時間は基準処理との比で、メモリ確保量はバイト数で比較し、
+    許容範囲を超えた項目を各結果のregressionsに記録する
+    段階ごとの許容範囲はベースラインの"tolerance"で上書きできる
+
+    Args:
+        results: 計測結果
+        baseline: ベースライン
+        tolerance: 許容する増加率（0.3で30%）
+        check_time: Falseの場合はメモリ確保量のみ比較する
+
+    Returns:
+        List[StageResult]: 許容範囲を超えた段階の計測結果
+    """
+    regressed = []
+    stages = baseline.get("stages", {})
+    for result in results:
+        entry = stages.get(result.name)
+        result.baseline = entry
+        result.regressions = []
+        if not entry:
+            continue
+
+        limit = 1 + entry.get("tolerance", tolerance)
+        if check_time and result.relative > entry["relative"] * limit:
+            result.regressions.append(
+                f"処理時間 {result.relative / entry['relative']:.2f}倍"
+            )
+        for key, label in (("alloc_bytes", "確保量"), ("retained_bytes", "残存量")):
+            allowed = entry.get(key, 0) * limit + ALLOC_SLACK
+            if getattr(result, key) > allowed:
+                result.regressions.append(
+                    f"{label} {getattr(result, key):.0f}B（ベースライン {entry.get(key, 0):.0f}B）"
+                )
+        if result.regressions:
+            regressed.append(result)
+    return regressed
+
+
+def format_results(results: List[StageResult]) -> str:
+    """表形式の文字列に変換"""
+    lines = [
+        f"{'stage':<26}{'ns/op':>10}{'alloc B':>10}{'retain B':>10}{'vs base':>9}  status"
+    ]
+    for result in results:
+        ratio = "-"
+        if result.baseline:
+            ratio = f"{result.relative / result.baseline['relative']:.2f}x"
+        status = "NG: " + ", ".join(result.regressions) if result.regressions else "ok"
+        if not result.baseline:
+            status = "ベースラインなし"
+        lines.append(
+            f"{result.name:<26}{result.ns_per_op:>10.0f}{result.alloc_bytes:>10.0f}"
+            f"{result.retained_bytes:>10.0f}{ratio:>9}  {status}"
+        )
+    if results:
+        calibration = statistics.median(r.calibration_ns for r in results)
+        lines.append(f"\n基準処理: {calibration:.0f} ns/op")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """メイン関数"""
+    parser = argparse.ArgumentParser(
+        description="ホットパスのマイクロベンチマーク",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("使用方法:", 1)[1],
+    )
+    parser.add_argument("--stage", action="append", choices=[s.name for s in STAGES],
+                        help="計測する段階（複数指定可、省略時はすべて）")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"許容する増加率（デフォルト: {DEFAULT_TOLERANCE}）")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="1回の計測の最短時間（秒、デフォルト: 0.2）")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE,
+                        help="ベースラインファイル（デフォルト: benchmarks/baseline.json）")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="計測結果をベースラインとして保存")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    args = parser.parse_args(argv)
+
+    if args.tolerance < 0:
+        parser.error("--toleranceは0以上で指定してください")
+
+    results = run_suite(args.stage, args.min_time)
+
+    if args.update_baseline:
+        save_baseline(results, args.baseline)
+        print(f"ベースラインを更新しました: {args.baseline}", file=sys.stderr)
+        regressed = []
+    else:
+        regressed = compare(results, load_baseline(args.baseline), args.tolerance)
+
+    if args.json:
+        print(json.dumps({r.name: r.to_dict() for r in results}, ensure_ascii=False, indent=2))
+    else:
+        print(format_results(results))
+
+    if regressed:
+        print(
+            f"\n{len(regressed)}件の段階が許容範囲（+{args.tolerance:.0%}）を超えました: "
+            + ", ".join(r.name for r in regressed),
+            file=sys.stderr
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+alertリプレイツール
+
+記録された /api/control のリクエストを元の到着間隔のまま（speed倍速で）再生し、
+レイテンシの分布、切り替え回数、冪等性キャッシュによる削減数を集計します。
+実際の運用データの負荷で、必要な処理能力を見積もるために使用します。
+
+再生先:
+    --url を指定した場合: 起動中のスイッチャーにHTTPで送信
+    省略した場合: HTTPServer.get_app() をプロセス内で直接呼び出し、
+                  TBBOXの代わりにシミュレータ（メモリ内接続）に切り替えコマンドを送る
+
+入力形式（--formatで指定、省略時は拡張子から判定）:
+    log      アプリケーションログ（"リクエスト受信: alert=..., id=..."の行）、
+             またはアクセスログ（"GET /api/control?alert=...&id=..."を含む行）
+    history  切り替え履歴データベース（data/history.db）
+    jsonl    1行1リクエストのJSON（{"ts": UNIX時間またはISO形式, "alert": ..., "id": ...}）
+
+使用方法:
+    python -m benchmarks.replay_alerts data/history.db --speed 1000
+    python -m benchmarks.replay_alerts logs/app.log --speed 100 --latency 0.03
+    python -m benchmarks.replay_alerts linkbase.log --url http://192.168.0.100:8080 --speed 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.bench_control_endpoint import make_scope  # noqa: E402
+from config import settings  # noqa: E402
+from main import TBBOXPlaylistSwitcher  # noqa: E402
+from src.http.idempotency import IdempotencyCache  # noqa: E402
+from src.http.server import HTTPServer  # noqa: E402
+from src.mapper.layout import AlertLayout  # noqa: E402
+from src.mapper.switch_mapper import SwitchMapper  # noqa: E402
+from src.tbbox.client import TBBOXClient  # noqa: E402
+from src.tbbox.playlist import PlaylistController  # noqa: E402
+from src.tbbox.simulator import TBBOXSimulator  # noqa: E402
+from src.utils.logger import logger  # noqa: E402
+from src.utils.stats import PERCENTILES, summarize  # noqa: E402
+
+# 再生速度の範囲
+MIN_SPEED = 1.0
+MAX_SPEED = 1000.0
+
+# ログの時刻（ISO形式 / Common Log Format）
+_ISO_TIME = re.compile(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?")
+_CLF_TIME = re.compile(r"\d{2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2}(?: [+-]\d{4})?")
+# アクセスログのリクエスト行
+_CONTROL_QUERY = re.compile(r"/api/control\?([^\s\"]*)")
+# アプリケーションログのリクエスト受信行
+_RECEIVED = re.compile(r"リクエスト受信: alert=(\S*?), id=(\S*)")
+
+
+@dataclass(frozen=True)
+class AlertEvent:
+    """記録された1リクエスト"""
+
+    ts: float
+    alert: Optional[str]
+    sim_id: Optional[str] = None
+
+    def query_string(self) -> str:
+        params = {}
+        if self.alert is not None:
+            params["alert"] = self.alert
+        if self.sim_id is not None:
+            params["id"] = self.sim_id
+        return urlencode(params)
+
+
+def _parse_time(line: str) -> Optional[float]:
+    """ログ行から時刻を取り出してUNIX時間に変換"""
+    match = _ISO_TIME.search(line)
+    if match:
+        return datetime.fromisoformat(match.group(0).replace(",", ".").replace(" ", "T")).timestamp()
+    match = _CLF_TIME.search(line)
+    if match:
+        text = match.group(0)
+        fmt = "%d/%b/%Y:%H:%M:%S %z" if " " in text else "%d/%b/%Y:%H:%M:%S"
+        return datetime.strptime(text, fmt).timestamp()
+    return None
+
+
+def _none_if_missing(value: Optional[str]) -> Optional[str]:
+    return None if value in (None, "None") else value
+
+
+def parse_log_line(line: str) -> Optional[AlertEvent]:
+    """
+    ログの1行からリクエストを取り出す
+
+    Args:
+        line: アプリケーションログまたはアクセスログの1行
+
+    Returns:
+        Optional[AlertEvent]: /api/controlのリクエストでない行の場合はNone
+    """
+    query = _CONTROL_QUERY.search(line)
+    received = None if query else _RECEIVED.search(line)
+    if not query and not received:
+        return None
+
+    ts = _parse_time(line)
+    if ts is None:
+        return None
+
+    if query:
+        params = parse_qs(query.group(1), keep_blank_values=True)
+        return AlertEvent(ts, params.get("alert", [None])[0], params.get("id", [None])[0])
+    return AlertEvent(ts, _none_if_missing(received.group(1)), _none_if_missing(received.group(2)))
+
+
+def read_log(lines: Iterable[str]) -> Iterator[AlertEvent]:
+    """ログからリクエストを読み込む"""
+    for line in lines:
+        event = parse_log_line(line)
+        if event:
+            yield event
+
+
+def read_history(path: Path) -> Iterator[AlertEvent]:
+    """切り替え履歴データベースからリクエストを読み込む（読み取り専用で開く）"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        # 時間帯ルール・スケジュールによる切り替えはリクエストではないため除く
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(history)")}
+        where = " WHERE source = 'http'" if "source" in columns else ""
+        for ts, alert, sim_id in conn.execute(
+            f"SELECT ts, alert, sim_id FROM history{where} ORDER BY ts, id"
+        ):
+            yield AlertEvent(ts, alert, sim_id)
+    finally:
+        conn.close()
+
+
+def read_jsonl(lines: Iterable[str]) -> Iterator[AlertEvent]:
+    """1行1リクエストのJSONからリクエストを読み込む"""
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+            ts = data["ts"]
+            ts = float(ts) if isinstance(ts, (int, float)) else datetime.fromisoformat(ts).timestamp()
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"{number}行目: {e}")
+        yield AlertEvent(ts, data.get("alert"), data.get("id"))
+
+
+def load_events(path: Path, fmt: str = "auto") -> List[AlertEvent]:
+    """
+    記録ファイルからリクエストを読み込む
+
+    Args:
+        path: 記録ファイルのパス
+        fmt: 形式（"auto" / "log" / "history" / "jsonl"）
+
+    Returns:
+        List[AlertEvent]: 時刻順のリクエスト（同じ時刻は記録順）
+    """
+    if fmt == "auto":
+        suffix = path.suffix.lower()
+        fmt = "history" if suffix in (".db", ".sqlite", ".sqlite3") else "jsonl" if suffix == ".jsonl" else "log"
+
+    if fmt == "history":
+        events = list(read_history(path))
+    else:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            events = list(read_jsonl(f) if fmt == "jsonl" else read_log(f))
+
+    events.sort(key=lambda e: e.ts)
+    return events
+
+
+@dataclass
+class ReplayReport:
+    """再生結果"""
+
+    target: str
+    speed: float
+    events: int = 0
+    span: float = 0.0
+    elapsed: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+    # 記録上の到着時刻からの送信の遅れ（再生側の処理が追いついているかの確認用）
+    max_lag: float = 0.0
+    results: Dict[str, int] = field(default_factory=dict)
+    idempotency: Dict[str, int] = field(default_factory=dict)
+    switch_calls: Optional[int] = None
+    tbbox_commands: Optional[int] = None
+
+    @property
+    def switch_requests(self) -> int:
+        """切り替えを要求したリクエスト数（冪等性キャッシュでまとめたものを含む）"""
+        return sum(
+            count for result, count in self.results.items()
+            if result not in ("invalid", "status", "rate_limited", "no_callback")
+        )
+
+    @property
+    def saved(self) -> int:
+        """冪等性キャッシュで省略した切り替え数（完了済みの再送 + 処理中の同時要求）"""
+        return self.idempotency.get("hits", 0) + self.idempotency.get("joined", 0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "target": self.target,
+            "speed": self.speed,
+            "events": self.events,
+            "recorded_span_s": self.span,
+            "elapsed_s": self.elapsed,
+            "latency_ms": summarize(self.latencies),
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items(), key=lambda i: str(i[0]))},
+            "max_lag_ms": self.max_lag * 1000,
+            "results": self.results,
+            "switch_requests": self.switch_requests,
+            "dedupe_hits": self.idempotency.get("hits", 0),
+            "coalesced": self.idempotency.get("joined", 0),
+            "switch_calls": self.switch_calls,
+            "tbbox_commands": self.tbbox_commands,
+        }
+
+    def format(self) -> str:
+        """表示用の文字列に変換"""
+        summary = summarize(self.latencies)
+        cells = "  ".join(
+            f"{name}={summary[name]:.1f}" for name in [f"p{q}" for q in PERCENTILES] + ["max"]
+            if summary[name] is not None
+        )
+        lines = [
+            f"リプレイ結果: {self.target} ({self.events}件, 記録 {self.span:.0f}秒 → "
+            f"実時間 {self.elapsed:.1f}秒, {self.speed:g}倍速)",
+            f"レイテンシ (ms): {cells or '-'}",
+            "ステータス: " + " ".join(f"{k}={v}" for k, v in sorted(self.statuses.items(), key=lambda i: str(i[0]))),
+            "処理結果: " + (" ".join(f"{k}={v}" for k, v in sorted(self.results.items())) or "-"),
+        ]
+        requests = self.switch_requests
+        if requests:
+            lines.append(
+                f"切り替え要求: {requests}件  冪等性キャッシュで省略: {self.saved}件 "
+                f"(再送 {self.idempotency.get('hits', 0)} / 同時要求の合流 {self.idempotency.get('joined', 0)}, "
+                f"{self.saved / requests * 100:.1f}%)"
+            )
+        if self.switch_calls is not None:
+            lines.append(f"切り替え処理の実行: {self.switch_calls}回  TBBOXへのコマンド送信: {self.tbbox_commands}件")
+        lines.append(f"送信の最大遅れ: {self.max_lag * 1000:.1f}ms")
+        return "\n".join(lines)
+
+
+async def _replay(events: List[AlertEvent], speed: float, send, report: ReplayReport) -> None:
+    """記録どおりの間隔でsend(event)を開始し、すべての完了を待つ"""
+    loop = asyncio.get_running_loop()
+    origin = events[0].ts
+    started = loop.time()
+
+    async def run(event: AlertEvent) -> None:
+        sent_at = time.perf_counter()
+        status = await send(event)
+        report.latencies.append(time.perf_counter() - sent_at)
+        report.statuses[status] += 1
+
+    tasks = []
+    for event in events:
+        due = started + (event.ts - origin) / speed
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        report.max_lag = max(report.max_lag, loop.time() - due)
+        tasks.append(asyncio.ensure_future(run(event)))
+    await asyncio.gather(*tasks)
+
+
+def _run(events: List[AlertEvent], speed: float, send, report: ReplayReport) -> None:
+    """再生を実行して件数・所要時間を記録"""
+    report.events = len(events)
+    if not events:
+        return
+    report.span = events[-1].ts - events[0].ts
+    started = time.perf_counter()
+    asyncio.run(_replay(events, speed, send, report))
+    report.elapsed = time.perf_counter() - started
+
+
+def build_in_process(latency: float, speed: float) -> Dict[str, Any]:
+    """
+    プロセス内で再生するためのアプリケーションを組み立てる
+
+    冪等性キャッシュの有効期間は記録上の時間に合わせるため、再生速度で割った値を使用する
+
+    Returns:
+        Dict[str, Any]: server, simulator, switcher
+    """
+    simulator = TBBOXSimulator(latency=latency)
+    layout = AlertLayout(switch_count=settings.SWITCH_COUNT, alert_length=settings.ALERT_LENGTH)
+
+    switcher = TBBOXPlaylistSwitcher()
+    switcher.switch_mapper = SwitchMapper(layout=layout)
+    switcher.tbbox_client = TBBOXClient(transport=simulator.transport())
+    switcher.playlist_controller = PlaylistController(
+        switcher.tbbox_client, state=switcher.device_state, status_command=""
+    )
+
+    server = HTTPServer(
+        callback=switcher.on_alert_received,
+        status_snapshot=switcher.device_state,
+        idempotency=(
+            IdempotencyCache(
+                max_entries=settings.IDEMPOTENCY_MAX_ENTRIES,
+                ttl=settings.IDEMPOTENCY_TTL / speed
+            )
+            if settings.IDEMPOTENCY_TTL > 0 else None
+        ),
+        deadline_seconds=settings.CONTROL_DEADLINE or None,
+        layout=layout
+    )
+    return {"server": server, "simulator": simulator, "switcher": switcher}
+
+
+def replay_in_process(events: List[AlertEvent], speed: float, latency: float = 0.0) -> ReplayReport:
+    """
+    HTTPServer.get_app()をプロセス内で呼び出して再生
+
+    Args:
+        events: 再生するリクエスト
+        speed: 再生速度
+        latency: シミュレータの応答遅延（秒）
+
+    Returns:
+        ReplayReport: 再生結果
+    """
+    parts = build_in_process(latency, speed)
+    server: HTTPServer = parts["server"]
+    simulator: TBBOXSimulator = parts["simulator"]
+    app = server.get_app()
+    switch_calls = Counter()
+    original_callback = server.callback
+
+    def counting_callback(alert: str):
+        switch_calls["calls"] += 1
+        return original_callback(alert)
+
+    server.set_callback(counting_callback)
+
+    async def send(event: AlertEvent) -> int:
+        status = 0
+
+        async def receive() -> Dict[str, Any]:
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send_message(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        await app(make_scope(event.query_string().encode()), receive, send_message)
+        return status
+
+    report = ReplayReport(target="in-process", speed=speed)
+    _run(events, speed, send, report)
+    parts["switcher"].tbbox_client.close()
+
+    metrics = server.get_metrics()
+    report.results = metrics["control"]
+    report.idempotency = metrics.get("idempotency", {})
+    report.switch_calls = switch_calls["calls"]
+    report.tbbox_commands = simulator.commands
+    return report
+
+
+def _fetch_metrics(base_url: str) -> Dict[str, Any]:
+    """起動中のスイッチャーから /api/metrics を取得（取得できない場合は空）"""
+    try:
+        with urllib.request.urlopen(f"{base_url}/api/metrics", timeout=5) as response:
+            return json.loads(response.read().decode("utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _delta(after: Dict[str, int], before: Dict[str, int]) -> Dict[str, int]:
+    """カウンタの差分"""
+    return {
+        key: value - before.get(key, 0)
+        for key, value in after.items()
+        if isinstance(value, (int, float)) and value - before.get(key, 0)
+    }
+
+
+def replay_http(
+    events: List[AlertEvent],
+    speed: float,
+    base_url: str,
+    concurrency: int = 64,
+    timeout: float = 30.0
+) -> ReplayReport:
+    """
+    起動中のスイッチャーにHTTPで再生
+
+    処理結果と冪等性キャッシュの集計は、再生前後の /api/metrics の差分から求める
+    （再生中に他のリクエストがあった場合はそれも含まれる）
+
+    Args:
+        events: 再生するリクエスト
+        speed: 再生速度
+        base_url: スイッチャーのURL（例: http://192.168.0.100:8080）
+        concurrency: 同時に送信する最大リクエスト数
+        timeout: 1リクエストのタイムアウト（秒）
+
+    Returns:
+        ReplayReport: 再生結果
+    """
+    base_url = base_url.rstrip("/")
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="replay")
+
+    def get(event: AlertEvent) -> Any:
+        try:
+            with urllib.request.urlopen(
+                f"{base_url}/api/control?{event.query_string()}", timeout=timeout
+            ) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except OSError as e:
+            return type(e).__name__
+
+    async def send(event: AlertEvent) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(executor, get, event)
+
+    before = _fetch_metrics(base_url)
+    report = ReplayReport(target=urlsplit(base_url).netloc or base_url, speed=speed)
+    try:
+        _run(events, speed, send, report)
+    finally:
+        executor.shutdown(wait=False)
+    after = _fetch_metrics(base_url)
+
+    report.results = _delta(after.get("control", {}), before.get("control", {}))
+    report.idempotency = _delta(after.get("idempotency", {}), before.get("idempotency", {}))
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """メイン関数"""
+    parser = argparse.ArgumentParser(
+        description="記録された /api/control のリクエストを再生して負荷を計測します",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("再生先:", 1)[1],
+    )
+    parser.add_argument("source", type=Path, help="記録ファイル（ログ・履歴DB・JSONL）")
+    parser.add_argument("--format", choices=["auto", "log", "history", "jsonl"], default="auto",
+                        help="記録ファイルの形式（デフォルト: 拡張子から判定）")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help=f"再生速度（{MIN_SPEED:g}～{MAX_SPEED:g}倍、デフォルト: 1）")
+    parser.add_argument("--url", help="再生先のスイッチャーのURL（省略時はプロセス内で再生）")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="プロセス内で再生する場合のTBBOXの応答遅延（秒、デフォルト: 0.02）")
+    parser.add_argument("--concurrency", type=int, default=64,
+                        help="HTTPで再生する場合の最大同時リクエスト数（デフォルト: 64）")
+    parser.add_argument("--limit", type=int, help="先頭から再生する件数")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    args = parser.parse_args(argv)
+
+    if not MIN_SPEED <= args.speed <= MAX_SPEED:
+        parser.error(f"--speedは{MIN_SPEED:g}～{MAX_SPEED:g}で指定してください")
+
+    try:
+        events = load_events(args.source, args.format)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        parser.error(f"記録ファイルを読み込めません: {e}")
+    if args.limit:
+        events = events[:args.limit]
+    if not events:
+        parser.error("再生するリクエストがありません")
+
+    # ログ出力のコストと量を抑える
+    logger.setLevel(logging.ERROR)
+
+    if args.url:
+        report = replay_http(events, args.speed, args.url, concurrency=args.concurrency)
+    else:
+        report = replay_in_process(events, args.speed, latency=args.latency)
+
+    if args.json:
+        print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2))
+    else:
+        print(report.format())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,6 +21,62 @@ HTTP_HOST = os.getenv("HTTP_HOST", "0.0.0.0")
 # linkbaseがポート80を使用するため、8080を使用
 HTTP_PORT = int(os.getenv("HTTP_PORT", "8080"))
 
+# /api/control をFastAPIを経由せず軽量ASGIアプリで処理するかどうか
+# レスポンスの形式は同じ（"true" または "1" で有効）
+HTTP_LEAN_CONTROL = os.getenv("HTTP_LEAN_CONTROL", "false").lower() in ("true", "1")
+
+# HTTPワーカープロセスの数（1の場合は単一プロセスで動作）
+# 2以上の場合、HTTPの処理を複数のプロセスに分散し、TBBOXとの通信は1つのブローカープロセスが行う
+# （TBBOXは制御用の接続を1本しか受け付けないため）
+HTTP_WORKERS = int(os.getenv("HTTP_WORKERS", "1"))
+
+# HTTPワーカーとブローカーの通信に使用するUnixドメインソケットのパス
+BROKER_SOCKET = Path(os.getenv(
+    "BROKER_SOCKET",
+    str(Path(__file__).parent.parent / "data" / "broker.sock")
+))
+
+# /api/events（Server-Sent Events）の購読者ごとに保持する未読イベントの最大数
+# 読み取りが遅れて超えた分は古いイベントから捨てる
+EVENTS_BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "256"))
+
+# /api/events を同時に購読できる最大数（超えた場合は503）
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "32"))
+
+# 終了時に処理中のリクエスト・TBBOXへのコマンドの完了を待つ時間（秒）
+# 新しいリクエストの受け付けを停止してから、この時間を過ぎた処理は打ち切って終了する
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "15"))
+
+# 終了時にデバイス状態（プログラム・音量・再生状態）を保存し、起動時に復元するファイル
+# 空の場合は保存しない
+STATE_FILE = os.getenv(
+    "STATE_FILE",
+    str(Path(__file__).parent.parent / "data" / "state.json")
+)
+
+# 再送リクエストの結果を保持する時間（秒、0で冪等性キャッシュを無効化）
+# 同じid・alertのリクエストがこの時間内に届いた場合はTBBOXにコマンドを送らず前回の結果を返す
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "10"))
+
+# 冪等性キャッシュの最大エントリ数
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "1024"))
+
+# 送信元（SIM ID・クライアントIP）ごとのレート制限
+# 1秒あたりに受け付けるリクエスト数（0でレート制限を無効化）
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "5"))
+
+# 連続して受け付けられる最大リクエスト数（バースト）
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "20"))
+
+# /api/control の処理期限（秒、0で期限なし）
+# 期限を過ぎると再接続・再送を打ち切って504を返す（X-Deadline-Msヘッダで個別に指定可能）
+CONTROL_DEADLINE = float(os.getenv("CONTROL_DEADLINE", "10"))
+
+# alertパラメータのスイッチ数と桁数
+# 先頭SWITCH_COUNT桁がスイッチの状態、残りの桁は未使用（通常はすべて9）
+SWITCH_COUNT = int(os.getenv("SWITCH_COUNT", "4"))
+ALERT_LENGTH = int(os.getenv("ALERT_LENGTH", "8"))
+
 # TBBOX接続をスキップするかどうか（テスト用）
 # "true" または "1" でスキップ
 TBBOX_SKIP_CONNECTION = os.getenv("TBBOX_SKIP_CONNECTION", "false").lower() in ("true", "1")
@@ -114,6 +170,96 @@ CONNECTION_RETRY_INTERVAL = 3
 # コマンド送信リトライ回数
 COMMAND_MAX_RETRIES = 3
 
+# TCP接続のタイムアウト（秒）
+TBBOX_CONNECT_TIMEOUT = float(os.getenv("TBBOX_CONNECT_TIMEOUT", "10"))
+
+# レスポンス待ちタイムアウトの上限（秒）
+# ログイン時と、RTTの実測値が無い間はこの値を使用する
+TBBOX_READ_TIMEOUT = float(os.getenv("TBBOX_READ_TIMEOUT", "10"))
+
+# レスポンス待ちタイムアウトの下限（秒）
+# 通常はRTTの実測値（平滑化RTT + 4×変動）から算出した値を使用する
+TBBOX_RTO_MIN = float(os.getenv("TBBOX_RTO_MIN", "0.2"))
+
+# TCP_NODELAYを設定するかどうか（コマンドは小さな要求・応答のため既定で有効）
+TBBOX_TCP_NODELAY = os.getenv("TBBOX_TCP_NODELAY", "true").lower() in ("true", "1")
+
+# TCPキープアライブを使用するかどうか（無通信のまま切れた接続を検知する）
+TBBOX_TCP_KEEPALIVE = os.getenv("TBBOX_TCP_KEEPALIVE", "false").lower() in ("true", "1")
+
+# キープアライブを開始するまでの無通信時間（秒、0の場合はOSの設定）
+TBBOX_TCP_KEEPALIVE_IDLE = int(os.getenv("TBBOX_TCP_KEEPALIVE_IDLE", "0"))
+
+# TCPの代わりに接続するUnixドメインソケットのパス（シミュレータ等、空の場合はTCP）
+TBBOX_UNIX_SOCKET = os.getenv("TBBOX_UNIX_SOCKET", "")
+
+# TBBOXとの送受信を記録するキャプチャファイルのパス（空の場合は記録しない）
+# 不具合の再現用（python -m src.tbbox.capture <ファイル> で内容を表示できる）
+TBBOX_CAPTURE_FILE = os.getenv("TBBOX_CAPTURE_FILE", "")
+
+
+# ========================================
+# 再生状態設定
+# ========================================
+
+# 再生状態（プログラム・音量・再生/一時停止）の問い合わせコマンド（16進数）
+# 空の場合は問い合わせず、送信したコマンドから推定した状態のみを使用する
+STATUS_COMMAND = os.getenv("TBBOX_STATUS_COMMAND", "")
+
+# 接続監視の間隔（秒、0で無効）
+# 切断中は再接続し、接続中は再生状態を問い合わせてキャッシュを更新する
+TBBOX_SUPERVISOR_INTERVAL = float(os.getenv("TBBOX_SUPERVISOR_INTERVAL", "15"))
+
+# TBBOXから読み取った再生状態の有効期間（秒）
+PLAYBACK_STATE_TTL = float(os.getenv("PLAYBACK_STATE_TTL", "30"))
+
+# 有効期間内の再生状態で再生中と確認できたプログラムへの切り替えを省略するかどうか
+# "true" または "1" で有効
+PLAYBACK_SKIP_IF_PLAYING = os.getenv("PLAYBACK_SKIP_IF_PLAYING", "false").lower() in ("true", "1")
+
+
+# ========================================
+# 切り替え履歴設定
+# ========================================
+
+# 切り替え履歴を記録するかどうか
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "true").lower() in ("true", "1")
+
+# 履歴データベースファイルのパス
+HISTORY_DB_PATH = Path(os.getenv(
+    "HISTORY_DB_PATH",
+    str(Path(__file__).parent.parent / "data" / "history.db")
+))
+
+# 履歴の保持日数（これより古い履歴は自動的に削除）
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", "30"))
+
+
+# ========================================
+# スケジュール設定
+# ========================================
+
+# 指定時刻のプログラム切り替え・音量変更などを実行するかどうか
+SCHEDULE_ENABLED = os.getenv("SCHEDULE_ENABLED", "true").lower() in ("true", "1")
+
+# スケジュールの保存先ファイルのパス（/api/schedules で編集した内容を保存）
+SCHEDULE_FILE = Path(os.getenv(
+    "SCHEDULE_FILE",
+    str(Path(__file__).parent.parent / "data" / "schedules.json")
+))
+
+
+# ========================================
+# 管理用エンドポイント設定
+# ========================================
+
+# /api/admin/*（プロファイル・メモリ・スタックの診断）の認証トークン
+# 空の場合は管理用エンドポイントを無効化する（推測されにくい長い文字列を設定すること）
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# プロファイルの最大計測時間（秒）
+ADMIN_PROFILE_MAX_SECONDS = float(os.getenv("ADMIN_PROFILE_MAX_SECONDS", "60"))
+
 
 # ========================================
 # ログ設定
@@ -4,15 +4,35 @@ TBBOX Playlist Switcher - メインエントリーポイント
 満空灯制御装置（linkbase）からのHTTPリクエストを受信し、
 スイッチの状態に応じてTBBOXのプログラムを自動的に切り替えます。
 """
+import os
 import signal
+import socket
 import sys
+import threading
+from typing import Callable, Optional, Union
 
 from config import settings
+from src.broker import BrokerClient, CommandBroker, WorkerPool
+from src.history.store import HistoryStore
+from src.http.admin import AdminTools
+from src.http.idempotency import IdempotencyCache
+from src.http.rate_limit import TokenBucketLimiter
 from src.http.server import HTTPServer
+from src.mapper.layout import AlertLayout
 from src.mapper.switch_mapper import SwitchMapper
+from src.mapper.time_rules import RuleScheduler
+from src.scheduler.scheduler import ActionScheduler
+from src.tbbox.capture import CaptureWriter
 from src.tbbox.client import TBBOXClient
 from src.tbbox.playlist import PlaylistController
+from src.tbbox.protocol import CommandResult
+from src.tbbox.state import DeviceStateSnapshot
+from src.tbbox.supervisor import ConnectionSupervisor
+from src.utils.deadline import Deadline, current_deadline
+from src.utils.events import EventBus
 from src.utils.logger import logger
+from src.utils.systemd import listen_sockets, notify
+from src.utils.trace import traced
 
 
 class TBBOXPlaylistSwitcher:
@@ -23,22 +43,40 @@ class TBBOXPlaylistSwitcher:
         self.http_server = None
         self.switch_mapper = None
         self.tbbox_client = None
+        self.capture = None
         self.playlist_controller = None
-
-    def on_alert_received(self, alert: str) -> bool:
+        self.history_store = None
+        self.supervisor = None
+        self.rule_scheduler = None
+        self.action_scheduler = None
+        self.broker = None
+        self.worker_pool = None
+        self.listen_sock = None
+        self.device_state = DeviceStateSnapshot()
+        self.events = EventBus(
+            buffer_size=settings.EVENTS_BUFFER_SIZE,
+            max_subscribers=settings.EVENTS_MAX_SUBSCRIBERS
+        )
+        self._stopping = threading.Event()
+
+    def on_alert_received(self, alert: str) -> Union[bool, CommandResult]:
         """
         HTTPリクエスト受信時のコールバック関数
 
         Args:
-            alert: 8桁のalertパラメータ（例: "10109999"）
+            alert: alertパラメータ（例: "10109999"）
 
         Returns:
-            bool: 処理成功時True、失敗時False
+            Union[bool, CommandResult]: 処理結果（TBBOXにコマンドを送信した場合はその結果）
+
+        Raises:
+            DeadlineExceeded: HTTPリクエストの期限内に切り替えが完了しなかった場合
         """
         logger.info(f"alertを受信しました: {alert}")
 
         # alertをプログラムIDに変換
-        program_id = self.switch_mapper.parse_alert(alert)
+        with traced("map"):
+            program_id = self.switch_mapper.parse_alert(alert)
 
         if program_id is None:
             logger.warning("プログラムIDの取得に失敗しました（スキップ）")
@@ -46,17 +84,49 @@ class TBBOXPlaylistSwitcher:
 
         logger.info(f"プログラム切り替えリクエスト: プログラムID={program_id}")
 
-        # TBBOXプログラムを切り替える
+        # TBBOXプログラムを切り替える（HTTPリクエストの期限を引き継ぐ）
         if self.playlist_controller:
-            success = self.playlist_controller.switch_program(program_id)
-            if not success:
+            result = self.playlist_controller.switch_program(
+                program_id,
+                deadline=current_deadline()
+            )
+            if result:
+                self.switch_mapper.record_switch(program_id)
+            else:
                 logger.error(f"プログラム '{program_id}' への切り替えに失敗しました")
-                return False
-            return True
+            return result
         else:
             logger.error("PlaylistControllerが初期化されていません")
             return False
 
+    def forward_alert(self, alert: str) -> CommandResult:
+        """
+        HTTPワーカーでのリクエスト受信時のコールバック関数（alertをブローカーに転送する）
+
+        プログラムIDへの変換はブローカーで行い、時間帯ルールの境界時刻での再評価に使う
+        最後に受信したパターンをブローカーのSwitchMapperに残す
+
+        Args:
+            alert: alertパラメータ（例: "10109999"）
+
+        Returns:
+            CommandResult: ブローカーでの処理結果
+
+        Raises:
+            DeadlineExceeded: HTTPリクエストの期限内に切り替えが完了しなかった場合
+        """
+        logger.info(f"alertをブローカーに転送します: {alert}")
+        return self.playlist_controller.switch_alert(alert, deadline=current_deadline())
+
+    def on_connection_changed(self, connected: bool) -> None:
+        """
+        TBBOXとの接続状態が変化したときのコールバック関数（切断・再接続をイベントとして配信）
+
+        Args:
+            connected: ログイン済みで通信可能になった場合True、切断された場合False
+        """
+        self.events.publish("connection", connected=connected)
+
     def setup(self) -> None:
         """アプリケーションのセットアップ"""
         logger.info("=" * 60)
@@ -64,8 +134,20 @@ class TBBOXPlaylistSwitcher:
         logger.info("=" * 60)
 
         try:
+            # 前回の終了時に保存したデバイス状態を復元（接続状態は接続後に更新される）
+            if settings.STATE_FILE and self.device_state.load(settings.STATE_FILE):
+                logger.info(f"デバイス状態を復元しました: {self.device_state.get()}")
+
+            # systemdのソケットアクティベーションで起動された場合は、渡された待ち受けソケットを使用する
+            sockets = listen_sockets()
+            self.listen_sock = sockets[0] if sockets else None
+
             # スイッチマッパーを初期化
-            self.switch_mapper = SwitchMapper()
+            layout = AlertLayout(
+                switch_count=settings.SWITCH_COUNT,
+                alert_length=settings.ALERT_LENGTH
+            )
+            self.switch_mapper = SwitchMapper(layout=layout)
             mapping = self.switch_mapper.get_mapping()
             logger.info(f"スイッチマッピング: {len(mapping)}パターン登録済み")
 
@@ -77,7 +159,11 @@ class TBBOXPlaylistSwitcher:
             else:
                 # TBBOXクライアントを初期化
                 logger.info("TBBOXクライアントを初期化しています...")
-                self.tbbox_client = TBBOXClient()
+                if settings.TBBOX_CAPTURE_FILE:
+                    self.capture = CaptureWriter(settings.TBBOX_CAPTURE_FILE)
+                    logger.info(f"TBBOXとの送受信を記録します: {settings.TBBOX_CAPTURE_FILE}")
+                self.tbbox_client = TBBOXClient(recorder=self.capture)
+                self.tbbox_client.add_connection_listener(self.on_connection_changed)
 
                 # TBBOXに接続
                 if not self.tbbox_client.connect():
@@ -86,24 +172,177 @@ class TBBOXPlaylistSwitcher:
                     logger.warning("TBBOXに接続できませんが、HTTPサーバを起動します")
 
                 # PlaylistControllerを初期化
-                self.playlist_controller = PlaylistController(self.tbbox_client)
+                self.playlist_controller = PlaylistController(
+                    self.tbbox_client,
+                    state=self.device_state,
+                    skip_if_playing_ttl=(
+                        settings.PLAYBACK_STATE_TTL if settings.PLAYBACK_SKIP_IF_PLAYING else 0
+                    ),
+                    events=self.events
+                )
                 logger.info("PlaylistControllerを初期化しました")
 
-            # HTTPサーバをセットアップ
-            self.http_server = HTTPServer(
-                host=settings.HTTP_HOST,
-                port=settings.HTTP_PORT,
-                callback=self.on_alert_received
+                # 接続監視（再接続・再生状態の更新）を開始
+                if settings.TBBOX_SUPERVISOR_INTERVAL > 0:
+                    self.supervisor = ConnectionSupervisor(
+                        self.playlist_controller,
+                        interval=settings.TBBOX_SUPERVISOR_INTERVAL
+                    )
+                    self.supervisor.start()
+
+            # 切り替え履歴ストアを初期化（スケジューラによる切り替えも記録する）
+            self._create_history_store()
+
+            # 時間帯ルールの境界時刻に自動で切り替えるスケジューラを開始
+            if self.switch_mapper.time_rules and self.playlist_controller:
+                self.rule_scheduler = RuleScheduler(
+                    self.switch_mapper.time_rules,
+                    resolve=self.switch_mapper.reevaluate,
+                    callback=self.playlist_controller.switch_program,
+                    history=self.history_store,
+                    on_switched=self.switch_mapper.record_switch
+                )
+                self.rule_scheduler.start()
+
+            # 指定時刻の操作（音量変更・停止など）を実行するスケジューラを開始
+            if settings.SCHEDULE_ENABLED and self.playlist_controller:
+                self.action_scheduler = ActionScheduler(
+                    self.playlist_controller,
+                    path=settings.SCHEDULE_FILE,
+                    history=self.history_store
+                )
+                self.action_scheduler.start()
+
+            if settings.HTTP_WORKERS > 1:
+                # HTTPはワーカープロセスで処理し、このプロセスはTBBOXとの通信のみを行う
+                self.broker = CommandBroker(
+                    settings.BROKER_SOCKET,
+                    self.playlist_controller,
+                    self.device_state,
+                    events=self.events,
+                    alert_handler=self.on_alert_received,
+                    # 再送が別のワーカーに届いた場合もTBBOXへの送信を1回にまとめる
+                    idempotency=self._create_idempotency_cache()
+                )
+                self.worker_pool = WorkerPool(
+                    run_worker,
+                    settings.HTTP_WORKERS,
+                    settings.HTTP_HOST,
+                    settings.HTTP_PORT,
+                    sock=self.listen_sock
+                )
+                logger.info(f"HTTPワーカー{settings.HTTP_WORKERS}個とブローカーで動作します")
+            else:
+                self.http_server = self._create_http_server(layout)
+
+        except Exception as e:
+            logger.error(f"セットアップ中にエラーが発生しました: {e}")
+            sys.exit(1)
+
+    def setup_worker(self) -> None:
+        """
+        HTTPワーカープロセスのセットアップ
+
+        TBBOXへは接続せず、alertの検証だけを行ってブローカーに転送する
+        （プログラムIDへの変換・時間帯ルールの評価はブローカーで行う）
+        デバイス状態はブローカーから配信されたものを使用する
+        """
+        try:
+            layout = AlertLayout(
+                switch_count=settings.SWITCH_COUNT,
+                alert_length=settings.ALERT_LENGTH
             )
-            logger.info(
-                f"HTTPサーバを設定しました: "
-                f"http://{settings.HTTP_HOST}:{settings.HTTP_PORT}"
+            self.playlist_controller = BrokerClient(
+                settings.BROKER_SOCKET,
+                state=self.device_state,
+                events=self.events
+            )
+            self.playlist_controller.connect()
+            # 再送はブローカーでまとめる（ワーカーごとのキャッシュでは、別のワーカーに届いた
+            # alertで以前の結果を破棄できず、A→B→Aの3回目を再送として捨ててしまうため）
+            self.http_server = self._create_http_server(
+                layout, callback=self.forward_alert, idempotency=False
             )
 
         except Exception as e:
-            logger.error(f"セットアップ中にエラーが発生しました: {e}")
+            logger.error(f"ワーカーのセットアップ中にエラーが発生しました: {e}")
             sys.exit(1)
 
+    def _create_history_store(self) -> None:
+        """切り替え履歴ストアを作成（無効な場合・作成済みの場合は何もしない）"""
+        if not settings.HISTORY_ENABLED or self.history_store:
+            return
+        self.history_store = HistoryStore(
+            settings.HISTORY_DB_PATH,
+            retention_days=settings.HISTORY_RETENTION_DAYS
+        )
+        self.history_store.start()
+
+    @staticmethod
+    def _create_idempotency_cache() -> Optional[IdempotencyCache]:
+        """冪等性キャッシュを作成（IDEMPOTENCY_TTLが0の場合はNone）"""
+        if settings.IDEMPOTENCY_TTL <= 0:
+            return None
+        return IdempotencyCache(
+            max_entries=settings.IDEMPOTENCY_MAX_ENTRIES,
+            ttl=settings.IDEMPOTENCY_TTL
+        )
+
+    def _create_http_server(
+        self,
+        layout: AlertLayout,
+        callback: Optional[Callable[[str], Union[bool, CommandResult]]] = None,
+        idempotency: bool = True
+    ) -> HTTPServer:
+        """
+        切り替え履歴ストアとHTTPサーバを作成
+
+        Args:
+            layout: alertのレイアウト
+            callback: リクエスト受信時のコールバック関数（省略時はon_alert_received）
+            idempotency: Falseの場合は冪等性キャッシュを作成しない（ブローカーでまとめるワーカー用）
+
+        Returns:
+            HTTPServer: 設定済みのHTTPサーバ
+        """
+        self._create_history_store()
+
+        # HTTPサーバをセットアップ
+        http_server = HTTPServer(
+            host=settings.HTTP_HOST,
+            port=settings.HTTP_PORT,
+            callback=callback or self.on_alert_received,
+            history=self.history_store,
+            status_snapshot=self.device_state,
+            lean_control=settings.HTTP_LEAN_CONTROL,
+            idempotency=self._create_idempotency_cache() if idempotency else None,
+            rate_limiter=(
+                TokenBucketLimiter(
+                    rate=settings.RATE_LIMIT_RATE,
+                    burst=settings.RATE_LIMIT_BURST
+                )
+                if settings.RATE_LIMIT_RATE > 0 else None
+            ),
+            deadline_seconds=settings.CONTROL_DEADLINE or None,
+            state_ttl=settings.PLAYBACK_STATE_TTL,
+            scheduler=self.action_scheduler,
+            layout=layout,
+            admin=(
+                AdminTools(
+                    token=settings.ADMIN_TOKEN,
+                    max_profile_seconds=settings.ADMIN_PROFILE_MAX_SECONDS
+                )
+                if settings.ADMIN_TOKEN else None
+            ),
+            drain_seconds=settings.SHUTDOWN_DRAIN_SECONDS,
+            events=self.events
+        )
+        logger.info(
+            f"HTTPサーバを設定しました: "
+            f"http://{settings.HTTP_HOST}:{settings.HTTP_PORT}"
+        )
+        return http_server
+
     def run(self) -> None:
         """アプリケーションを実行"""
         try:
@@ -113,18 +352,92 @@ class TBBOXPlaylistSwitcher:
             logger.info(
                 f"エンドポイント: http://{settings.HTTP_HOST}:{settings.HTTP_PORT}/api/control"
             )
-            self.http_server.run()
+            if self._stopping.is_set():
+                return
+            if self.worker_pool:
+                self.broker.start()
+                self.worker_pool.start()
+                notify("READY=1")
+                if not self._stopping.is_set():
+                    self.worker_pool.watch()
+            else:
+                # systemdが待ち受けソケットを保持しているため、起動完了前の接続もキューで待たされる
+                notify("READY=1")
+                self.http_server.run(self.listen_sock)
 
         except KeyboardInterrupt:
             logger.info("ユーザーによって停止されました")
         except Exception as e:
             logger.error(f"実行中にエラーが発生しました: {e}")
         finally:
+            notify("STOPPING=1")
             self.cleanup()
 
+    def request_shutdown(self) -> None:
+        """
+        新しいリクエストの受け付けを停止し、run()から戻るよう要求する
+
+        処理中のリクエストとTBBOXへのコマンドの完了はcleanup()で待つ
+        シグナルハンドラーから呼び出すため、ここでは待たない
+        """
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        if self.http_server:
+            self.http_server.shutdown()
+        if self.worker_pool:
+            self.worker_pool.interrupt()
+
     def cleanup(self) -> None:
-        """クリーンアップ処理"""
+        """
+        クリーンアップ処理
+
+        処理中の切り替え・送信待ちのコマンドの完了をSHUTDOWN_DRAIN_SECONDS秒まで待ち、
+        デバイス状態を保存してから接続を閉じる
+        """
         logger.info("クリーンアップを実行しています...")
+        drain = Deadline(settings.SHUTDOWN_DRAIN_SECONDS)
+
+        # 新しい切り替えを受け付けないよう、HTTPワーカーとブローカーを先に停止する
+        # （ワーカーは処理中のリクエストの完了を待って終了し、ブローカーは実行中の切り替えの完了を待つ）
+        if self.worker_pool:
+            self.worker_pool.stop(timeout=drain.remaining())
+            self.worker_pool = None
+
+        if self.broker:
+            self.broker.stop()
+            self.broker = None
+
+        if self.action_scheduler:
+            self.action_scheduler.stop()
+            self.action_scheduler = None
+
+        if self.rule_scheduler:
+            self.rule_scheduler.stop()
+            self.rule_scheduler = None
+
+        if self.supervisor:
+            self.supervisor.stop()
+            self.supervisor = None
+
+        # 送信待ち・送信中の切り替えが状態の記録まで完了するのを待つ
+        if self.playlist_controller and not self.playlist_controller.drain(drain.remaining()):
+            logger.warning("完了しない切り替えがあるまま終了します")
+
+        # 送信待ち・送信中のTBBOXへのコマンド（接続監視など）の完了を待つ
+        if self.tbbox_client and not self.tbbox_client.drain(drain.remaining()):
+            logger.warning(
+                f"TBBOXへのコマンド{self.tbbox_client.pending_commands}件が"
+                f"完了しないまま終了します"
+            )
+
+        # TBBOXとの接続を持つプロセスだけがデバイス状態を保存する（ワーカーはブローカーからの配信で保持）
+        if settings.STATE_FILE and self.tbbox_client:
+            try:
+                self.device_state.save(settings.STATE_FILE)
+                logger.info(f"デバイス状態を保存しました: {settings.STATE_FILE}")
+            except OSError as e:
+                logger.error(f"デバイス状態の保存に失敗しました: {e}")
 
         if self.playlist_controller:
             self.playlist_controller.close()
@@ -134,15 +447,44 @@ class TBBOXPlaylistSwitcher:
             self.tbbox_client.close()
             logger.info("TBBOXクライアントをクローズしました")
 
+        if self.capture:
+            self.capture.close()
+            self.capture = None
+
+        if self.history_store:
+            self.history_store.close()
+            self.history_store = None
+
         logger.info("=" * 60)
         logger.info("TBBOX Playlist Switcher を終了しました")
         logger.info("=" * 60)
 
     def signal_handler(self, signum, frame):
-        """シグナルハンドラー"""
-        logger.info(f"シグナル {signum} を受信しました")
-        self.cleanup()
-        sys.exit(0)
+        """
+        シグナルハンドラー
+
+        新しいリクエストの受け付けを停止するだけで、終了処理はrun()から戻った後にcleanup()で行う
+        （処理中の切り替えを送信の途中で打ち切らない）
+        """
+        logger.info(f"シグナル {signum} を受信しました。新しいリクエストの受け付けを停止します")
+        self.request_shutdown()
+
+
+def run_worker(index: int, sock: socket.socket) -> None:
+    """
+    HTTPワーカープロセスのエントリーポイント（WorkerPoolからspawnで起動される）
+
+    Args:
+        index: ワーカー番号
+        sock: 親プロセスが作成した待ち受けソケット
+    """
+    app = TBBOXPlaylistSwitcher()
+    app.setup_worker()
+    logger.info(f"HTTPワーカー{index}を起動しました (pid={os.getpid()})")
+    try:
+        app.http_server.run(sock)
+    finally:
+        app.cleanup()
 
 
 def main():
@@ -0,0 +1,11 @@
+"""
+コマンドブローカーモジュール
+複数のHTTPワーカープロセスからのプログラム切り替えを、TBBOXとの接続を持つ1つのプロセスで実行する
+多数のTBBOXへの操作は、デバイスIDのハッシュで複数のワーカープロセスに振り分ける
+"""
+from src.broker.client import BrokerClient
+from src.broker.pool import WorkerPool
+from src.broker.server import CommandBroker
+from src.broker.shard import ShardFailure, ShardRouter, shard_for
+
+__all__ = ["BrokerClient", "CommandBroker", "ShardFailure", "ShardRouter", "WorkerPool", "shard_for"]
@@ -0,0 +1,278 @@
+"""
+ブローカークライアント
+HTTPワーカープロセスで動作し、プログラム切り替えをブローカープロセスに依頼する
+
+PlaylistControllerと同じswitch_program()を持つため、ワーカーではPlaylistControllerの代わりに使用する
+ブローカーから配信されたデバイス状態は手元のDeviceStateSnapshotに反映し、
+状態問い合わせ（すべて9のalert）と /api/state はブローカーに問い合わせずに応答する
+ブローカーから転送されたイベントは手元のEventBusで配信する（/api/events）
+"""
+import itertools
+import json
+import socket
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import settings
+from src.broker import wire
+from src.http.idempotency import current_idempotency_key
+from src.tbbox.protocol import CommandResult
+from src.tbbox.state import DeviceStateSnapshot
+from src.utils.deadline import Deadline, DeadlineExceeded
+from src.utils.events import EventBus
+from src.utils.logger import logger
+from src.utils.trace import current_trace
+
+
+class BrokerClient:
+    """
+    ブローカーに切り替えを依頼するクライアント
+
+    1本の接続を複数のスレッドで共有し、相関IDで要求と結果を対応付ける
+    ブローカーとの接続が切れた場合は、次の切り替え時に再接続する
+    """
+
+    # 処理期限が無い場合の結果待ちの上限に加える余裕（秒）
+    REPLY_TIMEOUT_MARGIN = 5.0
+
+    def __init__(
+        self,
+        path: Path,
+        state: Optional[DeviceStateSnapshot] = None,
+        connect_timeout: float = 1.0,
+        events: Optional[EventBus] = None,
+        reply_timeout: Optional[float] = None
+    ):
+        """
+        BrokerClientの初期化
+
+        Args:
+            path: ブローカーのUnixドメインソケットのパス
+            state: ブローカーから配信された状態を反映するスナップショット
+            connect_timeout: 接続のタイムアウト（秒）
+            events: ブローカーから転送されたイベントを配信するイベントバス
+            reply_timeout: 処理期限が無い場合に結果を待つ上限（秒、省略時はTBBOXへの接続と
+                           すべての再送が上限まで待った場合の時間に余裕を加えた値）
+        """
+        self.path = Path(path)
+        self.state = state or DeviceStateSnapshot()
+        self.connect_timeout = connect_timeout
+        self.events = events
+        # ブローカーが切断しないまま応答しなくなった場合に、いつまでも待たないようにする
+        self.reply_timeout = reply_timeout or (
+            settings.TBBOX_CONNECT_TIMEOUT
+            + settings.TBBOX_READ_TIMEOUT * (settings.COMMAND_MAX_RETRIES + 1)
+            + self.REPLY_TIMEOUT_MARGIN
+        )
+
+        self._sock: Optional[socket.socket] = None
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._pending: Dict[int, "Future[wire.SwitchReply]"] = {}
+        self._ids = itertools.count()
+
+    @property
+    def is_connected(self) -> bool:
+        """ブローカーに接続中の場合True"""
+        return self._sock is not None
+
+    def connect(self, deadline: Optional[Deadline] = None) -> bool:
+        """
+        ブローカーに接続（接続済みの場合は何もしない）
+
+        Args:
+            deadline: 処理の期限（接続のタイムアウトは残り時間までに制限される）
+
+        Returns:
+            bool: 接続済みまたは接続に成功した場合True
+        """
+        with self._lock:
+            if self._sock is not None:
+                return True
+            timeout = deadline.clamp(self.connect_timeout) if deadline else self.connect_timeout
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(timeout)
+                sock.connect(str(self.path))
+                sock.settimeout(None)
+            except OSError as e:
+                sock.close()
+                logger.warning(f"ブローカーに接続できません: {self.path} ({e})")
+                return False
+            self._sock = sock
+            threading.Thread(
+                target=self._reader,
+                args=(sock,),
+                name="broker-reader",
+                daemon=True
+            ).start()
+            logger.info(f"ブローカーに接続しました: {self.path}")
+            return True
+
+    def switch_program(
+        self,
+        program_id: str,
+        deadline: Optional[Deadline] = None
+    ) -> CommandResult:
+        """
+        ブローカーにプログラムの切り替えを依頼
+
+        HTTPリクエストの処理中であれば、ブローカー内の処理段階ごとの所要時間と
+        ブローカーとの通信時間（ipc）をトレースに加算する
+
+        Args:
+            program_id: プログラムID（"01"～"20"）
+            deadline: 処理の期限（残り時間をブローカーに引き継ぐ）
+
+        Returns:
+            CommandResult: 切り替え結果（ブローカーに接続できない場合は失敗結果）
+
+        Raises:
+            DeadlineExceeded: 期限内に切り替えが完了しなかった場合
+        """
+        return self._request(wire.MSG_SWITCH, program_id, deadline)
+
+    def switch_alert(
+        self,
+        alert: str,
+        deadline: Optional[Deadline] = None
+    ) -> CommandResult:
+        """
+        ブローカーにalertの処理（プログラムIDへの変換と切り替え）を依頼
+
+        時間帯ルールの評価と境界時刻での再評価はブローカーのSwitchMapperで行う
+        HTTPリクエストの冪等性キーもブローカーに渡し、別のワーカーに届いた再送もまとめさせる
+
+        Args:
+            alert: 検証済みのalert（例: "10109999"）
+            deadline: 処理の期限（残り時間をブローカーに引き継ぐ）
+
+        Returns:
+            CommandResult: 切り替え結果（切り替えを行わなかった場合は成功）
+
+        Raises:
+            DeadlineExceeded: 期限内に切り替えが完了しなかった場合
+        """
+        return self._request(wire.MSG_ALERT, alert, deadline)
+
+    def _request(self, kind: int, value: str, deadline: Optional[Deadline]) -> CommandResult:
+        """
+        MSG_SWITCH・MSG_ALERTを送信して結果を待つ
+
+        Args:
+            kind: MSG_SWITCH / MSG_ALERT
+            value: プログラムIDまたはalert
+            deadline: 処理の期限
+        """
+        if not self.connect(deadline):
+            return CommandResult.failure("broker_unavailable", retryable=True)
+
+        trace = current_trace()
+        # 相関IDは1～0xFFFFFFFFを繰り返す（0はMSG_STATE用）
+        correlation_id = next(self._ids) % 0xFFFFFFFF + 1
+        future: "Future[wire.SwitchReply]" = Future()
+        # 切断時に結果待ちの要求を失敗させる処理と同じロックで登録する
+        # （登録前に切断されていた場合、結果が届かないまま待ち続けないよう即座に失敗させる）
+        with self._lock:
+            sock = self._sock
+            if sock is None:
+                return CommandResult.failure("broker_unavailable", retryable=True)
+            self._pending[correlation_id] = future
+        key = current_idempotency_key() if kind == wire.MSG_ALERT else None
+        message = wire.encode_switch(
+            correlation_id,
+            value,
+            int(deadline.remaining() * 1000) if deadline else None,
+            trace.request_id if trace is not None else "",
+            kind,
+            json.dumps(key, ensure_ascii=False, separators=(",", ":")) if key else ""
+        )
+
+        sent_at = time.perf_counter()
+        try:
+            with self._send_lock:
+                sock.sendall(message)
+        except OSError as e:
+            self._pending.pop(correlation_id, None)
+            logger.warning(f"ブローカーへの送信に失敗しました: {e}")
+            self._disconnect(sock)
+            return CommandResult.failure("broker_unavailable", retryable=True)
+
+        try:
+            reply = future.result(
+                timeout=deadline.remaining() if deadline else self.reply_timeout
+            )
+        except FutureTimeout:
+            self._pending.pop(correlation_id, None)
+            if deadline:
+                raise DeadlineExceeded("broker")
+            logger.warning(f"ブローカーから{self.reply_timeout:.1f}秒以内に結果が届きませんでした")
+            return CommandResult.failure("broker_timeout", retryable=True)
+        except ConnectionError:
+            return CommandResult.failure("broker_unavailable", retryable=True)
+
+        if trace is not None:
+            trace.add("ipc", max(0.0, time.perf_counter() - sent_at - reply.handled))
+            for stage, seconds in reply.durations.items():
+                trace.add(stage, seconds)
+            trace.retries += reply.retries
+        if reply.flags & wire.FLAG_DEADLINE:
+            raise DeadlineExceeded(reply.result.error or "broker")
+        return reply.result
+
+    def _reader(self, sock: socket.socket) -> None:
+        """ブローカーからの結果と状態を受信する"""
+        stream = sock.makefile("rb")
+        try:
+            while True:
+                message = wire.read_message(stream)
+                if message is None:
+                    break
+                kind, flags, correlation_id, payload = message
+                if kind == wire.MSG_RESULT:
+                    future = self._pending.pop(correlation_id, None)
+                    if future is not None:
+                        future.set_result(wire.decode_result(payload, flags))
+                elif kind == wire.MSG_STATE:
+                    self.state.update(**wire.decode_state(payload))
+                elif kind == wire.MSG_EVENT and self.events:
+                    event, data = wire.decode_event(payload)
+                    self.events.publish(event, **data)
+        except (OSError, ConnectionError, ValueError) as e:
+            if self._sock is sock:
+                logger.warning(f"ブローカーからの受信中にエラーが発生しました: {e}")
+        finally:
+            stream.close()
+            self._disconnect(sock)
+
+    def _disconnect(self, sock: Optional[socket.socket], expected: bool = False) -> None:
+        """
+        接続を閉じ、結果待ちの要求をすべて失敗させる
+
+        Args:
+            sock: 閉じる接続（既に閉じて別の接続に置き換わっている場合は何もしない）
+            expected: close()による切断の場合True（警告を出力しない）
+        """
+        with self._lock:
+            if sock is None or self._sock is not sock:
+                return
+            self._sock = None
+            pending, self._pending = self._pending, {}
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+        for future in pending.values():
+            future.set_exception(ConnectionError("ブローカーとの接続が切断されました"))
+        # ブローカーが停止している間はTBBOXの接続状態を確認できない
+        self.state.set_connected(False)
+        if not expected:
+            logger.warning("ブローカーとの接続が切断されました")
+
+    def close(self) -> None:
+        """接続を閉じる"""
+        self._disconnect(self._sock, expected=True)
@@ -0,0 +1,147 @@
+"""
+HTTPワーカープロセスの管理
+待ち受けソケットを作成して複数のワーカープロセスで共有し、異常終了したワーカーを再起動する
+"""
+import multiprocessing
+import socket
+import threading
+import time
+from typing import Callable, List, Optional
+
+from src.utils.logger import logger
+
+# ワーカープロセスのエントリーポイント: (ワーカー番号, 待ち受けソケット) を受け取る
+WorkerTarget = Callable[[int, socket.socket], None]
+
+
+class WorkerPool:
+    """
+    HTTPワーカープロセスのプール
+
+    待ち受けソケットは親プロセスで作成してワーカーに渡すため、
+    どのワーカーが接続を受け付けるかはカーネルが振り分ける
+    ワーカーはspawnで起動する（親プロセスのスレッド・TBBOXとの接続を引き継がない）
+    """
+
+    def __init__(
+        self,
+        target: WorkerTarget,
+        count: int,
+        host: str,
+        port: int,
+        restart_delay: float = 1.0,
+        sock: Optional[socket.socket] = None
+    ):
+        """
+        WorkerPoolの初期化
+
+        Args:
+            target: ワーカープロセスで実行する関数（モジュールの最上位で定義された関数）
+            count: ワーカープロセスの数
+            host: 待ち受けホスト
+            port: 待ち受けポート（0の場合は空いているポート）
+            restart_delay: 異常終了したワーカーを再起動するまでの待ち時間（秒）
+            sock: 待ち受け済みのソケット（systemdから受け取った場合、省略時はhost:portで待ち受ける）
+        """
+        self.target = target
+        self.count = count
+        self.host = host
+        self.port = port
+        self.restart_delay = restart_delay
+
+        self.sock = sock
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * count
+        self.restarts = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """待ち受けソケットを作成してワーカーを起動"""
+        if self.sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.host, self.port))
+            sock.listen(2048)
+            self.sock = sock
+        self.host, self.port = self.sock.getsockname()[:2]
+        self._stop.clear()
+
+        for index in range(self.count):
+            self._spawn(index)
+        logger.info(f"HTTPワーカーを{self.count}個起動しました: http://{self.host}:{self.port}")
+
+    def _spawn(self, index: int) -> None:
+        """ワーカーを起動"""
+        process = self._context.Process(
+            target=self.target,
+            args=(index, self.sock),
+            name=f"http-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+
+    def watch(self, interval: float = 1.0) -> None:
+        """
+        stop()が呼ばれるまでワーカーを監視し、終了したワーカーを再起動する（ブロッキング）
+
+        Args:
+            interval: 監視間隔（秒）
+        """
+        while not self._stop.wait(interval):
+            self.check()
+
+    def interrupt(self) -> None:
+        """watch()を終了させる（ワーカーは停止しない、シグナルハンドラーから呼び出してもよい）"""
+        self._stop.set()
+
+    def check(self) -> int:
+        """
+        終了したワーカーを再起動
+
+        Returns:
+            int: 再起動したワーカーの数
+        """
+        restarted = 0
+        for index, process in enumerate(self.processes):
+            if process is None or process.is_alive() or self._stop.is_set():
+                continue
+            logger.error(
+                f"HTTPワーカー{index}が終了しました (終了コード: {process.exitcode})。"
+                f"{self.restart_delay}秒後に再起動します"
+            )
+            process.close()
+            self.processes[index] = None
+            if self._stop.wait(self.restart_delay):
+                break
+            self._spawn(index)
+            self.restarts += 1
+            restarted += 1
+        return restarted
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        ワーカーを停止
+
+        SIGTERMで処理中のリクエストの完了を待ち、timeout秒以内に終了しない場合は強制終了する
+
+        Args:
+            timeout: 終了を待つ時間（秒）
+        """
+        self._stop.set()
+        processes = [process for process in self.processes if process is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"{process.name}が終了しないため強制終了します")
+                process.kill()
+                process.join()
+        self.processes = [None] * self.count
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        logger.info("HTTPワーカーを停止しました")
@@ -0,0 +1,432 @@
+"""
+コマンドブローカー
+TBBOXとの接続を持つ唯一のプロセスで動作し、HTTPワーカープロセスから
+Unixドメインソケットで受け取ったプログラム切り替えを実行する
+
+TBBOXは制御用の接続を1本しか受け付けないため、ワーカーが複数あっても
+TBBOXに接続するのはブローカーのPlaylistControllerのみとなる
+"""
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Union
+
+from src.broker import wire
+from src.http.idempotency import IdempotencyCache, IdempotencyKey
+from src.tbbox.protocol import CommandResult
+from src.utils.deadline import Deadline, DeadlineExceeded, deadline_scope
+from src.utils.events import EventBus
+from src.utils.logger import logger
+from src.utils.trace import RequestTrace, trace_scope
+
+if TYPE_CHECKING:
+    from src.tbbox.playlist import PlaylistController
+    from src.tbbox.state import DeviceStateSnapshot
+
+
+class _WorkerConnection:
+    """
+    ワーカーとの接続
+
+    送信は上限付きのキューを介して専用のスレッドで行い、切り替え処理中
+    （PlaylistControllerのロックを保持した状態・結果の返信）にソケットへ書き込まない
+    キューがあふれたワーカー（応答しない・受信が追いつかない）は切断する
+    （状態を取りこぼしたまま動作させないため。ワーカーは次の切り替え時に再接続し、最新の状態を受け取る）
+    """
+
+    def __init__(self, sock: socket.socket, max_queue: int):
+        """
+        Args:
+            sock: ワーカーとの接続
+            max_queue: 送信待ちのメッセージ数の上限
+        """
+        self.sock = sock
+        self.closed = False
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(max_queue)
+        self._sender = threading.Thread(target=self._send_loop, name="broker-send", daemon=True)
+        self._sender.start()
+
+    def send(self, data: bytes) -> bool:
+        """
+        メッセージを送信キューに追加（ブロックしない）
+
+        Returns:
+            bool: 追加できた場合True（切断済み・キューがあふれて切断した場合False）
+        """
+        if self.closed:
+            return False
+        try:
+            self._queue.put_nowait(data)
+            return True
+        except queue.Full:
+            logger.warning("ワーカーへの送信が滞っているため切断します")
+            self.close()
+            return False
+
+    def _send_loop(self) -> None:
+        """送信キューのメッセージを順にワーカーへ送信する"""
+        while True:
+            data = self._queue.get()
+            if data is None or self.closed:
+                return
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.close()
+                return
+
+    def close(self) -> None:
+        """接続を閉じる（受信スレッドは切断を検出して終了する）"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class CommandBroker:
+    """
+    HTTPワーカーからのコマンドを実行するブローカー
+
+    ワーカーごとに受信スレッドを持ち、受け取った切り替えはスレッドプールで実行する
+    （送信の順序付け・処理期限・状態の記録はPlaylistControllerが単一プロセスの場合と同じく行う）
+    デバイス状態が変化するたびに、接続中のすべてのワーカーへ状態を送信する
+    イベント（切り替え・接続状態の変化）も同様にすべてのワーカーへ転送する
+    （送信はワーカーごとのスレッドで行い、受信が滞ったワーカーは切断する）
+
+    alert（MSG_ALERT）はブローカーのalert_handlerで処理する
+    （時間帯ルールの境界時刻での再評価に必要な、最後に受信したパターンをブローカーに残すため）
+    ワーカーから受け取った冪等性キーでalertの再送をまとめる
+    （ワーカーごとの冪等性キャッシュでは、別のワーカーに届いた再送をまとめられないため）
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        controller: Optional["PlaylistController"],
+        state: "DeviceStateSnapshot",
+        max_pending: int = 32,
+        events: Optional[EventBus] = None,
+        alert_handler: Optional[Callable[[str], Union[bool, CommandResult]]] = None,
+        max_queue: int = 256,
+        idempotency: Optional[IdempotencyCache] = None
+    ):
+        """
+        CommandBrokerの初期化
+
+        Args:
+            path: 待ち受けるUnixドメインソケットのパス
+            controller: 切り替えを実行するPlaylistController（Noneの場合はすべて失敗を返す）
+            state: ワーカーに配信するデバイス状態
+            max_pending: 同時に実行する切り替えの最大数（超えた分はブローカー内で待つ）
+            events: ワーカーに転送するイベントバス（Noneの場合は転送しない）
+            alert_handler: alertをプログラムIDに変換して切り替える関数
+                           （処理期限はcurrent_deadline()で参照できる、Noneの場合MSG_ALERTは失敗を返す）
+            max_queue: ワーカーごとの送信待ちメッセージ数の上限（超えたワーカーは切断する）
+            idempotency: alertの再送をまとめる冪等性キャッシュ（Noneの場合は無効）
+        """
+        self.path = Path(path)
+        self.controller = controller
+        self.alert_handler = alert_handler
+        self.idempotency = idempotency
+        self.state = state
+        self.max_pending = max_pending
+        self.max_queue = max_queue
+
+        self._listener: Optional[socket.socket] = None
+        self._accept_thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._connections: List[_WorkerConnection] = []
+        self._connections_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        self.handled = 0
+        self.errors = 0
+        self.state.add_listener(self._broadcast_state)
+        if events:
+            events.add_listener(self._broadcast_event)
+
+    def start(self) -> None:
+        """ソケットを作成して待ち受けを開始"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # 前回の異常終了で残ったソケットファイルを削除する
+        if self.path.exists():
+            self.path.unlink()
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(str(self.path))
+        # 同じユーザーのプロセス（ワーカー）以外からは接続させない
+        os.chmod(self.path, 0o600)
+        listener.listen(16)
+        self._listener = listener
+        self._stopping.clear()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_pending,
+            thread_name_prefix="broker"
+        )
+        self._accept_thread = threading.Thread(
+            target=self._accept_loop,
+            name="broker-accept",
+            daemon=True
+        )
+        self._accept_thread.start()
+        logger.info(f"コマンドブローカーを開始しました: {self.path}")
+
+    def stop(self) -> None:
+        """待ち受けを停止し、ワーカーとの接続を閉じる"""
+        self._stopping.set()
+        if self._listener:
+            try:
+                self._listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._listener.close()
+            self._listener = None
+        if self._accept_thread:
+            self._accept_thread.join(timeout=5)
+            self._accept_thread = None
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
+        logger.info("コマンドブローカーを停止しました")
+
+    @property
+    def worker_count(self) -> int:
+        """接続中のワーカー数"""
+        return len(self._connections)
+
+    def _accept_loop(self) -> None:
+        """ワーカーからの接続を受け付ける"""
+        while not self._stopping.is_set():
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                if not self._stopping.is_set():
+                    logger.error("ブローカーの待ち受けが停止しました")
+                return
+
+            connection = _WorkerConnection(sock, self.max_queue)
+            # 接続直後に現在の状態を送り、ワーカーの状態問い合わせに応答できるようにする
+            # 状態の配信と同じロックを保持したまま登録するため、この間に変化した状態は必ずこの後に届く
+            with self._connections_lock:
+                connection.send(wire.encode_state(self.state.get()))
+                self._connections.append(connection)
+            threading.Thread(
+                target=self._serve,
+                args=(connection,),
+                name="broker-conn",
+                daemon=True
+            ).start()
+
+    def _serve(self, connection: _WorkerConnection) -> None:
+        """ワーカーからのメッセージを受信して切り替えを実行する"""
+        logger.info(f"ワーカーが接続しました (接続中: {self.worker_count})")
+        stream = connection.sock.makefile("rb")
+        try:
+            while True:
+                message = wire.read_message(stream)
+                if message is None:
+                    break
+                kind, _, correlation_id, payload = message
+                if kind not in (wire.MSG_SWITCH, wire.MSG_ALERT):
+                    logger.warning(f"不明なメッセージ種別を受信しました: {kind}")
+                    continue
+                self._executor.submit(
+                    self._run_switch, connection, kind, correlation_id, payload, time.perf_counter()
+                )
+        except (OSError, ConnectionError, RuntimeError) as e:
+            # RuntimeErrorは停止処理中にスレッドプールへ投入した場合
+            if not self._stopping.is_set():
+                logger.warning(f"ワーカーとの接続が切断されました: {e}")
+        finally:
+            stream.close()
+            with self._connections_lock:
+                if connection in self._connections:
+                    self._connections.remove(connection)
+            connection.close()
+            if not self._stopping.is_set():
+                logger.info(f"ワーカーが切断しました (接続中: {self.worker_count})")
+
+    def _run_switch(
+        self,
+        connection: _WorkerConnection,
+        kind: int,
+        correlation_id: int,
+        payload: bytes,
+        received_at: float
+    ) -> None:
+        """
+        プログラム切り替えを実行して結果を返す
+
+        ワーカーから受け取ったリクエストIDと残りの処理期限を引き継ぎ、
+        処理段階ごとの所要時間を結果に含めてワーカーのServer-Timingに反映させる
+
+        Args:
+            connection: 要求を受信したワーカーとの接続
+            kind: MSG_SWITCH / MSG_ALERT
+            correlation_id: 要求の相関ID
+            payload: MSG_SWITCH・MSG_ALERTのペイロード
+            received_at: 要求を受信した時刻（time.perf_counter()）
+        """
+        try:
+            request = wire.decode_switch(payload)
+        except ValueError as e:
+            logger.error(f"切り替え要求を解析できません: {e}")
+            self.errors += 1
+            connection.send(wire.encode_result(
+                correlation_id, CommandResult.failure("bad_request", retryable=False), wire.FLAG_ERROR
+            ))
+            return
+
+        deadline = Deadline(request.deadline_ms / 1000) if request.deadline_ms is not None else None
+        trace = RequestTrace(request.request_id)
+        # スレッドプールの空き待ち
+        trace.add("queue", time.perf_counter() - received_at)
+        flags = 0
+        with trace_scope(trace):
+            try:
+                if kind == wire.MSG_ALERT:
+                    result = self._handle_alert(request.program_id, deadline, request.idempotency_key)
+                elif self.controller is None:
+                    logger.error("PlaylistControllerが初期化されていません")
+                    result = CommandResult.failure("no_controller", retryable=False)
+                else:
+                    result = self.controller.switch_program(request.program_id, deadline=deadline)
+            except DeadlineExceeded as e:
+                flags = wire.FLAG_DEADLINE
+                result = CommandResult.failure(e.stage, retryable=False)
+            except Exception as e:
+                logger.error(f"ブローカーでの切り替え中にエラーが発生しました: {e}")
+                self.errors += 1
+                flags = wire.FLAG_ERROR
+                result = CommandResult.failure("internal_error", retryable=False)
+
+        self.handled += 1
+        connection.send(wire.encode_result(
+            correlation_id,
+            result,
+            flags,
+            trace.retries,
+            time.perf_counter() - received_at,
+            trace.durations
+        ))
+
+    def _handle_alert(
+        self,
+        alert: str,
+        deadline: Optional[Deadline],
+        idempotency_key: str = ""
+    ) -> CommandResult:
+        """
+        alertをalert_handlerで処理
+
+        冪等性キーがある場合は、同じキーの処理中・処理済みの結果を返す（TBBOXへ送信しない）
+
+        Args:
+            alert: ワーカーで検証済みのalert
+            deadline: 処理期限（alert_handlerからはcurrent_deadline()で参照する）
+            idempotency_key: ワーカーから受け取った冪等性キー（JSON）
+
+        Returns:
+            CommandResult: 切り替え結果（切り替えを行わなかった場合は成功）
+
+        Raises:
+            DeadlineExceeded: 期限内に切り替えが完了しなかった場合
+        """
+        if self.alert_handler is None:
+            logger.error("alertの処理関数が設定されていません")
+            return CommandResult.failure("no_alert_handler", retryable=False)
+        key = self._parse_key(idempotency_key) if self.idempotency else None
+        if key is None:
+            return self._call_alert_handler(alert, deadline)
+
+        try:
+            result, duplicate = self.idempotency.run_sync(
+                key[0],
+                lambda: self._call_alert_handler(alert, deadline),
+                cacheable=lambda r: r.ok,
+                group=key[1],
+                timeout=deadline.remaining() if deadline else None
+            )
+        except FutureTimeout:
+            raise DeadlineExceeded("queue")
+        if duplicate:
+            logger.info(f"再送のため前回の結果を返します: alert={alert}")
+        return result
+
+    @staticmethod
+    def _parse_key(idempotency_key: str) -> Optional[IdempotencyKey]:
+        """
+        ワーカーから受け取った冪等性キー（JSON）を (キー, グループ) に変換
+
+        Returns:
+            Optional[IdempotencyKey]: (キー, グループ)（無い・形式が不正な場合はNone）
+        """
+        if not idempotency_key:
+            return None
+
+        def freeze(value: Any) -> Any:
+            # JSONの配列をタプルに戻す（キャッシュのキーはハッシュ可能である必要がある）
+            return tuple(freeze(item) for item in value) if isinstance(value, list) else value
+
+        try:
+            key, group = freeze(json.loads(idempotency_key))
+            hash((key, group))
+        except (ValueError, TypeError) as e:
+            logger.warning(f"冪等性キーの形式が不正です: {e}")
+            return None
+        return key, group
+
+    def _call_alert_handler(self, alert: str, deadline: Optional[Deadline]) -> CommandResult:
+        """alert_handlerを処理期限を設定して呼び出し、結果をCommandResultに変換"""
+        with deadline_scope(deadline):
+            result = self.alert_handler(alert)
+        if isinstance(result, CommandResult):
+            return result
+        return CommandResult(ok=True) if result else CommandResult.failure("failed", retryable=False)
+
+    def _broadcast_state(self, state: Dict[str, Any]) -> None:
+        """
+        デバイス状態を接続中のすべてのワーカーに送信
+
+        切り替え処理中（PlaylistControllerのロックを保持した状態）に呼ばれるため、
+        各ワーカーの送信キューに追加するだけでソケットには書き込まない
+        """
+        self._broadcast(lambda: wire.encode_state(state))
+
+    def _broadcast_event(self, kind: str, data: Dict[str, Any]) -> None:
+        """イベントを接続中のすべてのワーカーに送信（_broadcast_stateと同じく送信キューに追加する）"""
+        self._broadcast(lambda: wire.encode_event(kind, data))
+
+    def _broadcast(self, encode: Callable[[], bytes]) -> None:
+        """
+        メッセージを接続中のすべてのワーカーの送信キューに追加
+
+        Args:
+            encode: メッセージを生成する関数（ワーカーが接続していない場合は呼ばない）
+        """
+        with self._connections_lock:
+            if not self._connections:
+                return
+            message = encode()
+            for connection in self._connections:
+                connection.send(message)
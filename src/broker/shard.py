@@ -0,0 +1,289 @@
+"""
+デバイスごとの処理のプロセス分散
+多数のTBBOXへの接続・操作を、デバイスIDのハッシュで複数のワーカープロセスに振り分ける
+
+振り分けにはランデブーハッシュ（HRW）を使用するため、同じデバイスは常に同じワーカーで処理され、
+ワーカーが異常終了した場合はそのワーカーが担当していたデバイスだけが残りのワーカーに移る
+"""
+import hashlib
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from src.utils.logger import logger
+
+# ワーカーで実行する関数: ジョブの内容を受け取り、結果を返す（引数・結果はpickle可能であること）
+ShardTarget = Callable[[Any], Any]
+
+
+def shard_for(key: str, shards: Iterable[int]) -> int:
+    """
+    キーを担当するシャードをランデブーハッシュで決定
+
+    Pythonのhash()はプロセスごとに値が変わるため、blake2bで重みを計算する
+
+    Args:
+        key: デバイスID
+        shards: 候補のシャード番号
+
+    Returns:
+        int: 重みが最大のシャード番号
+
+    Raises:
+        ValueError: 候補が無い場合
+    """
+    def weight(shard: int) -> int:
+        digest = hashlib.blake2b(f"{shard}:{key}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    return max(shards, key=weight)
+
+
+class ShardFailure(NamedTuple):
+    """ワーカーで完了しなかったジョブ"""
+
+    key: str
+    reason: str
+
+
+def _shard_worker(
+    target: ShardTarget,
+    threads: int,
+    tasks: "multiprocessing.Queue",
+    results: "multiprocessing.Queue",
+    initializer: Optional[Callable[..., None]],
+    initargs: Tuple
+) -> None:
+    """
+    ワーカープロセスのメインループ
+
+    受け取ったジョブをスレッドで並行して実行し、(キー, 成功, 結果) を返す
+    Noneを受け取ると実行中のジョブの完了を待って終了する
+    """
+    if initializer is not None:
+        initializer(*initargs)
+
+    def run(key: str, job: Any) -> None:
+        try:
+            results.put((key, True, target(job)))
+        except Exception as e:
+            results.put((key, False, f"{type(e).__name__}: {e}"))
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="shard") as executor:
+        while True:
+            item = tasks.get()
+            if item is None:
+                break
+            executor.submit(run, *item)
+
+
+class ShardRouter:
+    """
+    ジョブをキーのハッシュでワーカープロセスに振り分けて結果を集めるルーター
+
+    ワーカーはspawnで起動し、それぞれがスレッドで担当分のジョブを並行して実行する
+    実行中にワーカーが異常終了した場合は、未完了のジョブを残りのワーカーに振り分け直す
+    終了したワーカーは次のrun()の開始時に再起動する
+    """
+
+    def __init__(
+        self,
+        target: ShardTarget,
+        processes: int,
+        threads: int = 8,
+        max_attempts: int = 2,
+        initializer: Optional[Callable[..., None]] = None,
+        initargs: Tuple = (),
+        poll_interval: float = 0.1
+    ):
+        """
+        ShardRouterの初期化
+
+        Args:
+            target: ワーカーで実行する関数（モジュールの最上位で定義された関数）
+            processes: ワーカープロセスの数
+            threads: ワーカーごとに同時に実行するジョブの数
+            max_attempts: 1つのジョブを実行する最大回数（実行中のワーカーが異常終了した場合に再実行する）
+            initializer: ワーカーの起動時に実行する関数（ログレベルの設定など）
+            initargs: initializerの引数
+            poll_interval: ワーカーの生存を確認する間隔（秒）
+        """
+        if processes < 1:
+            raise ValueError(f"ワーカープロセスの数は1以上で指定してください: {processes}")
+        self.target = target
+        self.processes = processes
+        self.threads = max(1, threads)
+        self.max_attempts = max(1, max_attempts)
+        self.initializer = initializer
+        self.initargs = initargs
+        self.poll_interval = poll_interval
+
+        self.workers: List[Optional[multiprocessing.Process]] = [None] * processes
+        self.crashes = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._tasks: List[Optional["multiprocessing.Queue"]] = [None] * processes
+        self._results: Optional["multiprocessing.Queue"] = None
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "ShardRouter":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """ワーカーを起動（起動済みのワーカーはそのまま）"""
+        if self._results is None:
+            self._results = self._context.Queue()
+        for index in range(self.processes):
+            worker = self.workers[index]
+            if worker is not None and worker.is_alive():
+                continue
+            if worker is not None:
+                worker.close()
+            self._spawn(index)
+
+    def _spawn(self, index: int) -> None:
+        """ワーカーを起動"""
+        tasks = self._context.Queue()
+        worker = self._context.Process(
+            target=_shard_worker,
+            args=(self.target, self.threads, tasks, self._results, self.initializer, self.initargs),
+            name=f"shard-worker-{index}",
+            daemon=True
+        )
+        worker.start()
+        self._tasks[index] = tasks
+        self.workers[index] = worker
+
+    def alive(self) -> Set[int]:
+        """動作中のワーカーの番号"""
+        return {
+            index for index, worker in enumerate(self.workers)
+            if worker is not None and worker.is_alive()
+        }
+
+    def owner(self, key: str) -> int:
+        """
+        キーを担当するワーカーの番号（動作中のワーカーの中から決定）
+
+        Raises:
+            ValueError: 動作中のワーカーが無い場合
+        """
+        return shard_for(key, self.alive())
+
+    def run(self, jobs: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        ジョブを担当のワーカーで実行し、すべての結果を待つ
+
+        Args:
+            jobs: キー（デバイスID）ごとのジョブ
+            timeout: 全体の待ち時間の上限（秒、省略時は無制限）
+
+        Returns:
+            Dict[str, Any]: キーごとの結果（完了しなかったジョブ・例外が発生したジョブはShardFailure）
+        """
+        with self._lock:
+            self.start()
+            # 前回の実行で期限切れになったジョブの結果を読み捨てる
+            self._drain()
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            results: Dict[str, Any] = {}
+            attempts: Dict[str, int] = {}
+            # ワーカー番号 -> 実行中のキー
+            running: Dict[int, Set[str]] = {index: set() for index in range(self.processes)}
+            live = self.alive()
+
+            def dispatch(keys: Iterable[str]) -> None:
+                for key in keys:
+                    if attempts.get(key, 0) >= self.max_attempts:
+                        results[key] = ShardFailure(key, "worker_crashed")
+                        continue
+                    if not live:
+                        results[key] = ShardFailure(key, "no_worker")
+                        continue
+                    index = shard_for(key, live)
+                    attempts[key] = attempts.get(key, 0) + 1
+                    running[index].add(key)
+                    self._tasks[index].put((key, jobs[key]))
+
+            dispatch(jobs)
+            while len(results) < len(jobs):
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                try:
+                    key, ok, value = self._results.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    pass
+                else:
+                    # 振り分け直した後に元のワーカーの結果が届いた場合は先着を採用する
+                    if key in jobs and key not in results:
+                        results[key] = value if ok else ShardFailure(key, value)
+                    for keys in running.values():
+                        keys.discard(key)
+                    continue
+
+                for index in list(live):
+                    if self.workers[index].is_alive():
+                        continue
+                    live.discard(index)
+                    self.crashes += 1
+                    orphans = sorted(running[index] - results.keys())
+                    running[index] = set()
+                    logger.error(
+                        f"{self.workers[index].name}が終了しました "
+                        f"(終了コード: {self.workers[index].exitcode})。"
+                        f"担当していた{len(orphans)}件を残りの{len(live)}個のワーカーに振り分けます"
+                    )
+                    dispatch(orphans)
+
+            for key in jobs:
+                results.setdefault(key, ShardFailure(key, "timeout"))
+            return {key: results[key] for key in jobs}
+
+    def _drain(self) -> None:
+        """受け取られなかった結果を読み捨てる"""
+        try:
+            while True:
+                self._results.get_nowait()
+        except (queue.Empty, OSError, ValueError):
+            pass
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        ワーカーを停止
+
+        実行中のジョブの完了を待ち、timeout秒以内に終了しない場合は強制終了する
+
+        Args:
+            timeout: 終了を待つ時間（秒）
+        """
+        with self._lock:
+            for index, worker in enumerate(self.workers):
+                if worker is not None and worker.is_alive():
+                    self._tasks[index].put(None)
+            deadline = time.monotonic() + timeout
+            for worker in self.workers:
+                if worker is None:
+                    continue
+                # 結果を送信し終えるまでワーカーは終了しないため、受け取られなかった結果を読み捨てる
+                while worker.is_alive() and time.monotonic() < deadline:
+                    self._drain()
+                    worker.join(self.poll_interval)
+                if worker.is_alive():
+                    logger.warning(f"{worker.name}が終了しないため強制終了します")
+                    worker.kill()
+                    worker.join()
+                worker.close()
+            for tasks in self._tasks:
+                if tasks is not None:
+                    tasks.close()
+            if self._results is not None:
+                self._results.close()
+            self.workers = [None] * self.processes
+            self._tasks = [None] * self.processes
+            self._results = None
@@ -0,0 +1,323 @@
+"""
+ブローカー通信のメッセージ形式
+HTTPワーカープロセスとブローカープロセスの間で、検証済みのコマンドと結果をバイナリで送受信する
+
+メッセージは8バイトのヘッダとペイロードで構成される（数値はビッグエンディアン）
+
+    オフセット  サイズ  内容
+    0          1      メッセージ種別（MSG_SWITCH / MSG_RESULT / MSG_STATE / MSG_EVENT / MSG_ALERT）
+    1          1      フラグ（MSG_RESULT: FLAG_DEADLINE / FLAG_ERROR）
+    2          4      相関ID（要求と結果の対応付け、MSG_STATE・MSG_EVENTは0）
+    6          2      ペイロード長
+    8          n      ペイロード
+
+MSG_SWITCH（ワーカー → ブローカー）
+
+    4  処理期限（ミリ秒、NO_DEADLINEは期限なし）
+    1  プログラムIDの長さ
+    2  冪等性キーの長さ（0は無し）
+    n  プログラムID（ASCII）
+    k  冪等性キー（UTF-8のJSON）
+    m  リクエストID（ASCII、残り全部）
+
+MSG_ALERT（ワーカー → ブローカー）
+
+    MSG_SWITCHと同じ形式で、プログラムIDの代わりに検証済みのalertを送る
+    （alertからプログラムIDへの変換・時間帯ルールの評価はブローカーで行う）
+    冪等性キーはワーカーの冪等性キャッシュと同じ (キー, グループ) で、
+    ブローカーでも再送をまとめる（再送が別のワーカーに届いた場合のため）
+
+MSG_RESULT（ブローカー → ワーカー）
+
+    1  成功（1）/ 失敗（0）
+    1  再送で回復しうる失敗（1）
+    4  結果コード（符号付き、-1は結果コードなし）
+    2  コマンド種別
+    2  アクション
+    1  再送回数
+    20 処理段階ごとの所要時間（マイクロ秒）: ブローカー内の処理全体, queue, connect, tbbox, retry
+    1  切り替え先プログラムIDの長さ（0は無し）
+    n  切り替え先プログラムID（ASCII、時間帯ルール・マッピングの適用後）
+    m  エラー種別（ASCII、残り全部。FLAG_DEADLINEの場合は期限を過ぎた処理段階）
+
+MSG_STATE（ブローカー → ワーカー、デバイス状態が変化するたびに送信）
+
+    n  DeviceStateSnapshotの状態（JSON）
+
+MSG_EVENT（ブローカー → ワーカー、切り替え・接続状態の変化などのイベントが発生するたびに送信）
+
+    n  {"kind": 種別, "data": 内容}（JSON）
+"""
+import json
+import struct
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from src.tbbox.protocol import CommandResult
+
+HEADER = struct.Struct("!BBIH")
+HEADER_SIZE = HEADER.size
+
+MSG_SWITCH = 1
+MSG_RESULT = 2
+MSG_STATE = 3
+MSG_EVENT = 4
+MSG_ALERT = 5
+
+# MSG_RESULTのフラグ
+FLAG_DEADLINE = 0x01  # ブローカーでの処理中に期限を過ぎた
+FLAG_ERROR = 0x02     # ブローカーでの処理中に予期しないエラーが発生した
+
+# 期限なしを表す処理期限
+NO_DEADLINE = 0xFFFFFFFF
+
+# ペイロードの最大長
+MAX_PAYLOAD = 0xFFFF
+
+_SWITCH = struct.Struct("!IBH")
+_RESULT = struct.Struct("!BBiHHB5IB")
+
+# MSG_RESULTで送る処理段階（ブローカー内の処理全体を除く）
+RESULT_STAGES = ("queue", "connect", "tbbox", "retry")
+
+
+class SwitchRequest(NamedTuple):
+    """プログラム切り替えの要求"""
+
+    program_id: str
+    deadline_ms: Optional[int]
+    request_id: str
+    # 冪等性キー（JSON、無い場合は空文字列）
+    idempotency_key: str = ""
+
+
+class SwitchReply(NamedTuple):
+    """プログラム切り替えの結果"""
+
+    result: CommandResult
+    flags: int
+    retries: int
+    # ブローカー内の処理全体の所要時間（秒）
+    handled: float
+    # 処理段階 → 所要時間（秒）
+    durations: Dict[str, float]
+
+
+def _micros(seconds: float) -> int:
+    """秒をマイクロ秒の符号なし32ビット整数に変換"""
+    return min(max(int(seconds * 1_000_000), 0), 0xFFFFFFFF)
+
+
+def pack(kind: int, correlation_id: int, payload: bytes = b"", flags: int = 0) -> bytes:
+    """
+    メッセージをバイト列に変換
+
+    Args:
+        kind: メッセージ種別
+        correlation_id: 相関ID
+        payload: ペイロード
+        flags: フラグ
+
+    Returns:
+        bytes: ヘッダとペイロード
+
+    Raises:
+        ValueError: ペイロードが長すぎる場合
+    """
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"ペイロードが長すぎます ({len(payload)}バイト)")
+    return HEADER.pack(kind, flags, correlation_id, len(payload)) + payload
+
+
+def encode_switch(
+    correlation_id: int,
+    program_id: str,
+    deadline_ms: Optional[int] = None,
+    request_id: str = "",
+    kind: int = MSG_SWITCH,
+    idempotency_key: str = ""
+) -> bytes:
+    """
+    MSG_SWITCH（kind=MSG_ALERTの場合はMSG_ALERT）を生成
+
+    Args:
+        correlation_id: 相関ID
+        program_id: 切り替え先プログラムID（MSG_ALERTの場合はalert）
+        deadline_ms: 処理期限（ミリ秒、Noneは期限なし）
+        request_id: ログに付与するリクエストID
+        kind: MSG_SWITCH / MSG_ALERT
+        idempotency_key: 冪等性キー（JSON）
+
+    Raises:
+        ValueError: ペイロードが長すぎる場合
+    """
+    program = program_id.encode("ascii")
+    key = idempotency_key.encode("utf-8")
+    deadline = NO_DEADLINE if deadline_ms is None else min(max(deadline_ms, 0), NO_DEADLINE - 1)
+    if len(key) > MAX_PAYLOAD:
+        raise ValueError(f"冪等性キーが長すぎます ({len(key)}バイト)")
+    payload = (
+        _SWITCH.pack(deadline, len(program), len(key)) + program + key + request_id.encode("ascii")
+    )
+    return pack(kind, correlation_id, payload)
+
+
+def decode_switch(payload: bytes) -> SwitchRequest:
+    """
+    MSG_SWITCH・MSG_ALERTのペイロードを解析（MSG_ALERTの場合、program_idはalert）
+
+    Raises:
+        ValueError: ペイロードの形式が不正な場合
+    """
+    try:
+        deadline, length, key_length = _SWITCH.unpack_from(payload)
+        start = _SWITCH.size
+        program_id = payload[start:start + length].decode("ascii")
+        key = payload[start + length:start + length + key_length]
+        idempotency_key = key.decode("utf-8")
+        request_id = payload[start + length + key_length:].decode("ascii")
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"MSG_SWITCHの形式が不正です: {e}")
+    if len(program_id) != length:
+        raise ValueError("MSG_SWITCHのプログラムIDが途中で切れています")
+    if len(key) != key_length:
+        raise ValueError("MSG_SWITCHの冪等性キーが途中で切れています")
+    return SwitchRequest(
+        program_id, None if deadline == NO_DEADLINE else deadline, request_id, idempotency_key
+    )
+
+
+def encode_result(
+    correlation_id: int,
+    result: CommandResult,
+    flags: int = 0,
+    retries: int = 0,
+    handled: float = 0.0,
+    durations: Optional[Dict[str, float]] = None
+) -> bytes:
+    """
+    MSG_RESULTを生成
+
+    Args:
+        correlation_id: 要求の相関ID
+        result: コマンドの実行結果
+        flags: FLAG_DEADLINE / FLAG_ERROR
+        retries: 再送回数
+        handled: ブローカー内の処理全体の所要時間（秒）
+        durations: 処理段階ごとの所要時間（秒）
+    """
+    durations = durations or {}
+    program = (result.program or "").encode("ascii", "replace")[:0xFF]
+    payload = _RESULT.pack(
+        1 if result.ok else 0,
+        1 if result.retryable else 0,
+        -1 if result.status is None else result.status,
+        result.command or 0,
+        result.action or 0,
+        min(retries, 0xFF),
+        _micros(handled),
+        *(_micros(durations.get(stage, 0.0)) for stage in RESULT_STAGES),
+        len(program)
+    ) + program + (result.error or "").encode("ascii", "replace")
+    return pack(MSG_RESULT, correlation_id, payload, flags)
+
+
+def decode_result(payload: bytes, flags: int = 0) -> SwitchReply:
+    """
+    MSG_RESULTのペイロードを解析
+
+    Raises:
+        ValueError: ペイロードの形式が不正な場合
+    """
+    try:
+        ok, retryable, status, command, action, retries, handled, *micros, length = (
+            _RESULT.unpack_from(payload)
+        )
+    except struct.error as e:
+        raise ValueError(f"MSG_RESULTの形式が不正です: {e}")
+    start = _RESULT.size
+    if len(payload) < start + length:
+        raise ValueError("MSG_RESULTのプログラムIDが途中で切れています")
+    program = payload[start:start + length].decode("ascii", "replace") or None
+    error = payload[start + length:].decode("ascii", "replace") or None
+    result = CommandResult(
+        ok=bool(ok),
+        status=None if status < 0 else status,
+        command=command or None,
+        action=action or None,
+        error=error,
+        retryable=bool(retryable),
+        program=program,
+    )
+    durations = {
+        stage: value / 1_000_000 for stage, value in zip(RESULT_STAGES, micros) if value
+    }
+    return SwitchReply(result, flags, retries, handled / 1_000_000, durations)
+
+
+def encode_state(state: Dict[str, Any]) -> bytes:
+    """MSG_STATEを生成"""
+    payload = json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return pack(MSG_STATE, 0, payload)
+
+
+def decode_state(payload: bytes) -> Dict[str, Any]:
+    """
+    MSG_STATEのペイロードを解析
+
+    Raises:
+        ValueError: ペイロードの形式が不正な場合
+    """
+    state = json.loads(payload.decode("utf-8"))
+    if not isinstance(state, dict):
+        raise ValueError("MSG_STATEの形式が不正です")
+    return state
+
+
+def encode_event(kind: str, data: Dict[str, Any]) -> bytes:
+    """MSG_EVENTを生成"""
+    payload = json.dumps(
+        {"kind": kind, "data": data}, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+    return pack(MSG_EVENT, 0, payload)
+
+
+def decode_event(payload: bytes) -> Tuple[str, Dict[str, Any]]:
+    """
+    MSG_EVENTのペイロードを解析
+
+    Returns:
+        Tuple[str, Dict[str, Any]]: (種別, 内容)
+
+    Raises:
+        ValueError: ペイロードの形式が不正な場合
+    """
+    event = json.loads(payload.decode("utf-8"))
+    if not isinstance(event, dict) or not isinstance(event.get("data"), dict):
+        raise ValueError("MSG_EVENTの形式が不正です")
+    return str(event.get("kind")), event["data"]
+
+
+def read_message(stream) -> Optional[Tuple[int, int, int, bytes]]:
+    """
+    ストリームからメッセージを1件読み取る
+
+    Args:
+        stream: バイナリストリーム（socket.makefile("rb") など）
+
+    Returns:
+        Optional[Tuple[int, int, int, bytes]]: (メッセージ種別, フラグ, 相関ID, ペイロード)
+                                                相手が切断した場合はNone
+
+    Raises:
+        ConnectionError: メッセージの途中で切断された場合
+    """
+    header = stream.read(HEADER_SIZE)
+    if not header:
+        return None
+    if len(header) < HEADER_SIZE:
+        raise ConnectionError("ヘッダの途中で切断されました")
+    kind, flags, correlation_id, length = HEADER.unpack(header)
+    payload = stream.read(length) if length else b""
+    if len(payload) < length:
+        raise ConnectionError("ペイロードの途中で切断されました")
+    return kind, flags, correlation_id, payload
@@ -0,0 +1,7 @@
+"""
+切り替え履歴モジュール
+alert受信と切り替え結果を記録・検索する
+"""
+from src.history.store import HistoryStore
+
+__all__ = ["HistoryStore"]
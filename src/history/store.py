@@ -0,0 +1,361 @@
+"""
+切り替え履歴ストア
+alert受信と切り替え結果をSQLiteに記録し、時間範囲・デバイス単位で検索する
+
+記録はキューに積むだけで、書き込みはバックグラウンドスレッドがまとめて行う
+（リクエスト処理のホットパスではディスクI/Oを行わない）
+"""
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.utils.logger import logger
+
+
+class HistoryStore:
+    """
+    切り替え履歴を保存するストア
+
+    (ts, id) と (sim_id, ts, id) のインデックスを持ち、
+    時間範囲・SIM IDでの検索をキーセットページングで行う
+    """
+
+    # 1回の書き込みでまとめる最大件数
+    BATCH_SIZE = 200
+
+    # 書き込みキューの上限（超えた分は破棄してカウントする）
+    MAX_QUEUE_SIZE = 10000
+
+    # 1回の検索で返す最大件数
+    MAX_PAGE_SIZE = 1000
+
+    def __init__(
+        self,
+        db_path: Path,
+        retention_days: float = 30,
+        flush_interval: float = 1.0,
+        prune_interval: float = 3600
+    ):
+        """
+        HistoryStoreの初期化
+
+        Args:
+            db_path: SQLiteデータベースファイルのパス（":memory:"は使用不可）
+            retention_days: 履歴の保持日数（これより古い履歴は削除される）
+            flush_interval: バッチ書き込みの最大待ち時間（秒）
+            prune_interval: 古い履歴の削除を実行する間隔（秒）
+        """
+        self.db_path = Path(db_path)
+        self.retention_days = retention_days
+        self.flush_interval = flush_interval
+        self.prune_interval = prune_interval
+
+        self._queue: "queue.Queue[Optional[Tuple]]" = queue.Queue(maxsize=self.MAX_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._last_prune = 0.0
+        self._closing = False
+        self.dropped = 0
+        self.written = 0
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_db()
+
+        logger.info(f"履歴ストア初期化: {self.db_path} (保持日数: {retention_days})")
+
+    def _connect(self) -> sqlite3.Connection:
+        """SQLite接続を作成"""
+        conn = sqlite3.connect(str(self.db_path), timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_db(self) -> None:
+        """テーブルとインデックスを作成"""
+        conn = self._connect()
+        try:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts REAL NOT NULL,
+                    sim_id TEXT,
+                    alert TEXT,
+                    program TEXT,
+                    latency_ms REAL,
+                    result TEXT NOT NULL,
+                    source TEXT NOT NULL DEFAULT 'http'
+                );
+                CREATE INDEX IF NOT EXISTS idx_history_ts ON history (ts, id);
+                CREATE INDEX IF NOT EXISTS idx_history_sim_ts ON history (sim_id, ts, id);
+                """
+            )
+            # source列が無い以前のデータベース（記録はすべてHTTPリクエストによるもの）
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(history)")}
+            if "source" not in columns:
+                conn.execute("ALTER TABLE history ADD COLUMN source TEXT NOT NULL DEFAULT 'http'")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def start(self) -> None:
+        """バックグラウンド書き込みスレッドを開始"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._thread = threading.Thread(
+            target=self._writer_loop,
+            name="history-writer",
+            daemon=True
+        )
+        self._thread.start()
+
+    def record(
+        self,
+        sim_id: Optional[str],
+        alert: Optional[str],
+        program: Optional[str],
+        latency_ms: float,
+        result: str,
+        timestamp: Optional[float] = None,
+        source: str = "http"
+    ) -> None:
+        """
+        履歴を記録（ノンブロッキング）
+
+        Args:
+            sim_id: SIMカードID
+            alert: 受信したalertパラメータ
+            program: 切り替え先プログラムID（無い場合はNone）
+            latency_ms: 処理時間（ミリ秒）
+            result: 処理結果（"ok", "failed", "invalid"など）
+            timestamp: 受信時刻（UNIX時間、省略時は現在時刻）
+            source: 記録元（"http": alert受信、"rule": 時間帯ルールの境界、"schedule": スケジュール）
+        """
+        ts = timestamp if timestamp is not None else time.time()
+        try:
+            self._queue.put_nowait((ts, sim_id, alert, program, latency_ms, result, source))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """
+        キューに積まれた履歴がすべて書き込まれるまで待機
+
+        Args:
+            timeout: 最大待ち時間（秒）
+
+        Returns:
+            bool: すべて書き込まれた場合True
+        """
+        if not self._thread or not self._thread.is_alive():
+            # 書き込みスレッドが無い場合はその場で書き込む
+            conn = self._connect()
+            try:
+                while not self._queue.empty():
+                    self._drain(conn, block=False)
+            finally:
+                conn.close()
+            return True
+
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self) -> None:
+        """書き込みスレッドを停止（残りの履歴は書き込んでから終了）"""
+        if self._thread and self._thread.is_alive():
+            self._closing = True
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+        self._thread = None
+        logger.info(f"履歴ストアをクローズしました (書き込み: {self.written}件, 破棄: {self.dropped}件)")
+
+    def _writer_loop(self) -> None:
+        """
+        キューから履歴を取り出してまとめて書き込む
+
+        書き込み・削除でエラーが発生しても停止要求を受け取るまで続ける
+        （スレッドが終了すると、以降の履歴はキューが一杯になって警告なく破棄されるため）
+        """
+        conn = self._connect()
+        try:
+            while True:
+                try:
+                    if not self._drain(conn, block=True):
+                        break
+                    now = time.time()
+                    if now - self._last_prune >= self.prune_interval:
+                        self.prune(now, conn=conn)
+                except Exception as e:
+                    logger.error(f"履歴書き込みスレッドでエラーが発生しました: {e}")
+                    # 停止要求を取り出した後のエラーで終了できなくならないようにする
+                    if self._closing:
+                        break
+                    # 削除に失敗した場合も、次の削除はprune_interval後に行う
+                    self._last_prune = time.time()
+                    time.sleep(self.flush_interval)
+        finally:
+            conn.close()
+
+    def _drain(self, conn: sqlite3.Connection, block: bool) -> bool:
+        """
+        キューから最大BATCH_SIZE件を取り出して1トランザクションで書き込む
+
+        Returns:
+            bool: 停止要求を受け取った場合False
+        """
+        rows: List[Tuple] = []
+        running = True
+
+        try:
+            item = self._queue.get(timeout=self.flush_interval) if block else self._queue.get_nowait()
+        except queue.Empty:
+            return True
+
+        while True:
+            if item is None:
+                running = False
+                self._queue.task_done()
+            else:
+                rows.append(item)
+            # 停止要求の後に残っている分はまとめて書き込む
+            if len(rows) >= self.BATCH_SIZE and running:
+                break
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+        if rows:
+            try:
+                conn.executemany(
+                    "INSERT INTO history (ts, sim_id, alert, program, latency_ms, result, source) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                conn.commit()
+                self.written += len(rows)
+            except sqlite3.Error as e:
+                logger.error(f"履歴の書き込みに失敗しました: {e}")
+                self.dropped += len(rows)
+            finally:
+                for _ in rows:
+                    self._queue.task_done()
+
+        return running
+
+    def prune(self, now: Optional[float] = None, conn: Optional[sqlite3.Connection] = None) -> int:
+        """
+        保持期間を過ぎた履歴を削除
+
+        Args:
+            now: 基準時刻（UNIX時間、省略時は現在時刻）
+            conn: 使用するSQLite接続（省略時は新規作成）
+
+        Returns:
+            int: 削除した件数
+        """
+        now = now if now is not None else time.time()
+        cutoff = now - self.retention_days * 86400
+        own_conn = conn is None
+        conn = conn or self._connect()
+        try:
+            cursor = conn.execute("DELETE FROM history WHERE ts < ?", (cutoff,))
+            conn.commit()
+            self._last_prune = now
+            if cursor.rowcount:
+                logger.info(f"古い履歴を削除しました: {cursor.rowcount}件")
+            return cursor.rowcount
+        finally:
+            if own_conn:
+                conn.close()
+
+    def query(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        sim_id: Optional[str] = None,
+        limit: int = 100,
+        cursor: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        履歴を検索（時刻の昇順）
+
+        Args:
+            start: 検索開始時刻（UNIX時間、この時刻を含む）
+            end: 検索終了時刻（UNIX時間、この時刻を含まない）
+            sim_id: SIMカードIDで絞り込む場合に指定
+            limit: 1ページの最大件数
+            cursor: 前ページのnext_cursor（続きを取得する場合）
+
+        Returns:
+            Dict[str, Any]: {"items": [...], "next_cursor": str or None}
+
+        Raises:
+            ValueError: cursorの形式が不正な場合
+        """
+        limit = max(1, min(self.MAX_PAGE_SIZE, limit))
+        conditions = []
+        params: List[Any] = []
+
+        if sim_id is not None:
+            conditions.append("sim_id = ?")
+            params.append(sim_id)
+        if start is not None:
+            conditions.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("ts < ?")
+            params.append(end)
+        if cursor:
+            last_ts, last_id = self._decode_cursor(cursor)
+            conditions.append("(ts, id) > (?, ?)")
+            params.extend([last_ts, last_id])
+
+        sql = "SELECT id, ts, sim_id, alert, program, latency_ms, result, source FROM history"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY ts, id LIMIT ?"
+        # 次ページの有無を判定するため1件多く取得する
+        params.append(limit + 1)
+
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = f"{last[1]!r}:{last[0]}"
+
+        items = [
+            {
+                "timestamp": row[1],
+                "id": row[2],
+                "alert": row[3],
+                "program": row[4],
+                "latency_ms": row[5],
+                "result": row[6],
+                "source": row[7],
+            }
+            for row in rows
+        ]
+        return {"items": items, "next_cursor": next_cursor}
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[float, int]:
+        """ページングカーソルを (ts, id) に変換"""
+        try:
+            ts, row_id = cursor.rsplit(":", 1)
+            return float(ts), int(row_id)
+        except ValueError:
+            raise ValueError(f"Invalid cursor: {cursor}")
@@ -0,0 +1,376 @@
+"""
+管理用エンドポイントの診断機能
+稼働中のプロセスのプロファイル取得・メモリ確保量の比較・スタックの出力・実行環境の統計を提供する
+
+現地で動作が重くなった場合に、再起動や再配置をせずに原因を調べるために使用する
+"""
+import asyncio
+import cProfile
+import gc
+import hmac
+import io
+import os
+import platform
+import pstats
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from src.utils.logger import logger
+
+# プロファイル結果の並べ替えに指定できるキー
+PROFILE_SORT_KEYS = ("cumulative", "tottime", "calls", "ncalls", "time")
+
+# tracemallocの集計単位
+SNAPSHOT_KEY_TYPES = ("lineno", "filename", "traceback")
+
+# tracemallocの集計から除外するフレーム（計測自体による確保）
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class ProfilerBusy(RuntimeError):
+    """他のプロファイルを実行中の場合の例外"""
+
+
+def _frame_label(frame) -> str:
+    """折りたたみ形式のスタックに出力するフレーム名"""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_names() -> Dict[int, str]:
+    """スレッドID → スレッド名"""
+    return {thread.ident: thread.name for thread in threading.enumerate() if thread.ident}
+
+
+class AdminTools:
+    """
+    管理用エンドポイントの診断機能
+
+    プロファイルは同時に1つのみ実行できる
+    tracemallocは start_tracing() で開始し、snapshot_diff() のたびに前回のスナップショットとの差分を返す
+    """
+
+    def __init__(self, token: str, max_profile_seconds: float = 60.0):
+        """
+        AdminToolsの初期化
+
+        Args:
+            token: 管理用エンドポイントの認証トークン（空の場合はすべて拒否する）
+            max_profile_seconds: プロファイルの最大計測時間（秒）
+        """
+        self.token = token
+        self.max_profile_seconds = max_profile_seconds
+        self.started_at = time.time()
+        self._profile_lock = threading.Lock()
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._snapshot_time = 0.0
+
+    def authorize(self, authorization: Optional[str], admin_token: Optional[str] = None) -> bool:
+        """
+        リクエストの認証
+
+        Args:
+            authorization: Authorizationヘッダの値（"Bearer <トークン>"）
+            admin_token: X-Admin-Tokenヘッダの値
+
+        Returns:
+            bool: トークンが一致した場合True
+        """
+        if not self.token:
+            return False
+        supplied = admin_token
+        if authorization:
+            scheme, _, value = authorization.partition(" ")
+            if scheme.lower() == "bearer":
+                supplied = value.strip()
+        if not supplied:
+            return False
+        return hmac.compare_digest(supplied.encode("utf-8"), self.token.encode("utf-8"))
+
+    def _check_seconds(self, seconds: float) -> None:
+        """計測時間の検証"""
+        if not 0 < seconds <= self.max_profile_seconds:
+            raise ValueError(f"秒数は0より大きく{self.max_profile_seconds:g}以下で指定してください")
+
+    async def profile(self, seconds: float, sort: str = "cumulative", limit: int = 40) -> str:
+        """
+        cProfileでイベントループのスレッドをseconds秒間計測
+
+        cProfileは有効にしたスレッドのみを計測するため、HTTPリクエストの処理（イベントループ）が対象となる
+        TBBOXとの通信などスレッドプールで実行される処理は sample() で計測する
+
+        Args:
+            seconds: 計測時間（秒）
+            sort: 並べ替えのキー（PROFILE_SORT_KEYS）
+            limit: 出力する関数の数
+
+        Returns:
+            str: pstats形式の計測結果
+
+        Raises:
+            ValueError: 引数が不正な場合
+            ProfilerBusy: 他のプロファイルを実行中の場合
+        """
+        self._check_seconds(seconds)
+        if sort not in PROFILE_SORT_KEYS:
+            raise ValueError(f"sortは{', '.join(PROFILE_SORT_KEYS)}のいずれかを指定してください")
+        if not self._profile_lock.acquire(blocking=False):
+            raise ProfilerBusy("他のプロファイルを実行中です")
+
+        try:
+            logger.info(f"cProfileによる計測を開始します ({seconds:g}秒)")
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:
+                # 他のプロファイラ（デバッガ等）が有効な場合
+                raise ProfilerBusy(str(e))
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.disable()
+        finally:
+            self._profile_lock.release()
+
+        stream = io.StringIO()
+        stream.write(f"# cProfile: イベントループのスレッド, {seconds:g}秒\n")
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def sample(self, seconds: float, interval: float = 0.01) -> str:
+        """
+        全スレッドのスタックをinterval秒ごとに採取して集計
+
+        Args:
+            seconds: 計測時間（秒）
+            interval: 採取間隔（秒）
+
+        Returns:
+            str: 折りたたみ形式のスタック（"スレッド名;関数;関数 回数"、回数の多い順）
+                 flamegraph.pl や speedscope でフレームグラフとして表示できる
+
+        Raises:
+            ValueError: 引数が不正な場合
+            ProfilerBusy: 他のプロファイルを実行中の場合
+        """
+        self._check_seconds(seconds)
+        if not 0.001 <= interval <= 1:
+            raise ValueError("intervalは0.001以上1以下で指定してください")
+        if not self._profile_lock.acquire(blocking=False):
+            raise ProfilerBusy("他のプロファイルを実行中です")
+
+        logger.info(f"スタックの採取を開始します ({seconds:g}秒, 間隔 {interval:g}秒)")
+        own_thread = threading.get_ident()
+        stacks: Counter = Counter()
+        samples = 0
+        try:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = _thread_names()
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_thread:
+                        continue
+                    labels: List[str] = []
+                    while frame is not None:
+                        labels.append(_frame_label(frame))
+                        frame = frame.f_back
+                    labels.append(names.get(ident, f"thread-{ident}"))
+                    stacks[";".join(reversed(labels))] += 1
+                samples += 1
+                time.sleep(interval)
+        finally:
+            self._profile_lock.release()
+
+        lines = [f"# samples={samples} interval={interval:g}s"]
+        lines.extend(f"{stack} {count}" for stack, count in stacks.most_common())
+        return "\n".join(lines) + "\n"
+
+    def start_tracing(self, frames: int = 10) -> Dict[str, Any]:
+        """
+        tracemallocを開始して基準のスナップショットを取得
+
+        既に開始している場合は基準のスナップショットのみ取り直す
+
+        Args:
+            frames: 確保元として記録するスタックの深さ
+
+        Returns:
+            Dict[str, Any]: tracemallocの状態
+
+        Raises:
+            ValueError: framesが範囲外の場合
+        """
+        if not 1 <= frames <= 100:
+            raise ValueError("framesは1以上100以下で指定してください")
+        if not tracemalloc.is_tracing():
+            logger.info(f"tracemallocを開始します (frames={frames})")
+            tracemalloc.start(frames)
+        self._snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        self._snapshot_time = time.time()
+        return self.tracing_status()
+
+    def stop_tracing(self) -> Dict[str, Any]:
+        """tracemallocを停止（記録中の確保情報は破棄される）"""
+        if tracemalloc.is_tracing():
+            logger.info("tracemallocを停止します")
+            tracemalloc.stop()
+        self._snapshot = None
+        return self.tracing_status()
+
+    def tracing_status(self) -> Dict[str, Any]:
+        """tracemallocの状態"""
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {
+            "tracing": tracing,
+            "frames": tracemalloc.get_traceback_limit() if tracing else None,
+            "traced_bytes": current,
+            "peak_bytes": peak,
+        }
+
+    def snapshot_diff(self, limit: int = 20, key_type: str = "lineno") -> Dict[str, Any]:
+        """
+        スナップショットを取得して前回との差分を返す
+
+        取得したスナップショットを次回の比較の基準とする
+
+        Args:
+            limit: 出力する確保元の数（増加量の多い順）
+            key_type: 集計単位（SNAPSHOT_KEY_TYPES）
+
+        Returns:
+            Dict[str, Any]: {"tracing": ..., "interval_s": ..., "top": [{"location", "size", "size_diff", ...}]}
+
+        Raises:
+            ValueError: 引数が不正な場合
+            RuntimeError: tracemallocを開始していない場合
+        """
+        if key_type not in SNAPSHOT_KEY_TYPES:
+            raise ValueError(f"keyは{', '.join(SNAPSHOT_KEY_TYPES)}のいずれかを指定してください")
+        if not tracemalloc.is_tracing() or self._snapshot is None:
+            raise RuntimeError("tracemallocを開始していません")
+
+        previous, previous_time = self._snapshot, self._snapshot_time
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        self._snapshot, self._snapshot_time = snapshot, time.time()
+
+        top = []
+        for stat in snapshot.compare_to(previous, key_type)[:limit]:
+            frames = stat.traceback.format() if key_type == "traceback" else None
+            top.append({
+                "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size": stat.size,
+                "size_diff": stat.size_diff,
+                "count": stat.count,
+                "count_diff": stat.count_diff,
+                **({"traceback": frames} if frames else {}),
+            })
+
+        status = self.tracing_status()
+        status["interval_s"] = round(self._snapshot_time - previous_time, 3)
+        status["top"] = top
+        return status
+
+    @staticmethod
+    def dump_stacks(loop: Optional[asyncio.AbstractEventLoop] = None) -> str:
+        """
+        全スレッドとasyncioタスクのスタックを出力
+
+        Args:
+            loop: タスクを出力するイベントループ（省略時は実行中のループ、無い場合はスレッドのみ）
+
+        Returns:
+            str: スタックのテキスト
+        """
+        stream = io.StringIO()
+        names = _thread_names()
+        frames = sys._current_frames()
+        stream.write(f"# threads={len(frames)}\n")
+        for ident, frame in frames.items():
+            stream.write(f"\n--- Thread {names.get(ident, '?')} (id={ident}) ---\n")
+            stream.write("".join(traceback.format_stack(frame)))
+
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+        if loop is not None:
+            tasks = asyncio.all_tasks(loop)
+            stream.write(f"\n# asyncio tasks={len(tasks)}\n")
+            for task in tasks:
+                stream.write(f"\n--- {task!r} ---\n")
+                task.print_stack(file=stream)
+        return stream.getvalue()
+
+    def runtime(self) -> Dict[str, Any]:
+        """
+        実行環境の統計（GC・ファイルディスクリプタ・スレッド・メモリ）
+
+        Returns:
+            Dict[str, Any]: 統計情報
+        """
+        gc_stats = gc.get_stats()
+        try:
+            loop = asyncio.get_running_loop()
+            tasks: Optional[int] = len(asyncio.all_tasks(loop))
+        except RuntimeError:
+            tasks = None
+
+        return {
+            "pid": os.getpid(),
+            "python": platform.python_version(),
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "threads": threading.active_count(),
+            "asyncio_tasks": tasks,
+            "open_fds": _count_fds(),
+            "rss_bytes": _rss_bytes(),
+            "gc": {
+                "enabled": gc.isenabled(),
+                "counts": list(gc.get_count()),
+                "thresholds": list(gc.get_threshold()),
+                "collections": [s["collections"] for s in gc_stats],
+                "collected": [s["collected"] for s in gc_stats],
+                "uncollectable": [s["uncollectable"] for s in gc_stats],
+                "garbage": len(gc.garbage),
+                "objects": len(gc.get_objects()),
+            },
+            "tracemalloc": self.tracing_status(),
+        }
+
+
+def _count_fds() -> Optional[int]:
+    """開いているファイルディスクリプタの数（/proc が無い環境ではNone）"""
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def _rss_bytes() -> Optional[int]:
+    """常駐メモリ量（/proc が無い環境では最大常駐メモリ量）"""
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOSはバイト、Linuxはキロバイト単位
+        return usage if sys.platform == "darwin" else usage * 1024
+    except (ImportError, OSError):
+        return None
@@ -0,0 +1,266 @@
+"""
+冪等性キャッシュ
+linkbaseの再送リクエストでTBBOXへのコマンドが重複しないようにする
+
+複数ワーカー構成では、ワーカーが計算したキーをcurrent_idempotency_key()でブローカークライアントに渡し、
+ブローカーでも同じキーでまとめる（再送が別のワーカーに届いた場合もTBBOXへは1回だけ送信する）
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+# 冪等性キーとグループ
+IdempotencyKey = Tuple[Hashable, Optional[Hashable]]
+
+
+class _Entry:
+    """キャッシュエントリ"""
+
+    __slots__ = ("future", "expires_at")
+
+    def __init__(self, future: Any):
+        # run()ではasyncio.Future、run_sync()ではconcurrent.futures.Future
+        self.future = future
+        # 処理中は期限切れにしない
+        self.expires_at = float("inf")
+
+
+class IdempotencyCache:
+    """
+    LRU + TTLの冪等性キャッシュ
+
+    同じキーのリクエストが処理中に届いた場合は同じFutureの完了を待ち、
+    処理完了後TTL以内に届いた場合はキャッシュ済みの結果を返す
+
+    グループ（SIM IDなど）を指定した場合、同じグループに別のキーが届いた時点で
+    そのグループの以前のエントリを破棄する（A→B→Aの3回目を再送として扱わない）
+
+    イベントループではrun()を、スレッド（ブローカー）ではrun_sync()を使う
+    （1つのキャッシュではどちらか一方のみを使う）
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 10.0):
+        """
+        IdempotencyCacheの初期化
+
+        Args:
+            max_entries: 保持する最大エントリ数（超えた場合は古いものから破棄）
+            ttl: 処理完了後に結果を保持する時間（秒）
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        # グループごとの最後のキー
+        self._latest: "OrderedDict[Hashable, Hashable]" = OrderedDict()
+        # run_sync()でのエントリの参照・更新を排他する
+        self._lock = threading.Lock()
+
+        self.misses = 0
+        self.hits = 0
+        self.joined = 0
+
+    async def run(
+        self,
+        key: Hashable,
+        factory: Callable[[], Awaitable[Any]],
+        cacheable: Optional[Callable[[Any], bool]] = None,
+        group: Optional[Hashable] = None
+    ) -> Tuple[Any, bool]:
+        """
+        キーに対応する処理を1回だけ実行して結果を返す
+
+        Args:
+            key: 冪等性キー
+            factory: 実際の処理を行うコルーチン関数
+            cacheable: 結果をキャッシュするかを判定する関数
+                       （Falseの場合、完了後の重複リクエストは再実行される）
+            group: キーのグループ（別のキーが届いた場合に以前のエントリを破棄する）
+
+        Returns:
+            Tuple[Any, bool]: (処理結果, 重複リクエストだった場合True)
+        """
+        if group is not None:
+            self._switch_group(group, key)
+
+        now = time.monotonic()
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            if entry.expires_at > now:
+                self._entries.move_to_end(key)
+                if entry.future.done():
+                    self.hits += 1
+                else:
+                    self.joined += 1
+                # 待機側のキャンセルが元の処理に波及しないようにする
+                return await asyncio.shield(entry.future), True
+            del self._entries[key]
+
+        self.misses += 1
+        future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        entry = _Entry(future)
+        self._entries[key] = entry
+        self._evict()
+
+        try:
+            result = await factory()
+        except BaseException as e:
+            self._discard(key, entry)
+            future.set_exception(e)
+            # 待機者がいない場合の「未取得の例外」警告を抑止する
+            future.exception()
+            raise
+
+        future.set_result(result)
+        if cacheable is None or cacheable(result):
+            entry.expires_at = time.monotonic() + self.ttl
+        else:
+            self._discard(key, entry)
+
+        return result, False
+
+    def run_sync(
+        self,
+        key: Hashable,
+        func: Callable[[], Any],
+        cacheable: Optional[Callable[[Any], bool]] = None,
+        group: Optional[Hashable] = None,
+        timeout: Optional[float] = None
+    ) -> Tuple[Any, bool]:
+        """
+        run()のスレッド版（複数のスレッドから呼ばれるブローカー用）
+
+        Args:
+            key: 冪等性キー
+            func: 実際の処理を行う関数
+            cacheable: 結果をキャッシュするかを判定する関数
+            group: キーのグループ
+            timeout: 処理中の同じキーの完了を待つ上限（秒、Noneの場合は無制限）
+
+        Returns:
+            Tuple[Any, bool]: (処理結果, 重複リクエストだった場合True)
+
+        Raises:
+            concurrent.futures.TimeoutError: 処理中の同じキーがtimeout秒以内に完了しなかった場合
+        """
+        with self._lock:
+            if group is not None:
+                self._switch_group(group, key)
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+            duplicate = entry is not None
+            if duplicate:
+                self._entries.move_to_end(key)
+                if entry.future.done():
+                    self.hits += 1
+                else:
+                    self.joined += 1
+            else:
+                self.misses += 1
+                entry = _Entry(Future())
+                self._entries[key] = entry
+                self._evict()
+        if duplicate:
+            return entry.future.result(timeout), True
+
+        future = entry.future
+        try:
+            result = func()
+        except BaseException as e:
+            with self._lock:
+                self._discard(key, entry)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if cacheable is None or cacheable(result):
+                entry.expires_at = time.monotonic() + self.ttl
+            else:
+                self._discard(key, entry)
+        future.set_result(result)
+        return result, False
+
+    def _switch_group(self, group: Hashable, key: Hashable) -> None:
+        """グループの最後のキーを更新し、別のキーだった場合は以前のエントリを破棄"""
+        previous = self._latest.pop(group, None)
+        if previous is not None and previous != key:
+            # 処理中の場合も、待機中のリクエストは取得済みのFutureで結果を受け取れる
+            self._entries.pop(previous, None)
+        self._latest[group] = key
+        while len(self._latest) > self.max_entries:
+            self._latest.popitem(last=False)
+
+    def _discard(self, key: Hashable, entry: _Entry) -> None:
+        """エントリが置き換えられていなければ削除"""
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+
+    def _evict(self) -> None:
+        """
+        期限切れ・上限超過のエントリを古いものから削除
+
+        処理中のエントリは削除しない（処理中に届いた再送が同じ処理の完了を待てるようにするため。
+        処理中のエントリ数は同時に処理中のリクエスト数までのため、上限を一時的に超えても増え続けない）
+        """
+        now = time.monotonic()
+        excess = len(self._entries) - self.max_entries
+        expired = []
+        for key, entry in self._entries.items():
+            if entry.expires_at == float("inf"):
+                continue
+            if excess <= 0 and entry.expires_at > now:
+                break
+            expired.append(key)
+            excess -= 1
+        for key in expired:
+            del self._entries[key]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        統計情報を取得
+
+        Returns:
+            Dict[str, int]: エントリ数、ヒット数などのカウンタ
+        """
+        return {
+            "entries": len(self._entries),
+            "misses": self.misses,
+            "hits": self.hits,
+            "joined": self.joined,
+        }
+
+
+_current_key: ContextVar[Optional[IdempotencyKey]] = ContextVar("idempotency_key", default=None)
+
+
+def current_idempotency_key() -> Optional[IdempotencyKey]:
+    """
+    処理中のリクエストの冪等性キーとグループを取得
+
+    Returns:
+        Optional[IdempotencyKey]: (キー, グループ)（冪等性キャッシュが無効な場合はNone）
+    """
+    return _current_key.get()
+
+
+@contextmanager
+def idempotency_scope(key: Optional[IdempotencyKey]) -> Iterator[Optional[IdempotencyKey]]:
+    """
+    ブロック内で参照される冪等性キーを設定
+
+    Args:
+        key: (キー, グループ)
+    """
+    token = _current_key.set(key)
+    try:
+        yield key
+    finally:
+        _current_key.reset(token)
@@ -0,0 +1,130 @@
+"""
+軽量ASGIアプリケーション
+/api/control をFastAPIのルーティング・バリデーションを通さずに直接処理する
+
+レスポンスはFastAPIのルートと同じバイト列を返す（ワイヤ互換）
+/api/control 以外のリクエストはFastAPIアプリケーションに委譲する
+"""
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import unquote_plus
+
+if TYPE_CHECKING:
+    from src.http.server import HTTPServer
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+CONTROL_PATH = "/api/control"
+
+_JSON_CONTENT_TYPE = (b"content-type", b"application/json")
+_METHOD_NOT_ALLOWED = b'{"detail":"Method Not Allowed"}'
+
+
+def _decode_value(value: bytes) -> str:
+    """クエリパラメータの値をデコード（エスケープが無い場合はそのまま）"""
+    text = value.decode("latin-1")
+    if "%" in text or "+" in text:
+        return unquote_plus(text)
+    return text
+
+
+def parse_control_query(query_string: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """
+    生のクエリ文字列からalertとidを取り出す
+
+    同じキーが複数ある場合は、FastAPIと同様に最後の値を採用する
+
+    Args:
+        query_string: ASGIスコープのquery_string（例: b"alert=10109999&id=123"）
+
+    Returns:
+        Tuple[Optional[str], Optional[str]]: (alert, id)
+    """
+    alert: Optional[str] = None
+    sim_id: Optional[str] = None
+
+    if not query_string:
+        return alert, sim_id
+
+    for part in query_string.split(b"&"):
+        key, _, value = part.partition(b"=")
+        if key == b"alert":
+            alert = _decode_value(value)
+        elif key == b"id":
+            sim_id = _decode_value(value)
+
+    return alert, sim_id
+
+
+class LeanControlApp:
+    """
+    /api/control 専用の軽量ASGIアプリケーション
+
+    クエリ文字列を直接解析してHTTPServer._handle_controlを呼び出し、
+    事前エンコード済みのレスポンスをそのまま送信する
+    """
+
+    def __init__(self, server: "HTTPServer"):
+        """
+        LeanControlAppの初期化
+
+        Args:
+            server: 処理を委譲するHTTPServer
+        """
+        self.server = server
+        self.fallback = server.get_app()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """ASGIエントリーポイント"""
+        if scope["type"] != "http" or scope["path"] != CONTROL_PATH:
+            await self.fallback(scope, receive, send)
+            return
+
+        if scope["method"] != "GET":
+            await self._send(send, 405, _METHOD_NOT_ALLOWED, [(b"allow", b"GET")])
+            return
+
+        alert, sim_id = parse_control_query(scope.get("query_string", b""))
+        idempotency_key = None
+        deadline_ms = None
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"idempotency-key":
+                idempotency_key = value.decode("latin-1")
+            elif name == b"x-deadline-ms":
+                deadline_ms = value.decode("latin-1")
+            elif name == b"x-request-id":
+                request_id = value.decode("latin-1")
+        client = scope.get("client")
+        response = await self.server._handle_control(
+            alert,
+            sim_id,
+            idempotency_key,
+            client_ip=client[0] if client else None,
+            deadline_ms=deadline_ms,
+            request_id=request_id
+        )
+        extra_headers = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in response.headers
+        ]
+        await self._send(send, response.status_code, response.body, extra_headers)
+
+    @staticmethod
+    async def _send(
+        send: Send,
+        status_code: int,
+        body: bytes,
+        extra_headers: Optional[list] = None
+    ) -> None:
+        """レスポンスを送信"""
+        headers = [
+            (b"content-length", str(len(body)).encode("latin-1")),
+            _JSON_CONTENT_TYPE,
+        ]
+        if extra_headers:
+            headers.extend(extra_headers)
+
+        await send({"type": "http.response.start", "status": status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
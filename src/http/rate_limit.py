@@ -0,0 +1,134 @@
+"""
+レート制限モジュール
+送信元（SIM ID・クライアントIP）ごとのトークンバケットでリクエストを制限する
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+class TokenBucketLimiter:
+    """
+    キーごとのトークンバケットによるレート制限
+
+    バケットはキーごとに [トークン数, 最終更新時刻] のみを保持し、
+    一定時間アクセスの無いキーは自動的に破棄する
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        idle_timeout: float = 300,
+        max_keys: int = 10000
+    ):
+        """
+        TokenBucketLimiterの初期化
+
+        Args:
+            rate: 1秒あたりに補充されるトークン数
+            burst: バケットの容量（連続して受け付けられる最大リクエスト数）
+            idle_timeout: この秒数アクセスの無いキーを破棄する
+            max_keys: 保持する最大キー数（超えた場合は最も古いキーから破棄）
+        """
+        self.rate = rate
+        self.burst = burst
+        self.idle_timeout = idle_timeout
+        self.max_keys = max_keys
+
+        # キー → [トークン数, 最終更新時刻]（最終アクセス順）
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.allowed = 0
+        self.limited = 0
+        self.evicted = 0
+
+    def acquire(self, *keys: str, now: Optional[float] = None) -> float:
+        """
+        すべてのキーのバケットからトークンを1つずつ取得
+
+        いずれかのバケットが空の場合はどのバケットからも取得しない
+
+        Args:
+            *keys: バケットのキー（例: "id:8942...", "ip:192.168.0.10"）
+            now: 現在時刻（省略時はtime.monotonic()）
+
+        Returns:
+            float: 0の場合は許可、正の値の場合は再試行までの待ち時間（秒）
+        """
+        now = time.monotonic() if now is None else now
+
+        with self._lock:
+            self._evict_idle(now)
+
+            buckets = []
+            retry_after = 0.0
+            for key in keys:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = [self.burst, now]
+                    self._buckets[key] = bucket
+                else:
+                    # 経過時間分のトークンを補充
+                    bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                    bucket[1] = now
+                    self._buckets.move_to_end(key)
+                buckets.append(bucket)
+
+                if bucket[0] < 1:
+                    retry_after = max(retry_after, (1 - bucket[0]) / self.rate)
+
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evicted += 1
+
+            if retry_after > 0:
+                self.limited += 1
+                return retry_after
+
+            for bucket in buckets:
+                bucket[0] -= 1
+            self.allowed += 1
+            return 0.0
+
+    def _evict_idle(self, now: float) -> None:
+        """一定時間アクセスの無いキーを破棄（古い順に並んでいるため先頭から確認）"""
+        cutoff = now - self.idle_timeout
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket[1] >= cutoff:
+                break
+            del self._buckets[key]
+            self.evicted += 1
+
+    @staticmethod
+    def retry_after_header(retry_after: float) -> str:
+        """
+        Retry-Afterヘッダの値（整数秒、切り上げ）を取得
+
+        Args:
+            retry_after: 待ち時間（秒）
+
+        Returns:
+            str: ヘッダ値
+        """
+        return str(max(1, math.ceil(retry_after)))
+
+    def stats(self) -> Dict[str, float]:
+        """
+        統計情報を取得
+
+        Returns:
+            Dict[str, float]: 許可・制限したリクエスト数などのカウンタ
+        """
+        return {
+            "active_keys": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "evicted": self.evicted,
+            "rate": self.rate,
+            "burst": self.burst,
+        }
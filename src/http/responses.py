@@ -0,0 +1,123 @@
+"""
+/api/control のレスポンス定義
+応答の種類は限られているため、固定の応答はJSONバイト列に事前エンコードしておく
+"""
+import json
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+
+def encode_json(payload: Any) -> bytes:
+    """
+    JSONバイト列にエンコード
+
+    FastAPI（Starlette）のJSONResponseと同じ形式で出力する
+
+    Args:
+        payload: エンコード対象
+
+    Returns:
+        bytes: UTF-8のJSONバイト列
+    """
+    return json.dumps(
+        payload,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":")
+    ).encode("utf-8")
+
+
+class ControlResponse(NamedTuple):
+    """/api/control のレスポンス（ステータスコード、ボディ、追加ヘッダ）"""
+
+    status_code: int
+    body: bytes
+    headers: Tuple[Tuple[str, str], ...] = ()
+
+
+class SwitchOutcome(NamedTuple):
+    """コールバック（プログラム切り替え）の実行結果"""
+
+    response: ControlResponse
+    result: str
+    program_id: Optional[str]
+
+
+# 固定の応答
+NO_ACTION = ControlResponse(200, encode_json({"status": "ok", "message": "No action (all 9s)"}))
+NO_CALLBACK = ControlResponse(200, encode_json({"status": "ok", "message": "No callback configured"}))
+SWITCH_FAILED = ControlResponse(500, encode_json({"detail": "Program_switch_failed"}))
+DEADLINE_EXCEEDED = ControlResponse(504, encode_json({"detail": "Deadline_exceeded"}))
+
+_error_cache: Dict[str, ControlResponse] = {}
+_switched_cache: Dict[str, ControlResponse] = {}
+
+
+def error(status_code: int, detail: str) -> ControlResponse:
+    """
+    エラー応答を取得
+
+    Args:
+        status_code: HTTPステータスコード
+        detail: エラーメッセージ（HTTPExceptionのdetailと同じ形式で返す）
+
+    Returns:
+        ControlResponse: エラー応答
+    """
+    key = f"{status_code}:{detail}"
+    response = _error_cache.get(key)
+    if response is None:
+        response = ControlResponse(status_code, encode_json({"detail": detail}))
+        # 例外メッセージを含む応答は種類が増え続けるためキャッシュしない
+        if not detail.startswith("Internal_error"):
+            _error_cache[key] = response
+    return response
+
+
+def too_many_requests(retry_after: str) -> ControlResponse:
+    """
+    レート制限超過の応答を取得
+
+    Args:
+        retry_after: Retry-Afterヘッダの値（秒）
+
+    Returns:
+        ControlResponse: 429応答
+    """
+    return ControlResponse(
+        429,
+        error(429, "Too_many_requests").body,
+        (("Retry-After", retry_after),)
+    )
+
+
+def switch_rejected(status: Optional[int]) -> ControlResponse:
+    """
+    TBBOXがコマンドを拒否した場合の応答を取得
+
+    Args:
+        status: TBBOXが返した結果コード
+
+    Returns:
+        ControlResponse: 500応答（detailと結果コードを含む）
+    """
+    return ControlResponse(
+        500,
+        encode_json({"detail": "Program_switch_rejected", "code": status})
+    )
+
+
+def switched(program_id: str) -> ControlResponse:
+    """
+    切り替え成功の応答を取得
+
+    Args:
+        program_id: 切り替え先プログラムID
+
+    Returns:
+        ControlResponse: 成功応答
+    """
+    response = _switched_cache.get(program_id)
+    if response is None:
+        response = ControlResponse(200, encode_json({"status": "ok", "program": program_id}))
+        _switched_cache[program_id] = response
+    return response
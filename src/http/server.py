@@ -2,13 +2,34 @@
 HTTPサーバモジュール
 満空灯制御装置からのHTTPリクエストを受信してプログラム切り替えをトリガーする
 """
+import asyncio
+import math
 import re
-from typing import Callable, Optional
-
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import JSONResponse
-
+import socket
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, Optional, Tuple, Union
+
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+from src.http import responses
+from src.http.admin import AdminTools, ProfilerBusy
+from src.http.idempotency import idempotency_scope
+from src.mapper.layout import AlertLayout
+from src.tbbox.protocol import CommandResult
+from src.utils.deadline import Deadline, DeadlineExceeded, deadline_scope
+from src.utils.events import EventBus, Subscription, TooManySubscribers, format_event
 from src.utils.logger import logger
+from src.utils.trace import RequestTrace, current_trace, trace_scope
+
+if TYPE_CHECKING:
+    from src.history.store import HistoryStore
+    from src.http.idempotency import IdempotencyCache
+    from src.http.rate_limit import TokenBucketLimiter
+    from src.scheduler.scheduler import ActionScheduler
+    from src.tbbox.state import DeviceStateSnapshot
 
 
 class HTTPServer:
@@ -19,11 +40,32 @@ class HTTPServer:
     スイッチ状態に応じてコールバック関数を呼び出す
     """
 
+    # /api/control のうちエラーイベントを配信する処理結果
+    ERROR_RESULTS = ("failed", "rejected", "cancelled", "error")
+    # /api/events で購読者の終了・サーバの停止を確認する間隔（秒）
+    EVENTS_POLL_INTERVAL = 1.0
+    # /api/events でイベントが無い間にコメント行を送る間隔（秒、プロキシによる切断を防ぐ）
+    EVENTS_KEEPALIVE = 15.0
+    # X-Deadline-Msで指定できる期限の上限（ミリ秒、超えた場合はこの値に制限する）
+    MAX_DEADLINE_MS = 600_000.0
+
     def __init__(
         self,
         host: str = "0.0.0.0",
         port: int = 8080,
-        callback: Optional[Callable[[str], bool]] = None
+        callback: Optional[Callable[[str], Union[bool, CommandResult]]] = None,
+        history: Optional["HistoryStore"] = None,
+        status_snapshot: Optional["DeviceStateSnapshot"] = None,
+        lean_control: bool = False,
+        idempotency: Optional["IdempotencyCache"] = None,
+        rate_limiter: Optional["TokenBucketLimiter"] = None,
+        deadline_seconds: Optional[float] = None,
+        state_ttl: float = 30.0,
+        scheduler: Optional["ActionScheduler"] = None,
+        layout: Optional[AlertLayout] = None,
+        admin: Optional[AdminTools] = None,
+        drain_seconds: Optional[float] = None,
+        events: Optional[EventBus] = None
     ):
         """
         HTTPServerの初期化
@@ -34,11 +76,43 @@ class HTTPServer:
             callback: リクエスト受信時のコールバック関数
                       callback(alert: str) -> bool の形式
                       alertは8桁のパラメータ文字列
+                      TBBOXの応答を返す場合はCommandResultを返してもよい
+            history: 切り替え履歴ストア（Noneの場合は履歴を記録しない）
+            status_snapshot: デバイス状態スナップショット
+                             すべて9のalert（状態問い合わせ）への応答に使用する
+            lean_control: Trueの場合、/api/control をLeanControlAppで直接処理する
+            idempotency: 再送リクエストをまとめる冪等性キャッシュ（Noneの場合は無効）
+            rate_limiter: SIM ID・クライアントIPごとのレート制限（Noneの場合は無効）
+            deadline_seconds: /api/control の処理期限（秒、Noneの場合は期限なし）
+                              X-Deadline-Msヘッダで指定された場合はそちらを優先する
+            state_ttl: TBBOXから読み取った再生状態の有効期間（秒、/api/state のfresh判定用）
+            scheduler: スケジューラ（Noneの場合は /api/schedules を無効化）
+            layout: alertのレイアウト（省略時は4スイッチ・8桁）
+            admin: 管理用エンドポイントの診断機能（Noneの場合は /api/admin/* を無効化）
+            drain_seconds: 終了時に処理中のリクエストの完了を待つ時間（秒、Noneの場合は無制限）
+            events: alert受信・エラーを配信するイベントバス（Noneの場合は /api/events を無効化）
         """
         self.host = host
         self.port = port
         self.callback = callback
+        self.history = history
+        self.status_snapshot = status_snapshot
+        self.lean_control = lean_control
+        self.idempotency = idempotency
+        self.rate_limiter = rate_limiter
+        self.deadline_seconds = deadline_seconds
+        self.state_ttl = state_ttl
+        self.scheduler = scheduler
+        self.layout = layout or AlertLayout()
+        self.admin = admin
+        self.drain_seconds = drain_seconds
+        self.events = events
+        self.result_counts: Dict[str, int] = {}
         self.app = FastAPI(title="TBBOX Playlist Switcher")
+        self._server = None
+        self._shutdown_requested = False
+        # SIM ID → 最後に受信したリクエストのコールバック完了（同じSIM IDのコールバックを受信順に実行する）
+        self._sim_tails: Dict[str, "asyncio.Future[None]"] = {}
         self._setup_routes()
 
     def _setup_routes(self) -> None:
@@ -46,8 +120,12 @@ class HTTPServer:
 
         @self.app.get("/api/control")
         async def control(
+            request: Request,
             alert: Optional[str] = Query(None, description="8桁のスイッチ状態パラメータ"),
-            id: Optional[str] = Query(None, description="SIMカードID（オプション）")
+            id: Optional[str] = Query(None, description="SIMカードID（オプション）"),
+            idempotency_key: Optional[str] = Header(None, description="再送判定用のキー（オプション）"),
+            x_deadline_ms: Optional[str] = Header(None, description="処理期限（ミリ秒、オプション）"),
+            x_request_id: Optional[str] = Header(None, description="リクエストID（オプション）")
         ):
             """
             スイッチ状態を受信してプログラム切り替えを実行
@@ -55,118 +133,733 @@ class HTTPServer:
             Args:
                 alert: 8桁のスイッチ状態（例: "10109999"）
                 id: SIMカードID（ログ用、オプション）
+                idempotency_key: Idempotency-Keyヘッダ（オプション）
+                x_deadline_ms: X-Deadline-Msヘッダ（オプション）
+                x_request_id: X-Request-IDヘッダ（オプション、省略時は生成する）
+
+            Returns:
+                Response: 処理結果（Server-Timing, X-Request-IDヘッダ付き）
+            """
+            response = await self._handle_control(
+                alert,
+                id,
+                idempotency_key,
+                client_ip=request.client.host if request.client else None,
+                deadline_ms=x_deadline_ms,
+                request_id=x_request_id
+            )
+            return Response(
+                content=response.body,
+                status_code=response.status_code,
+                headers=dict(response.headers),
+                media_type="application/json"
+            )
+
+        @self.app.get("/api/history")
+        def history(
+            start: Optional[str] = Query(None, description="検索開始時刻（ISO 8601またはUNIX時間）"),
+            end: Optional[str] = Query(None, description="検索終了時刻（ISO 8601またはUNIX時間）"),
+            id: Optional[str] = Query(None, description="SIMカードIDで絞り込む"),
+            limit: int = Query(100, ge=1, le=1000, description="1ページの最大件数"),
+            cursor: Optional[str] = Query(None, description="前ページのnext_cursor")
+        ):
+            """
+            切り替え履歴を検索
+
+            SQLiteへの問い合わせを伴うため、同期関数としてスレッドプールで実行する
+
+            Returns:
+                JSONResponse: {"items": [...], "next_cursor": ...}
+            """
+            if not self.history:
+                raise HTTPException(status_code=503, detail="History_disabled")
+
+            try:
+                page = self.history.query(
+                    start=self._parse_time(start),
+                    end=self._parse_time(end),
+                    sim_id=id,
+                    limit=limit,
+                    cursor=cursor
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid_query: {e}")
+
+            return JSONResponse(content=page, status_code=200)
+
+        @self.app.get("/api/state")
+        async def state():
+            """
+            TBBOXの再生状態を取得
+
+            TBBOXへは問い合わせず、接続監視が更新したキャッシュを返す
+            freshはTBBOXから読み取った状態が有効期間内かどうかを表す
+
+            Returns:
+                JSONResponse: {"program": ..., "volume": ..., "playing": ..., "fresh": ..., ...}
+            """
+            if not self.status_snapshot:
+                raise HTTPException(status_code=503, detail="State_unavailable")
+
+            body = self.status_snapshot.get()
+            body["fresh"] = self.status_snapshot.is_fresh(self.state_ttl)
+            return JSONResponse(content=body, status_code=200)
+
+        @self.app.get("/api/events")
+        async def events():
+            """
+            alert受信・切り替え・接続状態の変化・エラーをServer-Sent Eventsで配信
+
+            接続直後に現在のデバイス状態（state）を送り、以降はイベントが発生するたびに送る
+            読み取りが遅れて捨てられたイベントがある場合は、その件数（dropped）を送る
+
+            Returns:
+                StreamingResponse: text/event-stream
+            """
+            if not self.events:
+                raise HTTPException(status_code=503, detail="Events_disabled")
+            try:
+                subscription = self.events.subscribe()
+            except TooManySubscribers:
+                raise HTTPException(status_code=503, detail="Too_many_subscribers")
+            return StreamingResponse(
+                self._stream_events(subscription),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+
+        @self.app.get("/api/schedules")
+        def list_schedules():
+            """
+            スケジュールの一覧を取得
+
+            Returns:
+                JSONResponse: {"items": [...]}（次回実行時刻の早い順）
+            """
+            return JSONResponse(
+                content={"items": self._require_scheduler().entries()},
+                status_code=200
+            )
+
+        @self.app.post("/api/schedules")
+        def create_schedule(payload: Dict[str, Any] = Body(...)):
+            """
+            スケジュールを追加
+
+            スケジュールファイルへの書き込みを伴うため、同期関数としてスレッドプールで実行する
+
+            Args:
+                payload: {"action": "volume", "value": 30, "time": "22:00", "days": ["mon", ...]}
+
+            Returns:
+                JSONResponse: 追加したスケジュール（201）
+            """
+            scheduler = self._require_scheduler()
+            try:
+                entry = scheduler.add(payload)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid_schedule: {e}")
+            return JSONResponse(content=entry, status_code=201)
+
+        @self.app.get("/api/schedules/{entry_id}")
+        def get_schedule(entry_id: str):
+            """スケジュールを取得"""
+            entry = self._require_scheduler().get(entry_id)
+            if entry is None:
+                raise HTTPException(status_code=404, detail="Schedule_not_found")
+            return JSONResponse(content=entry, status_code=200)
+
+        @self.app.put("/api/schedules/{entry_id}")
+        def update_schedule(entry_id: str, payload: Dict[str, Any] = Body(...)):
+            """
+            スケジュールを置き換え
+
+            Returns:
+                JSONResponse: 更新後のスケジュール
+            """
+            scheduler = self._require_scheduler()
+            try:
+                entry = scheduler.update(entry_id, payload)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid_schedule: {e}")
+            if entry is None:
+                raise HTTPException(status_code=404, detail="Schedule_not_found")
+            return JSONResponse(content=entry, status_code=200)
+
+        @self.app.delete("/api/schedules/{entry_id}")
+        def delete_schedule(entry_id: str):
+            """スケジュールを削除"""
+            if not self._require_scheduler().remove(entry_id):
+                raise HTTPException(status_code=404, detail="Schedule_not_found")
+            return Response(status_code=204)
+
+        @self.app.get("/api/metrics")
+        async def metrics():
+            """
+            各コンポーネントのカウンタを取得
+
+            Returns:
+                JSONResponse: {"control": {...}, "rate_limit": {...}, "idempotency": {...}, ...}
+            """
+            return JSONResponse(content=self.get_metrics(), status_code=200)
+
+        def admin_auth(
+            request: Request,
+            authorization: Optional[str] = Header(None),
+            x_admin_token: Optional[str] = Header(None)
+        ) -> AdminTools:
+            """管理用エンドポイントの認証（Authorization: Bearer またはX-Admin-Tokenヘッダ）"""
+            return self._require_admin(
+                authorization,
+                x_admin_token,
+                request.client.host if request.client else None
+            )
+
+        @self.app.get("/api/admin/profile")
+        async def admin_profile(
+            seconds: float = Query(10.0, description="計測時間（秒）"),
+            mode: str = Query("cprofile", description="cprofile または sample"),
+            sort: str = Query("cumulative", description="cprofileの並べ替えキー"),
+            limit: int = Query(40, ge=1, le=500, description="cprofileで出力する関数の数"),
+            interval: float = Query(0.01, description="sampleの採取間隔（秒）"),
+            admin: AdminTools = Depends(admin_auth)
+        ):
+            """
+            稼働中のプロセスをseconds秒間計測
+
+            cprofileはイベントループのスレッドをpstats形式で、
+            sampleは全スレッドのスタックを折りたたみ形式（フレームグラフ用）で返す
+
+            Returns:
+                PlainTextResponse: 計測結果
+            """
+            try:
+                if mode == "cprofile":
+                    text = await admin.profile(seconds, sort, limit)
+                elif mode == "sample":
+                    text = await run_in_threadpool(admin.sample, seconds, interval)
+                else:
+                    raise ValueError("modeはcprofileまたはsampleを指定してください")
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid_parameter: {e}")
+            except ProfilerBusy:
+                raise HTTPException(status_code=409, detail="Profile_in_progress")
+            return PlainTextResponse(text)
+
+        @self.app.post("/api/admin/tracemalloc/start")
+        def admin_tracemalloc_start(
+            frames: int = Query(10, description="記録するスタックの深さ"),
+            admin: AdminTools = Depends(admin_auth)
+        ):
+            """tracemallocを開始して基準のスナップショットを取得"""
+            try:
+                return JSONResponse(content=admin.start_tracing(frames), status_code=200)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid_parameter: {e}")
+
+        @self.app.get("/api/admin/tracemalloc/snapshot")
+        def admin_tracemalloc_snapshot(
+            limit: int = Query(20, ge=1, le=500, description="出力する確保元の数"),
+            key: str = Query("lineno", description="集計単位（lineno / filename / traceback）"),
+            admin: AdminTools = Depends(admin_auth)
+        ):
+            """
+            スナップショットを取得して前回との差分を返す
+
+            Returns:
+                JSONResponse: {"traced_bytes": ..., "interval_s": ..., "top": [...]}
+            """
+            try:
+                return JSONResponse(content=admin.snapshot_diff(limit, key), status_code=200)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid_parameter: {e}")
+            except RuntimeError:
+                raise HTTPException(status_code=409, detail="Tracemalloc_not_started")
+
+        @self.app.post("/api/admin/tracemalloc/stop")
+        def admin_tracemalloc_stop(admin: AdminTools = Depends(admin_auth)):
+            """tracemallocを停止"""
+            return JSONResponse(content=admin.stop_tracing(), status_code=200)
+
+        @self.app.get("/api/admin/stacks")
+        async def admin_stacks(admin: AdminTools = Depends(admin_auth)):
+            """
+            全スレッドとasyncioタスクのスタックを取得
 
             Returns:
-                JSONResponse: 処理結果
+                PlainTextResponse: スタックのテキスト
             """
-            logger.info(f"リクエスト受信: alert={alert}, id={id}")
+            return PlainTextResponse(admin.dump_stacks())
 
+        @self.app.get("/api/admin/runtime")
+        async def admin_runtime(admin: AdminTools = Depends(admin_auth)):
+            """
+            GC・ファイルディスクリプタ・スレッド数などの統計を取得
+
+            Returns:
+                JSONResponse: 統計情報
+            """
+            return JSONResponse(content=admin.runtime(), status_code=200)
+
+        @self.app.get("/health")
+        async def health():
+            """ヘルスチェックエンドポイント"""
+            return JSONResponse(
+                content={"status": "healthy"},
+                status_code=200
+            )
+
+    async def _handle_control(
+        self,
+        alert: Optional[str],
+        sim_id: Optional[str],
+        idempotency_key: Optional[str] = None,
+        client_ip: Optional[str] = None,
+        deadline_ms: Optional[str] = None,
+        request_id: Optional[str] = None
+    ) -> responses.ControlResponse:
+        """
+        /api/control の処理本体
+
+        FastAPIのルートとLeanControlAppの両方から呼ばれる
+        処理中のログにはリクエストIDが付与され、レスポンスには処理段階ごとの所要時間
+        （Server-Timing）とリクエストID（X-Request-ID）のヘッダが追加される
+
+        Args:
+            alert: 8桁のスイッチ状態（例: "10109999"）
+            sim_id: SIMカードID（ログ用、オプション）
+            idempotency_key: Idempotency-Keyヘッダの値（オプション）
+            client_ip: 送信元IPアドレス（レート制限用、オプション）
+            deadline_ms: X-Deadline-Msヘッダの値（処理期限、ミリ秒）
+            request_id: X-Request-IDヘッダの値（省略時・形式が不正な場合は生成する）
+
+        Returns:
+            ControlResponse: ステータスコード、JSONボディ、追加ヘッダ
+        """
+        trace = RequestTrace(request_id)
+        with trace_scope(trace):
+            response = await self._process_control(
+                alert, sim_id, idempotency_key, client_ip, deadline_ms, trace
+            )
+        return response._replace(headers=response.headers + trace.headers())
+
+    async def _process_control(
+        self,
+        alert: Optional[str],
+        sim_id: Optional[str],
+        idempotency_key: Optional[str],
+        client_ip: Optional[str],
+        deadline_ms: Optional[str],
+        trace: RequestTrace
+    ) -> responses.ControlResponse:
+        """_handle_controlの本体（トレースを設定済みで呼ばれる）"""
+        logger.info(f"リクエスト受信: alert={alert}, id={sim_id}")
+        received_at = time.time()
+        started = time.perf_counter()
+        program_id: Optional[str] = None
+        result = "error"
+        deadline = self._make_deadline(deadline_ms)
+
+        try:
             # alertパラメータの検証
+            validated_at = time.perf_counter()
             error = self._validate_alert(alert)
+            trace.add("validate", time.perf_counter() - validated_at)
             if error:
                 logger.warning(f"パラメータエラー: {error}")
-                raise HTTPException(status_code=400, detail=error)
+                result = "invalid"
+                return responses.error(400, error)
 
             # すべて9の場合は何もしない（状態問い合わせとして扱う）
             if re.fullmatch(r"9+", alert):
                 logger.info("すべて9のため、処理をスキップします")
-                return JSONResponse(
-                    content={"status": "ok", "message": "No action (all 9s)"},
-                    status_code=200
-                )
+                result = "status"
+                if self.status_snapshot:
+                    # シリアライズ済みの現在状態をそのまま返す
+                    return responses.ControlResponse(200, self.status_snapshot.to_bytes())
+                return responses.NO_ACTION
 
-            # コールバック実行
-            if self.callback:
-                try:
-                    success = self.callback(alert)
-                    if success:
-                        # 上位4桁からプログラムIDを推測してレスポンスに含める
-                        switch_pattern = alert[:4]
-                        program_id = self._calculate_program_id(switch_pattern)
-                        logger.info(f"プログラム切り替え成功: {program_id}")
-                        return JSONResponse(
-                            content={"status": "ok", "program": program_id},
-                            status_code=200
-                        )
-                    else:
-                        logger.error("プログラム切り替え失敗")
-                        raise HTTPException(
-                            status_code=500,
-                            detail="Program_switch_failed"
-                        )
-                except HTTPException:
-                    raise
-                except Exception as e:
-                    logger.error(f"コールバック実行中にエラー: {e}")
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Internal_error: {str(e)}"
-                    )
-            else:
+            if not self.callback:
                 logger.warning("コールバックが設定されていません")
-                return JSONResponse(
-                    content={"status": "ok", "message": "No callback configured"},
-                    status_code=200
+                result = "no_callback"
+                return responses.NO_CALLBACK
+
+            if self.events:
+                self.events.publish("alert", alert=alert, id=sim_id, request_id=trace.request_id)
+
+            # コールバック実行（再送リクエストは冪等性キャッシュで1回にまとめる）
+            # 複数ワーカー構成ではブローカークライアントがキーをブローカーに渡し、ブローカーでまとめる
+            # レート制限はキャッシュの確認後に行い、前回の結果を返す再送にはトークンを消費させない
+            key, group = self._idempotency_key(alert, sim_id, idempotency_key, client_ip)
+            with idempotency_scope((key, group)):
+                if self.idempotency:
+                    outcome, duplicate = await self.idempotency.run(
+                        key,
+                        lambda: self._run_limited(alert, deadline, sim_id, client_ip),
+                        cacheable=lambda o: o.result == "ok",
+                        group=group
+                    )
+                    if duplicate:
+                        logger.info(
+                            f"再送リクエストのため前回の結果を返します: alert={alert}, id={sim_id}"
+                        )
+                        program_id = outcome.program_id
+                        result = "duplicate"
+                        return outcome.response
+                else:
+                    outcome = await self._run_limited(alert, deadline, sim_id, client_ip)
+
+            program_id = outcome.program_id
+            result = outcome.result
+            return outcome.response
+
+        finally:
+            self.result_counts[result] = self.result_counts.get(result, 0) + 1
+            if self.events and result in self.ERROR_RESULTS:
+                self.events.publish(
+                    "error", alert=alert, id=sim_id, request_id=trace.request_id, result=result
+                )
+            if self.history:
+                latency_ms = (time.perf_counter() - started) * 1000
+                self.history.record(
+                    sim_id, alert, program_id, latency_ms, result, timestamp=received_at
                 )
 
-        @self.app.get("/health")
-        async def health():
-            """ヘルスチェックエンドポイント"""
-            return JSONResponse(
-                content={"status": "healthy"},
-                status_code=200
-            )
+    async def _run_limited(
+        self,
+        alert: str,
+        deadline: Optional[Deadline],
+        sim_id: Optional[str],
+        client_ip: Optional[str]
+    ) -> responses.SwitchOutcome:
+        """
+        送信元ごとのレート制限を確認してからコールバックを実行
 
-    def _validate_alert(self, alert: Optional[str]) -> Optional[str]:
+        TBBOXにコマンドを送信するリクエストのみを制限するため、検証と冪等性キャッシュの
+        確認を済ませた後に呼ばれる
+
+        Args:
+            alert: 検証済みのalertパラメータ
+            deadline: リクエストの処理期限
+            sim_id: SIMカードID
+            client_ip: クライアントのIPアドレス
+
+        Returns:
+            SwitchOutcome: レスポンスと処理結果（制限を超過した場合は429応答）
         """
-        alertパラメータを検証
+        if self.rate_limiter:
+            limited_at = time.perf_counter()
+            retry_after = self._check_rate_limit(sim_id, client_ip)
+            trace = current_trace()
+            if trace is not None:
+                trace.add("ratelimit", time.perf_counter() - limited_at)
+            if retry_after:
+                logger.warning(
+                    f"レート制限を超過しました: id={sim_id}, ip={client_ip} "
+                    f"({retry_after:.2f}秒後に再試行可能)"
+                )
+                return responses.SwitchOutcome(
+                    responses.too_many_requests(self.rate_limiter.retry_after_header(retry_after)),
+                    "rate_limited",
+                    None
+                )
+        return await self._run_callback(alert, deadline, sim_id)
+
+    async def _run_callback(
+        self,
+        alert: str,
+        deadline: Optional[Deadline] = None,
+        sim_id: Optional[str] = None
+    ) -> responses.SwitchOutcome:
+        """
+        コールバックを実行してプログラムを切り替える
+
+        TBBOXとの通信でイベントループを止めないよう、スレッドプールで実行する
+        コールバック内ではcurrent_deadline()でリクエストの期限を、
+        current_trace()で処理段階ごとの所要時間の記録先を参照できる
+        同じSIM IDのコールバックは受信順に1件ずつ実行し、最後に受信したalertが最終状態になるようにする
+        （スレッドプールではコールバックの実行順が入れ替わりうるため）
 
         Args:
-            alert: 検証対象のalertパラメータ
+            alert: 検証済みのalertパラメータ
+            deadline: リクエストの処理期限
+            sim_id: SIMカードID（Noneの場合は順序付けしない）
 
         Returns:
-            エラーメッセージ（エラーがない場合はNone）
+            SwitchOutcome: レスポンスと処理結果
         """
-        # alertが無い
-        if not alert:
-            return "Parameter_not_found"
+        loop = asyncio.get_running_loop()
+        previous = self._sim_tails.get(sim_id) if sim_id else None
+        done: "asyncio.Future[None]" = loop.create_future()
+        if sim_id:
+            self._sim_tails[sim_id] = done
+        try:
+            if previous is not None:
+                # 先に受信したリクエストのコールバック完了を待つ（待ち時間はqueueに含める）
+                waited_at = time.perf_counter()
+                await asyncio.wait({previous})
+                trace = current_trace()
+                if trace is not None:
+                    trace.add("queue", time.perf_counter() - waited_at)
+            if deadline:
+                deadline.check("queue")
+            with deadline_scope(deadline):
+                success = await run_in_threadpool(self._call_traced, alert, time.perf_counter())
+        except DeadlineExceeded as e:
+            logger.warning(f"処理期限を過ぎたため切り替えを中断しました: {e}")
+            return responses.SwitchOutcome(
+                responses.DEADLINE_EXCEEDED, "cancelled", None
+            )
+        except Exception as e:
+            logger.error(f"コールバック実行中にエラー: {e}")
+            return responses.SwitchOutcome(
+                responses.error(500, f"Internal_error: {str(e)}"), "error", None
+            )
+        finally:
+            done.set_result(None)
+            if sim_id and self._sim_tails.get(sim_id) is done:
+                del self._sim_tails[sim_id]
+
+        if not success:
+            if isinstance(success, CommandResult) and success.error == "rejected":
+                logger.error(f"TBBOXがコマンドを拒否しました: status={success.status}")
+                return responses.SwitchOutcome(
+                    responses.switch_rejected(success.status), "rejected", None
+                )
+            logger.error("プログラム切り替え失敗")
+            return responses.SwitchOutcome(responses.SWITCH_FAILED, "failed", None)
+
+        # 実際に切り替えたプログラム（マッピング・時間帯ルールの適用後）をレスポンスと履歴に含める
+        program_id = success.program if isinstance(success, CommandResult) else None
+        if program_id is None:
+            # 切り替え先を返さないコールバック（真偽値を返す場合）はスイッチ部分から推測する
+            program_id = self._calculate_program_id(self.layout.switch_pattern(alert))
+        logger.info(f"プログラム切り替え成功: {program_id}")
+        return responses.SwitchOutcome(responses.switched(program_id), "ok", program_id)
+
+    def _call_traced(self, alert: str, dispatched_at: float) -> Union[bool, CommandResult]:
+        """
+        コールバックを呼び出す（スレッドプールで実行される）
 
-        # alertの桁数が異常（8桁でない）
-        if len(alert) != 8:
-            return "Invalid_parameter_length"
+        スレッドプールの空き待ちの時間をトレースのqueueに加算する
 
-        # alertに0/1/9以外が含まれる
-        if re.search(r"[^019]", alert):
-            return "Parameter_contains_invalid_value"
+        Args:
+            alert: 検証済みのalertパラメータ
+            dispatched_at: スレッドプールに投入した時刻（time.perf_counter()）
+        """
+        trace = current_trace()
+        if trace is not None:
+            trace.add("queue", time.perf_counter() - dispatched_at)
+        return self.callback(alert)
 
-        # 下位4桁が9999でない場合は警告ログ（エラーにはしない）
-        if alert[4:] != "9999":
-            logger.warning(f"下位4桁が9999ではありません: {alert[4:]}")
+    async def _stream_events(self, subscription: Subscription) -> AsyncIterator[bytes]:
+        """
+        /api/events のレスポンスボディを生成
+
+        購読者が切断した場合・サーバの停止が要求された場合に終了する
+
+        Args:
+            subscription: 購読
+        """
+        try:
+            yield b"retry: 3000\n\n"
+            if self.status_snapshot:
+                yield format_event(None, "state", self.status_snapshot.get())
+            dropped = 0
+            idle = 0.0
+            while not self._stopping():
+                frames = await subscription.get(self.EVENTS_POLL_INTERVAL)
+                if subscription.dropped != dropped:
+                    yield format_event(None, "dropped", {"count": subscription.dropped - dropped})
+                    dropped = subscription.dropped
+                if frames:
+                    yield b"".join(frames)
+                    idle = 0.0
+                    continue
+                idle += self.EVENTS_POLL_INTERVAL
+                if idle >= self.EVENTS_KEEPALIVE:
+                    yield b": keepalive\n\n"
+                    idle = 0.0
+        finally:
+            self.events.unsubscribe(subscription)
+
+    def _stopping(self) -> bool:
+        """サーバの停止が要求されている場合True（uvicornがシグナルを受信した場合を含む）"""
+        return self._shutdown_requested or (
+            self._server is not None and self._server.should_exit
+        )
+
+    def _require_scheduler(self) -> "ActionScheduler":
+        """
+        スケジューラを取得
+
+        Raises:
+            HTTPException: スケジューラが無効な場合（503）
+        """
+        if not self.scheduler:
+            raise HTTPException(status_code=503, detail="Scheduler_disabled")
+        return self.scheduler
+
+    def _require_admin(
+        self,
+        authorization: Optional[str],
+        admin_token: Optional[str],
+        client_ip: Optional[str] = None
+    ) -> AdminTools:
+        """
+        管理用エンドポイントの診断機能を取得
+
+        Raises:
+            HTTPException: 管理用エンドポイントが無効な場合（503）、認証に失敗した場合（401）
+        """
+        if not self.admin:
+            raise HTTPException(status_code=503, detail="Admin_disabled")
+        if not self.admin.authorize(authorization, admin_token):
+            logger.warning(f"管理用エンドポイントの認証に失敗しました: ip={client_ip}")
+            raise HTTPException(
+                status_code=401,
+                detail="Unauthorized",
+                headers={"WWW-Authenticate": "Bearer"}
+            )
+        return self.admin
+
+    def _make_deadline(self, deadline_ms: Optional[str]) -> Optional[Deadline]:
+        """
+        リクエストの処理期限を生成
+
+        Args:
+            deadline_ms: X-Deadline-Msヘッダの値（不正な値・inf・nanの場合は無視し、
+                         MAX_DEADLINE_MSを超える値はMAX_DEADLINE_MSに制限する）
 
+        Returns:
+            Optional[Deadline]: 処理期限（期限なしの場合はNone）
+        """
+        if deadline_ms:
+            try:
+                value = float(deadline_ms)
+                # infはロック・ソケットのタイムアウトでOverflowErrorになる
+                if not math.isfinite(value):
+                    raise ValueError(deadline_ms)
+                return Deadline(min(max(0.0, value), self.MAX_DEADLINE_MS) / 1000)
+            except ValueError:
+                logger.warning(f"X-Deadline-Msの値が不正です: {deadline_ms}")
+        if self.deadline_seconds:
+            return Deadline(self.deadline_seconds)
         return None
 
+    def _check_rate_limit(self, sim_id: Optional[str], client_ip: Optional[str]) -> float:
+        """
+        SIM IDとクライアントIPのバケットからトークンを取得
+
+        Returns:
+            float: 0の場合は許可、正の値の場合は再試行までの待ち時間（秒）
+        """
+        keys = []
+        if sim_id:
+            keys.append(f"id:{sim_id}")
+        if client_ip:
+            keys.append(f"ip:{client_ip}")
+        if not keys:
+            return 0.0
+        return self.rate_limiter.acquire(*keys)
+
+    @staticmethod
+    def _idempotency_key(
+        alert: str,
+        sim_id: Optional[str],
+        idempotency_key: Optional[str],
+        client_ip: Optional[str] = None
+    ) -> Tuple[Tuple, Optional[Tuple]]:
+        """
+        冪等性キャッシュのキーとグループを生成
+
+        Idempotency-Keyヘッダがあればそれを使い、
+        無ければ (id, alert) を使う（有効期間はキャッシュのTTL）
+        後者はSIM IDごとのグループとし、同じSIM IDに別のalertが届いた時点で
+        以前の結果を破棄する（状態の変化を再送として捨てないため）
+        idが無い場合はSIM IDの代わりに送信元IPで区別する（別のlinkbaseのalertをまとめないため）
+
+        Returns:
+            Tuple[Tuple, Optional[Tuple]]: (キー, グループ)
+        """
+        if idempotency_key:
+            return ("key", idempotency_key), None
+        if not sim_id:
+            return ("alert", None, client_ip, alert), ("ip", client_ip)
+        return ("alert", sim_id, alert), ("id", sim_id)
+
+    def _validate_alert(self, alert: Optional[str]) -> Optional[str]:
+        """
+        alertパラメータを検証
+
+        Args:
+            alert: 検証対象のalertパラメータ
+
+        Returns:
+            エラーメッセージ（エラーがない場合はNone）
+        """
+        return self.layout.validate(alert)
+
     def _calculate_program_id(self, switch_pattern: str) -> str:
         """
         スイッチパターンからプログラムIDを計算
 
         Args:
-            switch_pattern: 4桁のスイッチ状態（例: "1010"）
+            switch_pattern: スイッチ状態（例: "1010"）
 
         Returns:
-            プログラムID（"01"～"16"）
+            プログラムID（"01"～）
         """
-        # "9"を"0"として扱う（未定義状態はOFFとみなす）
-        pattern = switch_pattern.replace("9", "0")
-
-        # 2進数として解釈
+        # 2進数として解釈（"9"は未定義状態としてOFFとみなす）
         try:
-            pattern_number = int(pattern, 2)
-            program_id = f"{pattern_number + 1:02d}"
-            return program_id
+            bits, _ = self.layout.encode(switch_pattern)
+            return f"{bits + 1:02d}"
         except ValueError:
             return "01"
 
-    def set_callback(self, callback: Callable[[str], bool]) -> None:
+    @staticmethod
+    def _parse_time(value: Optional[str]) -> Optional[float]:
+        """
+        時刻パラメータをUNIX時間に変換
+
+        Args:
+            value: ISO 8601形式（例: "2026-10-18T14:05:00"）またはUNIX時間の文字列
+
+        Returns:
+            UNIX時間（未指定の場合はNone）
+
+        Raises:
+            ValueError: 形式が不正な場合
+        """
+        if value is None or value == "":
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.fromisoformat(value).timestamp()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        各コンポーネントのカウンタを取得
+
+        Returns:
+            Dict[str, Any]: 有効なコンポーネントごとの統計情報
+        """
+        metrics: Dict[str, Any] = {"control": dict(self.result_counts)}
+        if self.rate_limiter:
+            metrics["rate_limit"] = self.rate_limiter.stats()
+        if self.idempotency:
+            metrics["idempotency"] = self.idempotency.stats()
+        if self.history:
+            metrics["history"] = {
+                "written": self.history.written,
+                "dropped": self.history.dropped,
+            }
+        if self.events:
+            metrics["events"] = self.events.stats()
+        return metrics
+
+    def set_callback(self, callback: Callable[[str], Union[bool, CommandResult]]) -> None:
         """
         コールバック関数を設定
 
@@ -184,13 +877,56 @@ class HTTPServer:
         """
         return self.app
 
-    def run(self) -> None:
+    def get_asgi_app(self):
+        """
+        サーバとして公開するASGIアプリケーションを取得
+
+        lean_controlが有効な場合は、/api/control を直接処理し
+        それ以外をFastAPIに委譲するLeanControlAppを返す
+
+        Returns:
+            ASGIアプリケーション
+        """
+        if self.lean_control:
+            from src.http.lean import LeanControlApp
+            return LeanControlApp(self)
+        return self.app
+
+    def run(self, sock: Optional[socket.socket] = None) -> None:
         """
         サーバを起動（ブロッキング）
 
         uvicornを使用してサーバを起動する
+        shutdown()またはSIGTERM・SIGINTで新しい接続の受け付けを停止し、
+        処理中のリクエストの完了を最大drain_seconds秒待ってから戻る
+
+        Args:
+            sock: 待ち受け済みのソケット（複数のワーカープロセスで共有する場合・
+                  systemdから受け取った場合、省略時はhost:portで待ち受ける）
         """
         import uvicorn
 
-        logger.info(f"HTTPサーバを起動します: http://{self.host}:{self.port}")
-        uvicorn.run(self.app, host=self.host, port=self.port)
+        config = uvicorn.Config(
+            self.get_asgi_app(),
+            host=self.host,
+            port=self.port,
+            timeout_graceful_shutdown=self.drain_seconds
+        )
+        self._server = uvicorn.Server(config)
+        # 起動前にshutdown()が呼ばれていた場合は起動直後に終了する
+        self._server.should_exit = self._shutdown_requested
+        if sock is None:
+            logger.info(f"HTTPサーバを起動します: http://{self.host}:{self.port}")
+            self._server.run()
+        else:
+            self._server.run(sockets=[sock])
+
+    def shutdown(self) -> None:
+        """
+        新しい接続の受け付けを停止し、処理中のリクエストの完了後にrun()から戻るよう要求する
+
+        シグナルハンドラーから呼び出してもよい
+        """
+        self._shutdown_requested = True
+        if self._server is not None:
+            self._server.should_exit = True
@@ -0,0 +1,126 @@
+"""
+alertレイアウトモジュール
+alertパラメータの桁数・スイッチ数と、スイッチパターンのビットマスク表現を扱う
+"""
+import re
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from src.utils.logger import logger
+
+# 未定義（don't care）を表す文字
+UNKNOWN = "9"
+
+# alertに使用できない文字
+_INVALID_CHARS = re.compile(r"[^019]")
+
+# マッピング設定のパターンに使用できない文字（"x"も未定義として扱う）
+_INVALID_PATTERN_CHARS = re.compile(r"[^019xX]")
+
+# パターン文字列 → ONのビット列・定義済みのビット列（int(..., 2)で整数に変換する）
+_BITS = str.maketrans("9xX", "000")
+_CARE = str.maketrans("019xX", "11000")
+
+# 一度に扱えるスイッチ数の上限（プログラム表の大きさは 2^スイッチ数）
+MAX_SWITCHES = 16
+
+
+@dataclass(frozen=True)
+class AlertLayout:
+    """
+    alertパラメータのレイアウト
+
+    先頭switch_count桁が各スイッチの状態（"0": OFF, "1": ON, "9": 未定義）、
+    残りの桁は未使用で通常はすべて"9"が送られる
+
+    スイッチパターンは (ONのビット, 定義済みのビット) の2つの整数で表し、
+    先頭のスイッチを最上位ビットとする（"1091" → bits=0b1001, care=0b1101）
+    """
+
+    switch_count: int = 4
+    alert_length: int = 8
+
+    def __post_init__(self):
+        if not 1 <= self.switch_count <= MAX_SWITCHES:
+            raise ValueError(f"スイッチ数は1～{MAX_SWITCHES}で指定してください: {self.switch_count}")
+        if self.alert_length < self.switch_count:
+            raise ValueError(
+                f"alertの桁数({self.alert_length})がスイッチ数({self.switch_count})より少ない"
+            )
+
+    @property
+    def suffix(self) -> str:
+        """未使用桁に期待される値（例: "9999"）"""
+        return UNKNOWN * (self.alert_length - self.switch_count)
+
+    @property
+    def size(self) -> int:
+        """スイッチパターンの数（2^スイッチ数）"""
+        return 1 << self.switch_count
+
+    def validate(self, alert: Optional[str]) -> Optional[str]:
+        """
+        alertパラメータを検証
+
+        Args:
+            alert: 検証対象のalertパラメータ
+
+        Returns:
+            エラーメッセージ（エラーがない場合はNone）
+        """
+        # alertが無い
+        if not alert:
+            return "Parameter_not_found"
+
+        # alertの桁数が異常
+        if len(alert) != self.alert_length:
+            return "Invalid_parameter_length"
+
+        # alertに0/1/9以外が含まれる
+        if _INVALID_CHARS.search(alert):
+            return "Parameter_contains_invalid_value"
+
+        # 未使用桁がすべて9でない場合は警告ログ（エラーにはしない）
+        if alert[self.switch_count:] != self.suffix:
+            logger.warning(
+                f"下位{self.alert_length - self.switch_count}桁が{self.suffix}ではありません: "
+                f"{alert[self.switch_count:]}"
+            )
+
+        return None
+
+    def switch_pattern(self, alert: str) -> str:
+        """alertからスイッチパターン部分を取り出す"""
+        return alert[:self.switch_count]
+
+    def encode(self, pattern: str) -> Tuple[int, int]:
+        """
+        スイッチパターンをビットマスクに変換
+
+        Args:
+            pattern: スイッチ数と同じ桁数のパターン（"0"/"1"/"9"、"x"も未定義として扱う）
+
+        Returns:
+            Tuple[int, int]: (ONのビット, 定義済みのビット)
+
+        Raises:
+            ValueError: 桁数や文字が不正な場合
+        """
+        if len(pattern) != self.switch_count:
+            raise ValueError(f"パターンの桁数が不正です: {pattern}")
+        if _INVALID_PATTERN_CHARS.search(pattern):
+            raise ValueError(f"パターンに不正な文字が含まれています: {pattern}")
+
+        return int(pattern.translate(_BITS), 2), int(pattern.translate(_CARE), 2)
+
+    def decode(self, bits: int) -> str:
+        """
+        ビットマスクを"0"/"1"のパターン文字列に変換
+
+        Args:
+            bits: ONのビット
+
+        Returns:
+            str: スイッチ数と同じ桁数のパターン
+        """
+        return format(bits, f"0{self.switch_count}b")
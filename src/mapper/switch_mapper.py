@@ -3,10 +3,13 @@
 alertパラメータをプログラムIDに変換する
 """
 import json
-import re
+import threading
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
+from src.mapper.layout import AlertLayout
+from src.mapper.time_rules import TimeRuleTable
 from src.utils.logger import logger
 
 
@@ -14,23 +17,49 @@ class SwitchMapper:
     """
     スイッチパターンをプログラムIDに変換するクラス
 
-    4つのスイッチ（SW1-SW4）の組み合わせで16パターン（2^4）を
-    プログラムID（"01"～"16"）にマッピングする
+    N個のスイッチ（デフォルトはSW1-SW4）の組み合わせで 2^N パターンを
+    プログラムID（"01"～）にマッピングする
+    時間帯ルールが設定されている場合は、曜日・時刻に応じてルールのプログラムを優先する
+
+    マッピングは読み込み時にパターンのビットマスクを添字とする配列に展開し、
+    スイッチ数に関係なく1回の配列参照でプログラムIDを求める
     """
 
     # デフォルトのマッピング設定ファイルパス
     DEFAULT_MAPPING_FILE = Path(__file__).parent.parent.parent / "config" / "switch_mapping.json"
 
-    def __init__(self, mapping_file: Optional[Path] = None):
+    # デフォルトの時間帯ルール設定ファイルパス（存在しない場合はルールなし）
+    DEFAULT_RULES_FILE = Path(__file__).parent.parent.parent / "config" / "time_rules.json"
+
+    def __init__(
+        self,
+        mapping_file: Optional[Path] = None,
+        rules_file: Optional[Path] = None,
+        layout: Optional[AlertLayout] = None
+    ):
         """
         SwitchMapperの初期化
 
         Args:
             mapping_file: マッピング設定ファイルのパス（省略時はデフォルト）
+            rules_file: 時間帯ルール設定ファイルのパス（省略時はデフォルト）
+            layout: alertのレイアウト（省略時は4スイッチ・8桁）
         """
         self.mapping_file = mapping_file or self.DEFAULT_MAPPING_FILE
+        self.rules_file = rules_file or self.DEFAULT_RULES_FILE
+        self.layout = layout or AlertLayout()
         self.pattern_to_program: Dict[str, str] = {}
+        self.time_rules: Optional[TimeRuleTable] = None
+        # ビットマスク → プログラムIDの配列
+        self._table: List[str] = []
+        # 境界時刻での再評価用に、最後に受信したパターンと切り替えに成功したプログラムを保持する
+        # （HTTPのスレッドプールとRuleSchedulerのスレッドから更新されるためロックで保護する）
+        self.last_pattern: Optional[str] = None
+        self.last_program: Optional[str] = None
+        self._last_lock = threading.Lock()
         self._load_mapping()
+        self._compile_mapping()
+        self._load_time_rules()
 
     def _load_mapping(self) -> None:
         """マッピング設定ファイルを読み込む"""
@@ -56,93 +85,168 @@ class SwitchMapper:
             logger.error(f"マッピングファイルの読み込みに失敗しました: {e}")
             self._generate_default_mapping()
 
+    def _compile_mapping(self) -> None:
+        """
+        マッピングをビットマスクを添字とする配列に展開
+
+        マッピングに無いパターンは「2進数の値 + 1」のプログラムIDとする
+        未定義（"9"/"x"）を含むパターンは該当するすべてのパターンに展開し、
+        未定義の桁が少ない（より具体的な）パターンを優先する
+        """
+        table = [f"{index + 1:02d}" for index in range(self.layout.size)]
+        full_mask = self.layout.size - 1
+
+        entries = []
+        for pattern, program_id in self.pattern_to_program.items():
+            try:
+                bits, care = self.layout.encode(pattern)
+            except ValueError as e:
+                logger.warning(f"マッピングのパターンを無視します: {e}")
+                continue
+            entries.append((bin(care).count("1"), bits, care, str(program_id)))
+
+        # 具体的なパターンを後から書き込んで優先させる
+        for _, bits, care, program_id in sorted(entries, key=lambda e: e[0]):
+            free = full_mask & ~care
+            # freeの部分集合をすべて列挙する
+            subset = free
+            while True:
+                table[bits | subset] = program_id
+                if subset == 0:
+                    break
+                subset = (subset - 1) & free
+
+        self._table = table
+
+    def _load_time_rules(self) -> None:
+        """時間帯ルール設定ファイルを読み込んで区間表にコンパイル"""
+        if not self.rules_file.exists():
+            return
+        try:
+            self.time_rules = TimeRuleTable.from_file(self.rules_file)
+            logger.info(f"時間帯ルールを読み込みました: {len(self.time_rules)}ルール")
+        except (ValueError, OSError) as e:
+            # json.JSONDecodeErrorもValueErrorに含まれる
+            logger.error(f"時間帯ルールの読み込みに失敗しました（ルールなしで動作します）: {e}")
+            self.time_rules = None
+
     def _generate_default_mapping(self) -> None:
         """デフォルトのマッピングを生成"""
         self.pattern_to_program = {}
-        for i in range(16):
-            pattern = f"{i:04b}"  # 0000 ~ 1111
+        for i in range(self.layout.size):
+            pattern = self.layout.decode(i)  # 0000 ~ 1111
             program_id = f"{i + 1:02d}"  # 01 ~ 16
             self.pattern_to_program[pattern] = program_id
 
-        logger.info("デフォルトマッピングを生成しました（16パターン）")
+        logger.info(f"デフォルトマッピングを生成しました（{self.layout.size}パターン）")
 
-    def parse_alert(self, alert: str) -> Optional[str]:
+    def parse_alert(self, alert: str, now: Optional[datetime] = None) -> Optional[str]:
         """
         alertパラメータを解析してプログラムIDを返す
 
         Args:
-            alert: 8桁のalertパラメータ（例: "10109999"）
+            alert: alertパラメータ（例: "10109999"）
+            now: 時間帯ルールの評価に使う日時（省略時は現在時刻）
 
         Returns:
-            プログラムID（"01"～"16"）、エラー時はNone
+            プログラムID（"01"～）、エラー時はNone
         """
         # 基本的な検証
-        if not alert or len(alert) != 8:
+        if not alert or len(alert) != self.layout.alert_length:
             logger.error(f"無効なalertパラメータ: {alert}")
             return None
 
-        # 上位4桁を取得
-        switch_pattern = alert[:4]
+        # スイッチ部分を取得
+        switch_pattern = self.layout.switch_pattern(alert)
 
         # 0/1/9以外の文字が含まれていないか確認
-        if re.search(r"[^019]", switch_pattern):
+        try:
+            bits, care = self.layout.encode(switch_pattern)
+        except ValueError:
             logger.error(f"不正な文字を含むパターン: {switch_pattern}")
             return None
 
         # すべて9の場合はNoneを返す（変更なし）
-        if switch_pattern == "9999":
+        if care == 0:
             logger.info("すべてのスイッチが未定義(9)のため、処理をスキップします")
             return None
 
-        # プログラムIDに変換
-        program_id = self._switch_pattern_to_program_id(switch_pattern)
+        # プログラムIDに変換（"9"はOFFとして扱う）
+        program_id = self._table[bits]
 
-        if program_id:
-            logger.info(f"パターン '{switch_pattern}' → プログラムID '{program_id}'")
+        # 時間帯ルールが有効な場合はルールのプログラムを優先
+        if self.time_rules:
+            normalized_pattern = self.layout.decode(bits)
+            rule_program = self.time_rules.lookup(normalized_pattern, now or datetime.now())
+            if rule_program:
+                logger.info(f"時間帯ルールを適用: '{program_id}' → '{rule_program}'")
+                program_id = rule_program
+            # 切り替えの成否はまだ分からないため、last_programはrecord_switchで更新する
+            with self._last_lock:
+                self.last_pattern = normalized_pattern
+
+        logger.info(f"パターン '{switch_pattern}' → プログラムID '{program_id}'")
 
         return program_id
 
-    def _switch_pattern_to_program_id(self, switch_pattern: str) -> Optional[str]:
+    def reevaluate(self, when: datetime) -> Optional[str]:
         """
-        スイッチパターンからプログラムIDを計算
+        最後に受信したパターンに対して、指定日時に有効なプログラムを再評価
+
+        時間帯ルールの境界時刻にRuleSchedulerから呼ばれる
+        最後に切り替えに成功したプログラムと比較するため、切り替えに失敗した場合は
+        次の境界時刻（またはalert）で再度切り替えられる
 
         Args:
-            switch_pattern: 4桁のスイッチ状態（例: "1010"）
+            when: 評価する日時
 
         Returns:
-            プログラムID（"01"～"16"）、エラー時はNone
-        """
-        # "9"を含む場合の処理
-        if "9" in switch_pattern:
-            # "9"を"0"に置換して計算（未定義=OFFとして扱う）
-            normalized_pattern = switch_pattern.replace("9", "0")
-            logger.debug(
-                f"パターンに'9'を含むため正規化: "
-                f"{switch_pattern} → {normalized_pattern}"
-            )
-        else:
-            normalized_pattern = switch_pattern
+            Optional[str]: プログラムが変わる場合は新しいプログラムID、変わらない場合はNone
+        """
+        if not self.time_rules:
+            return None
 
-        # マッピングから検索
-        if normalized_pattern in self.pattern_to_program:
-            return self.pattern_to_program[normalized_pattern]
+        with self._last_lock:
+            pattern = self.last_pattern
+            last_program = self.last_program
+        if pattern is None:
+            return None
 
-        # マッピングにない場合は計算で求める
-        try:
-            # 2進数として解釈
-            pattern_number = int(normalized_pattern, 2)
-            program_id = f"{pattern_number + 1:02d}"
+        program_id = (
+            self.time_rules.lookup(pattern, when)
+            or self._switch_pattern_to_program_id(pattern)
+        )
+        if program_id is None or program_id == last_program:
+            return None
 
-            # 有効範囲チェック（01～16）
-            if 1 <= pattern_number + 1 <= 16:
-                return program_id
-            else:
-                logger.error(f"プログラムIDが範囲外: {program_id}")
-                return None
+        return program_id
+
+    def record_switch(self, program_id: str) -> None:
+        """
+        プログラムの切り替えに成功したことを記録（境界時刻での再評価の比較に使う）
+
+        Args:
+            program_id: 切り替えたプログラムID
+        """
+        with self._last_lock:
+            self.last_program = program_id
+
+    def _switch_pattern_to_program_id(self, switch_pattern: str) -> Optional[str]:
+        """
+        スイッチパターンからプログラムIDを計算
 
+        Args:
+            switch_pattern: スイッチ状態（例: "1010"、"9"は未定義=OFFとして扱う）
+
+        Returns:
+            プログラムID（"01"～）、エラー時はNone
+        """
+        try:
+            bits, _ = self.layout.encode(switch_pattern)
         except ValueError as e:
-            logger.error(f"パターンの解析に失敗しました: {normalized_pattern}, {e}")
+            logger.error(f"パターンの解析に失敗しました: {switch_pattern}, {e}")
             return None
+        return self._table[bits]
 
     def get_mapping(self) -> Dict[str, str]:
         """
@@ -153,32 +257,29 @@ class SwitchMapper:
         """
         return self.pattern_to_program.copy()
 
-    def get_program_id_for_switches(
-        self,
-        sw1: int,
-        sw2: int,
-        sw3: int,
-        sw4: int
-    ) -> Optional[str]:
+    def get_program_id_for_switches(self, *switches: int) -> Optional[str]:
         """
         個別のスイッチ状態からプログラムIDを取得
 
         Args:
-            sw1: スイッチ1の状態（0 or 1）
-            sw2: スイッチ2の状態（0 or 1）
-            sw3: スイッチ3の状態（0 or 1）
-            sw4: スイッチ4の状態（0 or 1）
+            *switches: 各スイッチの状態（0 or 1）、SW1から順にスイッチ数分
 
         Returns:
-            プログラムID（"01"～"16"）、エラー時はNone
+            プログラムID（"01"～）、エラー時はNone
         """
+        if len(switches) != self.layout.switch_count:
+            logger.error(
+                f"スイッチ数が一致しません: {len(switches)} "
+                f"(期待値: {self.layout.switch_count})"
+            )
+            return None
+
         # 入力値の検証
-        for i, sw in enumerate([sw1, sw2, sw3, sw4], 1):
+        bits = 0
+        for i, sw in enumerate(switches, 1):
             if sw not in (0, 1):
                 logger.error(f"スイッチ{i}の値が不正です: {sw}")
                 return None
+            bits = (bits << 1) | sw
 
-        # パターン文字列を生成
-        pattern = f"{sw1}{sw2}{sw3}{sw4}"
-
-        return self._switch_pattern_to_program_id(pattern)
+        return self._table[bits]
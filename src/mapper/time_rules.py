@@ -0,0 +1,372 @@
+"""
+時間帯ルールモジュール
+スイッチパターン・曜日・時間帯の組み合わせでプログラムを切り替えるルールを扱う
+
+ルールは読み込み時にパターンごとの区間表（1週間を分単位で表した、重なりの無いソート済み区間）に
+変換しておき、alert受信時は二分探索で O(log n) で検索する
+"""
+import bisect
+import json
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.utils.logger import logger
+
+if TYPE_CHECKING:
+    from src.history.store import HistoryStore
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+# すべてのパターンに適用するルールのパターン指定
+ANY_PATTERN = "*"
+
+
+@dataclass(frozen=True)
+class TimeRule:
+    """
+    時間帯ルール
+
+    endがstart以前の場合は日付をまたぐ（例: 22:00～06:00）
+    日付をまたぐ場合、daysは開始側の曜日を表す
+    """
+
+    pattern: str
+    program: str
+    start: int
+    end: int
+    days: Tuple[int, ...] = tuple(range(7))
+    name: str = ""
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "TimeRule":
+        """
+        設定ファイルの1エントリからルールを生成
+
+        Args:
+            data: {"pattern": "1111", "days": ["mon", ...], "start": "22:00",
+                   "end": "06:00", "program": "17", "name": "夜間"}
+                  daysを省略した場合は毎日
+
+        Returns:
+            TimeRule: 生成したルール
+
+        Raises:
+            ValueError: 形式が不正な場合
+        """
+        try:
+            pattern = str(data["pattern"])
+            program = str(data["program"])
+            start = parse_minute(data["start"])
+            end = parse_minute(data["end"])
+        except KeyError as e:
+            raise ValueError(f"必須項目がありません: {e}")
+
+        if pattern != ANY_PATTERN and (not pattern or set(pattern) - {"0", "1"}):
+            raise ValueError(f"パターンが不正です: {pattern}")
+
+        days = data.get("days")
+        if days is None:
+            day_indexes = tuple(range(7))
+        else:
+            try:
+                day_indexes = tuple(sorted({WEEKDAYS.index(str(d).lower()[:3]) for d in days}))
+            except ValueError:
+                raise ValueError(f"曜日が不正です: {days}")
+
+        return cls(
+            pattern=pattern,
+            program=program,
+            start=start,
+            end=end,
+            days=day_indexes,
+            name=str(data.get("name", ""))
+        )
+
+    def intervals(self) -> Iterable[Tuple[int, int]]:
+        """
+        ルールが有効な区間を週の分単位（月曜0:00 = 0）で列挙
+
+        週末をまたぐ区間は2つに分割する
+        """
+        length = (self.end - self.start) % MINUTES_PER_DAY or MINUTES_PER_DAY
+        for day in self.days:
+            start = day * MINUTES_PER_DAY + self.start
+            end = start + length
+            if end <= MINUTES_PER_WEEK:
+                yield start, end
+            else:
+                yield start, MINUTES_PER_WEEK
+                yield 0, end - MINUTES_PER_WEEK
+
+
+def parse_minute(value: str) -> int:
+    """"HH:MM"形式の時刻を0:00からの分数に変換"""
+    try:
+        hour, minute = (int(part) for part in str(value).split(":"))
+    except ValueError:
+        raise ValueError(f"時刻の形式が不正です: {value}")
+    if not (0 <= hour <= 24 and 0 <= minute < 60) or hour * 60 + minute > MINUTES_PER_DAY:
+        raise ValueError(f"時刻が範囲外です: {value}")
+    return hour * 60 + minute
+
+
+def week_minute(when: datetime) -> int:
+    """
+    日時を週の分単位（月曜0:00 = 0）に変換
+
+    Args:
+        when: 日時（ローカル時刻）
+
+    Returns:
+        int: 0～10079
+    """
+    return when.weekday() * MINUTES_PER_DAY + when.hour * 60 + when.minute
+
+
+class TimeRuleTable:
+    """
+    時間帯ルールをコンパイルした区間表
+
+    パターンごとに (開始, 終了, プログラムID) の重なりの無い区間を開始時刻順に保持する
+    ルールが重なる場合は設定ファイルで先に書かれたルールを優先する
+    """
+
+    def __init__(self, rules: List[TimeRule]):
+        """
+        TimeRuleTableの初期化（ルールを区間表にコンパイル）
+
+        Args:
+            rules: 時間帯ルール（先頭ほど優先）
+        """
+        self.rules = list(rules)
+        self._tables: Dict[str, Tuple[List[int], List[int], List[str]]] = {}
+
+        patterns = {rule.pattern for rule in self.rules if rule.pattern != ANY_PATTERN}
+        any_rules = [rule for rule in self.rules if rule.pattern == ANY_PATTERN]
+        for pattern in patterns:
+            applicable = [rule for rule in self.rules if rule.pattern in (pattern, ANY_PATTERN)]
+            self._tables[pattern] = self._compile(applicable)
+        if any_rules:
+            self._tables[ANY_PATTERN] = self._compile(any_rules)
+
+        # 境界時刻（ルールの開始・終了）は全パターン共通で保持する
+        self._boundaries = sorted({
+            minute % MINUTES_PER_WEEK
+            for starts, ends, _ in self._tables.values()
+            for minute in starts + ends
+        })
+
+    @staticmethod
+    def _compile(rules: List[TimeRule]) -> Tuple[List[int], List[int], List[str]]:
+        """
+        ルールを重なりの無いソート済み区間に変換
+
+        Args:
+            rules: 同じパターンに適用されるルール（先頭ほど優先）
+
+        Returns:
+            Tuple[List[int], List[int], List[str]]: 開始・終了・プログラムIDの並列リスト
+        """
+        edges = sorted({
+            minute
+            for rule in rules
+            for interval in rule.intervals()
+            for minute in interval
+        })
+
+        starts: List[int] = []
+        ends: List[int] = []
+        programs: List[str] = []
+        for start, end in zip(edges, edges[1:]):
+            program = None
+            for rule in rules:
+                if any(s <= start and end <= e for s, e in rule.intervals()):
+                    program = rule.program
+                    break
+            if program is None:
+                continue
+            if ends and ends[-1] == start and programs[-1] == program:
+                # 同じプログラムが続く区間は結合する
+                ends[-1] = end
+            else:
+                starts.append(start)
+                ends.append(end)
+                programs.append(program)
+        return starts, ends, programs
+
+    @classmethod
+    def from_file(cls, path: Path) -> "TimeRuleTable":
+        """
+        設定ファイルからルールを読み込む
+
+        Args:
+            path: ルール設定ファイルのパス（{"rules": [...]} 形式のJSON）
+
+        Returns:
+            TimeRuleTable: コンパイル済みのルール
+
+        Raises:
+            ValueError: ルールの形式が不正な場合
+            OSError, json.JSONDecodeError: ファイルを読み込めない場合
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        entries = data.get("rules", []) if isinstance(data, dict) else data
+        return cls([TimeRule.from_dict(entry) for entry in entries])
+
+    def lookup(self, pattern: str, when: datetime) -> Optional[str]:
+        """
+        指定日時に有効なルールのプログラムIDを取得
+
+        Args:
+            pattern: スイッチパターン（"0"/"1"のみ）
+            when: 日時（ローカル時刻）
+
+        Returns:
+            Optional[str]: プログラムID（有効なルールが無い場合はNone）
+        """
+        table = self._tables.get(pattern) or self._tables.get(ANY_PATTERN)
+        if not table:
+            return None
+
+        starts, ends, programs = table
+        minute = week_minute(when)
+        index = bisect.bisect_right(starts, minute) - 1
+        if index >= 0 and minute < ends[index]:
+            return programs[index]
+        return None
+
+    def next_boundary(self, when: datetime) -> Optional[datetime]:
+        """
+        指定日時より後で、有効なルールが切り替わる可能性のある最初の時刻を取得
+
+        Args:
+            when: 基準日時（ローカル時刻）
+
+        Returns:
+            Optional[datetime]: 次の境界時刻（ルールが無い場合はNone）
+        """
+        if not self._boundaries:
+            return None
+
+        minute = week_minute(when)
+        index = bisect.bisect_right(self._boundaries, minute)
+        if index < len(self._boundaries):
+            delta = self._boundaries[index] - minute
+        else:
+            # 翌週の最初の境界
+            delta = MINUTES_PER_WEEK - minute + self._boundaries[0]
+        base = when.replace(second=0, microsecond=0)
+        return base + timedelta(minutes=delta)
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+
+class RuleScheduler:
+    """
+    ルールの境界時刻にプログラムを切り替えるスケジューラ
+
+    境界時刻まで待機し、最後に受信したスイッチパターンに対して有効なプログラムが
+    変わった場合はalertを待たずにコールバックで切り替える
+    """
+
+    def __init__(
+        self,
+        table: TimeRuleTable,
+        resolve: Callable[[datetime], Optional[str]],
+        callback: Callable[[str], object],
+        clock: Callable[[], datetime] = datetime.now,
+        history: Optional["HistoryStore"] = None,
+        on_switched: Optional[Callable[[str], None]] = None
+    ):
+        """
+        RuleSchedulerの初期化
+
+        Args:
+            table: コンパイル済みのルール
+            resolve: resolve(when) -> 切り替えが必要なプログラムID（不要な場合はNone）
+                     最後に受信したパターンに対して有効なプログラムを求める関数
+            callback: callback(program_id) 切り替えを実行する関数（真偽値として評価して成功を判定）
+            clock: 現在時刻を返す関数（テスト用）
+            history: 切り替えを記録する履歴ストア（source="rule"、Noneの場合は記録しない）
+            on_switched: on_switched(program_id) 切り替えに成功した場合に呼ぶ関数
+        """
+        self.table = table
+        self.resolve = resolve
+        self.callback = callback
+        self.clock = clock
+        self.history = history
+        self.on_switched = on_switched
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.triggered = 0
+
+    def start(self) -> None:
+        """スケジューラスレッドを開始"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rule-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"時間帯ルールのスケジューラを開始しました ({len(self.table)}ルール)")
+
+    def stop(self) -> None:
+        """スケジューラスレッドを停止"""
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self) -> None:
+        """境界時刻ごとにルールを再評価するループ"""
+        while not self._stop.is_set():
+            now = self.clock()
+            boundary = self.table.next_boundary(now)
+            if boundary is None:
+                return
+
+            if self._stop.wait((boundary - now).total_seconds()):
+                return
+
+            try:
+                self.evaluate(boundary)
+            except Exception as e:
+                logger.error(f"時間帯ルールの再評価中にエラーが発生しました: {e}")
+
+    def evaluate(self, when: datetime) -> Optional[str]:
+        """
+        指定日時に有効なプログラムを求め、変わっていれば切り替える
+
+        Args:
+            when: 評価する日時
+
+        Returns:
+            Optional[str]: 切り替えたプログラムID（切り替え不要の場合はNone）
+        """
+        program = self.resolve(when)
+        if program is None:
+            return None
+
+        logger.info(
+            f"時間帯ルールの境界 ({when:%a %H:%M}) のためプログラム '{program}' に切り替えます"
+        )
+        self.triggered += 1
+        started = time.perf_counter()
+        success = self.callback(program)
+        if self.history:
+            self.history.record(
+                None, None, program, (time.perf_counter() - started) * 1000,
+                "ok" if success else "failed", source="rule"
+            )
+        if success and self.on_switched:
+            self.on_switched(program)
+        return program
@@ -0,0 +1,7 @@
+"""
+スケジューラモジュール
+指定した曜日・時刻にプログラム切り替え・音量変更などを実行する
+"""
+from src.scheduler.scheduler import ActionScheduler, ScheduleEntry
+
+__all__ = ["ActionScheduler", "ScheduleEntry"]
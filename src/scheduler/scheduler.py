@@ -0,0 +1,471 @@
+"""
+スケジューラモジュール
+指定した曜日・時刻にプログラム切り替え・音量変更・一時停止などを実行する
+
+次回実行時刻のヒープを持ち、最も近い実行時刻まで待機する（時計の補正を検出するため、待機は最大MAX_WAIT秒）
+スケジュールはJSONファイルに保存し、再起動後も引き継ぐ
+"""
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from src.mapper.time_rules import MINUTES_PER_DAY, WEEKDAYS, parse_minute
+from src.utils.logger import logger
+
+if TYPE_CHECKING:
+    from src.history.store import HistoryStore
+    from src.tbbox.playlist import PlaylistController
+
+# スケジュールで実行できる操作
+ACTIONS = ("switch", "volume", "pause", "resume", "stop")
+
+
+@dataclass(frozen=True)
+class ScheduleEntry:
+    """
+    スケジュールの1エントリ
+
+    daysで指定した曜日のtime（"HH:MM"、ローカル時刻）に毎週実行する
+    """
+
+    id: str
+    action: str
+    time: str
+    days: Tuple[str, ...] = WEEKDAYS
+    value: Optional[str] = None
+    enabled: bool = True
+    name: str = ""
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], entry_id: Optional[str] = None) -> "ScheduleEntry":
+        """
+        辞書（APIのリクエストボディ・保存ファイル）からエントリを生成
+
+        Args:
+            data: {"action": "volume", "value": 30, "time": "22:00",
+                   "days": ["mon", ...], "enabled": true, "name": "夜間音量"}
+            entry_id: エントリID（省略時はdataの"id"、それも無ければ新規に採番）
+
+        Returns:
+            ScheduleEntry: 検証済みのエントリ
+
+        Raises:
+            ValueError: 形式が不正な場合
+        """
+        if not isinstance(data, dict):
+            raise ValueError("オブジェクト形式で指定してください")
+
+        action = data.get("action")
+        if action not in ACTIONS:
+            raise ValueError(f"actionが不正です: {action} (有効な値: {', '.join(ACTIONS)})")
+
+        time_of_day = data.get("time")
+        if not time_of_day:
+            raise ValueError("timeがありません")
+        minute = parse_minute(time_of_day)
+        if minute >= MINUTES_PER_DAY:
+            raise ValueError(f"時刻が範囲外です: {time_of_day}")
+
+        days = data.get("days")
+        if days is None:
+            days = WEEKDAYS
+        else:
+            if isinstance(days, str) or not days:
+                raise ValueError(f"曜日が不正です: {days}")
+            normalized = {str(day).lower()[:3] for day in days}
+            if normalized - set(WEEKDAYS):
+                raise ValueError(f"曜日が不正です: {days}")
+            days = tuple(day for day in WEEKDAYS if day in normalized)
+
+        value = data.get("value")
+        if action == "switch":
+            if value is None or value == "":
+                raise ValueError("switchにはvalue（プログラムID）が必要です")
+            value = str(value)
+        elif action == "volume":
+            try:
+                volume = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"volumeのvalueが不正です: {value}")
+            if not 0 <= volume <= 100:
+                raise ValueError(f"音量が範囲外です: {volume}")
+            value = str(volume)
+        else:
+            value = None
+
+        return cls(
+            id=entry_id or str(data.get("id") or uuid.uuid4().hex[:12]),
+            action=action,
+            time=f"{minute // 60:02d}:{minute % 60:02d}",
+            days=days,
+            value=value,
+            enabled=bool(data.get("enabled", True)),
+            name=str(data.get("name", ""))
+        )
+
+    def next_run(self, after: datetime) -> Optional[datetime]:
+        """
+        指定日時より後の次回実行時刻を取得
+
+        Args:
+            after: 基準日時（ローカル時刻）
+
+        Returns:
+            Optional[datetime]: 次回実行時刻（無効なエントリの場合はNone）
+        """
+        if not self.enabled:
+            return None
+
+        hour, minute = (int(part) for part in self.time.split(":"))
+        day_indexes = {WEEKDAYS.index(day) for day in self.days}
+        candidate = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        for offset in range(8):
+            run_at = candidate + timedelta(days=offset)
+            if run_at > after and run_at.weekday() in day_indexes:
+                return run_at
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """保存・APIレスポンス用の辞書に変換"""
+        data = asdict(self)
+        data["days"] = list(self.days)
+        return data
+
+
+@dataclass
+class _EntryState:
+    """エントリの実行状態（メモリ上のみ）"""
+
+    entry: ScheduleEntry
+    version: int
+    next_run: Optional[datetime] = None
+    last_run_at: Optional[float] = None
+    last_result: Optional[bool] = None
+    runs: int = field(default=0)
+
+
+class ActionScheduler:
+    """
+    スケジュールされた操作をPlaylistController経由で実行するクラス
+
+    (次回実行時刻, 連番, エントリID, 版数) のヒープを持ち、先頭の実行時刻まで待機する
+    エントリの変更・削除時はヒープを作り直さず版数を上げ、古い要素は取り出した時点で捨てる
+
+    時計が先に進んだ場合（RTCの無い機器でNTPの同期が取れた場合など）は、
+    過ぎた実行時刻を1回にまとめて実行し、次回は現在時刻から計算する
+    """
+
+    # 待機の上限（秒）。時計の補正を待機中でも検出できるよう、長く眠り続けない
+    MAX_WAIT = 60.0
+
+    def __init__(
+        self,
+        controller: "PlaylistController",
+        path: Optional[Path] = None,
+        clock=datetime.now,
+        history: Optional["HistoryStore"] = None
+    ):
+        """
+        ActionSchedulerの初期化
+
+        Args:
+            controller: 操作を実行するPlaylistController
+            path: スケジュールの保存先（Noneの場合は保存しない）
+            clock: 現在時刻を返す関数（テスト用）
+            history: プログラムの切り替えを記録する履歴ストア（source="schedule"、Noneの場合は記録しない）
+        """
+        self.controller = controller
+        self.path = Path(path) if path else None
+        self.clock = clock
+        self.history = history
+
+        self._entries: Dict[str, _EntryState] = {}
+        self._heap: List[Tuple[datetime, int, str, int]] = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+        if self.path:
+            self._load()
+
+    def _load(self) -> None:
+        """保存されたスケジュールを読み込む"""
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                items = json.load(f).get("items", [])
+            for item in items:
+                self._put(ScheduleEntry.from_dict(item))
+            logger.info(f"スケジュールを読み込みました: {len(self._entries)}件")
+        except (ValueError, OSError, AttributeError) as e:
+            logger.error(f"スケジュールの読み込みに失敗しました: {e}")
+
+    def _save(self) -> None:
+        """スケジュールを保存（一時ファイルに書いてから置き換える）"""
+        if not self.path:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"items": [state.entry.to_dict() for state in self._entries.values()]},
+                f, ensure_ascii=False, indent=2
+            )
+        os.replace(tmp_path, self.path)
+
+    def _put(self, entry: ScheduleEntry) -> _EntryState:
+        """エントリを登録してヒープに次回実行時刻を積む（ロック取得済みで呼ぶ）"""
+        previous = self._entries.get(entry.id)
+        state = _EntryState(entry=entry, version=previous.version + 1 if previous else 0)
+        if previous:
+            state.last_run_at = previous.last_run_at
+            state.last_result = previous.last_result
+            state.runs = previous.runs
+        self._entries[entry.id] = state
+        self._schedule(state, self.clock())
+        self._compact()
+        return state
+
+    def _compact(self) -> None:
+        """変更・削除で古くなった要素が増えた場合にヒープを作り直す（ロック取得済みで呼ぶ）"""
+        if len(self._heap) <= 2 * len(self._entries) + 64:
+            return
+        self._heap = [
+            item for item in self._heap
+            if item[2] in self._entries and self._entries[item[2]].version == item[3]
+        ]
+        heapq.heapify(self._heap)
+
+    def _schedule(self, state: _EntryState, after: datetime) -> None:
+        """次回実行時刻をヒープに積む（ロック取得済みで呼ぶ）"""
+        state.next_run = state.entry.next_run(after)
+        if state.next_run is not None:
+            heapq.heappush(
+                self._heap,
+                (state.next_run, next(self._counter), state.entry.id, state.version)
+            )
+
+    def _validate(self, entry: ScheduleEntry) -> None:
+        """PlaylistControllerで実行できるエントリか確認"""
+        if entry.action == "switch" and entry.value not in self.controller.program_commands:
+            raise ValueError(f"無効なプログラムID: {entry.value}")
+
+    def add(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        エントリを追加
+
+        Args:
+            data: エントリの内容（ScheduleEntry.from_dictの形式）
+
+        Returns:
+            Dict[str, Any]: 追加したエントリ
+
+        Raises:
+            ValueError: 形式が不正な場合
+        """
+        entry = ScheduleEntry.from_dict(data, entry_id=uuid.uuid4().hex[:12])
+        self._validate(entry)
+        with self._cond:
+            state = self._put(entry)
+            self._save()
+            self._cond.notify()
+        logger.info(f"スケジュールを追加しました: {entry}")
+        return self._describe(state)
+
+    def update(self, entry_id: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        エントリを置き換え
+
+        Args:
+            entry_id: エントリID
+            data: 新しい内容
+
+        Returns:
+            Optional[Dict[str, Any]]: 更新後のエントリ（存在しない場合はNone）
+
+        Raises:
+            ValueError: 形式が不正な場合
+        """
+        entry = ScheduleEntry.from_dict(data, entry_id=entry_id)
+        self._validate(entry)
+        with self._cond:
+            if entry_id not in self._entries:
+                return None
+            state = self._put(entry)
+            self._save()
+            self._cond.notify()
+        logger.info(f"スケジュールを更新しました: {entry}")
+        return self._describe(state)
+
+    def remove(self, entry_id: str) -> bool:
+        """
+        エントリを削除
+
+        Args:
+            entry_id: エントリID
+
+        Returns:
+            bool: 削除した場合True（存在しない場合False）
+        """
+        with self._cond:
+            if self._entries.pop(entry_id, None) is None:
+                return False
+            self._compact()
+            self._save()
+            self._cond.notify()
+        logger.info(f"スケジュールを削除しました: {entry_id}")
+        return True
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """
+        エントリの一覧を取得
+
+        Returns:
+            List[Dict[str, Any]]: 次回実行時刻の早い順（無効なエントリは末尾）
+        """
+        with self._cond:
+            states = list(self._entries.values())
+        states.sort(key=lambda s: (s.next_run is None, s.next_run or datetime.max))
+        return [self._describe(state) for state in states]
+
+    def get(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        """
+        エントリを取得
+
+        Args:
+            entry_id: エントリID
+
+        Returns:
+            Optional[Dict[str, Any]]: エントリ（存在しない場合はNone）
+        """
+        state = self._entries.get(entry_id)
+        return self._describe(state) if state else None
+
+    @staticmethod
+    def _describe(state: _EntryState) -> Dict[str, Any]:
+        """エントリと実行状態をAPIレスポンス用の辞書に変換"""
+        data = state.entry.to_dict()
+        data["next_run"] = state.next_run.isoformat() if state.next_run else None
+        data["last_run_at"] = state.last_run_at
+        data["last_result"] = state.last_result
+        data["runs"] = state.runs
+        return data
+
+    def start(self) -> None:
+        """スケジューラスレッドを開始"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="action-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"スケジューラを開始しました ({len(self._entries)}件)")
+
+    def stop(self) -> None:
+        """スケジューラスレッドを停止"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self) -> None:
+        """ヒープの先頭の実行時刻まで待機して実行するループ"""
+        while True:
+            with self._cond:
+                due = self._pop_due()
+                while due is None and not self._stopped:
+                    timeout = self.MAX_WAIT
+                    if self._heap:
+                        timeout = min(
+                            timeout,
+                            max(0.0, (self._heap[0][0] - self.clock()).total_seconds())
+                        )
+                    self._cond.wait(timeout)
+                    due = self._pop_due()
+                if self._stopped:
+                    return
+
+            # 実行中は追加・変更を受け付けられるようロックを外す
+            self._execute(due)
+
+    def _pop_due(self) -> Optional[_EntryState]:
+        """
+        実行時刻を過ぎたエントリを1件取り出す（ロック取得済みで呼ぶ）
+
+        変更・削除で古くなった要素は読み捨て、取り出したエントリは次回実行時刻を積み直す
+        次回実行時刻は現在時刻より後から計算し、過ぎた実行時刻をまとめて1回だけ実行する
+        """
+        now = self.clock()
+        while self._heap and self._heap[0][0] <= now:
+            run_at, _, entry_id, version = heapq.heappop(self._heap)
+            state = self._entries.get(entry_id)
+            if state is None or state.version != version:
+                continue
+            self._schedule(state, max(run_at, now))
+            return state
+        return None
+
+    def _execute(self, state: _EntryState) -> bool:
+        """
+        エントリの操作をPlaylistControllerで実行
+
+        Args:
+            state: 実行するエントリ
+
+        Returns:
+            bool: 成功時True
+        """
+        entry = state.entry
+        logger.info(f"スケジュールを実行します: {entry.name or entry.id} ({entry.action} {entry.value or ''})")
+        started = time.perf_counter()
+        try:
+            if entry.action == "switch":
+                success = bool(self.controller.switch_program(entry.value))
+            elif entry.action == "volume":
+                success = self.controller.set_volume(int(entry.value))
+            else:
+                success = getattr(self.controller, entry.action)()
+        except Exception as e:
+            logger.error(f"スケジュールの実行中にエラーが発生しました: {e}")
+            success = False
+
+        if entry.action == "switch" and self.history:
+            self.history.record(
+                None, None, entry.value, (time.perf_counter() - started) * 1000,
+                "ok" if success else "failed", source="schedule"
+            )
+
+        state.last_run_at = time.time()
+        state.last_result = success
+        state.runs += 1
+        if not success:
+            logger.error(f"スケジュールの実行に失敗しました: {entry.name or entry.id}")
+        return success
+
+    def run_pending(self) -> int:
+        """
+        実行時刻を過ぎたエントリをすべて実行（テスト・手動実行用）
+
+        Returns:
+            int: 実行したエントリ数
+        """
+        count = 0
+        while True:
+            with self._cond:
+                state = self._pop_due()
+            if state is None:
+                return count
+            self._execute(state)
+            count += 1
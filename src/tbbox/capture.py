@@ -0,0 +1,295 @@
+"""
+通信キャプチャモジュール
+TBBOXとの送受信を時刻付きでファイルに記録し、記録した応答を再生する
+
+ファイル形式（数値はリトルエンディアン）
+
+    ファイルヘッダ（16バイト）
+        0   6  マジック "TBCAP\\0"
+        6   2  バージョン
+        8   8  記録開始時刻（UNIX時間、double）
+
+    レコード（13バイト + データ、ファイルの終わりまで繰り返す）
+        0   1  種別（0: 送信, 1: 受信, 2: 接続, 3: クローズ, 4: 切断検知）
+        1   8  記録開始からの経過時間（秒、double）
+        9   4  データ長
+        13  n  データ
+
+レコードは長さ付きで追記するだけのため、読み込み時はファイル全体をメモリマップして
+先頭から順に辿る（書き込み途中で終了したファイルは最後の完全なレコードまで読む）
+"""
+import binascii
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Deque, Iterator, List, Optional, Union
+
+from src.tbbox.transport import MemoryConnection, Transport
+
+FILE_MAGIC = b"TBCAP\x00"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<6sHd")
+RECORD_HEADER = struct.Struct("<BdI")
+
+# レコードの種別
+SENT = 0
+RECEIVED = 1
+CONNECTED = 2
+CLOSED = 3
+RESET = 4
+
+KIND_NAMES = {
+    SENT: "send",
+    RECEIVED: "recv",
+    CONNECTED: "connect",
+    CLOSED: "close",
+    RESET: "reset",
+}
+
+
+@dataclass(frozen=True)
+class CaptureRecord:
+    """キャプチャの1レコード"""
+
+    kind: int
+    timestamp: float
+    data: bytes = b""
+
+    @property
+    def kind_name(self) -> str:
+        return KIND_NAMES.get(self.kind, str(self.kind))
+
+
+class CaptureWriter:
+    """
+    送受信をキャプチャファイルに記録するクラス
+
+    TBBOXClientのrecorderに設定すると、接続・送信・受信・切断を記録する
+    複数スレッドから呼ばれても1レコードずつ書き込む
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        CaptureWriterの初期化（既存のファイルは上書きする）
+
+        Args:
+            path: キャプチャファイルのパス
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "wb")
+        self._file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, time.time()))
+        self._file.flush()
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.records = 0
+
+    def record(self, kind: int, data: bytes = b"") -> None:
+        """
+        レコードを追記
+
+        Args:
+            kind: レコードの種別（SENT / RECEIVED / CONNECTED / CLOSED / RESET）
+            data: 送受信データ（接続の場合は接続先）
+        """
+        with self._lock:
+            if self._file.closed:
+                return
+            elapsed = time.perf_counter() - self._started
+            self._file.write(RECORD_HEADER.pack(kind, elapsed, len(data)))
+            self._file.write(data)
+            # 異常終了した場合も記録が残るよう、レコードごとに書き出す
+            self._file.flush()
+            self.records += 1
+
+    def close(self) -> None:
+        """ファイルをクローズ"""
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class CaptureReader:
+    """
+    キャプチャファイルを読み込むクラス
+
+    ファイル全体をメモリマップし、レコードは必要になった時点で取り出す
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        CaptureReaderの初期化
+
+        Args:
+            path: キャプチャファイルのパス
+
+        Raises:
+            ValueError: キャプチャファイルの形式でない場合
+        """
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        try:
+            if os.fstat(self._file.fileno()).st_size < FILE_HEADER.size:
+                raise ValueError(f"キャプチャファイルではありません: {self.path}")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self._file.close()
+            raise
+
+        magic, version, self.started_at = FILE_HEADER.unpack_from(self._map)
+        if magic != FILE_MAGIC:
+            self.close()
+            raise ValueError(f"キャプチャファイルではありません: {self.path}")
+        if version != FILE_VERSION:
+            self.close()
+            raise ValueError(f"未対応のバージョンです: {version}")
+
+    def __iter__(self) -> Iterator[CaptureRecord]:
+        offset = FILE_HEADER.size
+        size = len(self._map)
+        while offset + RECORD_HEADER.size <= size:
+            kind, timestamp, length = RECORD_HEADER.unpack_from(self._map, offset)
+            start = offset + RECORD_HEADER.size
+            if start + length > size:
+                break  # 書き込み途中のレコード
+            yield CaptureRecord(kind, timestamp, self._map[start:start + length])
+            offset = start + length
+
+    def sessions(self) -> List[List[CaptureRecord]]:
+        """
+        接続ごとにレコードを分割
+
+        Returns:
+            List[List[CaptureRecord]]: 接続ごとのレコード（接続レコードから次の接続の直前まで）
+        """
+        sessions: List[List[CaptureRecord]] = []
+        for record in self:
+            if record.kind == CONNECTED or not sessions:
+                sessions.append([])
+            sessions[-1].append(record)
+        return sessions
+
+    def close(self) -> None:
+        """ファイルをクローズ"""
+        if getattr(self, "_map", None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ReplayTransport(Transport):
+    """
+    キャプチャの応答を再生するトランスポート
+
+    open()のたびにキャプチャの接続を1つずつ取り出し、送信を受けるたびに
+    記録上その送信に続いて受信した応答を、記録どおりの間隔（speed倍速）で返す
+    記録で切断が検知されていた箇所では接続を切断する
+
+    送信内容が記録と異なる場合も応答は記録どおりに返し、mismatchesに数える
+    """
+
+    def __init__(self, capture: Union[str, Path, CaptureReader], speed: float = 1.0):
+        """
+        ReplayTransportの初期化
+
+        Args:
+            capture: キャプチャファイルのパスまたはCaptureReader
+            speed: 再生速度（1.0で記録どおり、0の場合は待たずに応答する）
+        """
+        reader = capture if isinstance(capture, CaptureReader) else CaptureReader(capture)
+        try:
+            self._sessions: Deque[List[CaptureRecord]] = deque(reader.sessions())
+        finally:
+            if reader is not capture:
+                reader.close()
+        self.speed = speed
+        self.connections = 0
+        self.mismatches = 0
+
+    @property
+    def label(self) -> str:
+        return "replay"
+
+    @property
+    def remaining(self) -> int:
+        """再生していない接続の数"""
+        return len(self._sessions)
+
+    def _delay(self, elapsed: float) -> float:
+        """記録上の経過時間を再生時の遅延に変換"""
+        return elapsed / self.speed if self.speed > 0 else 0.0
+
+    def open(self, timeout: Optional[float]) -> MemoryConnection:
+        if not self._sessions:
+            raise ConnectionRefusedError("キャプチャの接続をすべて再生しました")
+
+        records = deque(self._sessions.popleft())
+        connection: Optional[MemoryConnection] = None
+
+        def handle(data: bytes) -> Optional[bytes]:
+            # 次の送信レコードまで読み進める
+            while records and records[0].kind != SENT:
+                records.popleft()
+            if not records:
+                raise ConnectionResetError("記録の終わり")
+
+            sent = records.popleft()
+            if sent.data != data:
+                self.mismatches += 1
+
+            # 記録上この送受信で切断を検知していた場合
+            if records and records[0].kind == RESET:
+                records.popleft()
+                raise ConnectionResetError("記録上の切断")
+
+            # この送信に続く受信を記録どおりの間隔で返す（空の受信は相手側からの切断）
+            while records and records[0].kind == RECEIVED:
+                record = records.popleft()
+                connection.deliver(record.data, self._delay(record.timestamp - sent.timestamp))
+                if not record.data:
+                    connection.close_peer()
+            return None
+
+        connection = MemoryConnection(handle)
+        connection.settimeout(timeout)
+        self.connections += 1
+        return connection
+
+
+def format_record(record: CaptureRecord, limit: int = 64) -> str:
+    """レコードを1行の文字列に変換（データは16進数、limitバイトまで）"""
+    data = binascii.hexlify(record.data[:limit]).decode()
+    if len(record.data) > limit:
+        data += "..."
+    return f"{record.timestamp:12.6f}  {record.kind_name:<8}{len(record.data):>6}  {data}"
+
+
+def main() -> None:
+    """キャプチャファイルの内容を表示"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="TBBOX通信キャプチャの表示")
+    parser.add_argument("path", help="キャプチャファイルのパス")
+    parser.add_argument("--limit", type=int, default=64, help="表示するデータのバイト数")
+    args = parser.parse_args()
+
+    with CaptureReader(args.path) as reader:
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(reader.started_at))
+        print(f"# 記録開始: {started}")
+        for record in reader:
+            print(format_record(record, args.limit))
+
+
+if __name__ == "__main__":
+    main()
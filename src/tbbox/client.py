@@ -3,11 +3,27 @@ TBBOXクライアント
 TBBOXデバイスとのTCP/IP通信と認証を管理
 """
 import socket
+import threading
 import time
-from typing import Optional
+from typing import Callable, List, Optional, Tuple
 import binascii
 
+from src.tbbox import capture
+from src.tbbox.capture import CaptureWriter
+from src.tbbox.protocol import (
+    HEADER,
+    HEADER_SIZE,
+    MAGIC,
+    CommandResult,
+    decode_response,
+    encode_command,
+    frame_length,
+)
+from src.tbbox.rtt import RTTEstimator
+from src.tbbox.transport import Transport, create_transport
+from src.utils.deadline import Deadline, DeadlineExceeded
 from src.utils.logger import logger
+from src.utils.trace import current_trace, traced
 from config import settings
 
 
@@ -18,52 +34,141 @@ class TBBOXClient:
     TCP/IP接続の確立、認証、コマンド送信、再接続処理を担当
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        login_command: Optional[str] = None,
+        transport: Optional[Transport] = None,
+        recorder: Optional[CaptureWriter] = None
+    ):
         """
         TBBOXクライアントの初期化
+
+        Args:
+            host: TBBOXのIPアドレス（省略時は設定値）
+            port: TBBOXのポート番号（省略時は設定値）
+            login_command: ログインコマンド（16進数、省略時は設定値）
+            transport: 接続方法（省略時は設定に従ったTCP接続）
+            recorder: 送受信を記録するキャプチャ（Noneの場合は記録しない）
         """
-        self.host = settings.TBBOX_IP
-        self.port = settings.TBBOX_PORT
+        self.host = host or settings.TBBOX_IP
+        self.port = port or settings.TBBOX_PORT
+        self.login_command = login_command or settings.LOGIN_COMMAND
+        # Noneの場合は接続のたびにhost・portと設定からTCP接続を作る
+        self.transport = transport
+        self.recorder = recorder
+        # 接続済みのソケット（トランスポートによってはソケット互換オブジェクト）
         self.socket: Optional[socket.socket] = None
         self.is_connected = False
         self.is_authenticated = False
         self.max_retry = 5
         self.retry_delay = 3  # 秒
+        self.resend_delay = 1  # 秒（コマンド送信失敗から再送までの待ち時間）
+        self.connect_timeout = settings.TBBOX_CONNECT_TIMEOUT
+        self.read_timeout = settings.TBBOX_READ_TIMEOUT
+        # レスポンス待ちのタイムアウトはRTTの実測値から決める（再接続しても引き継ぐ）
+        self.rtt = RTTEstimator(
+            initial_timeout=self.read_timeout,
+            min_timeout=settings.TBBOX_RTO_MIN,
+            max_timeout=self.read_timeout
+        )
+        # 直近の接続で計測したTCP接続・ログインの所要時間（秒、診断用）
+        self.last_connect_time: Optional[float] = None
+        self.last_login_time: Optional[float] = None
+        self._connection_listeners: List[Callable[[bool], None]] = []
+        # TBBOXは1接続のみ受け付けるため、コマンドの送受信は1件ずつ行う
+        self._lock = threading.RLock()
+        # 送信待ち・送信中のコマンド数（終了時にdrain()で完了を待つ）
+        self._active = 0
+        self._idle = threading.Condition()
+
+        label = transport.label if transport else f"{self.host}:{self.port}"
+        logger.info(f"TBBOXクライアント初期化: {label}")
+
+    def add_connection_listener(self, listener: Callable[[bool], None]) -> None:
+        """
+        接続状態の変化を通知するリスナーを登録
+
+        Args:
+            listener: listener(connected: bool) の形式
+                      ログイン完了時にTrue、切断時にFalseで呼ばれる
+        """
+        self._connection_listeners.append(listener)
+
+    def _notify_connection(self, connected: bool) -> None:
+        """接続状態の変化をリスナーに通知"""
+        for listener in self._connection_listeners:
+            try:
+                listener(connected)
+            except Exception as e:
+                logger.error(f"接続状態リスナーでエラーが発生しました: {e}")
+
+    def _mark_disconnected(self) -> None:
+        """
+        切断状態にする
 
-        logger.info(f"TBBOXクライアント初期化: {self.host}:{self.port}")
+        リスナーへの通知はログイン済みの状態から切断した場合のみ行う
+        （送受信エラーの後にclose()しても、切断を重複して通知しない）
+        """
+        was_authenticated = self.is_authenticated
+        self.is_connected = False
+        self.is_authenticated = False
+        if was_authenticated:
+            self._notify_connection(False)
 
-    def connect(self) -> bool:
+    def connect(self, deadline: Optional[Deadline] = None) -> bool:
         """
         TBBOXデバイスに接続
 
+        Args:
+            deadline: 処理の期限（Noneの場合は期限なし）
+
         Returns:
             bool: 接続成功時True、失敗時False
+
+        Raises:
+            DeadlineExceeded: 接続・ログインが期限内に完了しなかった場合
         """
         retry_count = 0
 
         while retry_count < self.max_retry:
             try:
+                if deadline:
+                    deadline.check("connect")
+
                 # 既存の接続があればクローズ
                 if self.socket:
                     self.close()
 
-                # ソケットを作成
-                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.socket.settimeout(10)  # 10秒のタイムアウト
-
-                logger.info(f"TBBOXに接続中... ({self.host}:{self.port})")
-                self.socket.connect((self.host, self.port))
+                transport = self.transport or create_transport(self.host, self.port)
+                logger.info(f"TBBOXに接続中... ({transport.label})")
+                connect_timeout = (
+                    deadline.clamp(self.connect_timeout) if deadline else self.connect_timeout
+                )
+                # check()の後に残り時間が0になった場合も、ノンブロッキングで接続しない
+                if connect_timeout <= 0:
+                    raise DeadlineExceeded("connect")
+                started = time.perf_counter()
+                self.socket = transport.open(connect_timeout)
+                self.last_connect_time = time.perf_counter() - started
+                self._record(capture.CONNECTED, transport.label.encode("utf-8"))
 
                 self.is_connected = True
                 logger.info("TBBOXへの接続に成功しました")
 
                 # ログイン処理
-                if self._login():
+                started = time.perf_counter()
+                if self._login(deadline):
+                    self.last_login_time = time.perf_counter() - started
                     return True
                 else:
                     logger.error("ログインに失敗しました")
                     self.close()
 
+            except DeadlineExceeded:
+                self.close()
+                raise
             except socket.timeout:
                 logger.error(f"接続タイムアウト (試行 {retry_count + 1}/{self.max_retry})")
             except ConnectionRefusedError:
@@ -73,16 +178,21 @@ class TBBOXClient:
 
             retry_count += 1
             if retry_count < self.max_retry:
+                if deadline and deadline.remaining() <= self.retry_delay:
+                    raise DeadlineExceeded("connect")
                 logger.info(f"{self.retry_delay}秒後に再接続を試行します...")
                 time.sleep(self.retry_delay)
 
         logger.error(f"TBBOXへの接続に失敗しました ({self.max_retry}回試行)")
         return False
 
-    def _login(self) -> bool:
+    def _login(self, deadline: Optional[Deadline] = None) -> bool:
         """
         TBBOXにログイン
 
+        Args:
+            deadline: 処理の期限（Noneの場合は期限なし）
+
         Returns:
             bool: ログイン成功時True、失敗時False
         """
@@ -94,102 +204,381 @@ class TBBOXClient:
             logger.info("TBBOXにログイン中...")
 
             # ログインコマンドを送信
-            login_command = settings.LOGIN_COMMAND
-            success = self._send_raw_command(login_command)
+            # 認証処理は通常のコマンドより時間がかかるため、RTTの推定には含めない
+            success = self._send_raw_command(
+                self.login_command, timeout=self.read_timeout, deadline=deadline
+            )
 
             if success:
                 self.is_authenticated = True
                 logger.info("TBBOXへのログインに成功しました")
+                self._notify_connection(True)
                 return True
             else:
                 logger.error("ログインコマンドの送信に失敗しました")
                 return False
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"ログイン中にエラーが発生しました: {e}")
             return False
 
-    def _send_raw_command(self, hex_command: str) -> bool:
+    def _record(self, kind: int, data: bytes = b"") -> None:
+        """キャプチャが設定されている場合は送受信を記録"""
+        if self.recorder:
+            self.recorder.record(kind, data)
+
+    def _send_raw_command(
+        self,
+        hex_command: str,
+        timeout: Optional[float] = None,
+        deadline: Optional[Deadline] = None
+    ) -> bool:
         """
         16進数コマンドを送信
 
         Args:
             hex_command: 16進数形式のコマンド文字列
+            timeout: レスポンス待ちのタイムアウト（秒）
+                     省略時はRTTから推定した値を使用し、応答時間を推定に反映する
+            deadline: 処理の期限（レスポンス待ちは残り時間までに制限される）
 
         Returns:
             bool: 送信成功時True、失敗時False
+
+        Raises:
+            DeadlineExceeded: 送信前またはレスポンス待ちの間に期限を過ぎた場合
+        """
+        return self._exchange(hex_command, timeout, deadline).ok
+
+    def _exchange(
+        self,
+        hex_command: str,
+        timeout: Optional[float] = None,
+        deadline: Optional[Deadline] = None,
+        retransmit: bool = False
+    ) -> CommandResult:
+        """
+        コマンドを1回送信してレスポンスを解析
+
+        Args:
+            hex_command: 16進数形式のコマンド文字列
+            timeout: レスポンス待ちのタイムアウト（_send_raw_commandと同じ）
+            deadline: 処理の期限
+            retransmit: 再送の場合True（応答が前回の送信に対するものか区別できないため、
+                        RTTの推定に反映しない。Karnのアルゴリズム）
+
+        Returns:
+            CommandResult: 解析したレスポンス（通信エラー時は失敗結果）
+
+        Raises:
+            DeadlineExceeded: 送信前またはレスポンス待ちの間に期限を過ぎた場合
         """
         try:
             if not self.socket or not self.is_connected:
                 logger.error("接続が確立されていません")
-                return False
+                return CommandResult.failure("not_connected", retryable=True)
 
             # 16進数文字列をバイナリに変換
-            # スペースを削除してから変換
-            hex_command = hex_command.replace(" ", "").replace("\n", "")
-            command_bytes = binascii.unhexlify(hex_command)
+            try:
+                command_bytes = encode_command(hex_command)
+            except (binascii.Error, ValueError) as e:
+                logger.error(f"コマンドの形式が不正です: {e}")
+                return CommandResult.failure("invalid_command", retryable=False)
+
+            use_rto = timeout is None
+            read_timeout = self.rtt.timeout if use_rto else timeout
+            clamped = False
+            if deadline:
+                clamped = deadline.remaining() < read_timeout
+                read_timeout = deadline.clamp(read_timeout)
+                # 残り時間が0の場合は送信しない
+                # （settimeout(0)はソケットをノンブロッキングにし、BlockingIOErrorで接続を切ってしまう）
+                if read_timeout <= 0:
+                    raise DeadlineExceeded("send")
+            self.socket.settimeout(read_timeout)
+            # 応答の照合に使う (コマンド種別, アクション)（プロトコル外のコマンドは照合しない）
+            expected = (
+                HEADER.unpack_from(command_bytes)[3:5]
+                if frame_length(command_bytes) is not None else None
+            )
 
             # コマンド送信
+            sent_at = time.perf_counter()
+            self._record(capture.SENT, command_bytes)
             self.socket.send(command_bytes)
             logger.debug(f"コマンド送信: {hex_command}")
 
             # レスポンスを受信（必須）
             try:
-                response = self.socket.recv(1024)
-                if response:
-                    response_hex = binascii.hexlify(response).decode()
-                    logger.debug(f"レスポンス受信: {response_hex}")
-                    return True  # レスポンス受信成功
-                else:
-                    logger.warning("レスポンスが空です")
-                    return False
+                response = self._recv_matching(expected, sent_at + read_timeout)
             except socket.timeout:
-                logger.warning("レスポンス受信タイムアウト")
-                return False
-
+                logger.warning(f"レスポンス受信タイムアウト ({read_timeout:.3f}秒)")
+                # プログラム切り替えはすべて同じヘッダ（種別・アクション・シーケンス番号）のため、
+                # 遅れて届く応答を次のコマンドの応答と区別できない
+                # 接続を閉じ、次のコマンドは再接続してから送信する
+                self.close()
+                if clamped:
+                    # RTOより先に期限が来た場合はRTTの推定に反映しない
+                    raise DeadlineExceeded("receive")
+                if use_rto:
+                    self.rtt.on_timeout()
+                return CommandResult.failure("timeout", retryable=True)
+
+            if not response:
+                logger.warning("レスポンスが空です")
+                return CommandResult.failure("empty_response", retryable=True)
+
+            if use_rto and not retransmit:
+                self.rtt.observe(time.perf_counter() - sent_at)
+            logger.debug(f"レスポンス受信: {binascii.hexlify(response).decode()}")
+
+            result = decode_response(response)
+            if not result.ok:
+                logger.warning(
+                    f"コマンドが失敗しました: error={result.error}, "
+                    f"status={result.status}, payload={result.payload}"
+                )
+            return result
+
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"コマンド送信中にエラーが発生しました: {e}")
-            self.is_connected = False
-            return False
+            self._record(capture.RESET)
+            self._mark_disconnected()
+            return CommandResult.failure("connection_error", retryable=True)
+
+    def _recv_response(self) -> bytes:
+        """
+        レスポンスを受信
+
+        プロトコルのフレームの場合は、ヘッダのペイロード長分を受信し終えるまで読み込む
+
+        Returns:
+            bytes: 受信データ（接続が閉じられた場合は空）
+
+        Raises:
+            socket.timeout: タイムアウト内に受信できなかった場合
+        """
+        response = self.socket.recv(1024)
+        if not response or not response.startswith(MAGIC[:len(response)]):
+            return response
+
+        # ヘッダが分割されて届いた場合
+        while len(response) < HEADER_SIZE:
+            chunk = self.socket.recv(1024)
+            if not chunk:
+                return response
+            response += chunk
+
+        expected = frame_length(response)
+        while expected is not None and len(response) < expected:
+            chunk = self.socket.recv(expected - len(response))
+            if not chunk:
+                break
+            response += chunk
+        return response
+
+    def _recv_matching(self, expected: Optional[Tuple[int, int]], receive_until: float) -> bytes:
+        """
+        送信したコマンドに対するレスポンスを受信
+
+        コマンド種別・アクションが送信したコマンドと一致しないレスポンスは破棄して受信を続ける
+        （タイムアウトしたコマンドの遅延レスポンスは、接続を閉じることで受信しないようにしている）
+
+        Args:
+            expected: 送信したコマンドの (コマンド種別, アクション)（Noneの場合は照合しない）
+            receive_until: 受信を打ち切る時刻（time.perf_counter()）
+
+        Returns:
+            bytes: 受信データ（接続が閉じられた場合は空）
 
-    def send_command(self, hex_command: str, max_retry: int = 5) -> bool:
+        Raises:
+            socket.timeout: receive_untilまでに一致するレスポンスを受信できなかった場合
+        """
+        while True:
+            response = self._recv_response()
+            self._record(capture.RECEIVED, response)
+            if expected is None or frame_length(response) is None:
+                return response
+            received = HEADER.unpack_from(response)[3:5]
+            if received == expected:
+                return response
+            logger.warning(
+                f"送信したコマンドと一致しないレスポンスを破棄しました: "
+                f"command=0x{received[0]:04x}, action=0x{received[1]:04x}"
+            )
+            remaining = receive_until - time.perf_counter()
+            if remaining <= 0:
+                raise socket.timeout("timed out")
+            self.socket.settimeout(remaining)
+
+    def send_command(
+        self,
+        hex_command: str,
+        max_retry: int = 5,
+        deadline: Optional[Deadline] = None
+    ) -> bool:
         """
         コマンドを送信（再送信機能付き）
 
         Args:
             hex_command: 16進数形式のコマンド文字列
             max_retry: 最大再送信回数（デフォルト: 5回）
+            deadline: 処理の期限（期限を過ぎた時点で再送を打ち切る）
 
         Returns:
             bool: 送信成功時True、失敗時False
+
+        Raises:
+            DeadlineExceeded: 送信待ち・再接続・送受信・再送の途中で期限を過ぎた場合
+        """
+        return self.execute(hex_command, max_retry, deadline).ok
+
+    def execute(
+        self,
+        hex_command: str,
+        max_retry: int = 5,
+        deadline: Optional[Deadline] = None
+    ) -> CommandResult:
+        """
+        コマンドを送信して解析済みの結果を返す（再送信機能付き）
+
+        再送は通信エラーなど再送で回復しうる失敗の場合のみ行い、
+        機器に拒否されたコマンドは再送しない
+
+        Args:
+            hex_command: 16進数形式のコマンド文字列
+            max_retry: 最大再送信回数（デフォルト: 5回）
+            deadline: 処理の期限（期限を過ぎた時点で再送を打ち切る）
+
+        Returns:
+            CommandResult: 最後に送信したコマンドの結果
+
+        Raises:
+            DeadlineExceeded: 送信待ち・再接続・送受信・再送の途中で期限を過ぎた場合
+        """
+        with self._idle:
+            self._active += 1
+        try:
+            # 他のコマンドの送信待ちも期限内に収める
+            with traced("queue"):
+                acquired = self._lock.acquire(timeout=deadline.remaining() if deadline else -1)
+            if not acquired:
+                raise DeadlineExceeded("queue")
+            try:
+                return self._execute_locked(hex_command, max_retry, deadline)
+            finally:
+                self._lock.release()
+        finally:
+            with self._idle:
+                self._active -= 1
+                if not self._active:
+                    self._idle.notify_all()
+
+    @property
+    def pending_commands(self) -> int:
+        """送信待ち・送信中のコマンド数"""
+        return self._active
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
         """
+        送信待ち・送信中のコマンドがすべて完了するまで待つ（終了処理用）
+
+        Args:
+            timeout: 待ち時間の上限（秒、Noneの場合は無制限）
+
+        Returns:
+            bool: すべて完了した場合True、timeout秒を過ぎても残っている場合False
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._active, timeout)
+
+    def ensure_connected(self, deadline: Optional[Deadline] = None) -> Optional[bool]:
+        """
+        切断されていれば再接続する（接続監視用）
+
+        コマンドの送信中は待たずに戻り、アラート処理を妨げない
+
+        Args:
+            deadline: 処理の期限（Noneの場合は期限なし）
+
+        Returns:
+            Optional[bool]: 接続済みまたは再接続に成功した場合True、失敗した場合False、
+                            他のコマンドを送信中で確認しなかった場合None
+
+        Raises:
+            DeadlineExceeded: 再接続が期限内に完了しなかった場合
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if self.is_connected and self.is_authenticated:
+                return True
+            logger.info("接続が切断されています。バックグラウンドで再接続します...")
+            return self.connect(deadline)
+        finally:
+            self._lock.release()
+
+    def _execute_locked(
+        self,
+        hex_command: str,
+        max_retry: int,
+        deadline: Optional[Deadline]
+    ) -> CommandResult:
+        """
+        executeの本体（ロック取得済みで呼ばれる）
+
+        HTTPリクエストの処理中であれば、再接続・送受信・再送待ちの時間と再送回数をトレースに記録する
+        """
+        trace = current_trace()
         retry_count = 0
+        result = CommandResult.failure("not_sent", retryable=True)
 
         while retry_count < max_retry:
             # 未接続の場合は再接続を試行
             if not self.is_connected or not self.is_authenticated:
                 logger.warning("接続が切断されています。再接続を試行します...")
-                if not self.connect():
+                with traced("connect"):
+                    connected = self.connect(deadline)
+                if not connected:
                     logger.error("再接続に失敗しました")
-                    return False
+                    return CommandResult.failure("connect_failed", retryable=True)
 
             # コマンド送信
-            if self._send_raw_command(hex_command):
-                return True
+            with traced("tbbox"):
+                result = self._exchange(hex_command, deadline=deadline, retransmit=retry_count > 0)
+            if result.ok:
+                return result
+            if not result.retryable:
+                logger.error(f"コマンドが拒否されたため再送しません (status={result.status})")
+                return result
 
             retry_count += 1
             if retry_count < max_retry:
-                logger.warning(f"コマンド送信失敗。1秒後に再送信します (試行 {retry_count + 1}/{max_retry})")
-                time.sleep(1)
+                if deadline and deadline.remaining() <= self.resend_delay:
+                    logger.warning("期限までに再送できないため、コマンド送信を打ち切ります")
+                    raise DeadlineExceeded("retry")
+                logger.warning(
+                    f"コマンド送信失敗。{self.resend_delay}秒後に再送信します "
+                    f"(試行 {retry_count + 1}/{max_retry})"
+                )
+                if trace is not None:
+                    trace.retries += 1
+                with traced("retry"):
+                    time.sleep(self.resend_delay)
 
         logger.error(f"コマンド送信に失敗しました ({max_retry}回試行)")
-        return False
+        return result
 
     def close(self):
         """
         接続をクローズ
         """
         if self.socket:
+            self._record(capture.CLOSED)
             try:
                 self.socket.close()
                 logger.info("TBBOXとの接続をクローズしました")
@@ -197,8 +586,7 @@ class TBBOXClient:
                 logger.error(f"接続クローズ中にエラーが発生しました: {e}")
             finally:
                 self.socket = None
-                self.is_connected = False
-                self.is_authenticated = False
+                self._mark_disconnected()
 
     def __enter__(self):
         """コンテキストマネージャーのエントリー"""
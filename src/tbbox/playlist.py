@@ -2,10 +2,18 @@
 TBBOXプレイリスト管理
 プログラム切り替えコマンドの送信を管理
 """
-from typing import Optional, Dict
+import threading
+from contextlib import contextmanager
+from dataclasses import replace
+from typing import Any, Dict, Iterator, Optional
 
 from src.utils.logger import logger
 from src.tbbox.client import TBBOXClient
+from src.tbbox.protocol import CommandResult, parse_playback_state
+from src.tbbox.state import DeviceStateSnapshot
+from src.utils.deadline import Deadline, DeadlineExceeded
+from src.utils.events import EventBus
+from src.utils.trace import traced
 from config import settings
 
 
@@ -17,14 +25,40 @@ class PlaylistController:
     TBBOXで再生するプログラムを切り替える
     """
 
-    def __init__(self, client: Optional[TBBOXClient] = None):
+    def __init__(
+        self,
+        client: Optional[TBBOXClient] = None,
+        state: Optional[DeviceStateSnapshot] = None,
+        status_command: Optional[str] = None,
+        skip_if_playing_ttl: float = 0,
+        events: Optional[EventBus] = None
+    ):
         """
         PlaylistControllerの初期化
 
         Args:
             client: TBBOXクライアントインスタンス（Noneの場合は新規作成）
+            state: デバイス状態スナップショット（Noneの場合は新規作成）
+            status_command: 再生状態の問い合わせコマンド（Noneの場合は設定値を使用）
+            skip_if_playing_ttl: 0より大きい場合、この秒数以内にTBBOXから読み取った状態で
+                                 再生中と確認できたプログラムへの切り替えを省略する
+            events: 切り替え結果を配信するイベントバス（Noneの場合は配信しない）
         """
         self.client = client or TBBOXClient()
+        self.state = state or DeviceStateSnapshot()
+        self.status_command = (
+            settings.STATUS_COMMAND if status_command is None else status_command
+        )
+        self.skip_if_playing_ttl = skip_if_playing_ttl
+        self.events = events
+        # コマンドの送信と状態の記録を1つの操作として行う
+        # （クライアントのロックだけでは、送信順と記録順が入れ替わり最終状態がずれる）
+        self._lock = threading.RLock()
+        # ロック待ち・ロック保持中の操作数（終了処理で状態の記録まで待つため）
+        self._active = 0
+        self._idle = threading.Condition()
+        self.state.set_connected(self.client.is_authenticated)
+        self.client.add_connection_listener(self.state.set_connected)
         self.program_commands = self._load_program_commands()
 
         # プレイリスト制御用コマンド
@@ -45,48 +79,124 @@ class PlaylistController:
         """
         return settings.PROGRAM_COMMANDS
 
-    def switch_program(self, program_id: str) -> bool:
+    @contextmanager
+    def _locked(self, deadline: Optional[Deadline] = None) -> Iterator[None]:
         """
-        指定されたプログラムに切り替え
+        コマンドの送信から状態の記録までロックを保持
 
         Args:
-            program_id: プログラムID（"01"～"20"）
+            deadline: 処理の期限（他のコマンドの送信待ちも期限内に収める）
 
-        Returns:
-            bool: 切り替え成功時True、失敗時False
+        Raises:
+            DeadlineExceeded: 期限内にロックを取得できなかった場合
         """
+        with self._idle:
+            self._active += 1
         try:
-            # プログラムIDの検証
-            if program_id not in self.program_commands:
-                logger.error(
-                    f"無効なプログラムID: {program_id} "
-                    f"(有効なID: {list(self.program_commands.keys())})"
-                )
-                return False
+            with traced("queue"):
+                acquired = self._lock.acquire(timeout=deadline.remaining() if deadline else -1)
+            if not acquired:
+                raise DeadlineExceeded("queue")
+            try:
+                yield
+            finally:
+                self._lock.release()
+        finally:
+            with self._idle:
+                self._active -= 1
+                if not self._active:
+                    self._idle.notify_all()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        送信待ち・送信中の操作が状態の記録まで完了するのを待つ（終了処理用）
 
-            # プログラムコマンドを取得
-            program_command = self.program_commands[program_id]
+        TBBOXClient.drain()はコマンドの応答までしか待たないため、
+        デバイス状態を保存する前にはこちらを呼ぶ
 
-            logger.info(f"プログラム '{program_id}' への切り替えを実行します")
+        Args:
+            timeout: 待ち時間の上限（秒、Noneの場合は無制限）
 
-            # コマンド送信（自動再接続・再送信機能付き）
-            success = self.client.send_command(program_command)
+        Returns:
+            bool: すべて完了した場合True、timeout秒を過ぎても残っている場合False
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._active, timeout)
+
+    def switch_program(
+        self,
+        program_id: str,
+        deadline: Optional[Deadline] = None
+    ) -> CommandResult:
+        """
+        指定されたプログラムに切り替え
 
-            if success:
-                logger.info(f"プログラム '{program_id}' への切り替えが完了しました")
+        Args:
+            program_id: プログラムID（"01"～"20"）
+            deadline: 処理の期限（期限を過ぎた時点で送信・再送を打ち切る）
 
-                # プログラム切り替え後、音量を0%に設定
-                # logger.info("音量を0%に設定します")
-                # self.set_volume(0)
+        Returns:
+            CommandResult: 切り替え結果（真偽値として評価すると成功時True）
 
-                return True
-            else:
-                logger.error(f"プログラム '{program_id}' への切り替えに失敗しました")
-                return False
+        Raises:
+            DeadlineExceeded: 期限内に切り替えが完了しなかった場合
+        """
+        try:
+            with self._locked(deadline):
+                # プログラムIDの検証
+                if program_id not in self.program_commands:
+                    logger.error(
+                        f"無効なプログラムID: {program_id} "
+                        f"(有効なID: {list(self.program_commands.keys())})"
+                    )
+                    return CommandResult.failure("invalid_program", retryable=False)
+
+                # TBBOXの実際の状態で再生中と確認できる場合は送信しない
+                if self.skip_if_playing_ttl > 0 and self.state.is_playing(
+                    program_id, self.skip_if_playing_ttl
+                ):
+                    logger.info(f"プログラム '{program_id}' は再生中のため、切り替えを省略します")
+                    return CommandResult(ok=True, program=program_id)
+
+                # プログラムコマンドを取得
+                program_command = self.program_commands[program_id]
+
+                logger.info(f"プログラム '{program_id}' への切り替えを実行します")
+
+                # コマンド送信（自動再接続・再送信機能付き）
+                result = replace(
+                    self.client.execute(program_command, deadline=deadline),
+                    program=program_id
+                )
 
+                if result:
+                    logger.info(f"プログラム '{program_id}' への切り替えが完了しました")
+                    self.state.record_switch(program_id)
+
+                    # プログラム切り替え後、音量を0%に設定
+                    # logger.info("音量を0%に設定します")
+                    # self.set_volume(0)
+                else:
+                    logger.error(
+                        f"プログラム '{program_id}' への切り替えに失敗しました "
+                        f"(error={result.error}, status={result.status})"
+                    )
+                if self.events:
+                    self.events.publish(
+                        "switch",
+                        program=program_id,
+                        ok=result.ok,
+                        error=result.error,
+                        status=result.status
+                    )
+                return result
+
+        except DeadlineExceeded as e:
+            logger.warning(f"プログラム '{program_id}' への切り替えを中断しました: {e}")
+            raise
         except Exception as e:
             logger.error(f"プログラム切り替え中にエラーが発生しました: {e}")
-            return False
+            return CommandResult.failure("internal_error", retryable=False)
 
     def pause(self) -> bool:
         """
@@ -96,15 +206,17 @@ class PlaylistController:
             bool: 成功時True、失敗時False
         """
         try:
-            logger.info("プログラムを一時停止します")
-            success = self.client.send_command(self.control_commands["pause"])
+            with self._locked():
+                logger.info("プログラムを一時停止します")
+                success = self.client.send_command(self.control_commands["pause"])
 
-            if success:
-                logger.info("プログラムの一時停止が完了しました")
-            else:
-                logger.error("プログラムの一時停止に失敗しました")
+                if success:
+                    logger.info("プログラムの一時停止が完了しました")
+                    self.state.record_playback(playing=False)
+                else:
+                    logger.error("プログラムの一時停止に失敗しました")
 
-            return success
+                return success
 
         except Exception as e:
             logger.error(f"一時停止中にエラーが発生しました: {e}")
@@ -118,15 +230,17 @@ class PlaylistController:
             bool: 成功時True、失敗時False
         """
         try:
-            logger.info("プログラムを再開します")
-            success = self.client.send_command(self.control_commands["resume"])
+            with self._locked():
+                logger.info("プログラムを再開します")
+                success = self.client.send_command(self.control_commands["resume"])
 
-            if success:
-                logger.info("プログラムの再開が完了しました")
-            else:
-                logger.error("プログラムの再開に失敗しました")
+                if success:
+                    logger.info("プログラムの再開が完了しました")
+                    self.state.record_playback(playing=True)
+                else:
+                    logger.error("プログラムの再開に失敗しました")
 
-            return success
+                return success
 
         except Exception as e:
             logger.error(f"再開中にエラーが発生しました: {e}")
@@ -140,15 +254,17 @@ class PlaylistController:
             bool: 成功時True、失敗時False
         """
         try:
-            logger.info("プログラムを停止します")
-            success = self.client.send_command(self.control_commands["stop"])
+            with self._locked():
+                logger.info("プログラムを停止します")
+                success = self.client.send_command(self.control_commands["stop"])
 
-            if success:
-                logger.info("プログラムの停止が完了しました")
-            else:
-                logger.error("プログラムの停止に失敗しました")
+                if success:
+                    logger.info("プログラムの停止が完了しました")
+                    self.state.record_playback(playing=False)
+                else:
+                    logger.error("プログラムの停止に失敗しました")
 
-            return success
+                return success
 
         except Exception as e:
             logger.error(f"停止中にエラーが発生しました: {e}")
@@ -177,20 +293,59 @@ class PlaylistController:
 
             volume_command = getattr(settings, f"VOLUME_{volume_percent}_COMMAND")
 
-            logger.info(f"音量を {volume_percent}% に設定します")
-            success = self.client.send_command(volume_command)
+            with self._locked():
+                logger.info(f"音量を {volume_percent}% に設定します")
+                success = self.client.send_command(volume_command)
 
-            if success:
-                logger.info(f"音量設定が完了しました: {volume_percent}%")
-            else:
-                logger.error(f"音量設定に失敗しました")
+                if success:
+                    logger.info(f"音量設定が完了しました: {volume_percent}%")
+                    self.state.record_playback(volume=volume_percent)
+                else:
+                    logger.error(f"音量設定に失敗しました")
 
-            return success
+                return success
 
         except Exception as e:
             logger.error(f"音量設定中にエラーが発生しました: {e}")
             return False
 
+    def query_playback_state(
+        self,
+        deadline: Optional[Deadline] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        TBBOXに再生状態を問い合わせてスナップショットを更新
+
+        アラート処理と同じ制御用接続を使用する（再送は行わない）
+
+        Args:
+            deadline: 処理の期限（送信待ちを含む）
+
+        Returns:
+            Optional[Dict[str, Any]]: 更新後の状態（問い合わせコマンド未設定・失敗時はNone）
+
+        Raises:
+            DeadlineExceeded: 期限内に応答が得られなかった場合
+        """
+        if not self.status_command:
+            return None
+
+        with self._locked(deadline):
+            result = self.client.execute(self.status_command, max_retry=1, deadline=deadline)
+            if not result:
+                logger.warning(f"再生状態の問い合わせに失敗しました (error={result.error})")
+                return None
+
+            playback = parse_playback_state(result.payload)
+            if not playback:
+                logger.warning(f"再生状態の応答を解析できませんでした: payload={result.payload}")
+                return None
+
+            # 応答を受信してから記録するまでの間に切り替えが記録されないようにする
+            self.state.record_playback(source="device", **playback)
+        logger.debug(f"再生状態を更新しました: {playback}")
+        return self.state.get()
+
     def close(self):
         """
         クライアント接続をクローズ
@@ -0,0 +1,197 @@
+"""
+TBBOXプロトコルモジュール
+中央制御プロトコルのフレームを解析し、コマンドの実行結果に変換する
+
+フレームは24バイトのヘッダとJSONペイロードで構成される（数値はリトルエンディアン）
+
+    オフセット  サイズ  内容
+    0          4      マジック "AVON"
+    4          4      シーケンス番号
+    8          2      "QR"
+    10         2      コマンド種別（0x001e: 再生制御, 0x0026: 音量 など）
+    12         2      アクション（0x0409: プログラム切り替え など）
+    14         2      結果コード（送信時は0、応答では0が成功）
+    16         4      ペイロード長
+    20         2      予約
+    22         2      チェックサム
+    24         n      JSONペイロード
+"""
+import binascii
+import json
+import struct
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+MAGIC = b"AVON"
+HEADER = struct.Struct("<4sI2sHHHIHH")
+HEADER_SIZE = HEADER.size
+
+
+@dataclass(frozen=True)
+class CommandResult:
+    """
+    コマンドの実行結果
+
+    真偽値として評価した場合は成功かどうかを返す
+    """
+
+    ok: bool
+    status: Optional[int] = None
+    command: Optional[int] = None
+    action: Optional[int] = None
+    payload: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    retryable: bool = False
+    raw: bytes = field(default=b"", repr=False)
+    # 切り替え先プログラムID（PlaylistController.switch_program()の結果のみ）
+    program: Optional[str] = None
+
+    def __bool__(self) -> bool:
+        return self.ok
+
+    @classmethod
+    def failure(cls, error: str, retryable: bool) -> "CommandResult":
+        """
+        通信エラーなど、応答を解析できなかった場合の結果を生成
+
+        Args:
+            error: エラー種別（"timeout", "connection_error"など）
+            retryable: 再送で回復する可能性がある場合True
+        """
+        return cls(ok=False, error=error, retryable=retryable)
+
+
+@lru_cache(maxsize=128)
+def encode_command(hex_command: str) -> bytes:
+    """
+    16進数文字列のコマンドをバイト列に変換
+
+    同じコマンドは繰り返し送信されるため、変換結果をキャッシュする
+
+    Args:
+        hex_command: 16進数形式のコマンド文字列（空白・改行を含んでもよい）
+
+    Returns:
+        bytes: 送信するバイト列
+
+    Raises:
+        binascii.Error: 16進数として不正な場合
+    """
+    return binascii.unhexlify(hex_command.replace(" ", "").replace("\n", ""))
+
+
+def frame_length(data: bytes) -> Optional[int]:
+    """
+    受信データの先頭にあるフレームの全長を取得
+
+    Args:
+        data: 受信データ
+
+    Returns:
+        Optional[int]: フレーム長（ヘッダが揃っていない、またはプロトコル外の場合はNone）
+    """
+    if len(data) < HEADER_SIZE or not data.startswith(MAGIC):
+        return None
+    return HEADER_SIZE + HEADER.unpack_from(data)[6]
+
+
+def decode_response(data: bytes) -> CommandResult:
+    """
+    応答フレームを解析
+
+    プロトコル外の応答（マジックが無いもの）は、従来どおり
+    「応答があった」ことをもって成功として扱う
+
+    Args:
+        data: 受信データ
+
+    Returns:
+        CommandResult: 解析結果
+    """
+    if not data:
+        return CommandResult(ok=False, error="empty_response", retryable=True, raw=data)
+
+    if not data.startswith(MAGIC):
+        return CommandResult(ok=True, raw=data)
+
+    if len(data) < HEADER_SIZE:
+        return CommandResult(ok=False, error="truncated", retryable=True, raw=data)
+
+    _, _, _, command, action, status, length, _, _ = HEADER.unpack_from(data)
+    body = data[HEADER_SIZE:HEADER_SIZE + length]
+    if len(body) < length:
+        return CommandResult(
+            ok=False, command=command, action=action, status=status,
+            error="truncated", retryable=True, raw=data
+        )
+
+    payload = None
+    if body:
+        try:
+            decoded = json.loads(body.decode("utf-8"))
+            payload = decoded if isinstance(decoded, dict) else {"value": decoded}
+        except (UnicodeDecodeError, ValueError):
+            payload = None
+
+    if status != 0:
+        # 機器が明示的に拒否したコマンドは再送しても結果が変わらない
+        return CommandResult(
+            ok=False, status=status, command=command, action=action,
+            payload=payload, error="rejected", retryable=False, raw=data
+        )
+
+    return CommandResult(
+        ok=True, status=status, command=command, action=action,
+        payload=payload, raw=data
+    )
+
+
+# 再生状態の応答ペイロードで使われるキー（ファームウェアによって表記が異なる）
+_PROGRAM_KEYS = ("program", "programId", "program_id", "id")
+_VOLUME_KEYS = ("ratio", "volume")
+_PLAYING_KEYS = ("playing", "state", "status")
+_PLAYING_VALUES = {"play", "playing", "run", "running", "1", "true"}
+_STOPPED_VALUES = {"pause", "paused", "stop", "stopped", "idle", "0", "false"}
+
+
+def parse_playback_state(payload: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    状態問い合わせ応答のペイロードから再生状態を取り出す
+
+    Args:
+        payload: 応答のJSONペイロード
+
+    Returns:
+        Dict[str, Any]: program（"01"形式）, volume（%）, playing（bool）のうち読み取れたもの
+    """
+    state: Dict[str, Any] = {}
+    if not payload:
+        return state
+
+    for key in _PROGRAM_KEYS:
+        value = payload.get(key)
+        if value is not None:
+            state["program"] = f"{int(value):02d}" if str(value).isdigit() else str(value)
+            break
+
+    for key in _VOLUME_KEYS:
+        value = payload.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            state["volume"] = int(value)
+            break
+
+    for key in _PLAYING_KEYS:
+        value = payload.get(key)
+        if isinstance(value, bool):
+            state["playing"] = value
+            break
+        text = str(value).lower()
+        if text in _PLAYING_VALUES:
+            state["playing"] = True
+            break
+        if text in _STOPPED_VALUES:
+            state["playing"] = False
+            break
+
+    return state
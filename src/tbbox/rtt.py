@@ -0,0 +1,93 @@
+"""
+RTT推定モジュール
+TCPの再送タイムアウト計算（RFC 6298）と同じ方法でレスポンス待ち時間を決める
+"""
+from typing import Dict, Optional
+
+
+class RTTEstimator:
+    """
+    平滑化RTTとその変動からレスポンス待ちのタイムアウトを算出するクラス
+
+    RTO = SRTT + max(G, K * RTTVAR) を最小値・最大値の範囲に制限して使用し、
+    タイムアウトが発生するたびにRTOを2倍にする（次の正常応答で元に戻る）
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(
+        self,
+        initial_timeout: float = 10.0,
+        min_timeout: float = 0.2,
+        max_timeout: float = 10.0,
+        granularity: float = 0.01
+    ):
+        """
+        RTTEstimatorの初期化
+
+        Args:
+            initial_timeout: RTTの計測値が無い間に使用するタイムアウト（秒）
+            min_timeout: タイムアウトの下限（秒）
+            max_timeout: タイムアウトの上限（秒）
+            granularity: 時計の分解能（秒）
+        """
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.granularity = granularity
+
+        self.srtt: Optional[float] = None
+        self.rttvar: Optional[float] = None
+        self.rto = self._clamp(initial_timeout)
+        self.samples = 0
+        self.timeouts = 0
+
+    def _clamp(self, value: float) -> float:
+        """タイムアウトを上下限の範囲に制限"""
+        return max(self.min_timeout, min(self.max_timeout, value))
+
+    def observe(self, rtt: float) -> None:
+        """
+        RTTの計測値を反映
+
+        再送したコマンドの応答は渡さない（最初の送信への遅延応答の可能性があり、
+        RTTを過小に見積もってしまうため。Karnのアルゴリズム）
+
+        Args:
+            rtt: コマンド送信からレスポンス受信までの時間（秒）
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+
+        self.rto = self._clamp(self.srtt + max(self.granularity, self.K * self.rttvar))
+        self.samples += 1
+
+    def on_timeout(self) -> None:
+        """タイムアウト発生時にRTOを2倍にする（指数バックオフ）"""
+        self.rto = self._clamp(self.rto * 2)
+        self.timeouts += 1
+
+    @property
+    def timeout(self) -> float:
+        """現在のレスポンス待ちタイムアウト（秒）"""
+        return self.rto
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        """
+        統計情報を取得
+
+        Returns:
+            Dict[str, Optional[float]]: SRTT・RTTVAR・RTO（秒）と計測回数
+        """
+        return {
+            "srtt": self.srtt,
+            "rttvar": self.rttvar,
+            "rto": self.rto,
+            "samples": self.samples,
+            "timeouts": self.timeouts,
+        }
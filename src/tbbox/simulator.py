@@ -0,0 +1,299 @@
+"""
+TBBOXシミュレータモジュール
+TBBOX実機の代わりにログイン・コマンドに応答する（テスト・ベンチマーク用）
+
+メモリ内トランスポートで直接接続するほか、TCP・Unixドメインソケットで待ち受けて
+main.pyなど別プロセスから接続することもできる
+"""
+import json
+import socket
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+from src.tbbox.protocol import HEADER, HEADER_SIZE, MAGIC, encode_command, frame_length
+from src.tbbox.transport import Handler, MemoryTransport
+from src.utils.logger import logger
+from config import settings
+
+# コマンド種別・アクション（protocol.pyのフレーム構成を参照）
+COMMAND_PLAYBACK = 0x001E
+COMMAND_VOLUME = 0x0026
+ACTION_SWITCH = 0x0409
+ACTION_RESUME = 0x040A
+ACTION_STOP = 0x040B
+ACTION_PAUSE = 0x040C
+
+# 故障の種類
+FAULT_DROP = "drop"              # 応答しない（タイムアウト）
+FAULT_REJECT = "reject"          # 結果コード1で拒否する
+FAULT_DISCONNECT = "disconnect"  # 接続を切断する
+FAULTS = (FAULT_DROP, FAULT_REJECT, FAULT_DISCONNECT)
+
+
+def make_response(
+    command: int,
+    action: int,
+    status: int = 0,
+    payload: Optional[Dict[str, Any]] = None,
+    sequence: int = 0
+) -> bytes:
+    """
+    応答フレームを作成
+
+    Args:
+        command: コマンド種別
+        action: アクション
+        status: 結果コード（0が成功）
+        payload: JSONペイロード
+        sequence: シーケンス番号
+
+    Returns:
+        bytes: 応答フレーム
+    """
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8") if payload else b""
+    return HEADER.pack(MAGIC, sequence, b"QR", command, action, status, len(body), 0, 0) + body
+
+
+class TBBOXSimulator:
+    """
+    TBBOXの動作を模擬するクラス
+
+    接続ごとに最初の受信をログインとして扱い、以降のAVONフレームに応答する
+    プログラム切り替え・再生制御・音量のコマンドは再生状態に反映し、
+    それ以外のコマンドには再生状態のペイロードを返す（状態問い合わせとして扱う）
+    実機と同じく同時に1接続のみ受け付ける
+    """
+
+    def __init__(self, login_command: Optional[str] = None, latency: float = 0.0):
+        """
+        TBBOXSimulatorの初期化
+
+        Args:
+            login_command: 受け付けるログインコマンド（16進数、省略時は設定値）
+            latency: 応答までの遅延（秒）
+        """
+        self.login_bytes = encode_command(login_command or settings.LOGIN_COMMAND)
+        self.latency = latency
+        self.program: Optional[str] = None
+        self.volume: Optional[int] = None
+        self.playing = False
+        self.connections = 0
+        self.logins = 0
+        self.commands = 0
+        # 受信したコマンド（ログインを除く、受信順）
+        self.received: List[bytes] = []
+        self._faults: Deque[str] = deque()
+        self._lock = threading.Lock()
+        self._server: Optional[socket.socket] = None
+        self._unix_path: Optional[Path] = None
+
+    def inject(self, fault: str, count: int = 1) -> None:
+        """
+        次に受信するcount件のコマンドで故障を発生させる
+
+        Args:
+            fault: 故障の種類（"drop" / "reject" / "disconnect"）
+            count: 件数
+        """
+        if fault not in FAULTS:
+            raise ValueError(f"不明な故障の種類です: {fault}")
+        with self._lock:
+            self._faults.extend([fault] * count)
+
+    def state(self) -> Dict[str, Any]:
+        """状態問い合わせに返す再生状態"""
+        return {"program": self.program, "ratio": self.volume, "playing": self.playing}
+
+    def session(self) -> Handler:
+        """
+        1接続分のハンドラを作成
+
+        Returns:
+            Handler: 受信データを受け取り、応答を返す関数
+        """
+        with self._lock:
+            self.connections += 1
+        authenticated = False
+
+        def handle(data: bytes) -> Optional[bytes]:
+            nonlocal authenticated
+            if not authenticated:
+                if data != self.login_bytes:
+                    logger.warning("シミュレータ: ログインコマンドが一致しません")
+                    raise ConnectionResetError("login rejected")
+                authenticated = True
+                with self._lock:
+                    self.logins += 1
+                return b"OK"
+            return self._handle_command(data)
+
+        return handle
+
+    def _handle_command(self, data: bytes) -> Optional[bytes]:
+        """ログイン後のコマンドを処理"""
+        with self._lock:
+            self.commands += 1
+            self.received.append(data)
+            fault = self._faults.popleft() if self._faults else None
+
+            if fault == FAULT_DISCONNECT:
+                raise ConnectionResetError("injected disconnect")
+            if fault == FAULT_DROP:
+                return None
+
+            if frame_length(data) is None:
+                # プロトコル外のコマンドは応答のみ返す
+                return b"OK"
+
+            _, sequence, _, command, action, _, length, _, _ = HEADER.unpack_from(data)
+            if fault == FAULT_REJECT:
+                return make_response(command, action, status=1, sequence=sequence)
+
+            body = data[HEADER_SIZE:HEADER_SIZE + length]
+            try:
+                payload = json.loads(body.decode("utf-8")) if body else {}
+            except (UnicodeDecodeError, ValueError):
+                payload = {}
+
+            if command == COMMAND_PLAYBACK and action == ACTION_SWITCH:
+                self.program = str(payload.get("name"))
+                self.playing = True
+            elif command == COMMAND_PLAYBACK and action == ACTION_RESUME:
+                self.playing = True
+            elif command == COMMAND_PLAYBACK and action in (ACTION_PAUSE, ACTION_STOP):
+                self.playing = False
+            elif command == COMMAND_VOLUME:
+                self.volume = payload.get("ratio", self.volume)
+            else:
+                return make_response(command, action, payload=self.state(), sequence=sequence)
+
+            return make_response(command, action, sequence=sequence)
+
+    def transport(self) -> MemoryTransport:
+        """このシミュレータに接続するメモリ内トランスポートを作成"""
+        return MemoryTransport(self.session, latency=self.latency)
+
+    def serve_tcp(self, host: str = "127.0.0.1", port: int = 0) -> Tuple[str, int]:
+        """
+        TCPで待ち受けを開始
+
+        Args:
+            host: 待ち受けるアドレス
+            port: 待ち受けるポート番号（0の場合は空いているポート）
+
+        Returns:
+            Tuple[str, int]: 待ち受けているアドレスとポート番号
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, port))
+        self._listen(server)
+        return server.getsockname()[:2]
+
+    def serve_unix(self, path: Union[str, Path]) -> Path:
+        """
+        Unixドメインソケットで待ち受けを開始
+
+        Args:
+            path: ソケットファイルのパス（既存のファイルは削除する）
+
+        Returns:
+            Path: ソケットファイルのパス
+        """
+        path = Path(path)
+        if path.exists():
+            path.unlink()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(path))
+        self._unix_path = path
+        self._listen(server)
+        return path
+
+    def _listen(self, server: socket.socket) -> None:
+        """待ち受けスレッドを開始"""
+        server.listen(1)
+        self._server = server
+        threading.Thread(target=self._accept_loop, args=(server,), daemon=True,
+                         name="tbbox-simulator").start()
+
+    def _accept_loop(self, server: socket.socket) -> None:
+        """接続を1つずつ受け付けて処理"""
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with conn:
+                self._serve_connection(conn)
+
+    def _serve_connection(self, conn: socket.socket) -> None:
+        """1接続分の送受信（受信データをフレーム単位に分割して処理）"""
+        handle = self.session()
+        buffer = b""
+        while True:
+            try:
+                data = conn.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            while buffer:
+                length = frame_length(buffer)
+                if buffer.startswith(MAGIC) and length is None:
+                    break  # ヘッダの続きを待つ
+                if length is not None and len(buffer) < length:
+                    break  # ペイロードの続きを待つ
+                message, buffer = (buffer[:length], buffer[length:]) if length else (buffer, b"")
+                try:
+                    reply = handle(message)
+                except ConnectionError:
+                    return
+                if reply:
+                    if self.latency:
+                        time.sleep(self.latency)
+                    try:
+                        conn.sendall(reply)
+                    except OSError:
+                        return
+
+    def stop(self) -> None:
+        """待ち受けを終了"""
+        if self._server:
+            self._server.close()
+            self._server = None
+        if self._unix_path and self._unix_path.exists():
+            self._unix_path.unlink()
+            self._unix_path = None
+
+
+def main() -> None:
+    """シミュレータを単独で起動（main.pyをシミュレータに接続して動作確認する場合に使用）"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="TBBOXシミュレータ")
+    parser.add_argument("--host", default="127.0.0.1", help="待ち受けるアドレス")
+    parser.add_argument("--port", type=int, default=settings.TBBOX_PORT, help="待ち受けるポート番号")
+    parser.add_argument("--unix", help="TCPの代わりに待ち受けるUnixドメインソケットのパス")
+    parser.add_argument("--latency", type=float, default=0.0, help="応答までの遅延（秒）")
+    args = parser.parse_args()
+
+    simulator = TBBOXSimulator(latency=args.latency)
+    if args.unix:
+        address = simulator.serve_unix(args.unix)
+    else:
+        address = "%s:%d" % simulator.serve_tcp(args.host, args.port)
+    logger.info(f"TBBOXシミュレータを起動しました: {address}（終了するにはCtrl+C）")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
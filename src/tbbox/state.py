@@ -0,0 +1,227 @@
+"""
+TBBOXデバイス状態スナップショット
+現在のプログラム・音量・再生状態・接続状態・最終切り替え時刻をメモリ上に保持する
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+
+class DeviceStateSnapshot:
+    """
+    デバイス状態のスナップショット
+
+    状態問い合わせ（すべて9のalert）に即座に応答できるよう、
+    状態が変化したときだけJSONを再シリアライズしてバイト列を保持する
+
+    再生状態（program, volume, playing）は、TBBOXへの問い合わせ結果（state_source="device"）
+    または自分が送信したコマンドからの推定（state_source="local"）のどちらかで更新される
+    """
+
+    # 状態問い合わせレスポンスの固定フィールド
+    RESPONSE_BASE = {"status": "ok", "message": "No action (all 9s)"}
+
+    # 保存・復元するフィールド（接続状態は起動後の接続結果で決まるため含めない）
+    PERSISTED_FIELDS = (
+        "program", "volume", "playing", "last_switch_at", "state_source", "state_updated_at"
+    )
+
+    def __init__(self):
+        """DeviceStateSnapshotの初期化"""
+        self._lock = threading.Lock()
+        self._state: Dict[str, Any] = {
+            "program": None,
+            "volume": None,
+            "playing": None,
+            "connected": False,
+            "last_switch_at": None,
+            "state_source": None,
+            "state_updated_at": None,
+        }
+        self._encoded = self._encode(self._state)
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        """
+        状態が変化したときに呼び出す関数を登録
+
+        Args:
+            listener: 変化後の状態を受け取る関数（状態を更新したスレッドで呼ばれる）
+        """
+        self._listeners.append(listener)
+
+    @classmethod
+    def _encode(cls, state: Dict[str, Any]) -> bytes:
+        """レスポンス用のJSONバイト列を生成"""
+        body = dict(cls.RESPONSE_BASE)
+        body.update(state)
+        return json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def update(self, **fields: Any) -> bool:
+        """
+        状態を更新
+
+        値が変化した場合のみJSONを再生成する
+
+        Args:
+            **fields: 更新するフィールド（program, volume, playing, connected など）
+
+        Returns:
+            bool: 状態が変化した場合True
+        """
+        with self._lock:
+            changed = {
+                key: value for key, value in fields.items()
+                if self._state.get(key) != value
+            }
+            if not changed:
+                return False
+            state = dict(self._state)
+            state.update(changed)
+            self._encoded = self._encode(state)
+            self._state = state
+        for listener in self._listeners:
+            listener(state)
+        return True
+
+    def record_switch(self, program_id: str, timestamp: Optional[float] = None) -> None:
+        """
+        プログラム切り替えの成功を記録
+
+        Args:
+            program_id: 切り替え先プログラムID
+            timestamp: 切り替え時刻（UNIX時間、省略時は現在時刻）
+        """
+        timestamp = timestamp if timestamp is not None else time.time()
+        self.update(
+            program=program_id,
+            playing=True,
+            last_switch_at=timestamp,
+            state_source="local",
+            state_updated_at=timestamp
+        )
+
+    def record_playback(
+        self,
+        source: str = "local",
+        timestamp: Optional[float] = None,
+        **fields: Any
+    ) -> None:
+        """
+        再生状態を記録
+
+        Args:
+            source: "device"（TBBOXから読み取った値）または "local"（送信したコマンドからの推定）
+            timestamp: 状態を取得した時刻（UNIX時間、省略時は現在時刻）
+            **fields: 再生状態（program, volume, playing）。Noneの値は更新しない
+        """
+        state = {key: value for key, value in fields.items() if value is not None}
+        state["state_source"] = source
+        state["state_updated_at"] = timestamp if timestamp is not None else time.time()
+        self.update(**state)
+
+    def is_fresh(self, ttl: float, now: Optional[float] = None) -> bool:
+        """
+        TBBOXから読み取った再生状態が有効期間内かどうか
+
+        Args:
+            ttl: 有効期間（秒）
+            now: 現在時刻（UNIX時間、省略時は現在時刻）
+
+        Returns:
+            bool: 最後の更新がTBBOXからの読み取りで、ttl秒以内の場合True
+        """
+        state = self._state
+        if state["state_source"] != "device" or state["state_updated_at"] is None:
+            return False
+        now = now if now is not None else time.time()
+        return now - state["state_updated_at"] <= ttl
+
+    def is_playing(self, program_id: str, ttl: float) -> bool:
+        """
+        指定プログラムを再生中であることをTBBOXの状態で確認できるかどうか
+
+        Args:
+            program_id: プログラムID
+            ttl: TBBOXから読み取った状態の有効期間（秒）
+
+        Returns:
+            bool: 有効期間内の状態で、そのプログラムを再生中の場合True
+        """
+        state = self._state
+        return (
+            self.is_fresh(ttl)
+            and state["program"] == program_id
+            and state["playing"] is True
+        )
+
+    def set_connected(self, connected: bool) -> None:
+        """
+        接続状態を更新
+
+        Args:
+            connected: ログイン済みで通信可能な場合True
+        """
+        self.update(connected=connected)
+
+    def get(self) -> Dict[str, Any]:
+        """
+        現在の状態を取得
+
+        Returns:
+            Dict[str, Any]: 状態のコピー
+        """
+        return dict(self._state)
+
+    def to_bytes(self) -> bytes:
+        """
+        状態問い合わせレスポンスのJSONバイト列を取得
+
+        Returns:
+            bytes: シリアライズ済みのレスポンスボディ
+        """
+        return self._encoded
+
+    def save(self, path: Union[str, Path]) -> None:
+        """
+        状態をJSONファイルに保存（一時ファイルに書き込んでから置き換える）
+
+        Args:
+            path: 保存先のパス
+        """
+        path = Path(path)
+        state = self._state
+        data = {key: state[key] for key in self.PERSISTED_FIELDS}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(path.name + ".tmp")
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    def load(self, path: Union[str, Path]) -> bool:
+        """
+        save()で保存した状態を復元
+
+        TBBOXから読み取った状態は保存時の時刻のまま復元するため、
+        有効期間（is_fresh）は再起動にかかった時間を含めて判定される
+
+        Args:
+            path: 保存先のパス
+
+        Returns:
+            bool: 復元した場合True（ファイルが無い・形式が不正な場合はFalse）
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not isinstance(data, dict):
+            return False
+        self.update(**{key: data[key] for key in self.PERSISTED_FIELDS if key in data})
+        return True
@@ -0,0 +1,116 @@
+"""
+TBBOX接続監視モジュール
+切断時の再接続と再生状態の定期的な問い合わせをバックグラウンドで行う
+"""
+import threading
+from typing import TYPE_CHECKING, Dict, Optional
+
+from src.utils.deadline import Deadline, DeadlineExceeded
+from src.utils.logger import logger
+
+if TYPE_CHECKING:
+    from src.tbbox.playlist import PlaylistController
+
+
+class ConnectionSupervisor:
+    """
+    TBBOXとの接続を監視するクラス
+
+    一定間隔で接続を確認し、切断されていれば再接続する
+    接続中は再生状態を問い合わせてDeviceStateSnapshotを更新するため、
+    アラートごとにTBBOXへ問い合わせる必要がない
+    """
+
+    def __init__(self, controller: "PlaylistController", interval: float = 15.0):
+        """
+        ConnectionSupervisorの初期化
+
+        Args:
+            controller: 監視対象のPlaylistController
+            interval: 監視間隔（秒）
+        """
+        self.controller = controller
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.reconnects = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def start(self) -> None:
+        """監視スレッドを開始"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="tbbox-supervisor",
+            daemon=True
+        )
+        self._thread.start()
+        logger.info(f"TBBOX接続監視を開始しました (間隔: {self.interval}秒)")
+
+    def stop(self) -> None:
+        """監視スレッドを停止"""
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.interval + 1)
+        self._thread = None
+
+    def _run(self) -> None:
+        """監視ループ"""
+        while not self._stop.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"TBBOX接続監視中にエラーが発生しました: {e}")
+
+    def tick(self) -> None:
+        """
+        接続確認と再生状態の更新を1回行う
+
+        監視処理が次の周期にはみ出さないよう、監視間隔を期限として処理する
+        """
+        client = self.controller.client
+        deadline = Deadline(self.interval)
+
+        if not client.is_authenticated:
+            try:
+                connected = client.ensure_connected(deadline)
+            except DeadlineExceeded:
+                connected = False
+            if connected is None:
+                # コマンド送信中（送信側で再接続される）
+                return
+            if not connected:
+                logger.warning("TBBOXへの再接続に失敗しました。次の監視周期で再試行します")
+                return
+            self.reconnects += 1
+
+        if not self.controller.status_command:
+            return
+
+        try:
+            state = self.controller.query_playback_state(deadline)
+        except DeadlineExceeded:
+            state = None
+        if state is None:
+            self.refresh_failures += 1
+        else:
+            self.refreshes += 1
+
+    def stats(self) -> Dict[str, float]:
+        """
+        統計情報を取得
+
+        Returns:
+            Dict[str, float]: 再接続回数・再生状態の更新回数
+        """
+        return {
+            "interval": self.interval,
+            "reconnects": self.reconnects,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+        }
@@ -0,0 +1,303 @@
+"""
+トランスポートモジュール
+TBBOXクライアントの接続方法（TCP・Unixドメインソケット・メモリ内）を切り替える
+
+トランスポートはopen()で接続済みの「ソケット互換オブジェクト」を返す
+クライアントが使用するのは send / recv / settimeout / setblocking / close のみで、
+socket.socketはそのままこの条件を満たす
+"""
+import socket
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Optional, Tuple
+
+from config import settings
+
+# メモリ内接続のハンドラ: 受信データを受け取り、応答（None: 応答なし）を返す
+# ConnectionErrorを送出すると、相手側から切断されたものとして扱う
+Handler = Callable[[bytes], Optional[bytes]]
+
+
+class Transport:
+    """トランスポートの基底クラス"""
+
+    @property
+    def label(self) -> str:
+        """ログに表示する接続先"""
+        raise NotImplementedError
+
+    def open(self, timeout: Optional[float]):
+        """
+        接続を確立
+
+        Args:
+            timeout: 接続のタイムアウト（秒）
+
+        Returns:
+            ソケット互換オブジェクト（送受信のタイムアウトもtimeoutに設定済み）
+
+        Raises:
+            OSError: 接続できなかった場合（タイムアウトはsocket.timeout）
+        """
+        raise NotImplementedError
+
+
+class TCPTransport(Transport):
+    """
+    TCP接続（TBBOX実機への接続）
+
+    コマンドは小さな要求・応答の繰り返しのため、既定でNagleアルゴリズムを無効にする
+    キープアライブを有効にすると、TBBOXの電源断など無通信のまま切れた接続を検知できる
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        nodelay: bool = True,
+        keepalive: bool = False,
+        keepalive_idle: Optional[int] = None,
+        keepalive_interval: Optional[int] = None,
+        keepalive_count: Optional[int] = None
+    ):
+        """
+        TCPTransportの初期化
+
+        Args:
+            host: 接続先のIPアドレス
+            port: 接続先のポート番号
+            nodelay: TCP_NODELAYを設定するかどうか
+            keepalive: SO_KEEPALIVEを設定するかどうか
+            keepalive_idle: キープアライブを開始するまでの無通信時間（秒、省略時はOSの設定）
+            keepalive_interval: キープアライブの送信間隔（秒、省略時はOSの設定）
+            keepalive_count: 切断と判定するまでの無応答回数（省略時はOSの設定）
+        """
+        self.host = host
+        self.port = port
+        self.nodelay = nodelay
+        self.keepalive = keepalive
+        self.keepalive_idle = keepalive_idle
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+
+    @property
+    def label(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def open(self, timeout: Optional[float]) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(timeout)
+            sock.connect((self.host, self.port))
+            self._apply_options(sock)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    def _apply_options(self, sock: socket.socket) -> None:
+        """ソケットオプションを設定（OSが対応していないオプションは無視する）"""
+        if self.nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if not self.keepalive:
+            return
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for name, value in (
+            ("TCP_KEEPIDLE", self.keepalive_idle),
+            ("TCP_KEEPINTVL", self.keepalive_interval),
+            ("TCP_KEEPCNT", self.keepalive_count),
+        ):
+            if value is not None and hasattr(socket, name):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+
+class UnixTransport(Transport):
+    """Unixドメインソケット接続（同じ機器上のシミュレータ・中継プロセスへの接続）"""
+
+    def __init__(self, path: str):
+        """
+        UnixTransportの初期化
+
+        Args:
+            path: ソケットファイルのパス
+        """
+        self.path = str(path)
+
+    @property
+    def label(self) -> str:
+        return f"unix:{self.path}"
+
+    def open(self, timeout: Optional[float]) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(self.path)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+
+class MemoryConnection:
+    """
+    メモリ内のソケット互換オブジェクト
+
+    send()で渡したデータをその場でハンドラに渡し、応答を受信バッファに積む
+    応答にはlatency秒の遅延を付けられ、遅延がタイムアウトより長い場合は
+    実際のソケットと同じくsocket.timeoutとなり、応答は遅れて届く
+    """
+
+    def __init__(self, handler: Handler, latency: float = 0.0):
+        """
+        MemoryConnectionの初期化
+
+        Args:
+            handler: 受信データを処理するハンドラ
+            latency: 応答が届くまでの遅延（秒）
+        """
+        self._handler = handler
+        self.latency = latency
+        # (受信可能になる時刻, データ)
+        self._chunks: Deque[Tuple[float, bytes]] = deque()
+        self._cond = threading.Condition()
+        self._timeout: Optional[float] = None
+        self._closed = False
+        self._peer_closed = False
+
+    def settimeout(self, timeout: Optional[float]) -> None:
+        self._timeout = timeout
+
+    def setblocking(self, flag: bool) -> None:
+        self._timeout = None if flag else 0.0
+
+    def gettimeout(self) -> Optional[float]:
+        return self._timeout
+
+    def send(self, data: bytes) -> int:
+        if self._closed:
+            raise OSError("接続はクローズされています")
+        if self._peer_closed:
+            raise BrokenPipeError("相手側から切断されています")
+
+        try:
+            reply = self._handler(bytes(data))
+        except ConnectionError:
+            self.close_peer()
+            raise ConnectionResetError("相手側から切断されました")
+
+        if reply:
+            self.deliver(reply, self.latency)
+        return len(data)
+
+    sendall = send
+
+    def deliver(self, data: bytes, delay: float = 0.0) -> None:
+        """
+        受信バッファにデータを積む（相手側からの送信）
+
+        Args:
+            data: 受信データ
+            delay: 受信可能になるまでの時間（秒）
+        """
+        with self._cond:
+            self._chunks.append((time.monotonic() + delay, bytes(data)))
+            self._cond.notify_all()
+
+    def close_peer(self) -> None:
+        """相手側から切断する（受信バッファを読み終えると空のデータを返す）"""
+        with self._cond:
+            self._peer_closed = True
+            self._cond.notify_all()
+
+    def recv(self, bufsize: int) -> bytes:
+        timeout = self._timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise OSError("接続はクローズされています")
+
+                now = time.monotonic()
+                if self._chunks and self._chunks[0][0] <= now:
+                    due, data = self._chunks.popleft()
+                    if len(data) > bufsize:
+                        self._chunks.appendleft((due, data[bufsize:]))
+                        data = data[:bufsize]
+                    return data
+                if not self._chunks and self._peer_closed:
+                    return b""
+                if timeout == 0.0:
+                    raise BlockingIOError("受信データがありません")
+
+                wait = self._chunks[0][0] - now if self._chunks else None
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise socket.timeout("timed out")
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(wait)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class MemoryTransport(Transport):
+    """
+    メモリ内接続（テスト・ベンチマーク用）
+
+    カーネルのネットワーク処理を介さずにハンドラと直接やり取りする
+    接続ごとに状態を持てるよう、open()のたびにhandler_factory()で新しいハンドラを作る
+    """
+
+    def __init__(self, handler_factory: Callable[[], Handler], latency: float = 0.0):
+        """
+        MemoryTransportの初期化
+
+        Args:
+            handler_factory: 接続ごとのハンドラを作成する関数
+            latency: 応答が届くまでの遅延（秒）
+        """
+        self.handler_factory = handler_factory
+        self.latency = latency
+        self.connections = 0
+        self.connection: Optional[MemoryConnection] = None
+
+    @property
+    def label(self) -> str:
+        return "memory"
+
+    def open(self, timeout: Optional[float]) -> MemoryConnection:
+        connection = MemoryConnection(self.handler_factory(), self.latency)
+        connection.settimeout(timeout)
+        self.connections += 1
+        self.connection = connection
+        return connection
+
+
+def create_transport(host: str, port: int) -> Transport:
+    """
+    設定に従ってトランスポートを作成
+
+    TBBOX_UNIX_SOCKETが設定されている場合はUnixドメインソケットで接続し、
+    それ以外の場合はTCPオプションを設定したTCP接続を使用する
+
+    Args:
+        host: TBBOXのIPアドレス
+        port: TBBOXのポート番号
+
+    Returns:
+        Transport: トランスポート
+    """
+    if settings.TBBOX_UNIX_SOCKET:
+        return UnixTransport(settings.TBBOX_UNIX_SOCKET)
+    return TCPTransport(
+        host,
+        port,
+        nodelay=settings.TBBOX_TCP_NODELAY,
+        keepalive=settings.TBBOX_TCP_KEEPALIVE,
+        keepalive_idle=settings.TBBOX_TCP_KEEPALIVE_IDLE or None,
+    )
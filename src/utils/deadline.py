@@ -0,0 +1,106 @@
+"""
+デッドラインモジュール
+HTTPリクエストの期限をTBBOXとの通信（キュー待ち・再接続・送受信・再送）まで伝播する
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+
+class DeadlineExceeded(Exception):
+    """デッドラインを過ぎたため処理を中断したことを表す例外"""
+
+    def __init__(self, stage: str):
+        """
+        Args:
+            stage: 中断した処理段階（"queue", "connect", "send"など）
+        """
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    処理の期限
+
+    time.monotonic()基準の期限時刻を保持する
+    """
+
+    __slots__ = ("expires_at",)
+
+    def __init__(self, timeout: float):
+        """
+        Deadlineの初期化
+
+        Args:
+            timeout: 現在からの猶予時間（秒）
+        """
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        """
+        残り時間を取得
+
+        Returns:
+            float: 残り時間（秒、期限切れの場合は0）
+        """
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        """期限を過ぎている場合True"""
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage: str) -> None:
+        """
+        期限を過ぎていれば例外を送出
+
+        Args:
+            stage: 現在の処理段階（例外メッセージ用）
+
+        Raises:
+            DeadlineExceeded: 期限を過ぎている場合
+        """
+        if self.expired:
+            raise DeadlineExceeded(stage)
+
+    def clamp(self, timeout: float) -> float:
+        """
+        タイムアウトを残り時間以内に制限
+
+        Args:
+            timeout: 元のタイムアウト（秒）
+
+        Returns:
+            float: min(timeout, 残り時間)
+        """
+        return min(timeout, self.remaining())
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """
+    処理中のリクエストのデッドラインを取得
+
+    Returns:
+        Optional[Deadline]: デッドライン（設定されていない場合はNone）
+    """
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """
+    ブロック内で参照されるデッドラインを設定
+
+    Args:
+        deadline: 設定するデッドライン（Noneの場合は期限なし）
+    """
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
@@ -0,0 +1,191 @@
+"""
+イベント配信モジュール
+alert受信・プログラム切り替え・TBBOXとの接続状態の変化・エラーを、
+Server-Sent Events（/api/events）の購読者に配信する
+
+配信は切り替えを行ったスレッドから呼ばれるため、購読者ごとの上限付きバッファに追加するだけで戻る
+バッファが一杯の場合は古いイベントから捨てるため、読み取りの遅い購読者が切り替えを遅らせることはない
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from src.utils.logger import logger
+
+# 配信するイベントの種別
+KINDS = ("alert", "switch", "connection", "error")
+
+
+class TooManySubscribers(Exception):
+    """購読者数が上限に達している"""
+
+
+class Subscription:
+    """
+    1つの購読者（SSEの接続）
+
+    イベントは任意のスレッドから追加され、購読者のイベントループで読み取られる
+    """
+
+    __slots__ = ("_events", "_loop", "_wakeup", "_notified", "dropped")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, buffer_size: int):
+        """
+        Subscriptionの初期化
+
+        Args:
+            loop: 購読者のイベントループ
+            buffer_size: 未読のイベントを保持する最大数（超えた場合は古いものから捨てる）
+        """
+        self._events: Deque[bytes] = deque(maxlen=buffer_size)
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        # 起床を依頼済みの場合True（連続したイベントで何度も起床させない）
+        self._notified = False
+        self.dropped = 0
+
+    def push(self, frame: bytes) -> None:
+        """イベントを追加（任意のスレッドから呼ばれる、待たない）"""
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+        self._events.append(frame)
+        if not self._notified:
+            self._notified = True
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                # 購読者のイベントループが終了済み
+                pass
+
+    async def get(self, timeout: float) -> List[bytes]:
+        """
+        未読のイベントをすべて取得
+
+        Args:
+            timeout: イベントが無い場合に待つ時間（秒）
+
+        Returns:
+            List[bytes]: 追加順のSSEフレーム（timeout秒以内に届かなかった場合は空）
+        """
+        if not self._events:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._wakeup.clear()
+        self._notified = False
+        frames = []
+        while self._events:
+            frames.append(self._events.popleft())
+        return frames
+
+
+class EventBus:
+    """
+    イベントを購読者に配信する
+
+    購読者のリストは購読・解除のたびに作り直すため、配信時にロックを取らない
+    """
+
+    def __init__(self, buffer_size: int = 256, max_subscribers: int = 32):
+        """
+        EventBusの初期化
+
+        Args:
+            buffer_size: 購読者ごとに保持する未読イベントの最大数
+            max_subscribers: 同時に購読できる最大数
+        """
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self._subscribers: Tuple[Subscription, ...] = ()
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self._ids = itertools.count(1)
+        self.published = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        """購読者数"""
+        return len(self._subscribers)
+
+    def add_listener(self, listener: Callable[[str, Dict[str, Any]], None]) -> None:
+        """
+        イベントを受け取る関数を登録（ブローカーからワーカーへの転送用）
+
+        Args:
+            listener: listener(種別, 内容) の形式（publish()を呼んだスレッドで呼ばれる）
+        """
+        self._listeners.append(listener)
+
+    def publish(self, kind: str, **data: Any) -> None:
+        """
+        イベントを配信
+
+        購読者もリスナーもいない場合は何もしない
+
+        Args:
+            kind: 種別（KINDS）
+            **data: イベントの内容（JSONに変換できる値、tsを省略した場合は現在時刻）
+        """
+        subscribers = self._subscribers
+        if not subscribers and not self._listeners:
+            return
+        data.setdefault("ts", time.time())
+        self.published += 1
+        for listener in self._listeners:
+            try:
+                listener(kind, data)
+            except Exception as e:
+                logger.error(f"イベントリスナーでエラーが発生しました: {e}")
+        if subscribers:
+            frame = format_event(next(self._ids), kind, data)
+            for subscription in subscribers:
+                subscription.push(frame)
+
+    def subscribe(self) -> Subscription:
+        """
+        購読を開始（購読者のイベントループ内で呼ぶ）
+
+        Returns:
+            Subscription: 購読
+
+        Raises:
+            TooManySubscribers: 購読者数が上限に達している場合
+        """
+        if len(self._subscribers) >= self.max_subscribers:
+            raise TooManySubscribers()
+        subscription = Subscription(asyncio.get_running_loop(), self.buffer_size)
+        self._subscribers = self._subscribers + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """購読を終了"""
+        self._subscribers = tuple(s for s in self._subscribers if s is not subscription)
+
+    def stats(self) -> Dict[str, int]:
+        """配信状況（/api/metrics用）"""
+        subscribers = self._subscribers
+        return {
+            "subscribers": len(subscribers),
+            "published": self.published,
+            "dropped": sum(s.dropped for s in subscribers),
+        }
+
+
+def format_event(event_id: Optional[int], kind: str, data: Dict[str, Any]) -> bytes:
+    """
+    Server-Sent Eventsのフレームを生成
+
+    Args:
+        event_id: イベントID（Noneの場合は出力しない）
+        kind: イベント名
+        data: 内容（1行のJSONとして出力する）
+
+    Returns:
+        bytes: 例 b'id: 1\\nevent: switch\\ndata: {"program":"11"}\\n\\n'
+    """
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {kind}\ndata: {body}\n\n".encode("utf-8")
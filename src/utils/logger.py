@@ -6,6 +6,7 @@ import logging
 import sys
 from pathlib import Path
 from config import settings
+from src.utils.trace import RequestIdFilter
 
 
 def setup_logger(name: str = "tbbox_switcher", level: int = logging.INFO) -> logging.Logger:
@@ -32,8 +33,10 @@ def setup_logger(name: str = "tbbox_switcher", level: int = logging.INFO) -> log
     console_handler.setLevel(level)
 
     # フォーマッターを作成
+    # HTTPリクエストの処理中に出力したログにはリクエストIDを付与する
+    console_handler.addFilter(RequestIdFilter())
     formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        '%(asctime)s - %(name)s - %(levelname)s - %(request_tag)s%(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
     console_handler.setFormatter(formatter)
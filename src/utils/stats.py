@@ -0,0 +1,53 @@
+"""
+統計モジュール
+計測値の分布（パーセンタイル）を集計する（診断・ベンチマーク用）
+"""
+import math
+from typing import Dict, Optional, Sequence
+
+# 分布として表示するパーセンタイル
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(samples: Sequence[float], q: float) -> Optional[float]:
+    """
+    パーセンタイルを計算（線形補間）
+
+    Args:
+        samples: 計測値
+        q: パーセンタイル（0～100）
+
+    Returns:
+        Optional[float]: パーセンタイル値（計測値が無い場合はNone）
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    position = (len(ordered) - 1) * q / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(samples: Sequence[float]) -> Dict[str, Optional[float]]:
+    """
+    計測値（秒）の分布をミリ秒で集計
+
+    Args:
+        samples: 計測値（秒）
+
+    Returns:
+        Dict[str, Optional[float]]: 件数・最小・平均・パーセンタイル・最大（ミリ秒）
+    """
+    summary: Dict[str, Optional[float]] = {"count": len(samples)}
+    if not samples:
+        summary.update({"min": None, "mean": None, "max": None})
+        summary.update({f"p{q}": None for q in PERCENTILES})
+        return summary
+
+    summary["min"] = min(samples) * 1000
+    summary["mean"] = sum(samples) / len(samples) * 1000
+    for q in PERCENTILES:
+        summary[f"p{q}"] = percentile(samples, q) * 1000
+    summary["max"] = max(samples) * 1000
+    return summary
@@ -0,0 +1,74 @@
+"""
+systemd連携モジュール
+ソケットアクティベーションで渡された待ち受けソケットの取得と、起動・終了の通知（sd_notify）を行う
+
+systemdが待ち受けソケットを保持するため、サービスの再起動中に届いた接続は
+カーネルのキューで待たされ、新しいプロセスが起動した時点で処理される
+"""
+import os
+import socket
+from typing import List
+
+from src.utils.logger import logger
+
+# systemdが渡す最初のファイルディスクリプタ番号（SD_LISTEN_FDS_START）
+LISTEN_FDS_START = 3
+
+
+def listen_sockets(unset_environment: bool = True) -> List[socket.socket]:
+    """
+    ソケットアクティベーションで渡された待ち受けソケットを取得
+
+    LISTEN_PIDが自プロセスでない場合（親プロセス向けの値が残っている場合）は無視する
+
+    Args:
+        unset_environment: 子プロセスに引き継がないよう、LISTEN_PID・LISTEN_FDS・LISTEN_FDNAMESを削除する
+
+    Returns:
+        List[socket.socket]: 渡されたソケット（ソケットアクティベーションでない場合は空）
+    """
+    try:
+        pid = int(os.environ.get("LISTEN_PID", ""))
+        count = int(os.environ.get("LISTEN_FDS", ""))
+    except ValueError:
+        return []
+    finally:
+        if unset_environment:
+            for name in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+                os.environ.pop(name, None)
+
+    if pid != os.getpid() or count <= 0:
+        return []
+
+    sockets = []
+    for fd in range(LISTEN_FDS_START, LISTEN_FDS_START + count):
+        os.set_inheritable(fd, False)
+        sockets.append(socket.socket(fileno=fd))
+    logger.info(f"systemdから待ち受けソケットを{count}個受け取りました")
+    return sockets
+
+
+def notify(state: str) -> bool:
+    """
+    systemdにサービスの状態を通知（Type=notifyのサービス用）
+
+    Args:
+        state: 通知内容（"READY=1", "STOPPING=1" など）
+
+    Returns:
+        bool: 通知した場合True（NOTIFY_SOCKETが無い場合・送信に失敗した場合はFalse）
+    """
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return False
+    # "@"で始まるものは抽象名前空間のソケット
+    if address.startswith("@"):
+        address = "\0" + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode())
+        return True
+    except OSError as e:
+        logger.warning(f"systemdへの通知に失敗しました: {e}")
+        return False
@@ -0,0 +1,150 @@
+"""
+リクエストトレースモジュール
+/api/control の処理段階ごとの所要時間とリクエストIDを、TBBOXとの通信（スレッドプール）まで伝播する
+
+所要時間はServer-Timingヘッダとして返し、リクエストIDはX-Request-IDヘッダとすべてのログ行に出力する
+"""
+import logging
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Tuple
+
+# 受け付けるX-Request-IDの形式（ログ・ヘッダに埋め込むため英数字と一部の記号のみ）
+_REQUEST_ID = re.compile(r"[A-Za-z0-9._:-]{1,64}")
+
+# Server-Timingに出力する処理段階（出力順）
+STAGES = ("validate", "ratelimit", "map", "ipc", "queue", "connect", "tbbox", "retry")
+
+
+def new_request_id() -> str:
+    """リクエストIDを生成（UUID4の16進数32文字）"""
+    return uuid.uuid4().hex
+
+
+class RequestTrace:
+    """
+    1件のリクエストの処理段階ごとの所要時間
+
+    同じ段階を複数回記録した場合は合計する（再送時のTBBOXとの通信など）
+    """
+
+    __slots__ = ("request_id", "started", "durations", "retries")
+
+    def __init__(self, request_id: Optional[str] = None):
+        """
+        RequestTraceの初期化
+
+        Args:
+            request_id: 送信元から受け取ったリクエストID（形式が不正・省略時は生成する）
+        """
+        if not request_id or not _REQUEST_ID.fullmatch(request_id):
+            request_id = new_request_id()
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+        self.retries = 0
+
+    def add(self, stage: str, seconds: float) -> None:
+        """
+        処理段階の所要時間を加算
+
+        Args:
+            stage: 処理段階（STAGES）
+            seconds: 所要時間（秒）
+        """
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """ブロックの所要時間を処理段階に加算"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def server_timing(self) -> str:
+        """
+        Server-Timingヘッダの値
+
+        記録された段階と全体（total）の所要時間をミリ秒で出力する
+        再送した場合はretryのdescに再送回数を出力する
+
+        Returns:
+            str: 例 'validate;dur=0.04, tbbox;dur=12.5, total;dur=13.1'
+        """
+        entries = []
+        for stage in STAGES:
+            seconds = self.durations.get(stage)
+            if seconds is None and not (stage == "retry" and self.retries):
+                continue
+            entry = f"{stage};dur={(seconds or 0.0) * 1000:.2f}"
+            if stage == "retry":
+                entry += f';desc="{self.retries}"'
+            entries.append(entry)
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(entries)
+
+    def headers(self) -> Tuple[Tuple[str, str], ...]:
+        """レスポンスに追加するヘッダ（Server-Timing, X-Request-ID）"""
+        return (("Server-Timing", self.server_timing()), ("X-Request-ID", self.request_id))
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    """
+    処理中のリクエストのトレースを取得
+
+    Returns:
+        Optional[RequestTrace]: トレース（リクエストの処理中でない場合はNone）
+    """
+    return _current_trace.get()
+
+
+@contextmanager
+def trace_scope(trace: Optional[RequestTrace]) -> Iterator[Optional[RequestTrace]]:
+    """
+    ブロック内で参照されるトレースを設定
+
+    Args:
+        trace: 設定するトレース
+    """
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def traced(stage: str) -> Iterator[None]:
+    """
+    処理中のリクエストがあれば、ブロックの所要時間を処理段階に加算
+
+    Args:
+        stage: 処理段階（STAGES）
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(stage):
+        yield
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    ログレコードにリクエストIDを付与するフィルタ
+
+    record.request_tag に "[リクエストID] "（リクエストの処理中でない場合は空文字列）を設定する
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace = _current_trace.get()
+        record.request_tag = f"[{trace.request_id}] " if trace is not None else ""
+        return True
@@ -1,88 +1,514 @@
 #!/usr/bin/env python3
 """
-プログラム直接切り替えスクリプト
+TBBOX操作コマンドラインツール
 
-GPIOを使わずに、指定したプログラムに即座に切り替えます。
-プログラム番号はスクリプト内でハードコード。
+1台または複数台のTBBOXに対して、プログラム切り替え・音量設定・一時停止などを実行します。
+複数台を指定した場合は並行して実行し、台ごとの所要時間を表示します。
+1台への複数の操作は、1回の接続・ログインで続けて実行します。
+台数が多い場合は --processes で複数のプロセスに分けて実行できます（同じ台は常に同じプロセスが担当）。
 
 使用方法:
-    python switch_program.py
+    python switch_program.py switch 05
+    python switch_program.py switch 05 --device 192.168.0.58 --device 192.168.0.59:16603
+    python switch_program.py switch 05 07 --device 192.168.0.58 --device 192.168.0.59
+    python switch_program.py volume 30 --devices-file devices.txt
+    python switch_program.py pause --devices-file devices.txt
+    python switch_program.py batch site.txt
+    python switch_program.py switch 05 --devices-file fleet.txt --processes 4
 
-プログラム番号の変更:
-    スクリプト内の TARGET_PROGRAM_ID を変更してください
+    --deviceを省略した場合は.envのTBBOX_IP・TBBOX_PORTのTBBOXを操作します
+    switch・volumeで値を複数指定した場合は、指定した台に順番に割り当てます
+
+デバイスファイル（--devices-file）:
+    1行に1台 "HOST[:PORT] [ログインコマンド]"（#以降はコメント）
+
+バッチファイル:
+    1行に1操作 "HOST[:PORT] 操作 [値]"（同じ台の操作は記載順に実行）
+        192.168.0.58 switch 05
+        192.168.0.58 volume 30
+        192.168.0.59:16603 stop
 """
+import argparse
+import json
+import logging
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
 
+from config import settings
+from src.broker.shard import ShardFailure, ShardRouter
 from src.tbbox.client import TBBOXClient
 from src.tbbox.playlist import PlaylistController
 from src.utils.logger import logger
 
+# 操作名（値が必要な操作はTrue）
+ACTIONS = {
+    "switch": True,
+    "volume": True,
+    "pause": False,
+    "resume": False,
+    "stop": False,
+}
 
-# ========================================
-# 設定: ここでプログラム番号を指定
-# ========================================
-TARGET_PROGRAM_ID = "01"  # ← ここを変更するだけ（"01"～"20"）
+# 同時に操作する最大台数
+MAX_WORKERS = 32
 
 
-def main():
-    """メイン関数"""
-    logger.info("=" * 60)
-    logger.info(f"プログラム '{TARGET_PROGRAM_ID}' への切り替えを開始します")
-    logger.info("=" * 60)
+@dataclass(frozen=True)
+class Device:
+    """操作対象のTBBOX"""
+
+    host: str
+    port: int
+    login_command: Optional[str] = None
+
+    @property
+    def label(self) -> str:
+        return f"{self.host}:{self.port}"
+
+
+@dataclass(frozen=True)
+class Operation:
+    """TBBOXへの1つの操作"""
+
+    action: str
+    value: Optional[str] = None
+
+    def __str__(self) -> str:
+        return f"{self.action} {self.value}" if self.value is not None else self.action
+
+
+@dataclass
+class DeviceReport:
+    """1台分の実行結果"""
 
+    device: Device
+    connect_ms: Optional[float] = None
+    steps: List[Dict] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and all(step["ok"] for step in self.steps)
+
+    def to_dict(self) -> Dict:
+        return {
+            "device": self.device.label,
+            "ok": self.ok,
+            "connect_ms": self.connect_ms,
+            "steps": self.steps,
+            "error": self.error,
+        }
+
+
+def parse_device(text: str, login_command: Optional[str] = None) -> Device:
+    """
+    "HOST[:PORT]"形式の文字列をDeviceに変換
+
+    Args:
+        text: デバイス指定（ポート省略時は設定値）
+        login_command: ログインコマンド（省略時は設定値）
+
+    Returns:
+        Device: 操作対象
+
+    Raises:
+        ValueError: ポート番号が不正な場合
+    """
+    host, _, port = text.strip().partition(":")
+    if not host:
+        raise ValueError(f"ホストが指定されていません: {text}")
     try:
-        # TBBOXクライアントを初期化
-        logger.info("TBBOXクライアントを初期化しています...")
-        client = TBBOXClient()
+        port_number = int(port) if port else settings.TBBOX_PORT
+    except ValueError:
+        raise ValueError(f"ポート番号が不正です: {text}")
+    return Device(host=host, port=port_number, login_command=login_command)
+
+
+def _content_lines(path: str) -> List[List[str]]:
+    """ファイルを読み込み、コメント・空行を除いて空白で分割した行を返す"""
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        rows = []
+        for line in stream:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                rows.append(line.split())
+        return rows
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def load_devices(path: str, login_command: Optional[str] = None) -> List[Device]:
+    """
+    デバイスファイルを読み込む
+
+    Args:
+        path: ファイルパス（"-"の場合は標準入力）
+        login_command: ログインコマンドが記載されていない行に使用する値
+
+    Returns:
+        List[Device]: 記載順のデバイス
+    """
+    return [
+        parse_device(row[0], row[1] if len(row) > 1 else login_command)
+        for row in _content_lines(path)
+    ]
+
+
+def validate_operation(operation: Operation) -> None:
+    """
+    操作を検証
+
+    Raises:
+        ValueError: 操作名・値が不正な場合
+    """
+    if operation.action not in ACTIONS:
+        raise ValueError(f"不明な操作です: {operation.action}")
+    if ACTIONS[operation.action] and operation.value is None:
+        raise ValueError(f"{operation.action}には値が必要です")
+    if operation.action == "switch" and operation.value not in settings.PROGRAM_COMMANDS:
+        raise ValueError(
+            f"無効なプログラムID: {operation.value} "
+            f"(有効なID: {', '.join(settings.PROGRAM_COMMANDS)})"
+        )
+    if operation.action == "volume":
+        try:
+            volume = int(operation.value)
+        except ValueError:
+            raise ValueError(f"音量が不正です: {operation.value}")
+        if not 0 <= volume <= 100:
+            raise ValueError(f"音量は0～100で指定してください: {volume}")
+
+
+def load_batch(path: str, login_command: Optional[str] = None) -> Dict[Device, List[Operation]]:
+    """
+    バッチファイルを読み込む
+
+    Args:
+        path: ファイルパス（"-"の場合は標準入力）
+        login_command: ログインコマンド（省略時は設定値）
+
+    Returns:
+        Dict[Device, List[Operation]]: デバイスごとの操作（記載順）
+
+    Raises:
+        ValueError: 形式が不正な行がある場合
+    """
+    plan: Dict[Device, List[Operation]] = {}
+    for number, row in enumerate(_content_lines(path), 1):
+        if len(row) not in (2, 3):
+            raise ValueError(f"{number}行目: \"HOST[:PORT] 操作 [値]\" の形式で指定してください")
+        operation = Operation(row[1], row[2] if len(row) == 3 else None)
+        try:
+            validate_operation(operation)
+        except ValueError as e:
+            raise ValueError(f"{number}行目: {e}")
+        plan.setdefault(parse_device(row[0], login_command), []).append(operation)
+    return plan
+
+
+def build_plan(
+    action: str,
+    values: Sequence[str],
+    devices: List[Device]
+) -> Dict[Device, List[Operation]]:
+    """
+    サブコマンドの引数からデバイスごとの操作を組み立てる
+
+    Args:
+        action: 操作名
+        values: 値（1つの場合は全台共通、複数の場合は台数と同じ数）
+        devices: 操作対象
+
+    Returns:
+        Dict[Device, List[Operation]]: デバイスごとの操作
+
+    Raises:
+        ValueError: 値の数が台数と合わない場合
+    """
+    if not ACTIONS[action]:
+        values = [None]
+    if len(values) == 1:
+        values = list(values) * len(devices)
+    if len(values) != len(devices):
+        raise ValueError(f"値の数({len(values)})と台数({len(devices)})が一致しません")
+
+    plan: Dict[Device, List[Operation]] = {}
+    for device, value in zip(devices, values):
+        operation = Operation(action, value)
+        validate_operation(operation)
+        plan.setdefault(device, []).append(operation)
+    return plan
+
+
+def execute(controller: PlaylistController, operation: Operation) -> bool:
+    """
+    操作を1つ実行
+
+    Returns:
+        bool: 成功時True
+    """
+    if operation.action == "switch":
+        return bool(controller.switch_program(operation.value))
+    if operation.action == "volume":
+        return controller.set_volume(int(operation.value))
+    return getattr(controller, operation.action)()
+
+
+def run_device(device: Device, operations: List[Operation], retries: int = 3) -> DeviceReport:
+    """
+    1台に接続して操作を順に実行
 
-        # 接続
-        logger.info("TBBOXに接続中...")
+    接続・ログインは1回だけ行い、すべての操作で同じ接続を使用する
+
+    Args:
+        device: 操作対象
+        operations: 実行する操作
+        retries: 接続の試行回数
+
+    Returns:
+        DeviceReport: 実行結果
+    """
+    report = DeviceReport(device=device)
+    client = TBBOXClient(device.host, device.port, device.login_command)
+    client.max_retry = max(1, retries)
+
+    try:
+        started = time.perf_counter()
         if not client.connect():
-            logger.error("❌ TBBOXへの接続に失敗しました")
-            logger.error("")
-            logger.error("以下を確認してください：")
-            logger.error("  1. TBBOXの電源が入っているか")
-            logger.error("  2. TBBOXとRaspberry Piが同じネットワークにいるか")
-            logger.error("  3. .envファイルのTBBOX_IPが正しいか")
-            logger.error("  4. .envファイルのTBBOX_LOGIN_COMMANDが正しいか")
-            logger.error("  5. Viplex Expressが接続していないか（TBBOXは同時接続不可）")
-            return 1
-
-        # PlaylistControllerを初期化
-        controller = PlaylistController(client)
-        logger.info("PlaylistControllerを初期化しました")
-
-        # プログラム切り替えを実行
-        logger.info("")
-        logger.info(f"プログラム '{TARGET_PROGRAM_ID}' への切り替えを実行します...")
-        if controller.switch_program(TARGET_PROGRAM_ID):
-            logger.info("")
-            logger.info("=" * 60)
-            logger.info(f"✅ プログラム '{TARGET_PROGRAM_ID}' への切り替えに成功しました")
-            logger.info("=" * 60)
-            controller.close()
-            return 0
+            report.error = "connect_failed"
+            return report
+        report.connect_ms = (time.perf_counter() - started) * 1000
+
+        controller = PlaylistController(client, status_command="")
+        for operation in operations:
+            started = time.perf_counter()
+            try:
+                success = execute(controller, operation)
+            except Exception as e:
+                logger.error(f"{device.label}: {operation} の実行中にエラーが発生しました: {e}")
+                success = False
+            report.steps.append({
+                "operation": str(operation),
+                "ok": bool(success),
+                "ms": (time.perf_counter() - started) * 1000,
+            })
+        return report
+
+    except Exception as e:
+        report.error = str(e)
+        return report
+    finally:
+        client.close()
+
+
+def run_job(job: Tuple[Device, List[Operation], int]) -> DeviceReport:
+    """ShardRouterのワーカーで1台分の操作を実行（引数は run_device() と同じ）"""
+    return run_device(*job)
+
+
+def run_sharded(
+    plan: Dict[Device, List[Operation]],
+    processes: int,
+    workers: int,
+    retries: int = 3
+) -> List[DeviceReport]:
+    """
+    台ごとの操作をデバイスIDのハッシュで複数のプロセスに振り分けて実行
+
+    実行中にプロセスが異常終了した場合、そのプロセスが担当していた台は残りのプロセスで実行し直す
+
+    Args:
+        plan: デバイスごとの操作
+        processes: プロセス数
+        workers: 同時に操作する台数（全プロセスの合計）
+        retries: 接続の試行回数
+
+    Returns:
+        List[DeviceReport]: planと同じ順の実行結果
+    """
+    jobs = {device.label: (device, operations, retries) for device, operations in plan.items()}
+    router = ShardRouter(
+        run_job,
+        processes,
+        threads=-(-workers // processes),
+        initializer=logger.setLevel,
+        initargs=(logger.level,)
+    )
+    with router:
+        results = router.run(jobs)
+
+    reports = []
+    for device in plan:
+        result = results[device.label]
+        if isinstance(result, ShardFailure):
+            result = DeviceReport(device=device, error=result.reason)
+        reports.append(result)
+    return reports
+
+
+def run_all(
+    plan: Dict[Device, List[Operation]],
+    workers: Optional[int] = None,
+    retries: int = 3,
+    processes: int = 1
+) -> List[DeviceReport]:
+    """
+    すべての台の操作を並行して実行
+
+    Args:
+        plan: デバイスごとの操作
+        workers: 同時に操作する台数（省略時は台数、最大MAX_WORKERS）
+        retries: 接続の試行回数
+        processes: 実行するプロセス数（2以上の場合は run_sharded() で実行）
+
+    Returns:
+        List[DeviceReport]: planと同じ順の実行結果
+    """
+    if not plan:
+        return []
+    workers = max(1, min(workers or len(plan), MAX_WORKERS))
+    processes = max(1, min(processes, len(plan)))
+    if processes > 1:
+        return run_sharded(plan, processes, workers, retries)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tbbox-cli") as executor:
+        futures = [
+            executor.submit(run_device, device, operations, retries)
+            for device, operations in plan.items()
+        ]
+        return [future.result() for future in futures]
+
+
+def format_report(reports: List[DeviceReport], elapsed: float) -> str:
+    """
+    実行結果を表形式の文字列に変換
+
+    Args:
+        reports: 実行結果
+        elapsed: 全体の所要時間（秒）
+
+    Returns:
+        str: 表示用の文字列
+    """
+    width = max([len(r.device.label) for r in reports] + [len("DEVICE")])
+    lines = [f"{'DEVICE':<{width}}  {'CONNECT':>9}  RESULT  OPERATIONS"]
+    for report in reports:
+        connect = f"{report.connect_ms:.1f}ms" if report.connect_ms is not None else "-"
+        if report.error:
+            detail = f"error: {report.error}"
         else:
-            logger.error("")
-            logger.error("=" * 60)
-            logger.error(f"❌ プログラム '{TARGET_PROGRAM_ID}' への切り替えに失敗しました")
-            logger.error("=" * 60)
-            logger.error("")
-            logger.error("考えられる原因：")
-            logger.error(f"  1. プログラム '{TARGET_PROGRAM_ID}' がTBBOXに存在しない")
-            logger.error("  2. プログラム名が正しくない（2桁の数字形式: '01', '02', etc.）")
-            logger.error("  3. TBBOXとの接続が切断された")
-            controller.close()
-            return 1
+            detail = ", ".join(
+                f"{step['operation']} ({step['ms']:.1f}ms{'' if step['ok'] else ' NG'})"
+                for step in report.steps
+            )
+        status = "OK" if report.ok else "NG"
+        lines.append(f"{report.device.label:<{width}}  {connect:>9}  {status:<6}  {detail}")
+
+    succeeded = sum(1 for r in reports if r.ok)
+    lines.append(f"{len(reports)}台中{succeeded}台成功 (所要時間 {elapsed:.2f}秒)")
+    return "\n".join(lines)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """コマンドライン引数のパーサを作成"""
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--device", "-d", action="append", default=[], metavar="HOST[:PORT]",
+        help="操作するTBBOX（複数指定可、省略時は.envの設定）"
+    )
+    common.add_argument(
+        "--devices-file", "-f", metavar="PATH",
+        help="操作するTBBOXの一覧ファイル（\"-\"で標準入力）"
+    )
+    common.add_argument("--login-command", help="ログインコマンド（省略時は.envの設定）")
+    common.add_argument("--workers", type=int, help=f"同時に操作する台数（最大{MAX_WORKERS}）")
+    common.add_argument(
+        "--processes", "-p", type=int, default=1,
+        help="実行するプロセス数（台数が多い場合、デフォルト: 1）"
+    )
+    common.add_argument("--retries", type=int, default=3, help="接続の試行回数（デフォルト: 3）")
+    common.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    common.add_argument("--verbose", "-v", action="store_true", help="通信ログを表示")
+
+    parser = argparse.ArgumentParser(
+        description="TBBOXのプログラム切り替え・音量設定・再生制御を行います",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("使用方法:", 1)[1]
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    switch = subparsers.add_parser("switch", parents=[common], help="プログラムを切り替え")
+    switch.add_argument("values", nargs="+", metavar="PROGRAM", help="プログラムID（\"01\"～\"20\"）")
+
+    volume = subparsers.add_parser("volume", parents=[common], help="音量を設定")
+    volume.add_argument("values", nargs="+", metavar="PERCENT", help="音量（0～100、10刻みに丸め）")
+
+    for action, description in (("pause", "一時停止"), ("resume", "再生再開"), ("stop", "停止")):
+        subparsers.add_parser(action, parents=[common], help=description)
+
+    batch = subparsers.add_parser("batch", parents=[common], help="バッチファイルの操作を実行")
+    batch.add_argument("file", help="バッチファイル（\"-\"で標準入力）")
+
+    return parser
+
 
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """メイン関数"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "batch":
+            plan = load_batch(args.file, args.login_command)
+        else:
+            devices = [parse_device(d, args.login_command) for d in args.device]
+            if args.devices_file:
+                devices += load_devices(args.devices_file, args.login_command)
+            if not devices:
+                devices = [Device(settings.TBBOX_IP, settings.TBBOX_PORT, args.login_command)]
+            plan = build_plan(args.command, getattr(args, "values", []), devices)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+    if not plan:
+        parser.error("操作がありません")
+
+    # 複数台のログが混ざるため、通常は結果の表のみ表示する
+    level = logger.level
+    if not args.verbose:
+        logger.setLevel(logging.WARNING)
+    try:
+        started = time.perf_counter()
+        reports = run_all(
+            plan, workers=args.workers, retries=args.retries, processes=args.processes
+        )
+        elapsed = time.perf_counter() - started
     except KeyboardInterrupt:
-        logger.info("")
-        logger.info("ユーザーによって中断されました")
+        print("ユーザーによって中断されました", file=sys.stderr)
         return 130
-    except Exception as e:
-        logger.error("")
-        logger.error(f"予期しないエラーが発生しました: {e}")
-        return 1
+    finally:
+        logger.setLevel(level)
+
+    if args.json:
+        print(json.dumps(
+            {"elapsed": elapsed, "devices": [r.to_dict() for r in reports]},
+            ensure_ascii=False, indent=2
+        ))
+    else:
+        print(format_report(reports, elapsed))
+        if not all(r.ok for r in reports):
+            print("", file=sys.stderr)
+            print("失敗した台がある場合は以下を確認してください：", file=sys.stderr)
+            print("  1. TBBOXの電源が入っているか・同じネットワークにいるか", file=sys.stderr)
+            print("  2. IPアドレス・ポート番号・ログインコマンドが正しいか", file=sys.stderr)
+            print("  3. Viplex Expressが接続していないか（TBBOXは同時接続不可）", file=sys.stderr)
+            print("  4. プログラムIDがTBBOXに存在するか", file=sys.stderr)
+
+    return 0 if all(r.ok for r in reports) else 1
 
 
 if __name__ == "__main__":
@@ -1,21 +1,208 @@
 #!/usr/bin/env python3
 """
-TBBOX接続テストスクリプト
+TBBOX接続テスト・診断スクリプト
 
 TBBOXへの接続とログインが正常に行えるかを確認します。
 このテストが成功すれば、main.pyでもTBBOXとの通信が正常に動作します。
 
+--iterationsを指定すると診断モードで動作し、接続・ログイン・コマンド送信を
+指定回数繰り返して、TCP接続時間・ログイン時間・コマンドRTTの分布と
+ロス・再接続の回数を表示します（設置前の現地ネットワークの確認用）。
+
 使用方法:
     python test_connection.py
+    python test_connection.py --iterations 20
+    python test_connection.py --iterations 50 --commands 10 --interval 1 --json
+    python test_connection.py --iterations 20 --device 192.168.0.59:16603 --command <16進数>
+
+    コマンドを省略した場合は.envのTBBOX_STATUS_COMMANDを送信します
+    （未設定の場合はTCP接続とログインのみ計測します）
 """
+import argparse
+import json
+import logging
 import sys
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 
+from config import settings
 from src.tbbox.client import TBBOXClient
+from src.tbbox.rtt import RTTEstimator
 from src.utils.logger import logger
+from src.utils.stats import PERCENTILES, summarize
 
 
-def main():
-    """メイン関数"""
+@dataclass
+class ProbeReport:
+    """診断結果"""
+
+    target: str
+    iterations: int
+    commands: int
+    connect: List[float] = field(default_factory=list)
+    login: List[float] = field(default_factory=list)
+    rtt: List[float] = field(default_factory=list)
+    connect_failures: int = 0
+    reconnects: int = 0
+    sent: int = 0
+    lost: int = 0
+    rejected: int = 0
+    errors: Counter = field(default_factory=Counter)
+    elapsed: float = 0.0
+
+    @property
+    def attempts(self) -> int:
+        """接続の試行回数（再接続を含む）"""
+        return self.iterations + self.reconnects
+
+    @property
+    def loss_rate(self) -> float:
+        """コマンドのロス率（%）"""
+        return self.lost / self.sent * 100 if self.sent else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "target": self.target,
+            "iterations": self.iterations,
+            "commands_per_iteration": self.commands,
+            "connect_ms": summarize(self.connect),
+            "login_ms": summarize(self.login),
+            "rtt_ms": summarize(self.rtt),
+            "connect_attempts": self.attempts,
+            "connect_failures": self.connect_failures,
+            "reconnects": self.reconnects,
+            "sent": self.sent,
+            "lost": self.lost,
+            "loss_rate": self.loss_rate,
+            "rejected": self.rejected,
+            "errors": dict(self.errors),
+            "elapsed_s": self.elapsed,
+        }
+
+    def format(self) -> str:
+        """表形式の文字列に変換"""
+        columns = ["min"] + [f"p{q}" for q in PERCENTILES] + ["max", "mean"]
+        lines = [
+            f"TBBOX診断結果: {self.target} "
+            f"({self.iterations}回 × コマンド{self.commands}件, {self.elapsed:.1f}秒)",
+            "",
+            f"{'':<12}{'回数':>6}" + "".join(f"{c:>9}" for c in columns) + "  (ms)",
+        ]
+        for label, samples in (("TCP接続", self.connect), ("ログイン", self.login), ("コマンドRTT", self.rtt)):
+            summary = summarize(samples)
+            cells = "".join(
+                f"{summary[c]:>9.1f}" if summary[c] is not None else f"{'-':>9}"
+                for c in columns
+            )
+            # 全角文字の表示幅に合わせて左寄せ
+            padding = 12 - sum(2 if ord(ch) > 0x7F else 1 for ch in label)
+            lines.append(f"{label}{' ' * padding}{summary['count']:>6}{cells}")
+
+        lines.append("")
+        lines.append(
+            f"接続失敗: {self.connect_failures}/{self.attempts}  "
+            f"再接続: {self.reconnects}  "
+            f"ロス: {self.lost}/{self.sent} ({self.loss_rate:.1f}%)  "
+            f"拒否: {self.rejected}"
+        )
+        if self.errors:
+            lines.append("エラー内訳: " + ", ".join(f"{k}={v}" for k, v in self.errors.most_common()))
+        return "\n".join(lines)
+
+
+def _connect(client: TBBOXClient, report: ProbeReport) -> bool:
+    """接続・ログインして所要時間を記録"""
+    if not client.connect():
+        report.connect_failures += 1
+        report.errors["connect_failed"] += 1
+        return False
+    report.connect.append(client.last_connect_time)
+    report.login.append(client.last_login_time)
+    return True
+
+
+def run_probe(
+    host: Optional[str] = None,
+    port: Optional[int] = None,
+    login_command: Optional[str] = None,
+    iterations: int = 10,
+    commands: int = 5,
+    command: Optional[str] = None,
+    interval: float = 0.5,
+    timeout: Optional[float] = None
+) -> ProbeReport:
+    """
+    接続・ログイン・コマンド送信を繰り返して計測
+
+    1回ごとに接続し直し、接続後にコマンドをcommands件送信してから切断する
+    途中で切断された場合は再接続して続行し、再接続の回数として数える
+
+    Args:
+        host: TBBOXのIPアドレス（省略時は設定値）
+        port: TBBOXのポート番号（省略時は設定値）
+        login_command: ログインコマンド（省略時は設定値）
+        iterations: 繰り返し回数
+        commands: 1回あたりのコマンド送信件数
+        command: 送信するコマンド（16進数、Noneの場合はコマンドを送信しない）
+        interval: 各回の間隔（秒）
+        timeout: 接続・レスポンス待ちのタイムアウト（秒、省略時は設定値）
+
+    Returns:
+        ProbeReport: 計測結果
+    """
+    client = TBBOXClient(host, port, login_command)
+    # 失敗は再試行せずにそのまま記録する
+    client.max_retry = 1
+    timeout = timeout or settings.TBBOX_READ_TIMEOUT
+    client.connect_timeout = timeout
+    client.read_timeout = timeout
+    # RTTに応じてタイムアウトが変わるとロスの基準がぶれるため、固定のタイムアウトで計測する
+    client.rtt = RTTEstimator(initial_timeout=timeout, min_timeout=timeout, max_timeout=timeout)
+
+    commands = commands if command else 0
+    report = ProbeReport(target=f"{client.host}:{client.port}", iterations=iterations, commands=commands)
+    started = time.perf_counter()
+
+    try:
+        for iteration in range(iterations):
+            if iteration and interval > 0:
+                time.sleep(interval)
+
+            if not _connect(client, report):
+                continue
+
+            for _ in range(commands):
+                if not (client.is_connected and client.is_authenticated):
+                    report.reconnects += 1
+                    if not _connect(client, report):
+                        break
+
+                sent_at = time.perf_counter()
+                result = client.execute(command, max_retry=1)
+                elapsed = time.perf_counter() - sent_at
+                report.sent += 1
+
+                if result.ok:
+                    report.rtt.append(elapsed)
+                elif result.retryable:
+                    report.lost += 1
+                    report.errors[result.error or "unknown"] += 1
+                else:
+                    report.rejected += 1
+                    report.errors[result.error or "rejected"] += 1
+
+            client.close()
+    finally:
+        client.close()
+        report.elapsed = time.perf_counter() - started
+
+    return report
+
+
+def check_connection() -> int:
+    """接続とログインを1回だけ確認"""
     logger.info("=" * 60)
     logger.info("TBBOX接続テストを開始します")
     logger.info("=" * 60)
@@ -29,8 +216,9 @@ def main():
         logger.info("✅ TBBOXへの接続に成功しました！")
         logger.info("")
         logger.info("次のステップ:")
-        logger.info("  1. GPIO動作確認: python test_gpio.py")
-        logger.info("  2. 統合テスト: python main.py")
+        logger.info("  1. 通信品質の診断: python test_connection.py --iterations 20")
+        logger.info("  2. 切り替え確認: python switch_program.py switch 01")
+        logger.info("  3. 統合テスト: python main.py")
         client.close()
         return 0
     else:
@@ -45,5 +233,83 @@ def main():
         return 1
 
 
+def build_parser() -> argparse.ArgumentParser:
+    """コマンドライン引数のパーサを作成"""
+    parser = argparse.ArgumentParser(
+        description="TBBOXへの接続確認と通信品質の診断を行います",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("使用方法:", 1)[1],
+    )
+    parser.add_argument("--iterations", "-n", type=int,
+                        help="診断モードの繰り返し回数（省略時は接続を1回だけ確認）")
+    parser.add_argument("--commands", "-c", type=int, default=5,
+                        help="1回あたりのコマンド送信件数（デフォルト: 5）")
+    parser.add_argument("--command", default=settings.STATUS_COMMAND,
+                        help="送信するコマンド（16進数、デフォルト: TBBOX_STATUS_COMMAND）")
+    parser.add_argument("--interval", type=float, default=0.5,
+                        help="各回の間隔（秒、デフォルト: 0.5）")
+    parser.add_argument("--timeout", type=float, default=settings.TBBOX_READ_TIMEOUT,
+                        help="接続・レスポンス待ちのタイムアウト（秒）")
+    parser.add_argument("--device", "-d", metavar="HOST[:PORT]",
+                        help="診断するTBBOX（省略時は.envの設定）")
+    parser.add_argument("--login-command", help="ログインコマンド（省略時は.envの設定）")
+    parser.add_argument("--max-loss", type=float, default=0.0,
+                        help="許容するロス率（%%、超えた場合は終了コード1、デフォルト: 0）")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    parser.add_argument("--verbose", "-v", action="store_true", help="通信ログを表示")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """メイン関数"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.iterations is None:
+        return check_connection()
+    if args.iterations < 1 or args.commands < 0:
+        parser.error("--iterationsは1以上、--commandsは0以上で指定してください")
+
+    host, port = None, None
+    if args.device:
+        host, _, port_text = args.device.partition(":")
+        try:
+            port = int(port_text) if port_text else None
+        except ValueError:
+            parser.error(f"ポート番号が不正です: {args.device}")
+
+    if not args.command and not args.json:
+        print("TBBOX_STATUS_COMMANDが未設定のため、TCP接続とログインのみ計測します", file=sys.stderr)
+
+    level = logger.level
+    if not args.verbose:
+        logger.setLevel(logging.WARNING)
+    try:
+        report = run_probe(
+            host=host,
+            port=port,
+            login_command=args.login_command,
+            iterations=args.iterations,
+            commands=args.commands,
+            command=args.command or None,
+            interval=args.interval,
+            timeout=args.timeout,
+        )
+    except KeyboardInterrupt:
+        print("ユーザーによって中断されました", file=sys.stderr)
+        return 130
+    finally:
+        logger.setLevel(level)
+
+    if args.json:
+        print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2))
+    else:
+        print(report.format())
+
+    if report.connect_failures or report.loss_rate > args.max_loss:
+        return 1
+    return 0
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+管理用エンドポイント（/api/admin/*）のテスト
+"""
+import threading
+import time
+import tracemalloc
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.http.admin import AdminTools
+from src.http.server import HTTPServer
+
+TOKEN = "secret-token"
+AUTH = {"Authorization": f"Bearer {TOKEN}"}
+
+
+@pytest.fixture
+def admin():
+    admin = AdminTools(token=TOKEN, max_profile_seconds=5)
+    yield admin
+    admin.stop_tracing()
+
+
+@pytest.fixture
+def client(admin):
+    return TestClient(HTTPServer(admin=admin).get_app())
+
+
+def _busy_loop(stop: threading.Event) -> None:
+    """サンプリングで検出させるためのCPUを使い続ける関数"""
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestAuthorization:
+    """認証のテスト"""
+
+    def test_disabled_without_admin(self):
+        client = TestClient(HTTPServer().get_app())
+
+        response = client.get("/api/admin/runtime", headers=AUTH)
+
+        assert response.status_code == 503
+        assert response.json()["detail"] == "Admin_disabled"
+
+    def test_missing_token(self, client):
+        response = client.get("/api/admin/runtime")
+
+        assert response.status_code == 401
+        assert response.json()["detail"] == "Unauthorized"
+        assert response.headers["WWW-Authenticate"] == "Bearer"
+
+    def test_wrong_token(self, client):
+        response = client.get("/api/admin/runtime", headers={"Authorization": "Bearer wrong"})
+
+        assert response.status_code == 401
+
+    def test_bearer_and_header_token(self, client):
+        assert client.get("/api/admin/runtime", headers=AUTH).status_code == 200
+        assert client.get("/api/admin/runtime", headers={"X-Admin-Token": TOKEN}).status_code == 200
+
+    def test_empty_token_rejects_everything(self):
+        assert not AdminTools(token="").authorize("Bearer ", "")
+
+
+class TestDiagnostics:
+    """実行環境の統計・スタック出力のテスト"""
+
+    def test_runtime(self, client):
+        body = client.get("/api/admin/runtime", headers=AUTH).json()
+
+        assert body["threads"] >= 1
+        assert body["asyncio_tasks"] >= 1
+        assert body["gc"]["enabled"] is True
+        assert len(body["gc"]["collections"]) == 3
+        assert body["tracemalloc"]["tracing"] is False
+        if body["open_fds"] is not None:
+            assert body["open_fds"] > 0
+
+    def test_stacks(self, client):
+        response = client.get("/api/admin/stacks", headers=AUTH)
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "MainThread" in response.text
+        assert "# asyncio tasks=" in response.text
+
+
+class TestProfile:
+    """プロファイル取得のテスト"""
+
+    def test_cprofile(self, client):
+        response = client.get("/api/admin/profile?seconds=0.1&mode=cprofile&sort=tottime", headers=AUTH)
+
+        assert response.status_code == 200
+        assert response.text.startswith("# cProfile")
+        assert "function calls" in response.text
+
+    def test_sample_covers_other_threads(self, client):
+        stop = threading.Event()
+        worker = threading.Thread(target=_busy_loop, args=(stop,), name="busy-worker")
+        worker.start()
+        try:
+            response = client.get("/api/admin/profile?seconds=0.2&mode=sample&interval=0.005", headers=AUTH)
+        finally:
+            stop.set()
+            worker.join()
+
+        assert response.status_code == 200
+        lines = response.text.splitlines()
+        assert lines[0].startswith("# samples=")
+        busy = [line for line in lines[1:] if line.startswith("busy-worker;")]
+        assert busy
+        assert any("_busy_loop" in line for line in busy)
+        # 各行の末尾は採取回数
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines[1:])
+
+    @pytest.mark.parametrize("query", [
+        "seconds=10",
+        "seconds=0",
+        "mode=unknown&seconds=0.1",
+        "sort=unknown&seconds=0.1",
+        "mode=sample&seconds=0.1&interval=5",
+    ])
+    def test_invalid_parameters(self, client, query):
+        response = client.get(f"/api/admin/profile?{query}", headers=AUTH)
+
+        assert response.status_code == 400
+        assert response.json()["detail"].startswith("Invalid_parameter")
+
+    def test_one_profile_at_a_time(self, client, admin):
+        with admin._profile_lock:
+            response = client.get("/api/admin/profile?seconds=0.1", headers=AUTH)
+
+        assert response.status_code == 409
+        assert response.json()["detail"] == "Profile_in_progress"
+
+
+class TestTracemalloc:
+    """tracemallocのテスト"""
+
+    def test_snapshot_before_start(self, client):
+        response = client.get("/api/admin/tracemalloc/snapshot", headers=AUTH)
+
+        assert response.status_code == 409
+        assert response.json()["detail"] == "Tracemalloc_not_started"
+
+    def test_snapshot_reports_growth(self, client, admin):
+        started = client.post("/api/admin/tracemalloc/start?frames=5", headers=AUTH).json()
+        assert started["tracing"] is True
+        assert started["frames"] == 5
+
+        kept = [bytearray(100_000) for _ in range(10)]
+        time.sleep(0.01)
+        body = client.get("/api/admin/tracemalloc/snapshot?limit=5", headers=AUTH).json()
+
+        assert body["interval_s"] > 0
+        assert body["top"][0]["size_diff"] >= 1_000_000
+        assert "test_admin.py:" in body["top"][0]["location"]
+        del kept
+
+        stopped = client.post("/api/admin/tracemalloc/stop", headers=AUTH).json()
+        assert stopped["tracing"] is False
+        assert not tracemalloc.is_tracing()
+
+    def test_traceback_key(self, client):
+        client.post("/api/admin/tracemalloc/start", headers=AUTH)
+        kept = bytearray(500_000)
+
+        body = client.get("/api/admin/tracemalloc/snapshot?key=traceback&limit=1", headers=AUTH).json()
+
+        assert body["top"][0]["traceback"]
+        del kept
+
+    def test_invalid_parameters(self, client):
+        assert client.post("/api/admin/tracemalloc/start?frames=0", headers=AUTH).status_code == 400
+        client.post("/api/admin/tracemalloc/start", headers=AUTH)
+        assert client.get("/api/admin/tracemalloc/snapshot?key=unknown", headers=AUTH).status_code == 400
@@ -0,0 +1,588 @@
+"""
+コマンドブローカー（HTTPワーカー → ブローカー → TBBOX）のテスト
+"""
+import http.client
+import io
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from main import TBBOXPlaylistSwitcher, run_worker
+from src.broker import BrokerClient, CommandBroker, WorkerPool, wire
+from src.http.idempotency import IdempotencyCache
+from src.http.server import HTTPServer
+from src.mapper.switch_mapper import SwitchMapper
+from src.mapper.time_rules import RuleScheduler
+from src.tbbox.client import TBBOXClient
+from src.tbbox.playlist import PlaylistController
+from src.tbbox.protocol import CommandResult
+from src.tbbox.rtt import RTTEstimator
+from src.tbbox.simulator import TBBOXSimulator
+from src.tbbox.state import DeviceStateSnapshot
+from src.utils.deadline import Deadline, DeadlineExceeded
+from src.utils.events import EventBus
+from src.utils.logger import logger
+from src.utils.trace import RequestTrace, trace_scope
+
+
+def _wait_until(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return condition()
+
+
+class TestWire:
+    """メッセージ形式のテスト"""
+
+    def test_switch_round_trip(self):
+        message = wire.encode_switch(7, "11", 2500, "req-1")
+
+        kind, flags, correlation_id, payload = wire.read_message(io.BytesIO(message))
+
+        assert (kind, flags, correlation_id) == (wire.MSG_SWITCH, 0, 7)
+        assert wire.decode_switch(payload) == wire.SwitchRequest("11", 2500, "req-1")
+        # HTTPリクエスト（数百バイト）に比べて十分小さい
+        assert len(message) == wire.HEADER_SIZE + 7 + 2 + 5
+
+    def test_switch_without_deadline(self):
+        _, _, _, payload = wire.read_message(io.BytesIO(wire.encode_switch(1, "01")))
+
+        assert wire.decode_switch(payload) == wire.SwitchRequest("01", None, "")
+
+    def test_alert_round_trip(self):
+        key = '[["alert","sim1","10109999"],["id","sim1"]]'
+        message = wire.encode_switch(3, "10109999", 1000, "req-2", wire.MSG_ALERT, key)
+
+        kind, _, correlation_id, payload = wire.read_message(io.BytesIO(message))
+
+        assert (kind, correlation_id) == (wire.MSG_ALERT, 3)
+        assert wire.decode_switch(payload) == wire.SwitchRequest("10109999", 1000, "req-2", key)
+
+    def test_result_round_trip(self):
+        result = CommandResult(ok=False, status=3, command=0x1e, action=0x409, error="rejected")
+        message = wire.encode_result(
+            9, result, retries=2, handled=0.0125, durations={"tbbox": 0.010, "retry": 0.002}
+        )
+
+        kind, flags, correlation_id, payload = wire.read_message(io.BytesIO(message))
+        reply = wire.decode_result(payload, flags)
+
+        assert (kind, correlation_id) == (wire.MSG_RESULT, 9)
+        assert reply.result == CommandResult(
+            ok=False, status=3, command=0x1e, action=0x409, error="rejected"
+        )
+        assert reply.retries == 2
+        assert reply.handled == pytest.approx(0.0125)
+        assert reply.durations == pytest.approx({"tbbox": 0.010, "retry": 0.002})
+
+    def test_successful_result(self):
+        message = wire.encode_result(1, CommandResult(ok=True, status=0, program="17"))
+
+        _, flags, _, payload = wire.read_message(io.BytesIO(message))
+        reply = wire.decode_result(payload, flags)
+
+        assert reply.result.ok
+        assert reply.result.status == 0
+        assert reply.result.program == "17"
+        assert reply.result.error is None
+        assert reply.durations == {}
+
+    def test_state_round_trip(self):
+        state = DeviceStateSnapshot()
+        state.record_switch("05", timestamp=1792300000.25)
+
+        _, _, _, payload = wire.read_message(io.BytesIO(wire.encode_state(state.get())))
+
+        assert wire.decode_state(payload) == state.get()
+
+    def test_event_round_trip(self):
+        message = wire.encode_event("switch", {"program": "05", "ok": True, "ts": 1.5})
+        kind, _, correlation_id, payload = wire.read_message(io.BytesIO(message))
+
+        assert (kind, correlation_id) == (wire.MSG_EVENT, 0)
+        assert wire.decode_event(payload) == ("switch", {"program": "05", "ok": True, "ts": 1.5})
+        with pytest.raises(ValueError):
+            wire.decode_event(b'{"kind": "switch"}')
+
+    def test_consecutive_messages(self):
+        stream = io.BytesIO(wire.encode_switch(1, "01") + wire.encode_switch(2, "02"))
+
+        assert wire.read_message(stream)[2] == 1
+        assert wire.read_message(stream)[2] == 2
+        assert wire.read_message(stream) is None
+
+    def test_truncated_message(self):
+        message = wire.encode_switch(1, "01", None, "req")
+
+        with pytest.raises(ConnectionError):
+            wire.read_message(io.BytesIO(message[:4]))
+        with pytest.raises(ConnectionError):
+            wire.read_message(io.BytesIO(message[:-1]))
+
+    @pytest.mark.parametrize("payload", [
+        b"",
+        b"\x00\x00\x00\x01\x05\x00\x00ab",
+        b"\x00\x00\x00\x01\x01\x00\x00\xff",
+        b"\x00\x00\x00\x01\x01\x00\x05a[]",
+    ])
+    def test_malformed_switch(self, payload):
+        with pytest.raises(ValueError):
+            wire.decode_switch(payload)
+
+
+class _Broker:
+    """シミュレータに接続したブローカー"""
+
+    def __init__(self, path, rules_file=None):
+        self.simulator = TBBOXSimulator()
+        self.state = DeviceStateSnapshot()
+        self.events = EventBus()
+        self.tbbox = TBBOXClient(transport=self.simulator.transport())
+        self.tbbox.resend_delay = 0.01
+        self.tbbox.rtt = RTTEstimator(initial_timeout=0.2, min_timeout=0.2, max_timeout=0.2)
+        self.controller = PlaylistController(
+            self.tbbox, state=self.state, status_command="", events=self.events
+        )
+        # ブローカープロセスのアプリケーション（alertの変換を行う）
+        self.switcher = TBBOXPlaylistSwitcher()
+        self.switcher.switch_mapper = SwitchMapper(rules_file=rules_file)
+        self.switcher.playlist_controller = self.controller
+        self.broker = CommandBroker(
+            path, self.controller, self.state, events=self.events,
+            alert_handler=self.switcher.on_alert_received
+        )
+        self.broker.start()
+
+    def close(self):
+        self.broker.stop()
+        self.controller.close()
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return tmp_path / "broker.sock"
+
+
+@pytest.fixture
+def broker(socket_path):
+    broker = _Broker(socket_path)
+    yield broker
+    broker.close()
+
+
+@pytest.fixture
+def client(broker, socket_path):
+    client = BrokerClient(socket_path)
+    yield client
+    client.close()
+
+
+class TestBroker:
+    """ブローカーとブローカークライアントのテスト"""
+
+    def test_switch(self, broker, client):
+        result = client.switch_program("03")
+
+        assert result.ok
+        assert broker.simulator.program == "03"
+        assert broker.state.get()["program"] == "03"
+
+    def test_state_is_mirrored(self, broker, client):
+        client.switch_program("07")
+
+        assert _wait_until(lambda: client.state.get()["program"] == "07")
+        assert client.state.to_bytes() == broker.state.to_bytes()
+
+    def test_initial_state_on_connect(self, broker, socket_path):
+        broker.state.record_switch("09")
+        client = BrokerClient(socket_path)
+        try:
+            assert client.connect()
+            assert _wait_until(lambda: client.state.get()["program"] == "09")
+        finally:
+            client.close()
+
+    def test_events_are_forwarded(self, broker, socket_path):
+        events = EventBus()
+        received = []
+        events.add_listener(lambda kind, data: received.append((kind, data)))
+        client = BrokerClient(socket_path, events=events)
+        try:
+            assert client.switch_program("05").ok
+
+            assert _wait_until(lambda: received)
+            kind, data = received[0]
+            assert kind == "switch"
+            assert (data["program"], data["ok"], data["error"]) == ("05", True, None)
+        finally:
+            client.close()
+
+    def test_stalled_worker_does_not_block_switch(self, broker, client, socket_path):
+        """受信しないワーカーがあっても切り替えが止まらず、そのワーカーは切断されることのテスト"""
+        broker.broker.max_queue = 4
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stalled.connect(str(socket_path))
+        try:
+            assert _wait_until(lambda: broker.broker.worker_count == 1)
+
+            # ソケットのバッファと送信キューがあふれる量のイベントを配信する
+            started = time.perf_counter()
+            for _ in range(64):
+                broker.events.publish("test", blob="x" * 60000)
+            assert time.perf_counter() - started < 1.0
+
+            assert _wait_until(lambda: broker.broker.worker_count == 0)
+            assert client.switch_program("04").ok
+            assert broker.simulator.program == "04"
+        finally:
+            stalled.close()
+
+    def test_rejected_command(self, broker, client):
+        broker.simulator.inject("reject")
+
+        result = client.switch_program("03")
+
+        assert not result.ok
+        assert result.error == "rejected"
+        assert not result.retryable
+
+    def test_invalid_program(self, client):
+        result = client.switch_program("99")
+
+        assert result.error == "invalid_program"
+
+    def test_deadline_is_forwarded(self, broker, client):
+        # 1回目の応答を破棄させ、再送を待つ間に期限を過ぎさせる
+        broker.tbbox.resend_delay = 1.0
+        client.switch_program("01")
+        broker.simulator.inject("drop")
+
+        with pytest.raises(DeadlineExceeded):
+            client.switch_program("02", deadline=Deadline(0.3))
+
+    def test_trace_is_forwarded(self, broker, client):
+        trace = RequestTrace("req-77")
+        stream = io.StringIO()
+        handler = logger.handlers[0]
+        saved = handler.setStream(stream)
+        try:
+            with trace_scope(trace):
+                client.switch_program("04")
+        finally:
+            handler.setStream(saved)
+
+        assert {"ipc", "queue", "connect", "tbbox"} <= set(trace.durations)
+        # ブローカーでのログにも同じリクエストIDが付く
+        assert "[req-77] プログラム '04' への切り替えが完了しました" in stream.getvalue()
+
+    def test_retries_are_forwarded(self, broker, client):
+        client.switch_program("01")
+        broker.simulator.inject("drop")
+        trace = RequestTrace()
+
+        with trace_scope(trace):
+            assert client.switch_program("02").ok
+
+        assert trace.retries == 1
+        assert "retry" in trace.durations
+
+    def test_concurrent_clients_share_one_connection(self, broker, socket_path):
+        clients = [BrokerClient(socket_path) for _ in range(3)]
+        results = []
+
+        def send(client, count):
+            for i in range(count):
+                results.append(client.switch_program(f"{i % 16 + 1:02d}").ok)
+
+        threads = [
+            threading.Thread(target=send, args=(client, 30))
+            for client in clients for _ in range(4)
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            for client in clients:
+                client.close()
+
+        assert results == [True] * 360
+        assert broker.simulator.commands == 360
+        assert broker.simulator.connections == 1
+        assert broker.state.get()["program"] == broker.simulator.program
+
+    def test_broker_unavailable(self, socket_path):
+        client = BrokerClient(socket_path, connect_timeout=0.1)
+
+        result = client.switch_program("01")
+
+        assert result.error == "broker_unavailable"
+        assert result.retryable
+
+    def test_reconnects_after_broker_restart(self, broker, client, socket_path):
+        assert client.switch_program("01").ok
+        broker.broker.stop()
+        assert _wait_until(lambda: not client.is_connected)
+        assert client.state.get()["connected"] is False
+
+        broker.broker = CommandBroker(socket_path, broker.controller, broker.state)
+        broker.broker.start()
+
+        assert client.switch_program("02").ok
+        assert broker.simulator.program == "02"
+
+    def test_reply_timeout_without_deadline(self, socket_path):
+        """期限なしの要求でも、応答しないブローカーをいつまでも待たないことのテスト"""
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(str(socket_path))
+        listener.listen(1)
+        client = BrokerClient(socket_path, reply_timeout=0.2)
+        try:
+            # 接続は受け付けるが何も返さないブローカー
+            result = client.switch_program("01")
+        finally:
+            client.close()
+            listener.close()
+
+        assert result.error == "broker_timeout"
+        assert result.retryable
+        assert client._pending == {}
+
+    def test_default_reply_timeout_is_finite(self, socket_path):
+        assert 0 < BrokerClient(socket_path).reply_timeout < float("inf")
+
+    def test_disconnected_before_registration(self, client, monkeypatch):
+        """接続の確認後・要求の登録前に切断された場合、待たずに失敗することのテスト"""
+        assert client.connect()
+        client._disconnect(client._sock)
+        monkeypatch.setattr(client, "connect", lambda deadline=None: True)
+
+        result = client.switch_program("01")
+
+        assert result.error == "broker_unavailable"
+        assert client._pending == {}
+
+    def test_pending_requests_fail_when_broker_stops(self, broker, client):
+        broker.tbbox.resend_delay = 1.0
+        client.switch_program("01")
+        broker.simulator.inject("drop")
+        results = []
+        thread = threading.Thread(target=lambda: results.append(client.switch_program("02")))
+        thread.start()
+        assert _wait_until(lambda: broker.simulator.commands == 2)
+
+        # ブローカーの受信側を閉じる（処理中の切り替えの結果は届かない）
+        client._disconnect(client._sock)
+        thread.join()
+
+        assert results[0].error == "broker_unavailable"
+
+    def test_without_controller(self, socket_path):
+        broker = CommandBroker(socket_path, None, DeviceStateSnapshot())
+        broker.start()
+        client = BrokerClient(socket_path)
+        try:
+            assert client.switch_program("01").error == "no_controller"
+        finally:
+            client.close()
+            broker.stop()
+
+
+class TestWorkerApp:
+    """ワーカープロセスのHTTPサーバ（ブローカー経由の切り替え）のテスト"""
+
+    @pytest.fixture
+    def app(self, broker, client):
+        switcher = TBBOXPlaylistSwitcher()
+        switcher.device_state = client.state
+        switcher.playlist_controller = client
+        server = HTTPServer(callback=switcher.forward_alert, status_snapshot=client.state)
+        return TestClient(server.get_app())
+
+    def test_control(self, app, broker):
+        response = app.get("/api/control?alert=10109999&id=sim")
+
+        assert response.status_code == 200
+        assert response.json()["program"] == "11"
+        assert broker.simulator.program == "11"
+        timings = response.headers["Server-Timing"]
+        assert "ipc;dur=" in timings
+        assert "tbbox;dur=" in timings
+
+    def test_status_query_uses_mirrored_state(self, app, client):
+        app.get("/api/control?alert=01009999")
+        assert _wait_until(lambda: client.state.get()["program"] == "05")
+
+        response = app.get("/api/control?alert=99999999")
+
+        assert response.json()["program"] == "05"
+
+    def test_time_rules_are_evaluated_by_broker(self, socket_path, tmp_path):
+        """ワーカーに届いたalertでも、ブローカーで時間帯ルールの境界時刻に再評価されることのテスト"""
+        rules_file = tmp_path / "rules.json"
+        rules_file.write_text(json.dumps({"rules": [
+            {"pattern": "1111", "start": "22:00", "end": "06:00", "program": "12"}
+        ]}), encoding="utf-8")
+        broker = _Broker(socket_path, rules_file=rules_file)
+        client = BrokerClient(socket_path)
+        worker = TBBOXPlaylistSwitcher()
+        worker.playlist_controller = client
+        app = TestClient(HTTPServer(callback=worker.forward_alert).get_app())
+        mapper = broker.switcher.switch_mapper
+        scheduler = RuleScheduler(
+            mapper.time_rules, mapper.reevaluate, broker.controller.switch_program,
+            on_switched=mapper.record_switch
+        )
+        try:
+            assert app.get("/api/control?alert=11119999").status_code == 200
+            assert mapper.last_pattern == "1111"
+
+            # 昼に評価してルール外のプログラムにそろえてから、ルールの開始時刻を過ぎる
+            scheduler.evaluate(datetime(2026, 10, 19, 12))
+            assert scheduler.evaluate(datetime(2026, 10, 19, 23)) == "12"
+            assert broker.simulator.program == "12"
+        finally:
+            client.close()
+            broker.close()
+
+    def test_retransmit_to_another_worker_is_collapsed(self, socket_path):
+        """別のワーカーに届いた再送も、ブローカーでまとめてTBBOXへは1回だけ送信することのテスト"""
+        broker = _Broker(socket_path)
+        broker.broker.idempotency = IdempotencyCache()
+        clients = [BrokerClient(socket_path) for _ in range(2)]
+        apps = []
+        for client in clients:
+            worker = TBBOXPlaylistSwitcher()
+            worker.playlist_controller = client
+            # ワーカーは冪等性キャッシュを持たず、ブローカーでまとめる（setup_worker()と同じ）
+            server = HTTPServer(callback=worker.forward_alert)
+            apps.append(TestClient(server.get_app()))
+        try:
+            responses = [app.get("/api/control?alert=10109999&id=sim1") for app in apps]
+            assert [r.status_code for r in responses] == [200, 200]
+            assert [r.json()["program"] for r in responses] == ["11", "11"]
+            assert broker.simulator.commands == 1
+
+            # 同じSIM IDに別のalertが届いた後は、元のalertも再送として扱わない
+            apps[0].get("/api/control?alert=01109999&id=sim1")
+            apps[1].get("/api/control?alert=10109999&id=sim1")
+            assert broker.simulator.commands == 3
+            assert broker.simulator.program == "11"
+        finally:
+            for client in clients:
+                client.close()
+            broker.close()
+
+    def test_broker_deadline_returns_504(self, app, broker):
+        broker.tbbox.resend_delay = 1.0
+        app.get("/api/control?alert=10109999")
+        broker.simulator.inject("drop")
+
+        response = app.get("/api/control?alert=01109999", headers={"X-Deadline-Ms": "300"})
+
+        assert response.status_code == 504
+
+
+def _pid_worker(index: int, sock: socket.socket) -> None:
+    """接続を受け付けるたびに自身のPIDを返すワーカー（WorkerPoolのテスト用）"""
+    while True:
+        conn, _ = sock.accept()
+        with conn:
+            conn.sendall(f"{index}:{os.getpid()}".encode())
+
+
+def _ask(port: int) -> str:
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as conn:
+        return conn.recv(64).decode()
+
+
+class TestWorkerPool:
+    """WorkerPoolのテスト"""
+
+    def test_workers_share_listening_socket(self):
+        pool = WorkerPool(_pid_worker, 2, "127.0.0.1", 0, restart_delay=0)
+        pool.start()
+        try:
+            answers = {_ask(pool.port) for _ in range(40)}
+            pids = {answer.split(":")[1] for answer in answers}
+
+            assert {answer.split(":")[0] for answer in answers} <= {"0", "1"}
+            assert str(os.getpid()) not in pids
+        finally:
+            pool.stop()
+
+        assert pool.sock is None
+
+    def test_restarts_dead_worker(self):
+        pool = WorkerPool(_pid_worker, 1, "127.0.0.1", 0, restart_delay=0)
+        pool.start()
+        try:
+            first = _ask(pool.port)
+            pool.processes[0].kill()
+            pool.processes[0].join()
+
+            assert pool.check() == 1
+            second = _ask(pool.port)
+
+            assert first != second
+            assert second.startswith("0:")
+            assert pool.restarts == 1
+        finally:
+            pool.stop()
+
+    def test_uses_inherited_socket(self):
+        # systemdのソケットアクティベーションで受け取ったソケットの代わり
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(16)
+        port = sock.getsockname()[1]
+
+        pool = WorkerPool(_pid_worker, 1, "0.0.0.0", 9, restart_delay=0, sock=sock)
+        pool.start()
+        try:
+            assert pool.port == port
+            assert _ask(port).startswith("0:")
+        finally:
+            pool.stop()
+
+
+class TestMultiProcess:
+    """実際のワーカープロセス（main.run_worker）を起動したテスト"""
+
+    def test_end_to_end(self, broker, socket_path, monkeypatch):
+        pytest.importorskip("uvicorn")
+        # ワーカーはspawnで起動するため、設定は環境変数で渡す
+        monkeypatch.setenv("BROKER_SOCKET", str(socket_path))
+        monkeypatch.setenv("HISTORY_ENABLED", "false")
+        monkeypatch.setenv("RATE_LIMIT_RATE", "0")
+        pool = WorkerPool(run_worker, 2, "127.0.0.1", 0)
+        pool.start()
+        try:
+            assert _wait_until(lambda: broker.broker.worker_count == 2, timeout=30)
+
+            for alert, program in (("10109999", "11"), ("01019999", "06")):
+                conn = http.client.HTTPConnection("127.0.0.1", pool.port, timeout=10)
+                conn.request("GET", f"/api/control?alert={alert}&id=e2e")
+                response = conn.getresponse()
+                body = json.loads(response.read())
+                conn.close()
+
+                assert response.status == 200
+                assert body["program"] == program
+                assert "ipc;dur=" in response.getheader("Server-Timing")
+                assert broker.simulator.program == program
+        finally:
+            pool.stop()
+
+        # TBBOXへの接続はブローカーの1本のみ
+        assert broker.simulator.connections == 1
@@ -0,0 +1,205 @@
+"""
+通信キャプチャ（記録・再生）のテスト
+"""
+import time
+
+import pytest
+
+from config import settings
+from src.tbbox import capture
+from src.tbbox.capture import CaptureReader, CaptureWriter, ReplayTransport
+from src.tbbox.client import TBBOXClient
+from src.tbbox.simulator import TBBOXSimulator
+
+SWITCH_01 = settings.PROGRAM_COMMANDS["01"]
+SWITCH_02 = settings.PROGRAM_COMMANDS["02"]
+
+
+def _record_session(path, simulator, commands, timeout=None):
+    """シミュレータとの送受信を記録"""
+    writer = CaptureWriter(path)
+    client = TBBOXClient(transport=simulator.transport(), recorder=writer)
+    if timeout:
+        client.rtt.min_timeout = client.rtt.max_timeout = client.rtt.rto = timeout
+    results = []
+    try:
+        assert client.connect()
+        for command in commands:
+            results.append(client.execute(command, max_retry=1))
+    finally:
+        client.close()
+        writer.close()
+    return results
+
+
+class TestCaptureFile:
+    """キャプチャファイルの読み書きのテスト"""
+
+    def test_round_trip(self, tmp_path):
+        path = tmp_path / "capture.bin"
+        writer = CaptureWriter(path)
+        writer.record(capture.CONNECTED, b"memory")
+        writer.record(capture.SENT, b"\x01\x02")
+        writer.record(capture.RECEIVED, b"OK")
+        writer.record(capture.CLOSED)
+        writer.close()
+
+        with CaptureReader(path) as reader:
+            records = list(reader)
+
+        assert [r.kind for r in records] == [
+            capture.CONNECTED, capture.SENT, capture.RECEIVED, capture.CLOSED
+        ]
+        assert records[1].data == b"\x01\x02"
+        assert records[3].data == b""
+        assert records[0].timestamp <= records[3].timestamp
+        assert writer.records == 4
+
+    def test_truncated_record_is_ignored(self, tmp_path):
+        path = tmp_path / "capture.bin"
+        writer = CaptureWriter(path)
+        writer.record(capture.SENT, b"abc")
+        writer.record(capture.RECEIVED, b"0123456789")
+        writer.close()
+        # 書き込み途中で終了した状態を再現
+        with open(path, "r+b") as f:
+            f.truncate(path.stat().st_size - 4)
+
+        with CaptureReader(path) as reader:
+            records = list(reader)
+
+        assert len(records) == 1
+        assert records[0].data == b"abc"
+
+    def test_invalid_file(self, tmp_path):
+        path = tmp_path / "not_capture.bin"
+        path.write_bytes(b"x" * 64)
+
+        with pytest.raises(ValueError):
+            CaptureReader(path)
+
+        path.write_bytes(b"")
+        with pytest.raises(ValueError):
+            CaptureReader(path)
+
+    def test_sessions_split_by_connect(self, tmp_path):
+        path = tmp_path / "capture.bin"
+        simulator = TBBOXSimulator()
+        simulator.inject("disconnect")
+        writer = CaptureWriter(path)
+        client = TBBOXClient(transport=simulator.transport(), recorder=writer)
+        client.retry_delay = 0
+        try:
+            client.execute(SWITCH_01, max_retry=1)
+            client.execute(SWITCH_02, max_retry=1)
+        finally:
+            client.close()
+            writer.close()
+
+        with CaptureReader(path) as reader:
+            sessions = reader.sessions()
+
+        assert len(sessions) == 2
+        assert sessions[0][0].kind == capture.CONNECTED
+        assert capture.RESET in [r.kind for r in sessions[0]]
+        assert sessions[1][-1].kind == capture.CLOSED
+
+
+class TestClientRecording:
+    """TBBOXClientの記録のテスト"""
+
+    def test_records_login_and_commands(self, tmp_path):
+        path = tmp_path / "capture.bin"
+        _record_session(path, TBBOXSimulator(), [SWITCH_01, SWITCH_02])
+
+        with CaptureReader(path) as reader:
+            kinds = [r.kind for r in reader]
+
+        assert kinds == [
+            capture.CONNECTED,
+            capture.SENT, capture.RECEIVED,  # ログイン
+            capture.SENT, capture.RECEIVED,
+            capture.SENT, capture.RECEIVED,
+            capture.CLOSED,
+        ]
+
+    def test_no_recorder_by_default(self):
+        client = TBBOXClient(transport=TBBOXSimulator().transport())
+        assert client.recorder is None
+
+
+class TestReplay:
+    """記録した応答の再生のテスト"""
+
+    def test_replays_responses(self, tmp_path):
+        path = tmp_path / "capture.bin"
+        original = _record_session(path, TBBOXSimulator(), [SWITCH_01, SWITCH_02])
+
+        transport = ReplayTransport(path, speed=0)
+        client = TBBOXClient(transport=transport)
+        try:
+            replayed = [client.execute(c, max_retry=1) for c in (SWITCH_01, SWITCH_02)]
+        finally:
+            client.close()
+
+        assert [r.raw for r in replayed] == [r.raw for r in original]
+        assert transport.mismatches == 0
+        assert transport.remaining == 0
+
+    def test_recorded_timing_and_speed(self, tmp_path):
+        path = tmp_path / "capture.bin"
+        _record_session(path, TBBOXSimulator(latency=0.1), [SWITCH_01])
+
+        for speed, low, high in ((1.0, 0.08, 0.5), (10.0, 0.0, 0.05)):
+            client = TBBOXClient(transport=ReplayTransport(path, speed=speed))
+            try:
+                assert client.connect()
+                started = time.perf_counter()
+                assert client.execute(SWITCH_01, max_retry=1)
+                elapsed = time.perf_counter() - started
+            finally:
+                client.close()
+            assert low <= elapsed < high, speed
+
+    def test_reproduces_timeout(self, tmp_path):
+        path = tmp_path / "capture.bin"
+        simulator = TBBOXSimulator()
+        simulator.inject("drop")
+        original = _record_session(path, simulator, [SWITCH_01, SWITCH_02], timeout=0.05)
+        assert original[0].error == "timeout"
+
+        client = TBBOXClient(transport=ReplayTransport(path, speed=0))
+        client.rtt.min_timeout = client.rtt.max_timeout = client.rtt.rto = 0.05
+        try:
+            first = client.execute(SWITCH_01, max_retry=1)
+            second = client.execute(SWITCH_02, max_retry=1)
+        finally:
+            client.close()
+
+        assert first.error == "timeout"
+        assert second.ok
+
+    def test_mismatch_is_counted(self, tmp_path):
+        path = tmp_path / "capture.bin"
+        _record_session(path, TBBOXSimulator(), [SWITCH_01])
+
+        transport = ReplayTransport(path, speed=0)
+        client = TBBOXClient(transport=transport)
+        try:
+            assert client.execute(SWITCH_02, max_retry=1)
+        finally:
+            client.close()
+
+        assert transport.mismatches == 1
+
+    def test_exhausted_capture_refuses_connection(self, tmp_path):
+        path = tmp_path / "capture.bin"
+        _record_session(path, TBBOXSimulator(), [])
+
+        transport = ReplayTransport(path, speed=0)
+        client = TBBOXClient(transport=transport)
+        client.max_retry = 1
+        client.retry_delay = 0
+        assert client.connect()
+        client.close()
+        assert not client.connect()
@@ -0,0 +1,215 @@
+"""
+test_connection.py（TBBOX接続診断）のテスト
+"""
+import json
+import socket
+import threading
+
+import pytest
+
+import test_connection
+from src.utils.stats import percentile, summarize
+from test_connection import ProbeReport, run_probe
+
+STATUS_COMMAND = "55aa0000fe0000000000000000000000"
+
+
+class _ProbeServer:
+    """
+    ログインとコマンドにOKを返すTCPサーバ
+
+    drop_every: N件目ごとのコマンドに応答しない（ロスの再現）
+    close_after: 1接続あたりN件のコマンドに応答した後に切断する（再接続の再現）
+    """
+
+    def __init__(self, drop_every: int = 0, close_after: int = 0):
+        self.drop_every = drop_every
+        self.close_after = close_after
+        self.connections = 0
+        self.commands = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            with conn:
+                # 最初の受信はログインコマンド
+                if not conn.recv(1024):
+                    continue
+                conn.send(b"OK")
+                answered = 0
+                while True:
+                    data = conn.recv(1024)
+                    if not data:
+                        break
+                    self.commands += 1
+                    if self.drop_every and self.commands % self.drop_every == 0:
+                        continue
+                    conn.send(b"OK")
+                    answered += 1
+                    if self.close_after and answered >= self.close_after:
+                        break
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def quiet_logger():
+    level = test_connection.logger.level
+    test_connection.logger.setLevel("CRITICAL")
+    yield
+    test_connection.logger.setLevel(level)
+
+
+class TestStatistics:
+    """分布の集計のテスト"""
+
+    def test_percentile_interpolates(self):
+        samples = [1.0, 2.0, 3.0, 4.0, 5.0]
+
+        assert percentile(samples, 0) == 1.0
+        assert percentile(samples, 50) == 3.0
+        assert percentile(samples, 90) == pytest.approx(4.6)
+        assert percentile(samples, 100) == 5.0
+        assert percentile([], 50) is None
+
+    def test_summarize_converts_to_milliseconds(self):
+        summary = summarize([0.001, 0.002, 0.003])
+
+        assert summary["count"] == 3
+        assert summary["min"] == pytest.approx(1.0)
+        assert summary["p50"] == pytest.approx(2.0)
+        assert summary["max"] == pytest.approx(3.0)
+        assert summary["mean"] == pytest.approx(2.0)
+
+    def test_summarize_empty(self):
+        summary = summarize([])
+
+        assert summary["count"] == 0
+        assert summary["p99"] is None
+
+    def test_report_format_and_dict(self):
+        report = ProbeReport(target="127.0.0.1:1", iterations=2, commands=1,
+                             connect=[0.001], login=[0.002], sent=2, lost=1)
+        report.errors["timeout"] += 1
+
+        text = report.format()
+        data = report.to_dict()
+
+        assert "TCP接続" in text and "ロス: 1/2 (50.0%)" in text
+        assert data["loss_rate"] == 50.0
+        assert data["rtt_ms"]["count"] == 0
+        assert data["errors"] == {"timeout": 1}
+
+
+class TestRunProbe:
+    """計測のテスト"""
+
+    def test_measures_every_phase(self, quiet_logger):
+        server = _ProbeServer()
+        try:
+            report = run_probe("127.0.0.1", server.port, iterations=3, commands=4,
+                               command=STATUS_COMMAND, interval=0, timeout=1)
+        finally:
+            server.close()
+
+        assert server.connections == 3
+        assert len(report.connect) == 3
+        assert len(report.login) == 3
+        assert len(report.rtt) == 12
+        assert report.sent == 12
+        assert report.lost == 0
+        assert report.reconnects == 0
+
+    def test_counts_lost_commands(self, quiet_logger):
+        server = _ProbeServer(drop_every=3)
+        try:
+            report = run_probe("127.0.0.1", server.port, iterations=1, commands=6,
+                               command=STATUS_COMMAND, interval=0, timeout=0.2)
+        finally:
+            server.close()
+
+        assert report.sent == 6
+        assert report.lost == 2
+        assert report.errors["timeout"] == 2
+        assert len(report.rtt) == 4
+
+    def test_counts_reconnects(self, quiet_logger):
+        server = _ProbeServer(close_after=2)
+        try:
+            report = run_probe("127.0.0.1", server.port, iterations=1, commands=5,
+                               command=STATUS_COMMAND, interval=0, timeout=1)
+        finally:
+            server.close()
+
+        # 切断を検知したコマンドはロスとして数え、次のコマンドの前に再接続する
+        assert report.reconnects >= 1
+        assert len(report.connect) == 1 + report.reconnects
+        assert report.sent == 5
+
+    def test_connect_failure(self, quiet_logger):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        report = run_probe("127.0.0.1", port, iterations=2, commands=1,
+                           command=STATUS_COMMAND, interval=0, timeout=0.5)
+
+        assert report.connect_failures == 2
+        assert report.sent == 0
+
+    def test_without_command_measures_connection_only(self, quiet_logger):
+        server = _ProbeServer()
+        try:
+            report = run_probe("127.0.0.1", server.port, iterations=2, commands=5,
+                               command=None, interval=0, timeout=1)
+        finally:
+            server.close()
+
+        assert report.commands == 0
+        assert report.sent == 0
+        assert len(report.login) == 2
+
+
+class TestMain:
+    """コマンドラインのテスト"""
+
+    def test_json_output(self, capsys):
+        server = _ProbeServer()
+        try:
+            exit_code = test_connection.main([
+                "--iterations", "2", "--commands", "2", "--interval", "0",
+                "--timeout", "1", "--command", STATUS_COMMAND,
+                "--device", f"127.0.0.1:{server.port}", "--json",
+            ])
+        finally:
+            server.close()
+
+        data = json.loads(capsys.readouterr().out)
+        assert exit_code == 0
+        assert data["rtt_ms"]["count"] == 4
+        assert data["connect_failures"] == 0
+
+    def test_loss_over_threshold_fails(self, capsys):
+        server = _ProbeServer(drop_every=2)
+        try:
+            exit_code = test_connection.main([
+                "--iterations", "1", "--commands", "4", "--interval", "0",
+                "--timeout", "0.2", "--command", STATUS_COMMAND,
+                "--device", f"127.0.0.1:{server.port}", "--max-loss", "10",
+            ])
+        finally:
+            server.close()
+
+        assert exit_code == 1
+        assert "ロス: 2/4" in capsys.readouterr().out
@@ -0,0 +1,182 @@
+"""
+デッドライン伝播のテスト
+"""
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.http.server import HTTPServer
+from src.tbbox.client import TBBOXClient
+from src.tbbox.simulator import TBBOXSimulator
+from src.utils.deadline import Deadline, DeadlineExceeded, current_deadline, deadline_scope
+
+
+class TestDeadline:
+    """Deadlineクラスのテスト"""
+
+    def test_remaining_and_expired(self):
+        deadline = Deadline(0.05)
+        assert 0 < deadline.remaining() <= 0.05
+        assert not deadline.expired
+
+        time.sleep(0.06)
+        assert deadline.remaining() == 0.0
+        assert deadline.expired
+        with pytest.raises(DeadlineExceeded):
+            deadline.check("send")
+
+    def test_clamp(self):
+        deadline = Deadline(1.0)
+        assert deadline.clamp(10.0) <= 1.0
+        assert deadline.clamp(0.1) == 0.1
+
+    def test_deadline_scope(self):
+        deadline = Deadline(1.0)
+        assert current_deadline() is None
+        with deadline_scope(deadline):
+            assert current_deadline() is deadline
+        assert current_deadline() is None
+
+
+class _RacingDeadline(Deadline):
+    """期限の確認と残り時間の取得の間に期限を過ぎた状況を再現するDeadline"""
+
+    __slots__ = ()
+
+    @property
+    def expired(self) -> bool:
+        return False
+
+    def remaining(self) -> float:
+        return 0.0
+
+
+class TestClientDeadline:
+    """TBBOXClientのデッドライン処理のテスト"""
+
+    def test_queue_wait_exceeds_deadline(self):
+        """送信待ちの間に期限を過ぎた場合に中断されることのテスト"""
+        client = TBBOXClient()
+        holder_ready = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            with client._lock:
+                holder_ready.set()
+                release.wait(1)
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        holder_ready.wait(1)
+        try:
+            with pytest.raises(DeadlineExceeded) as exc_info:
+                client.send_command("00", deadline=Deadline(0.05))
+            assert exc_info.value.stage == "queue"
+        finally:
+            release.set()
+            holder.join()
+
+    def test_reconnect_aborted_after_deadline(self):
+        """期限切れの場合は再接続を試行しないことのテスト"""
+        client = TBBOXClient()
+        client.host = "127.0.0.1"
+        client.port = 1
+
+        with pytest.raises(DeadlineExceeded):
+            client.send_command("00", deadline=Deadline(0.0))
+
+
+    def test_no_time_left_before_send(self):
+        """送信直前に残り時間が0になった場合は送信せず、接続を維持することのテスト"""
+        simulator = TBBOXSimulator()
+        client = TBBOXClient(transport=simulator.transport())
+        try:
+            assert client.connect()
+            with pytest.raises(DeadlineExceeded) as exc_info:
+                client._exchange("00", deadline=_RacingDeadline(1.0))
+
+            assert exc_info.value.stage == "send"
+            assert simulator.commands == 0
+            assert client.is_connected
+        finally:
+            client.close()
+
+
+class TestControlDeadline:
+    """/api/control のデッドライン処理のテスト"""
+
+    def test_callback_sees_request_deadline(self):
+        """コールバックからリクエストの期限が参照できることのテスト"""
+        seen = []
+
+        def callback(alert: str) -> bool:
+            seen.append(current_deadline())
+            return True
+
+        server = HTTPServer(callback=callback, deadline_seconds=5)
+        client = TestClient(server.get_app())
+
+        client.get("/api/control?alert=10109999")
+        assert seen[0] is not None
+        assert 0 < seen[0].remaining() <= 5
+
+    def test_deadline_header(self):
+        """X-Deadline-Msヘッダで期限を指定できることのテスト"""
+        seen = []
+
+        def callback(alert: str) -> bool:
+            seen.append(current_deadline().remaining())
+            return True
+
+        server = HTTPServer(callback=callback, deadline_seconds=5)
+        client = TestClient(server.get_app())
+
+        client.get("/api/control?alert=10109999", headers={"X-Deadline-Ms": "200"})
+        assert seen[0] <= 0.2
+
+    @pytest.mark.parametrize("value", ["inf", "-inf", "nan", "abc"])
+    def test_invalid_deadline_header_is_ignored(self, value):
+        """X-Deadline-Msが有限の数値でない場合は無視して既定の期限を使うことのテスト"""
+        seen = []
+
+        def callback(alert: str) -> bool:
+            seen.append(current_deadline().remaining())
+            return True
+
+        server = HTTPServer(callback=callback, deadline_seconds=5)
+        client = TestClient(server.get_app())
+
+        response = client.get("/api/control?alert=10109999", headers={"X-Deadline-Ms": value})
+
+        assert response.status_code == 200
+        assert 4 < seen[0] <= 5
+
+    def test_deadline_header_is_capped(self):
+        seen = []
+
+        def callback(alert: str) -> bool:
+            seen.append(current_deadline().remaining())
+            return True
+
+        server = HTTPServer(callback=callback)
+        client = TestClient(server.get_app())
+
+        client.get("/api/control?alert=10109999", headers={"X-Deadline-Ms": "1e300"})
+        assert seen[0] <= HTTPServer.MAX_DEADLINE_MS / 1000
+
+    def test_deadline_exceeded_is_counted_as_cancelled(self):
+        """期限切れで504が返り、cancelledとして集計されることのテスト"""
+        def callback(alert: str) -> bool:
+            raise DeadlineExceeded("retry")
+
+        server = HTTPServer(callback=callback, deadline_seconds=5)
+        client = TestClient(server.get_app())
+
+        response = client.get("/api/control?alert=10109999")
+
+        assert response.status_code == 504
+        assert response.json()["detail"] == "Deadline_exceeded"
+        metrics = client.get("/api/metrics").json()
+        assert metrics["control"] == {"cancelled": 1}
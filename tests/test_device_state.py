@@ -0,0 +1,50 @@
+"""
+DeviceStateSnapshotのテスト
+"""
+import json
+
+from src.tbbox.state import DeviceStateSnapshot
+
+
+class TestDeviceStateSnapshot:
+    """DeviceStateSnapshotクラスのテスト"""
+
+    def test_initial_state(self):
+        """初期状態のテスト"""
+        snapshot = DeviceStateSnapshot()
+        body = json.loads(snapshot.to_bytes())
+
+        assert body["status"] == "ok"
+        assert body["message"] == "No action (all 9s)"
+        assert body["program"] is None
+        assert body["connected"] is False
+        assert body["last_switch_at"] is None
+
+    def test_record_switch(self):
+        """切り替え記録が反映されることのテスト"""
+        snapshot = DeviceStateSnapshot()
+        snapshot.record_switch("11", timestamp=1000.0)
+
+        body = json.loads(snapshot.to_bytes())
+        assert body["program"] == "11"
+        assert body["last_switch_at"] == 1000.0
+
+    def test_encoded_bytes_reused_when_unchanged(self):
+        """状態が変化しない場合はバイト列を再生成しないことのテスト"""
+        snapshot = DeviceStateSnapshot()
+        snapshot.set_connected(True)
+        encoded = snapshot.to_bytes()
+
+        assert snapshot.update(connected=True) is False
+        assert snapshot.to_bytes() is encoded
+
+        assert snapshot.update(connected=False) is True
+        assert snapshot.to_bytes() is not encoded
+
+    def test_get_returns_copy(self):
+        """getがコピーを返すことのテスト"""
+        snapshot = DeviceStateSnapshot()
+        state = snapshot.get()
+        state["program"] = "XX"
+
+        assert snapshot.get()["program"] is None
@@ -0,0 +1,197 @@
+"""
+イベント配信（EventBus・/api/events）のテスト
+"""
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.http.server import HTTPServer
+from src.tbbox.client import TBBOXClient
+from src.tbbox.playlist import PlaylistController
+from src.tbbox.simulator import TBBOXSimulator
+from src.tbbox.state import DeviceStateSnapshot
+from src.utils.events import EventBus, TooManySubscribers, format_event
+
+
+def _parse_stream(body: bytes):
+    """SSEのボディを (イベント名, 内容) のリストに変換（コメント・retryは除く）"""
+    events = []
+    for block in body.decode("utf-8").split("\n\n"):
+        fields = dict(
+            line.split(": ", 1) for line in block.splitlines()
+            if line and not line.startswith(":") and ": " in line
+        )
+        if "event" in fields:
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def _recording_bus():
+    bus = EventBus()
+    received = []
+    bus.add_listener(lambda kind, data: received.append((kind, data)))
+    return bus, received
+
+
+class TestEventBus:
+    """EventBusのテスト"""
+
+    def test_format_event(self):
+        frame = format_event(3, "switch", {"program": "11", "message": "切り替え"})
+
+        assert frame == 'id: 3\nevent: switch\ndata: {"program":"11","message":"切り替え"}\n\n'.encode()
+        assert format_event(None, "state", {}) == b"event: state\ndata: {}\n\n"
+
+    def test_publish_without_subscribers_is_noop(self):
+        bus = EventBus()
+        bus.publish("alert", alert="10109999")
+
+        assert bus.published == 0
+
+    def test_drop_oldest_when_buffer_is_full(self):
+        async def scenario():
+            bus = EventBus(buffer_size=3)
+            subscription = bus.subscribe()
+            for n in range(5):
+                bus.publish("switch", n=n)
+            return subscription, await subscription.get(1.0), bus
+
+        subscription, frames, bus = asyncio.run(scenario())
+
+        assert [_parse_stream(frame)[0][1]["n"] for frame in frames] == [2, 3, 4]
+        assert subscription.dropped == 2
+        assert bus.stats() == {"subscribers": 1, "published": 5, "dropped": 2}
+
+    def test_publish_from_other_thread_wakes_subscriber(self):
+        async def scenario():
+            bus = EventBus()
+            subscription = bus.subscribe()
+            threading.Timer(0.05, bus.publish, args=("connection",), kwargs={"connected": True}).start()
+            started = time.monotonic()
+            frames = await subscription.get(5.0)
+            return frames, time.monotonic() - started
+
+        frames, waited = asyncio.run(scenario())
+
+        assert _parse_stream(frames[0])[0][0] == "connection"
+        assert waited < 1.0
+
+    def test_slow_subscriber_does_not_block_publisher(self):
+        async def scenario():
+            bus = EventBus(buffer_size=8)
+            bus.subscribe()  # 読み取らない購読者
+            started = time.perf_counter()
+            for n in range(10000):
+                bus.publish("alert", n=n)
+            return time.perf_counter() - started
+
+        assert asyncio.run(scenario()) < 1.0
+
+    def test_max_subscribers_and_unsubscribe(self):
+        async def scenario():
+            bus = EventBus(max_subscribers=1)
+            subscription = bus.subscribe()
+            with pytest.raises(TooManySubscribers):
+                bus.subscribe()
+            bus.unsubscribe(subscription)
+            bus.subscribe()
+            return bus.subscriber_count
+
+        assert asyncio.run(scenario()) == 1
+
+
+class TestEventsEndpoint:
+    """/api/events と /api/control のイベント配信のテスト"""
+
+    def test_stream(self):
+        bus = EventBus()
+        state = DeviceStateSnapshot()
+        state.record_switch("05", timestamp=1000.0)
+        server = HTTPServer(events=bus, status_snapshot=state)
+        server.EVENTS_POLL_INTERVAL = 0.02
+
+        def publish_then_stop():
+            deadline = time.monotonic() + 5
+            while not bus.subscriber_count and time.monotonic() < deadline:
+                time.sleep(0.01)
+            bus.publish("switch", program="11", ok=True)
+            bus.publish("connection", connected=False)
+            time.sleep(0.1)
+            server.shutdown()
+
+        thread = threading.Thread(target=publish_then_stop)
+        thread.start()
+        response = TestClient(server.get_app()).get("/api/events")
+        thread.join()
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = _parse_stream(response.content)
+        assert [kind for kind, _ in events] == ["state", "switch", "connection"]
+        assert events[0][1]["program"] == "05"
+        assert events[1][1]["program"] == "11"
+        assert bus.subscriber_count == 0
+
+    def test_disabled(self):
+        response = TestClient(HTTPServer().get_app()).get("/api/events")
+
+        assert response.status_code == 503
+
+    def test_too_many_subscribers(self):
+        bus = EventBus(max_subscribers=0)
+        response = TestClient(HTTPServer(events=bus).get_app()).get("/api/events")
+
+        assert response.status_code == 503
+        assert "Too_many_subscribers" in response.text
+
+    def test_control_publishes_alert_and_error(self):
+        bus, received = _recording_bus()
+        server = HTTPServer(callback=lambda alert: False, events=bus)
+        client = TestClient(server.get_app())
+
+        response = client.get(
+            "/api/control?alert=10109999&id=sim1", headers={"X-Request-ID": "req-1"}
+        )
+
+        assert response.status_code == 500
+        assert [kind for kind, _ in received] == ["alert", "error"]
+        alert, error = received[0][1], received[1][1]
+        assert (alert["alert"], alert["id"], alert["request_id"]) == ("10109999", "sim1", "req-1")
+        assert error["result"] == "failed"
+        assert server.get_metrics()["events"]["published"] == 2
+
+    def test_status_query_is_not_published(self):
+        bus, received = _recording_bus()
+        server = HTTPServer(callback=lambda alert: True, events=bus)
+
+        TestClient(server.get_app()).get("/api/control?alert=99999999")
+
+        assert received == []
+
+
+class TestPlaylistEvents:
+    """PlaylistControllerの切り替えイベントのテスト"""
+
+    def test_switch_events(self):
+        bus, received = _recording_bus()
+        simulator = TBBOXSimulator()
+        client = TBBOXClient(transport=simulator.transport())
+        client.resend_delay = 0
+        controller = PlaylistController(client, status_command="", events=bus)
+        try:
+            controller.switch_program("03")
+            simulator.inject("reject")
+            controller.switch_program("04")
+            controller.switch_program("99")
+        finally:
+            controller.close()
+
+        switches = [data for kind, data in received if kind == "switch"]
+        assert [(s["program"], s["ok"], s["error"]) for s in switches] == [
+            ("03", True, None),
+            ("04", False, "rejected"),
+        ]
@@ -0,0 +1,241 @@
+"""
+HistoryStoreのテスト
+"""
+import sqlite3
+import time
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.history.store import HistoryStore
+from src.http.server import HTTPServer
+from src.mapper.time_rules import RuleScheduler, TimeRule, TimeRuleTable
+from src.scheduler.scheduler import ActionScheduler
+from src.tbbox.protocol import CommandResult
+
+
+# 保持期間内に収まる基準時刻
+BASE = time.time() - 3600
+
+
+class TestHistoryStore:
+    """HistoryStoreクラスのテスト"""
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        """テスト用ストアを作成"""
+        store = HistoryStore(tmp_path / "history.db", retention_days=1)
+        store.start()
+        yield store
+        store.close()
+
+    def test_record_and_query(self, store):
+        """記録した履歴が検索できることのテスト"""
+        store.record("sim1", "10109999", "11", 1.5, "ok", timestamp=BASE)
+        store.record("sim2", "00009999", "01", 2.0, "ok", timestamp=BASE + 1)
+        assert store.flush()
+
+        page = store.query()
+        assert [item["id"] for item in page["items"]] == ["sim1", "sim2"]
+        assert page["items"][0]["program"] == "11"
+        assert page["items"][0]["result"] == "ok"
+        assert page["next_cursor"] is None
+
+    def test_query_time_range_and_device(self, store):
+        """時間範囲とSIM IDで絞り込めることのテスト"""
+        for i in range(10):
+            store.record(f"sim{i % 2}", "10109999", "11", 1.0, "ok", timestamp=BASE + i)
+        assert store.flush()
+
+        page = store.query(start=BASE + 2, end=BASE + 6)
+        assert [item["timestamp"] for item in page["items"]] == [BASE + 2, BASE + 3, BASE + 4, BASE + 5]
+
+        page = store.query(sim_id="sim1")
+        assert len(page["items"]) == 5
+        assert all(item["id"] == "sim1" for item in page["items"])
+
+    def test_query_pagination(self, store):
+        """カーソルで全件を重複なく取得できることのテスト"""
+        for i in range(25):
+            # 同一時刻の履歴が複数あってもページ境界で欠落しないこと
+            store.record("sim1", "10109999", "11", 1.0, "ok", timestamp=BASE + i // 3)
+        assert store.flush()
+
+        seen = []
+        cursor = None
+        while True:
+            page = store.query(limit=10, cursor=cursor)
+            seen.extend(page["items"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+
+        assert len(seen) == 25
+
+    def test_query_invalid_cursor(self, store):
+        """不正なカーソルでValueErrorとなることのテスト"""
+        with pytest.raises(ValueError):
+            store.query(cursor="invalid")
+
+    def test_prune(self, store):
+        """保持期間を過ぎた履歴が削除されることのテスト"""
+        store.record("sim1", "10109999", "11", 1.0, "ok", timestamp=BASE)
+        store.record("sim1", "10109999", "11", 1.0, "ok", timestamp=BASE + 2 * 86400)
+        assert store.flush()
+
+        assert store.prune(now=BASE + 2 * 86400) == 1
+        assert len(store.query()["items"]) == 1
+
+    def test_writer_survives_errors(self, tmp_path, monkeypatch):
+        """削除などでエラーが発生しても書き込みスレッドが動作し続けることのテスト"""
+        store = HistoryStore(tmp_path / "history.db", flush_interval=0.01, prune_interval=0)
+        failures = []
+
+        def failing_prune(now=None, conn=None):
+            failures.append(now)
+            raise OSError("disk I/O error")
+
+        monkeypatch.setattr(store, "prune", failing_prune)
+        store.start()
+        try:
+            store.record("sim1", "10109999", "11", 1.0, "ok", timestamp=BASE)
+            assert store.flush()
+            store.record("sim1", "01019999", "06", 1.0, "ok", timestamp=BASE + 1)
+            assert store.flush()
+
+            assert failures
+            assert store._thread.is_alive()
+            assert store.written == 2
+        finally:
+            store.close()
+
+        assert not store._thread
+
+    def test_source_column_is_added_to_old_database(self, tmp_path):
+        """source列が無い以前のデータベースに列が追加されることのテスト"""
+        path = tmp_path / "history.db"
+        conn = sqlite3.connect(str(path))
+        conn.execute(
+            "CREATE TABLE history (id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, "
+            "sim_id TEXT, alert TEXT, program TEXT, latency_ms REAL, result TEXT NOT NULL)"
+        )
+        conn.execute("INSERT INTO history (ts, result) VALUES (?, 'ok')", (BASE,))
+        conn.commit()
+        conn.close()
+
+        store = HistoryStore(path)
+        store.record(None, None, "05", 1.0, "ok", timestamp=BASE + 1, source="rule")
+        store.flush()
+
+        assert [item["source"] for item in store.query()["items"]] == ["http", "rule"]
+
+    def test_flush_without_thread(self, tmp_path):
+        """書き込みスレッド無しでもflushで書き込まれることのテスト"""
+        store = HistoryStore(tmp_path / "history.db")
+        store.record("sim1", "10109999", "11", 1.0, "ok")
+        store.flush()
+
+        assert len(store.query()["items"]) == 1
+
+
+class TestHistoryEndpoint:
+    """/api/historyエンドポイントのテスト"""
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        store = HistoryStore(tmp_path / "history.db")
+        store.start()
+        yield store
+        store.close()
+
+    def test_control_requests_are_recorded(self, store):
+        """/api/controlの結果が履歴に記録されることのテスト"""
+        server = HTTPServer(callback=lambda alert: True, history=store)
+        client = TestClient(server.get_app())
+
+        client.get("/api/control?alert=10109999&id=sim1")
+        client.get("/api/control?alert=1234&id=sim1")
+        assert store.flush()
+
+        response = client.get("/api/history?id=sim1")
+        assert response.status_code == 200
+        items = response.json()["items"]
+        assert [item["result"] for item in items] == ["ok", "invalid"]
+        assert items[0]["program"] == "11"
+        assert items[0]["alert"] == "10109999"
+
+    def test_actual_program_is_recorded(self, store):
+        """マッピング・時間帯ルールの適用後に切り替えたプログラムが記録されることのテスト"""
+        server = HTTPServer(
+            callback=lambda alert: CommandResult(ok=True, program="17"), history=store
+        )
+        client = TestClient(server.get_app())
+
+        response = client.get("/api/control?alert=10109999&id=sim1")
+        assert store.flush()
+
+        assert response.json()["program"] == "17"
+        item = store.query(sim_id="sim1")["items"][0]
+        assert (item["program"], item["source"]) == ("17", "http")
+
+    def test_scheduler_switches_are_recorded(self, store):
+        """時間帯ルール・スケジュールによる切り替えが記録元付きで記録されることのテスト"""
+        table = TimeRuleTable([TimeRule.from_dict(
+            {"pattern": "1111", "start": "22:00", "end": "06:00", "program": "17"}
+        )])
+        rules = RuleScheduler(table, lambda when: "17", lambda program: False, history=store)
+        rules.evaluate(datetime(2026, 10, 19, 22))
+
+        class _Controller:
+            program_commands = {"02": "00"}
+
+            def switch_program(self, program_id, deadline=None):
+                return CommandResult(ok=True, program=program_id)
+
+            def set_volume(self, volume):
+                return True
+
+        actions = ActionScheduler(
+            _Controller(), clock=lambda: datetime(2026, 10, 19, 12), history=store
+        )
+        actions.add({"action": "switch", "value": "02", "time": "13:00"})
+        # 音量変更などプログラムの切り替え以外は記録しない
+        actions.add({"action": "volume", "value": 10, "time": "13:00"})
+        actions.clock = lambda: datetime(2026, 10, 19, 14)
+        actions.run_pending()
+        assert store.flush()
+
+        items = store.query()["items"]
+        assert [(i["source"], i["program"], i["result"]) for i in items] == [
+            ("rule", "17", "failed"),
+            ("schedule", "02", "ok"),
+        ]
+        assert items[0]["id"] is None and items[0]["alert"] is None
+
+    def test_history_time_range(self, store):
+        """ISO 8601形式の時刻で検索できることのテスト"""
+        server = HTTPServer(history=store)
+        client = TestClient(server.get_app())
+
+        client.get("/api/control?alert=10109999&id=sim1")
+        assert store.flush()
+
+        response = client.get("/api/history?start=2000-01-01T00:00:00&end=2000-01-02T00:00:00")
+        assert response.status_code == 200
+        assert response.json()["items"] == []
+
+    def test_history_invalid_time(self, store):
+        """不正な時刻指定で400となることのテスト"""
+        client = TestClient(HTTPServer(history=store).get_app())
+
+        response = client.get("/api/history?start=yesterday")
+        assert response.status_code == 400
+
+    def test_history_disabled(self):
+        """履歴ストア未設定時は503となることのテスト"""
+        client = TestClient(HTTPServer().get_app())
+
+        response = client.get("/api/history")
+        assert response.status_code == 503
+        assert response.json()["detail"] == "History_disabled"
@@ -5,6 +5,8 @@ import pytest
 from fastapi.testclient import TestClient
 
 from src.http.server import HTTPServer
+from src.mapper.layout import AlertLayout
+from src.tbbox.state import DeviceStateSnapshot
 
 
 class TestHTTPServer:
@@ -98,6 +100,31 @@ class TestHTTPServer:
         # コールバックは呼ばれない
         assert len(callback_called) == 0
 
+    def test_control_endpoint_all_nines_with_status(self):
+        """すべて9のalertで現在の状態が返されることのテスト"""
+        snapshot = DeviceStateSnapshot()
+        snapshot.set_connected(True)
+        snapshot.record_switch("11", timestamp=1000.0)
+
+        server = HTTPServer(callback=lambda alert: True, status_snapshot=snapshot)
+        client = TestClient(server.get_app())
+
+        response = client.get("/api/control?alert=99999999")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert response.json() == {
+            "status": "ok",
+            "message": "No action (all 9s)",
+            "program": "11",
+            "volume": None,
+            "playing": True,
+            "connected": True,
+            "last_switch_at": 1000.0,
+            "state_source": "local",
+            "state_updated_at": 1000.0,
+        }
+
     def test_control_endpoint_callback_failure(self):
         """コールバックが失敗した場合のテスト"""
         def failing_callback(alert: str) -> bool:
@@ -181,6 +208,22 @@ class TestHTTPServer:
         assert server._calculate_program_id("9000") == "01"
         assert server._calculate_program_id("1919") == "11"  # 1010
 
+    def test_custom_layout(self):
+        """スイッチ数・桁数を変更した場合のテスト"""
+        server = HTTPServer(
+            callback=lambda alert: True,
+            layout=AlertLayout(switch_count=8, alert_length=12)
+        )
+        client = TestClient(server.get_app())
+
+        response = client.get("/api/control?alert=000000119999")
+        assert response.status_code == 200
+        assert response.json()["program"] == "04"
+
+        response = client.get("/api/control?alert=10109999")
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid_parameter_length"
+
 
 class TestHTTPServerAllPatterns:
     """全16パターンのテスト"""
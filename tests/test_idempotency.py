@@ -0,0 +1,298 @@
+"""
+IdempotencyCacheのテスト
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.http.idempotency import IdempotencyCache
+from src.http.server import HTTPServer
+
+
+class TestIdempotencyCache:
+    """IdempotencyCacheクラスのテスト"""
+
+    def test_concurrent_duplicates_share_future(self):
+        """処理中の重複リクエストが同じ結果を待つことのテスト"""
+        cache = IdempotencyCache()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "done"
+
+        async def main():
+            return await asyncio.gather(*[cache.run("k", work) for _ in range(5)])
+
+        results = asyncio.run(main())
+
+        assert len(calls) == 1
+        assert [r for r, _ in results] == ["done"] * 5
+        assert sorted(dup for _, dup in results) == [False, True, True, True, True]
+        assert cache.stats()["joined"] == 4
+
+    def test_completed_result_is_cached(self):
+        """完了後の重複リクエストにキャッシュ済みの結果を返すことのテスト"""
+        cache = IdempotencyCache(ttl=10)
+        calls = []
+
+        async def work():
+            calls.append(1)
+            return len(calls)
+
+        async def main():
+            first = await cache.run("k", work)
+            second = await cache.run("k", work)
+            return first, second
+
+        assert asyncio.run(main()) == ((1, False), (1, True))
+        assert cache.stats()["hits"] == 1
+
+    def test_ttl_expiry(self):
+        """TTL経過後は再実行されることのテスト"""
+        cache = IdempotencyCache(ttl=0.01)
+        calls = []
+
+        async def work():
+            calls.append(1)
+            return len(calls)
+
+        async def main():
+            await cache.run("k", work)
+            await asyncio.sleep(0.02)
+            return await cache.run("k", work)
+
+        assert asyncio.run(main()) == (2, False)
+
+    def test_not_cacheable_result(self):
+        """キャッシュ対象外の結果は完了後に再実行されることのテスト"""
+        cache = IdempotencyCache()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            return "failed"
+
+        async def main():
+            await cache.run("k", work, cacheable=lambda r: r == "ok")
+            return await cache.run("k", work, cacheable=lambda r: r == "ok")
+
+        assert asyncio.run(main()) == ("failed", False)
+        assert len(calls) == 2
+
+    def test_exception_propagates_and_is_not_cached(self):
+        """例外が伝播し、キャッシュされないことのテスト"""
+        cache = IdempotencyCache()
+
+        async def work():
+            raise ValueError("boom")
+
+        async def main():
+            with pytest.raises(ValueError):
+                await cache.run("k", work)
+            return cache.stats()["entries"]
+
+        assert asyncio.run(main()) == 0
+
+    def test_group_discards_previous_key(self):
+        """同じグループに別のキーが届いた場合に以前のエントリが破棄されることのテスト"""
+        cache = IdempotencyCache()
+
+        async def work():
+            return "ok"
+
+        async def main():
+            await cache.run("a", work, group="sim1")
+            await cache.run("b", work, group="sim1")
+            await cache.run("c", work, group="sim2")
+            return await cache.run("a", work, group="sim1"), await cache.run("c", work, group="sim2")
+
+        assert asyncio.run(main()) == (("ok", False), ("ok", True))
+
+    def test_lru_eviction(self):
+        """上限を超えた場合に古いエントリから破棄されることのテスト"""
+        cache = IdempotencyCache(max_entries=2)
+
+        async def work():
+            return "ok"
+
+        async def main():
+            for key in ("a", "b", "c"):
+                await cache.run(key, work)
+            return await cache.run("a", work)
+
+        assert asyncio.run(main()) == ("ok", False)
+        assert cache.stats()["entries"] == 2
+
+
+    def test_in_flight_entry_is_not_evicted(self):
+        """上限を超えても処理中のエントリは破棄されず、処理中の再送がまとめられることのテスト"""
+        cache = IdempotencyCache(max_entries=1)
+        calls = []
+
+        async def slow():
+            calls.append("a")
+            await asyncio.sleep(0.05)
+            return "a"
+
+        async def fast():
+            return "b"
+
+        async def main():
+            first = asyncio.ensure_future(cache.run("a", slow))
+            await asyncio.sleep(0)
+            await cache.run("b", fast)
+            retransmit = await cache.run("a", slow)
+            return await first, retransmit
+
+        assert asyncio.run(main()) == (("a", False), ("a", True))
+        assert calls == ["a"]
+
+    def test_run_sync_from_threads(self):
+        """run_sync()で複数のスレッドから届いた同じキーが1回にまとめられることのテスト"""
+        cache = IdempotencyCache()
+        calls = []
+        started = threading.Event()
+
+        def work():
+            calls.append(1)
+            started.set()
+            time.sleep(0.05)
+            return "ok"
+
+        results = []
+        first = threading.Thread(target=lambda: results.append(cache.run_sync("k", work)))
+        first.start()
+        started.wait(1)
+        second = threading.Thread(target=lambda: results.append(cache.run_sync("k", work)))
+        second.start()
+        first.join()
+        second.join()
+
+        assert calls == [1]
+        assert sorted(results) == [("ok", False), ("ok", True)]
+        assert cache.run_sync("k", work) == ("ok", True)
+        assert cache.stats()["joined"] == 1
+
+    def test_run_sync_group(self):
+        """run_sync()でも同じグループに別のキーが届いた場合に以前のエントリが破棄されることのテスト"""
+        cache = IdempotencyCache()
+
+        assert cache.run_sync("a", lambda: "A", group="sim1") == ("A", False)
+        assert cache.run_sync("b", lambda: "B", group="sim1") == ("B", False)
+        assert cache.run_sync("a", lambda: "A", group="sim1") == ("A", False)
+        assert cache.run_sync("a", lambda: "A", group="sim1") == ("A", True)
+
+    def test_run_sync_exception_is_not_cached(self):
+        cache = IdempotencyCache()
+
+        def fail():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            cache.run_sync("k", fail)
+        assert cache.run_sync("k", lambda: "ok") == ("ok", False)
+
+
+class TestIdempotentControl:
+    """/api/control の再送リクエストのテスト"""
+
+    def test_retransmit_does_not_switch_twice(self):
+        """同じリクエストの再送でコールバックが1回だけ呼ばれることのテスト"""
+        calls = []
+        server = HTTPServer(callback=lambda alert: calls.append(alert) or True,
+                            idempotency=IdempotencyCache())
+        client = TestClient(server.get_app())
+
+        first = client.get("/api/control?alert=10109999&id=sim1")
+        second = client.get("/api/control?alert=10109999&id=sim1")
+
+        assert first.content == second.content
+        assert calls == ["10109999"]
+
+        # 別のSIM IDは別リクエストとして扱う
+        client.get("/api/control?alert=10109999&id=sim2")
+        assert len(calls) == 2
+
+    def test_changed_alert_is_not_collapsed(self):
+        """A→B→Aの3回目が再送として捨てられないことのテスト"""
+        calls = []
+        server = HTTPServer(callback=lambda alert: calls.append(alert) or True,
+                            idempotency=IdempotencyCache())
+        client = TestClient(server.get_app())
+
+        for alert in ("10109999", "01019999", "10109999", "10109999"):
+            client.get(f"/api/control?alert={alert}&id=sim1")
+
+        # 4回目は3回目の再送としてまとめられる
+        assert calls == ["10109999", "01019999", "10109999"]
+
+    def test_idempotency_key_header(self):
+        """Idempotency-Keyヘッダで重複判定されることのテスト"""
+        calls = []
+        server = HTTPServer(callback=lambda alert: calls.append(alert) or True,
+                            idempotency=IdempotencyCache())
+        client = TestClient(server.get_app())
+
+        client.get("/api/control?alert=10109999", headers={"Idempotency-Key": "req-1"})
+        client.get("/api/control?alert=10109999", headers={"Idempotency-Key": "req-1"})
+        client.get("/api/control?alert=10109999", headers={"Idempotency-Key": "req-2"})
+
+        assert len(calls) == 2
+
+    def test_failed_switch_is_retried(self):
+        """失敗した切り替えは再送で再実行されることのテスト"""
+        calls = []
+        server = HTTPServer(callback=lambda alert: calls.append(alert) and False,
+                            idempotency=IdempotencyCache())
+        client = TestClient(server.get_app())
+
+        client.get("/api/control?alert=10109999&id=sim1")
+        response = client.get("/api/control?alert=10109999&id=sim1")
+
+        assert response.status_code == 500
+        assert len(calls) == 2
+
+    def test_concurrent_retransmits(self):
+        """処理中に届いた再送がTBBOXへのコマンドを増やさないことのテスト"""
+        calls = []
+        lock = threading.Lock()
+
+        def slow_callback(alert: str) -> bool:
+            with lock:
+                calls.append(alert)
+            time.sleep(0.1)
+            return True
+
+        server = HTTPServer(callback=slow_callback, idempotency=IdempotencyCache())
+
+        with TestClient(server.get_app()) as client:
+            threads = [
+                threading.Thread(target=client.get, args=("/api/control?alert=10109999&id=sim1",))
+                for _ in range(5)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        assert calls == ["10109999"]
+
+    def test_requests_without_id_are_keyed_by_client_ip(self):
+        """idの無いリクエストは送信元IPごとに区別されることのテスト"""
+        calls = []
+        server = HTTPServer(callback=lambda alert: calls.append(alert) or True,
+                            idempotency=IdempotencyCache())
+
+        async def main():
+            for client_ip in ("192.0.2.1", "192.0.2.2", "192.0.2.1"):
+                await server._handle_control("10109999", None, client_ip=client_ip)
+
+        asyncio.run(main())
+
+        # 別のlinkbaseの同じalertはまとめず、同じlinkbaseの再送はまとめる
+        assert calls == ["10109999", "10109999"]
@@ -0,0 +1,94 @@
+"""
+LeanControlAppのテスト
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+from src.http.lean import LeanControlApp, parse_control_query
+from src.http.server import HTTPServer
+from src.tbbox.state import DeviceStateSnapshot
+
+
+class TestParseControlQuery:
+    """parse_control_queryのテスト"""
+
+    def test_parse(self):
+        assert parse_control_query(b"alert=10109999&id=123") == ("10109999", "123")
+
+    def test_parse_empty(self):
+        assert parse_control_query(b"") == (None, None)
+        assert parse_control_query(b"alert=") == ("", None)
+        assert parse_control_query(b"alert") == ("", None)
+
+    def test_parse_escaped(self):
+        assert parse_control_query(b"alert=101099%399&id=a+b") == ("10109999", "a b")
+
+    def test_parse_last_value_wins(self):
+        """同じキーが複数ある場合は最後の値を採用することのテスト"""
+        assert parse_control_query(b"alert=00009999&alert=11119999") == ("11119999", None)
+
+
+class TestLeanControlApp:
+    """LeanControlAppがFastAPIと同じレスポンスを返すことのテスト"""
+
+    @pytest.fixture(params=[True, False, None], ids=["success", "failure", "no_callback"])
+    def server(self, request):
+        if request.param is None:
+            return HTTPServer()
+
+        def callback(alert: str) -> bool:
+            if alert.startswith("0000"):
+                raise ValueError("Test exception")
+            return request.param
+
+        return HTTPServer(callback=callback, status_snapshot=DeviceStateSnapshot())
+
+    @pytest.mark.parametrize(
+        "query",
+        [
+            "",
+            "?alert=",
+            "?alert=1234",
+            "?alert=123456789",
+            "?alert=12349999",
+            "?alert=99999999",
+            "?alert=10109999&id=8942310222000544338",
+            "?alert=11119999",
+            "?alert=19199999",
+            "?alert=00009999",
+        ],
+    )
+    def test_wire_compatible(self, server, query):
+        """FastAPIのルートとステータス・ボディが一致することのテスト"""
+        fastapi_client = TestClient(server.get_app())
+        lean_client = TestClient(LeanControlApp(server))
+
+        expected = fastapi_client.get(f"/api/control{query}")
+        actual = lean_client.get(f"/api/control{query}")
+
+        assert actual.status_code == expected.status_code
+        assert actual.content == expected.content
+        assert actual.headers["content-type"] == expected.headers["content-type"]
+
+    def test_other_paths_are_delegated(self):
+        """/api/control 以外はFastAPIに委譲されることのテスト"""
+        server = HTTPServer(lean_control=True)
+        client = TestClient(server.get_asgi_app())
+
+        response = client.get("/health")
+
+        assert response.status_code == 200
+        assert response.json() == {"status": "healthy"}
+
+    def test_method_not_allowed(self):
+        """GET以外は405となることのテスト"""
+        client = TestClient(LeanControlApp(HTTPServer()))
+
+        response = client.post("/api/control?alert=10109999")
+
+        assert response.status_code == 405
+
+    def test_get_asgi_app_default(self):
+        """lean_control無効時はFastAPIアプリを返すことのテスト"""
+        server = HTTPServer()
+        assert server.get_asgi_app() is server.get_app()
@@ -0,0 +1,140 @@
+"""
+benchmarks/microbench.py（ホットパスのマイクロベンチマーク）のテスト
+"""
+import json
+
+import pytest
+
+from benchmarks import microbench
+from benchmarks.microbench import StageResult, compare, load_baseline, measure_allocations, save_baseline
+
+
+def _result(name="parse_alert", ns=1000.0, alloc=100.0, retained=0.0, calibration=100.0):
+    return StageResult(name=name, ns_per_op=ns, alloc_bytes=alloc,
+                       retained_bytes=retained, calibration_ns=calibration)
+
+
+def _baseline(**entries):
+    return {"stages": entries}
+
+
+class TestMeasurement:
+    """計測のテスト"""
+
+    def test_measures_allocation_peak(self):
+        result = measure_allocations(lambda: bytearray(10000))
+
+        assert 9900 <= result["alloc_bytes"] < 11000
+        assert result["retained_bytes"] == 0
+
+    def test_measures_retained_memory(self):
+        kept = []
+
+        result = measure_allocations(lambda: kept.append(bytearray(1000)))
+
+        assert result["retained_bytes"] >= 1000
+
+    def test_allocation_free_function(self):
+        value = (1, 2, 3)
+
+        result = measure_allocations(lambda: value[1])
+
+        assert result["alloc_bytes"] == 0
+
+    def test_unknown_stage(self):
+        with pytest.raises(ValueError):
+            microbench.run_suite(["no_such_stage"])
+
+
+class TestCompare:
+    """ベースラインとの比較のテスト"""
+
+    def test_within_tolerance(self):
+        results = [_result(ns=1200.0, calibration=100.0)]
+        baseline = _baseline(parse_alert={"relative": 10.0, "alloc_bytes": 100.0, "retained_bytes": 0})
+
+        assert compare(results, baseline, tolerance=0.3) == []
+        assert results[0].regressions == []
+
+    def test_time_is_compared_relative_to_calibration(self):
+        # 2倍遅いマシンでは基準処理も2倍になるため回帰とはみなさない
+        slow_machine = [_result(ns=2000.0, calibration=200.0)]
+        regressed = [_result(ns=2000.0, calibration=100.0)]
+        baseline = _baseline(parse_alert={"relative": 10.0, "alloc_bytes": 100.0})
+
+        assert compare(slow_machine, baseline) == []
+        assert compare(regressed, baseline) == regressed
+        assert "処理時間" in regressed[0].regressions[0]
+
+    def test_allocation_regression(self):
+        results = [_result(alloc=400.0)]
+        baseline = _baseline(parse_alert={"relative": 10.0, "alloc_bytes": 100.0})
+
+        assert compare(results, baseline, check_time=False) == results
+        assert "確保量" in results[0].regressions[0]
+
+    def test_small_allocation_changes_are_tolerated(self):
+        results = [_result(alloc=32.0)]
+        baseline = _baseline(parse_alert={"relative": 10.0, "alloc_bytes": 0.0})
+
+        assert compare(results, baseline) == []
+
+    def test_retained_memory_regression(self):
+        results = [_result(retained=1000.0)]
+        baseline = _baseline(parse_alert={"relative": 10.0, "alloc_bytes": 100.0, "retained_bytes": 0})
+
+        assert compare(results, baseline) == results
+        assert "残存量" in results[0].regressions[0]
+
+    def test_per_stage_tolerance(self):
+        results = [_result(ns=1800.0)]
+        baseline = _baseline(parse_alert={"relative": 10.0, "alloc_bytes": 100.0, "tolerance": 1.0})
+
+        assert compare(results, baseline, tolerance=0.1) == []
+
+    def test_stage_without_baseline_is_skipped(self):
+        results = [_result(name="new_stage", ns=1e9)]
+
+        assert compare(results, _baseline()) == []
+        assert "ベースラインなし" in microbench.format_results(results)
+
+
+class TestBaselineFile:
+    """ベースラインファイルのテスト"""
+
+    def test_save_keeps_other_stages_and_tolerance(self, tmp_path):
+        path = tmp_path / "baseline.json"
+        path.write_text(json.dumps(_baseline(
+            parse_alert={"relative": 1.0, "alloc_bytes": 1.0, "tolerance": 0.5},
+            validate_alert={"relative": 2.0, "alloc_bytes": 2.0},
+        )), encoding="utf-8")
+
+        save_baseline([_result(ns=3000.0, alloc=50.0)], path)
+        baseline = load_baseline(path)
+
+        assert baseline["stages"]["parse_alert"]["relative"] == 30.0
+        assert baseline["stages"]["parse_alert"]["alloc_bytes"] == 50.0
+        assert baseline["stages"]["parse_alert"]["tolerance"] == 0.5
+        assert baseline["stages"]["validate_alert"]["relative"] == 2.0
+        assert baseline["recorded_on"]["calibration_ns"] == 100.0
+
+    def test_missing_file(self, tmp_path):
+        assert load_baseline(tmp_path / "none.json") == {"stages": {}}
+
+    def test_repository_baseline_covers_every_stage(self):
+        stages = load_baseline()["stages"]
+
+        assert sorted(stages) == sorted(stage.name for stage in microbench.STAGES)
+
+
+class TestHotPathAllocations:
+    """ホットパスのメモリ確保量がベースラインを超えていないことの確認"""
+
+    def test_no_allocation_regression(self):
+        # 処理時間は実行環境の負荷で変動するため、ここではメモリ確保量のみ確認する
+        # （処理時間は python -m benchmarks.microbench で確認する）
+        results = microbench.run_suite(min_time=0.001)
+
+        regressed = compare(results, load_baseline(), check_time=False)
+
+        assert regressed == [], microbench.format_results(results)
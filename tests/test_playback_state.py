@@ -0,0 +1,258 @@
+"""
+再生状態の問い合わせ・キャッシュのテスト
+"""
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from src.http.server import HTTPServer
+from src.tbbox.playlist import PlaylistController
+from src.tbbox.protocol import CommandResult, parse_playback_state
+from src.tbbox.state import DeviceStateSnapshot
+from src.tbbox.supervisor import ConnectionSupervisor
+
+STATUS_COMMAND = "41564f4e0200000051521e00010400000000000000000000"
+
+
+class _FakeClient:
+    """送信したコマンドを記録し、決まった結果を返すクライアント"""
+
+    def __init__(self, result=None, authenticated=True):
+        self.result = result or CommandResult(ok=True)
+        self.is_authenticated = authenticated
+        self.sent = []
+        self.reconnect_result = True
+
+    def add_connection_listener(self, listener):
+        pass
+
+    def execute(self, hex_command, max_retry=5, deadline=None):
+        self.sent.append(hex_command)
+        return self.result
+
+    def send_command(self, hex_command, max_retry=5, deadline=None):
+        return self.execute(hex_command, max_retry, deadline).ok
+
+    def ensure_connected(self, deadline=None):
+        self.is_authenticated = bool(self.reconnect_result)
+        return self.reconnect_result
+
+    def close(self):
+        pass
+
+
+class TestParsePlaybackState:
+    """parse_playback_stateのテスト"""
+
+    def test_full_payload(self):
+        state = parse_playback_state({"program": 3, "ratio": 50, "state": "play"})
+        assert state == {"program": "03", "volume": 50, "playing": True}
+
+    def test_paused(self):
+        assert parse_playback_state({"status": "paused"}) == {"playing": False}
+        assert parse_playback_state({"playing": False}) == {"playing": False}
+
+    def test_unknown_payload(self):
+        """読み取れない項目は含まれないことのテスト"""
+        assert parse_playback_state(None) == {}
+        assert parse_playback_state({"foo": 1, "state": "unknown"}) == {}
+
+
+class TestSnapshotFreshness:
+    """DeviceStateSnapshotの再生状態の有効期間のテスト"""
+
+    def test_device_state_is_fresh_within_ttl(self):
+        snapshot = DeviceStateSnapshot()
+        snapshot.record_playback(source="device", timestamp=1000.0, program="11", playing=True)
+
+        assert snapshot.is_fresh(30, now=1020.0)
+        assert not snapshot.is_fresh(30, now=1031.0)
+
+    def test_local_state_is_not_fresh(self):
+        """送信したコマンドからの推定はTBBOXの状態として扱わないことのテスト"""
+        snapshot = DeviceStateSnapshot()
+        snapshot.record_switch("11")
+
+        assert snapshot.get()["state_source"] == "local"
+        assert not snapshot.is_fresh(30)
+        assert not snapshot.is_playing("11", 30)
+
+    def test_none_fields_are_not_overwritten(self):
+        snapshot = DeviceStateSnapshot()
+        snapshot.record_playback(source="device", volume=50)
+        snapshot.record_playback(source="device", playing=False)
+
+        state = snapshot.get()
+        assert state["volume"] == 50
+        assert state["playing"] is False
+
+
+class TestQueryPlaybackState:
+    """PlaylistController.query_playback_stateのテスト"""
+
+    def test_updates_snapshot(self):
+        client = _FakeClient(CommandResult(ok=True, payload={"program": "05", "ratio": 30, "state": "play"}))
+        controller = PlaylistController(client, status_command=STATUS_COMMAND)
+
+        state = controller.query_playback_state()
+
+        assert client.sent == [STATUS_COMMAND]
+        assert state["program"] == "05"
+        assert state["volume"] == 30
+        assert state["playing"] is True
+        assert state["state_source"] == "device"
+        assert controller.state.is_fresh(30)
+
+    def test_failure_keeps_previous_state(self):
+        client = _FakeClient(CommandResult.failure("timeout", retryable=True))
+        controller = PlaylistController(client, status_command=STATUS_COMMAND)
+
+        assert controller.query_playback_state() is None
+        assert controller.state.get()["state_source"] is None
+
+    def test_disabled_without_command(self):
+        client = _FakeClient()
+        controller = PlaylistController(client, status_command="")
+
+        assert controller.query_playback_state() is None
+        assert client.sent == []
+
+    def test_local_commands_update_state(self):
+        """送信したコマンドから再生状態が推定されることのテスト"""
+        controller = PlaylistController(_FakeClient(), status_command="")
+
+        controller.pause()
+        assert controller.state.get()["playing"] is False
+        controller.resume()
+        assert controller.state.get()["playing"] is True
+        controller.set_volume(40)
+        assert controller.state.get()["volume"] == 40
+
+    def test_local_commands_wait_for_switch(self):
+        """一時停止・音量設定も切り替え中は送信・記録を待つことのテスト"""
+        client = _FakeClient()
+        controller = PlaylistController(client, status_command="")
+        done = threading.Event()
+
+        def pause_and_set_volume():
+            controller.pause()
+            controller.set_volume(40)
+            done.set()
+
+        # 切り替え中（送信から状態の記録までロックを保持している状態）を再現する
+        with controller._lock:
+            thread = threading.Thread(target=pause_and_set_volume)
+            thread.start()
+            assert not done.wait(0.1)
+            assert client.sent == []
+            assert controller._active == 1
+        thread.join(1)
+
+        assert done.is_set()
+        assert len(client.sent) == 2
+        assert controller.state.get()["volume"] == 40
+
+
+class TestSkipIfPlaying:
+    """再生中のプログラムへの切り替え省略のテスト"""
+
+    def test_skips_when_device_confirms(self):
+        client = _FakeClient()
+        controller = PlaylistController(client, status_command="", skip_if_playing_ttl=30)
+        controller.state.record_playback(source="device", program="01", playing=True)
+
+        assert controller.switch_program("01")
+        assert client.sent == []
+
+        # 別のプログラムは送信する
+        assert controller.switch_program("02")
+        assert len(client.sent) == 1
+
+    def test_sends_when_state_is_stale(self):
+        client = _FakeClient()
+        controller = PlaylistController(client, status_command="", skip_if_playing_ttl=30)
+        controller.state.record_playback(
+            source="device", timestamp=time.time() - 60, program="01", playing=True
+        )
+
+        assert controller.switch_program("01")
+        assert len(client.sent) == 1
+
+    def test_disabled_by_default(self):
+        client = _FakeClient()
+        controller = PlaylistController(client, status_command="")
+        controller.state.record_playback(source="device", program="01", playing=True)
+
+        controller.switch_program("01")
+        assert len(client.sent) == 1
+
+
+class TestConnectionSupervisor:
+    """ConnectionSupervisorのテスト"""
+
+    def test_refreshes_state_when_connected(self):
+        client = _FakeClient(CommandResult(ok=True, payload={"program": 2, "state": "play"}))
+        controller = PlaylistController(client, status_command=STATUS_COMMAND)
+        supervisor = ConnectionSupervisor(controller, interval=1)
+
+        supervisor.tick()
+
+        assert supervisor.refreshes == 1
+        assert controller.state.get()["program"] == "02"
+
+    def test_reconnects_when_disconnected(self):
+        client = _FakeClient(authenticated=False)
+        controller = PlaylistController(client, status_command="")
+        supervisor = ConnectionSupervisor(controller, interval=1)
+
+        supervisor.tick()
+
+        assert supervisor.reconnects == 1
+        assert client.is_authenticated
+
+    def test_skips_while_client_busy(self):
+        """コマンド送信中は再接続も問い合わせも行わないことのテスト"""
+        client = _FakeClient(authenticated=False)
+        client.reconnect_result = None
+        controller = PlaylistController(client, status_command=STATUS_COMMAND)
+        supervisor = ConnectionSupervisor(controller, interval=1)
+
+        supervisor.tick()
+
+        assert client.sent == []
+        assert supervisor.reconnects == 0
+
+    def test_start_stop(self):
+        controller = PlaylistController(_FakeClient(), status_command="")
+        supervisor = ConnectionSupervisor(controller, interval=0.05)
+
+        supervisor.start()
+        supervisor.stop()
+
+        assert supervisor._thread is None
+
+
+class TestStateEndpoint:
+    """/api/stateのテスト"""
+
+    def test_returns_cached_state(self):
+        snapshot = DeviceStateSnapshot()
+        snapshot.record_playback(source="device", program="11", volume=50, playing=True)
+        server = HTTPServer(status_snapshot=snapshot, state_ttl=30)
+
+        response = TestClient(server.get_app()).get("/api/state")
+
+        assert response.status_code == 200
+        body = response.json()
+        assert body["program"] == "11"
+        assert body["volume"] == 50
+        assert body["playing"] is True
+        assert body["fresh"] is True
+
+    def test_unavailable_without_snapshot(self):
+        server = HTTPServer()
+        response = TestClient(server.get_app()).get("/api/state")
+
+        assert response.status_code == 503
+        assert response.json()["detail"] == "State_unavailable"
@@ -0,0 +1,313 @@
+"""
+TBBOXプロトコル解析のテスト
+"""
+import json
+import socket
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from config import settings
+from src.http.server import HTTPServer
+from src.tbbox.client import TBBOXClient
+from src.tbbox.rtt import RTTEstimator
+from src.tbbox.protocol import (
+    HEADER,
+    MAGIC,
+    CommandResult,
+    decode_response,
+    encode_command,
+    frame_length,
+)
+
+
+def make_frame(status: int = 0, payload: bytes = b"", command: int = 0x1E, action: int = 0x0409) -> bytes:
+    """テスト用の応答フレームを作成"""
+    header = HEADER.pack(MAGIC, 2, b"QR", command, action, status, len(payload), 0, 0)
+    return header + payload
+
+
+class TestDecodeResponse:
+    """decode_responseのテスト"""
+
+    def test_success_frame(self):
+        """結果コード0のフレームが成功となることのテスト"""
+        result = decode_response(make_frame(payload=b'{"name":"01"}'))
+
+        assert result.ok
+        assert result.status == 0
+        assert result.command == 0x1E
+        assert result.action == 0x0409
+        assert result.payload == {"name": "01"}
+
+    def test_rejected_frame(self):
+        """結果コードが0以外のフレームは再送不可の失敗となることのテスト"""
+        result = decode_response(make_frame(status=3, payload=b'{"error":"no such program"}'))
+
+        assert not result.ok
+        assert result.error == "rejected"
+        assert result.status == 3
+        assert result.retryable is False
+        assert result.payload == {"error": "no such program"}
+
+    def test_truncated_frame(self):
+        """ペイロードが不足しているフレームは再送可能な失敗となることのテスト"""
+        frame = make_frame(payload=b'{"name":"01"}')
+        result = decode_response(frame[:-3])
+
+        assert not result.ok
+        assert result.error == "truncated"
+        assert result.retryable is True
+
+    def test_non_protocol_response(self):
+        """プロトコル外の応答は成功として扱うことのテスト"""
+        assert decode_response(b"OK").ok
+
+    def test_empty_response(self):
+        result = decode_response(b"")
+        assert not result.ok
+        assert result.retryable
+
+    def test_invalid_json_payload(self):
+        """JSONとして不正なペイロードは無視されることのテスト"""
+        result = decode_response(make_frame(payload=b"{invalid"))
+        assert result.ok
+        assert result.payload is None
+
+    def test_bool(self):
+        assert bool(CommandResult(ok=True)) is True
+        assert bool(CommandResult.failure("timeout", retryable=True)) is False
+
+
+class TestEncodeCommand:
+    """encode_commandのテスト"""
+
+    def test_encode(self):
+        assert encode_command("41 56\n4f4e") == b"AVON"
+
+    def test_existing_commands_are_valid_frames(self):
+        """設定済みのコマンドがヘッダのペイロード長と一致することのテスト"""
+        for command in settings.PROGRAM_COMMANDS.values():
+            data = encode_command(command)
+            assert frame_length(data) == len(data)
+            assert json.loads(data[24:])["name"]
+
+
+class _FixedResponseServer:
+    """ログインにはOK、以降は指定した応答を返すTCPサーバ"""
+
+    def __init__(self, response: bytes):
+        self.response = response
+        self.commands = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        conn, _ = self.sock.accept()
+        with conn:
+            first = True
+            while conn.recv(1024):
+                if first:
+                    conn.send(b"OK")
+                    first = False
+                    continue
+                self.commands += 1
+                # ヘッダとペイロードを分割して送信
+                conn.send(self.response[:10])
+                conn.send(self.response[10:])
+
+    def close(self):
+        self.sock.close()
+
+
+class _LateReplyServer:
+    """ログインにはOK、以降は別のコマンドの応答（遅延レスポンス）を送ってから指定した応答を返すTCPサーバ"""
+
+    def __init__(self, stale: bytes, response: bytes = b""):
+        self.stale = stale
+        self.response = response
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        conn, _ = self.sock.accept()
+        with conn:
+            first = True
+            while conn.recv(1024):
+                if first:
+                    conn.send(b"OK")
+                    first = False
+                    continue
+                conn.send(self.stale)
+                # 別々に受信されるよう間を空ける
+                time.sleep(0.05)
+                if self.response:
+                    conn.send(self.response)
+
+    def close(self):
+        self.sock.close()
+
+
+class _LateFirstReplyServer:
+    """
+    ログインにはOK、最初のコマンドにだけ遅れて拒否（結果コード7）を返し、
+    以降のコマンドには即座に成功を返すTCPサーバ（再接続を受け付ける）
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.commands = 0
+        self.connections = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(4)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            first = True
+            try:
+                while conn.recv(1024):
+                    if first:
+                        conn.send(b"OK")
+                        first = False
+                        continue
+                    self.commands += 1
+                    if self.commands == 1:
+                        time.sleep(self.delay)
+                        conn.send(make_frame(status=7))
+                    else:
+                        conn.send(make_frame())
+            except OSError:
+                pass
+
+    def close(self):
+        self.sock.close()
+
+
+class TestClientResult:
+    """TBBOXClientの結果解析と再送判定のテスト"""
+
+    def _client(self, port: int) -> TBBOXClient:
+        client = TBBOXClient()
+        client.host = "127.0.0.1"
+        client.port = port
+        return client
+
+    def test_rejected_command_is_not_retried(self):
+        """拒否されたコマンドは再送されないことのテスト"""
+        server = _FixedResponseServer(make_frame(status=5))
+        client = self._client(server.port)
+        try:
+            result = client.execute(settings.PROGRAM_COMMANDS["01"])
+            assert not result.ok
+            assert result.status == 5
+            assert server.commands == 1
+            assert client.send_command(settings.PROGRAM_COMMANDS["01"]) is False
+        finally:
+            client.close()
+            server.close()
+
+    def test_split_frame_is_reassembled(self):
+        """分割されて届いたフレームが結合されることのテスト"""
+        server = _FixedResponseServer(make_frame(payload=b'{"name":"01"}'))
+        client = self._client(server.port)
+        try:
+            result = client.execute(settings.PROGRAM_COMMANDS["01"])
+            assert result.ok
+            assert result.payload == {"name": "01"}
+        finally:
+            client.close()
+            server.close()
+
+
+    def test_mismatched_reply_is_discarded(self):
+        """送信したコマンドと種別・アクションが一致しない応答は破棄されることのテスト"""
+        stale = make_frame(payload=b'{"ratio":50}', command=0x26, action=0x0101)
+        server = _LateReplyServer(stale, make_frame(payload=b'{"name":"01"}'))
+        client = self._client(server.port)
+        try:
+            assert client.connect()
+            result = client._exchange(settings.PROGRAM_COMMANDS["01"])
+            assert result.ok
+            assert (result.command, result.action) == (0x1E, 0x0409)
+            assert result.payload == {"name": "01"}
+        finally:
+            client.close()
+            server.close()
+
+    def test_only_mismatched_reply_times_out(self):
+        """一致する応答が届かない場合はタイムアウトになることのテスト"""
+        stale = make_frame(command=0x26, action=0x0101)
+        server = _LateReplyServer(stale)
+        client = self._client(server.port)
+        try:
+            assert client.connect()
+            result = client._exchange(settings.PROGRAM_COMMANDS["01"], timeout=0.3)
+            assert not result.ok
+            assert result.error == "timeout"
+        finally:
+            client.close()
+            server.close()
+
+
+    def test_late_reply_after_retry_is_not_taken(self):
+        """タイムアウトしたコマンドの応答が再送の後に届いても、再送の応答として扱わないことのテスト"""
+        server = _LateFirstReplyServer(delay=0.3)
+        client = self._client(server.port)
+        client.rtt = RTTEstimator(initial_timeout=0.1, min_timeout=0.1, max_timeout=0.1)
+        client.resend_delay = 0
+        try:
+            # 再送は1件目の応答が届く前に送信される
+            result = client.execute(settings.PROGRAM_COMMANDS["01"], max_retry=3)
+            assert result.ok
+            assert result.status == 0
+            # 以降の応答も1件ずれない
+            result = client.execute(settings.PROGRAM_COMMANDS["02"], max_retry=1)
+            assert result.ok
+            assert result.status == 0
+            assert server.connections == 2
+        finally:
+            client.close()
+            server.close()
+
+
+class TestRejectedControl:
+    """TBBOXに拒否された場合の/api/control のテスト"""
+
+    def test_rejected_response(self):
+        server = HTTPServer(
+            callback=lambda alert: CommandResult(ok=False, status=7, error="rejected")
+        )
+        client = TestClient(server.get_app())
+
+        response = client.get("/api/control?alert=10109999")
+
+        assert response.status_code == 500
+        assert response.json() == {"detail": "Program_switch_rejected", "code": 7}
+
+    def test_command_result_success(self):
+        server = HTTPServer(callback=lambda alert: CommandResult(ok=True, status=0))
+        client = TestClient(server.get_app())
+
+        response = client.get("/api/control?alert=10109999")
+
+        assert response.status_code == 200
+        assert response.json() == {"status": "ok", "program": "11"}
@@ -0,0 +1,140 @@
+"""
+TokenBucketLimiterのテスト
+"""
+from fastapi.testclient import TestClient
+
+from src.http.idempotency import IdempotencyCache
+from src.http.rate_limit import TokenBucketLimiter
+from src.http.server import HTTPServer
+
+
+class TestTokenBucketLimiter:
+    """TokenBucketLimiterクラスのテスト"""
+
+    def test_burst_then_limited(self):
+        """バースト分を超えると制限されることのテスト"""
+        limiter = TokenBucketLimiter(rate=1, burst=3)
+
+        assert [limiter.acquire("a", now=0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+        assert limiter.acquire("a", now=0.0) == 1.0
+        assert limiter.stats()["limited"] == 1
+
+    def test_refill(self):
+        """経過時間に応じてトークンが補充されることのテスト"""
+        limiter = TokenBucketLimiter(rate=2, burst=1)
+
+        assert limiter.acquire("a", now=0.0) == 0.0
+        assert limiter.acquire("a", now=0.25) == 0.25
+        assert limiter.acquire("a", now=0.5) == 0.0
+
+    def test_keys_are_independent(self):
+        """キーごとに独立して制限されることのテスト"""
+        limiter = TokenBucketLimiter(rate=1, burst=1)
+
+        assert limiter.acquire("a", now=0.0) == 0.0
+        assert limiter.acquire("b", now=0.0) == 0.0
+        assert limiter.acquire("a", now=0.0) > 0
+
+    def test_multiple_keys_consume_all_or_nothing(self):
+        """複数キーのいずれかが空の場合はどのバケットも消費しないことのテスト"""
+        limiter = TokenBucketLimiter(rate=1, burst=1)
+
+        assert limiter.acquire("ip", now=0.0) == 0.0
+        assert limiter.acquire("id", "ip", now=0.0) > 0
+        # "id"のトークンは消費されていない
+        assert limiter.acquire("id", now=0.0) == 0.0
+
+    def test_idle_keys_are_evicted(self):
+        """アクセスの無いキーが破棄されることのテスト"""
+        limiter = TokenBucketLimiter(rate=1, burst=1, idle_timeout=10)
+
+        limiter.acquire("a", now=0.0)
+        limiter.acquire("b", now=5.0)
+        limiter.acquire("c", now=12.0)
+
+        stats = limiter.stats()
+        assert stats["active_keys"] == 2
+        assert stats["evicted"] == 1
+
+    def test_max_keys(self):
+        """最大キー数を超えないことのテスト"""
+        limiter = TokenBucketLimiter(rate=1, burst=1, max_keys=2)
+
+        for i in range(5):
+            limiter.acquire(f"k{i}", now=0.0)
+
+        assert limiter.stats()["active_keys"] == 2
+
+    def test_retry_after_header(self):
+        """Retry-Afterヘッダが整数秒に切り上げられることのテスト"""
+        assert TokenBucketLimiter.retry_after_header(0.2) == "1"
+        assert TokenBucketLimiter.retry_after_header(2.1) == "3"
+
+
+class TestRateLimitedControl:
+    """/api/control のレート制限のテスト"""
+
+    def test_too_many_requests(self):
+        """制限超過時に429とRetry-Afterが返されることのテスト"""
+        server = HTTPServer(
+            callback=lambda alert: True,
+            rate_limiter=TokenBucketLimiter(rate=0.5, burst=2)
+        )
+        client = TestClient(server.get_app())
+
+        for _ in range(2):
+            assert client.get("/api/control?alert=10109999&id=sim1").status_code == 200
+
+        response = client.get("/api/control?alert=10109999&id=sim1")
+        assert response.status_code == 429
+        assert response.json()["detail"] == "Too_many_requests"
+        assert response.headers["retry-after"] == "2"
+
+    def test_requests_not_sent_to_tbbox_are_not_limited(self):
+        """不正なalert・すべて9のリクエストはトークンを消費しないことのテスト"""
+        server = HTTPServer(
+            callback=lambda alert: True,
+            rate_limiter=TokenBucketLimiter(rate=0.5, burst=1)
+        )
+        client = TestClient(server.get_app())
+
+        for _ in range(3):
+            assert client.get("/api/control?alert=1234&id=sim1").status_code == 400
+            assert client.get("/api/control?alert=99999999&id=sim1").status_code == 200
+
+        assert client.get("/api/control?alert=10109999&id=sim1").status_code == 200
+        assert server.rate_limiter.limited == 0
+
+    def test_duplicate_is_not_limited(self):
+        """冪等性キャッシュの結果を返す再送はトークンを消費しないことのテスト"""
+        calls = []
+        server = HTTPServer(
+            callback=lambda alert: calls.append(alert) or True,
+            rate_limiter=TokenBucketLimiter(rate=0.5, burst=2),
+            idempotency=IdempotencyCache()
+        )
+        client = TestClient(server.get_app())
+
+        for _ in range(5):
+            assert client.get("/api/control?alert=10109999&id=sim1").status_code == 200
+        assert client.get("/api/control?alert=01019999&id=sim1").status_code == 200
+
+        response = client.get("/api/control?alert=11119999&id=sim1")
+        assert response.status_code == 429
+        assert calls == ["10109999", "01019999"]
+        assert server.result_counts["duplicate"] == 4
+
+    def test_metrics_endpoint(self):
+        """/api/metricsでカウンタが取得できることのテスト"""
+        server = HTTPServer(
+            callback=lambda alert: True,
+            rate_limiter=TokenBucketLimiter(rate=1, burst=1)
+        )
+        client = TestClient(server.get_app())
+
+        client.get("/api/control?alert=10109999&id=sim1")
+        client.get("/api/control?alert=10109999&id=sim1")
+
+        metrics = client.get("/api/metrics").json()
+        assert metrics["rate_limit"]["allowed"] == 1
+        assert metrics["rate_limit"]["limited"] == 1
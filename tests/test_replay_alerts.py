@@ -0,0 +1,172 @@
+"""
+benchmarks/replay_alerts.py（alertリプレイツール）のテスト
+"""
+import json
+import logging
+from datetime import datetime
+
+import pytest
+
+from benchmarks import replay_alerts
+from benchmarks.replay_alerts import AlertEvent, load_events, parse_log_line, replay_in_process
+from src.history.store import HistoryStore
+
+BASE = datetime(2026, 10, 1, 8, 0, 0).timestamp()
+
+
+@pytest.fixture
+def quiet_logger():
+    level = replay_alerts.logger.level
+    replay_alerts.logger.setLevel(logging.ERROR)
+    yield
+    replay_alerts.logger.setLevel(level)
+
+
+class TestParsing:
+    """記録ファイルの解析のテスト"""
+
+    def test_application_log_line(self):
+        event = parse_log_line(
+            "2026-10-01 08:00:00 - tbbox_switcher - INFO - "
+            "リクエスト受信: alert=10109999, id=8942310222000544338"
+        )
+        assert event == AlertEvent(BASE, "10109999", "8942310222000544338")
+
+    def test_application_log_missing_alert(self):
+        event = parse_log_line(
+            "2026-10-01 08:00:00 - tbbox_switcher - INFO - リクエスト受信: alert=None, id=None"
+        )
+        assert event.alert is None
+        assert event.sim_id is None
+
+    def test_access_log_line(self):
+        event = parse_log_line(
+            '192.168.0.10 - - [01/Oct/2026:08:00:00 +0000] '
+            '"GET /api/control?alert=01019999&id=abc HTTP/1.1" 200 35'
+        )
+        assert event.alert == "01019999"
+        assert event.sim_id == "abc"
+        assert event.ts == datetime.fromisoformat("2026-10-01T08:00:00+00:00").timestamp()
+
+    def test_iso_access_log_with_fraction(self):
+        event = parse_log_line("2026-10-01T08:00:00.250 GET /api/control?alert=10109999")
+        assert event.ts == pytest.approx(BASE + 0.25)
+        assert event.sim_id is None
+
+    def test_unrelated_lines_are_skipped(self):
+        assert parse_log_line("2026-10-01 08:00:00 - tbbox_switcher - INFO - 起動しました") is None
+        assert parse_log_line("GET /api/control?alert=10109999 (時刻なし)") is None
+
+    def test_load_log_sorts_by_time(self, tmp_path):
+        path = tmp_path / "app.log"
+        path.write_text(
+            "2026-10-01 08:00:05 - x - INFO - リクエスト受信: alert=01019999, id=b\n"
+            "2026-10-01 08:00:05 - x - INFO - プログラム切り替え成功: 06\n"
+            "2026-10-01 08:00:00 - x - INFO - リクエスト受信: alert=10109999, id=a\n",
+            encoding="utf-8"
+        )
+
+        events = load_events(path)
+
+        assert [e.sim_id for e in events] == ["a", "b"]
+
+    def test_load_jsonl(self, tmp_path):
+        path = tmp_path / "alerts.jsonl"
+        path.write_text(
+            json.dumps({"ts": BASE, "alert": "10109999", "id": "a"}) + "\n\n"
+            + json.dumps({"ts": "2026-10-01T08:00:01", "alert": "99999999"}) + "\n",
+            encoding="utf-8"
+        )
+
+        events = load_events(path)
+
+        assert [e.ts - BASE for e in events] == [0, 1]
+        assert events[1].sim_id is None
+
+    def test_load_jsonl_error_reports_line(self, tmp_path):
+        path = tmp_path / "alerts.jsonl"
+        path.write_text('{"alert": "10109999"}\n', encoding="utf-8")
+
+        with pytest.raises(ValueError, match="1行目"):
+            load_events(path)
+
+    def test_load_history_database(self, tmp_path):
+        path = tmp_path / "history.db"
+        store = HistoryStore(path, retention_days=3650)
+        store.start()
+        store.record("sim1", "10109999", "11", 1.0, "ok", timestamp=BASE + 2)
+        store.record("sim2", "01019999", "06", 1.0, "ok", timestamp=BASE)
+        assert store.flush()
+        store.close()
+
+        events = load_events(path)
+
+        assert [(e.sim_id, e.alert) for e in events] == [("sim2", "01019999"), ("sim1", "10109999")]
+
+    def test_query_string(self):
+        assert AlertEvent(0, "10109999", "a").query_string() == "alert=10109999&id=a"
+        assert AlertEvent(0, None, None).query_string() == ""
+
+
+class TestReplayInProcess:
+    """プロセス内での再生のテスト"""
+
+    def test_counts_switches_and_savings(self, quiet_logger):
+        events = [
+            AlertEvent(BASE, "10109999", "a"),
+            AlertEvent(BASE, "10109999", "a"),      # 同時の再送（処理中の要求に合流）
+            AlertEvent(BASE + 1, "10109999", "a"),  # 完了後の再送（キャッシュから応答）
+            AlertEvent(BASE + 2, "01019999", "a"),
+            AlertEvent(BASE + 3, "99999999", "a"),  # 状態問い合わせ
+            AlertEvent(BASE + 4, "12349999", "a"),  # パラメータエラー
+        ]
+
+        report = replay_in_process(events, speed=1000, latency=0.01)
+
+        assert report.events == 6
+        assert report.span == 4
+        assert report.statuses[200] == 5
+        assert report.statuses[400] == 1
+        assert report.results["invalid"] == 1
+        assert report.results["status"] == 1
+        assert report.switch_requests == 4
+        assert report.saved == 2
+        assert report.switch_calls == 2
+        assert report.tbbox_commands == 2
+        assert len(report.latencies) == 6
+
+        data = report.to_dict()
+        assert data["dedupe_hits"] + data["coalesced"] == 2
+        assert "切り替え要求: 4件" in report.format()
+
+    def test_preserves_inter_arrival_time(self, quiet_logger):
+        events = [AlertEvent(BASE, "99999999"), AlertEvent(BASE + 20, "99999999")]
+
+        report = replay_in_process(events, speed=100)
+
+        assert 0.18 <= report.elapsed < 1.0
+
+
+class TestMain:
+    """コマンドラインのテスト"""
+
+    def test_rejects_speed_out_of_range(self, tmp_path):
+        path = tmp_path / "app.log"
+        path.write_text("", encoding="utf-8")
+
+        with pytest.raises(SystemExit) as e:
+            replay_alerts.main([str(path), "--speed", "5000"])
+        assert e.value.code == 2
+
+    def test_json_output(self, tmp_path, capsys, quiet_logger):
+        path = tmp_path / "alerts.jsonl"
+        path.write_text(
+            "\n".join(json.dumps({"ts": BASE + i, "alert": "10109999", "id": str(i)}) for i in range(3)),
+            encoding="utf-8"
+        )
+
+        assert replay_alerts.main([str(path), "--speed", "1000", "--latency", "0", "--json"]) == 0
+
+        data = json.loads(capsys.readouterr().out)
+        assert data["events"] == 3
+        assert data["switch_calls"] == 3
@@ -0,0 +1,130 @@
+"""
+RTTEstimatorとTBBOXClientのタイムアウトのテスト
+"""
+import socket
+import threading
+import time
+
+import pytest
+
+from config import settings
+from src.tbbox.client import TBBOXClient
+from src.tbbox.rtt import RTTEstimator
+from src.tbbox.simulator import TBBOXSimulator
+
+
+class TestRTTEstimator:
+    """RTTEstimatorクラスのテスト"""
+
+    def test_initial_timeout(self):
+        """計測値が無い間は初期タイムアウトを使用することのテスト"""
+        estimator = RTTEstimator(initial_timeout=10, min_timeout=0.2, max_timeout=10)
+        assert estimator.timeout == 10
+
+    def test_first_sample(self):
+        """最初の計測値でSRTT=R, RTTVAR=R/2となることのテスト"""
+        estimator = RTTEstimator(min_timeout=0.0)
+        estimator.observe(0.1)
+
+        assert estimator.srtt == pytest.approx(0.1)
+        assert estimator.rttvar == pytest.approx(0.05)
+        assert estimator.timeout == pytest.approx(0.1 + 4 * 0.05)
+
+    def test_converges_to_stable_rtt(self):
+        """安定したRTTではタイムアウトが下限付近に収束することのテスト"""
+        estimator = RTTEstimator(min_timeout=0.2, max_timeout=10)
+        for _ in range(50):
+            estimator.observe(0.005)
+
+        assert estimator.srtt == pytest.approx(0.005, rel=0.01)
+        assert estimator.timeout == pytest.approx(0.2)
+
+    def test_timeout_backoff(self):
+        """タイムアウトごとにRTOが2倍になり、上限で止まることのテスト"""
+        estimator = RTTEstimator(min_timeout=0.2, max_timeout=1.0)
+        for _ in range(20):
+            estimator.observe(0.005)
+
+        estimator.on_timeout()
+        assert estimator.timeout == pytest.approx(0.4)
+        estimator.on_timeout()
+        estimator.on_timeout()
+        assert estimator.timeout == pytest.approx(1.0)
+
+        # 正常な応答で推定値に戻る
+        estimator.observe(0.005)
+        assert estimator.timeout == pytest.approx(0.2)
+
+
+class _SilentAfterServer:
+    """指定回数だけ応答し、それ以降は応答しないTCPサーバ"""
+
+    def __init__(self, responses: int):
+        self.responses = responses
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        conn, _ = self.sock.accept()
+        with conn:
+            count = 0
+            while True:
+                data = conn.recv(1024)
+                if not data:
+                    break
+                if count < self.responses:
+                    conn.send(b"OK")
+                count += 1
+
+    def close(self):
+        self.sock.close()
+
+
+class TestClientAdaptiveTimeout:
+    """TBBOXClientのレスポンス待ちタイムアウトのテスト"""
+
+    def test_lost_response_detected_quickly(self):
+        """RTTが安定していれば応答の欠落を短時間で検出することのテスト"""
+        # ログイン + 20コマンドに応答し、その後は応答しない
+        server = _SilentAfterServer(responses=21)
+        client = TBBOXClient()
+        client.host = "127.0.0.1"
+        client.port = server.port
+        client.rtt = RTTEstimator(initial_timeout=10, min_timeout=0.2, max_timeout=10)
+
+        try:
+            assert client.connect()
+            for _ in range(20):
+                assert client._send_raw_command("00")
+
+            started = time.perf_counter()
+            assert client._send_raw_command("00") is False
+            elapsed = time.perf_counter() - started
+
+            assert elapsed < 1.0
+            assert client.rtt.stats()["timeouts"] == 1
+        finally:
+            client.close()
+            server.close()
+
+    def test_retransmission_is_not_sampled(self, monkeypatch):
+        """再送したコマンドの応答はRTTの推定に反映しないことのテスト（Karnのアルゴリズム）"""
+        monkeypatch.setattr("src.tbbox.client.time.sleep", lambda seconds: None)
+        simulator = TBBOXSimulator()
+        simulator.inject("drop")
+        client = TBBOXClient(transport=simulator.transport())
+        client.rtt = RTTEstimator(initial_timeout=0.1, min_timeout=0.05, max_timeout=1.0)
+        try:
+            assert client.execute(settings.PROGRAM_COMMANDS["02"], max_retry=3)
+            assert client.rtt.stats()["timeouts"] == 1
+            assert client.rtt.stats()["samples"] == 0
+
+            # 再送の無いコマンドは反映する
+            assert client.execute(settings.PROGRAM_COMMANDS["03"], max_retry=3)
+            assert client.rtt.stats()["samples"] == 1
+        finally:
+            client.close()
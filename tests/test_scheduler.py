@@ -0,0 +1,267 @@
+"""
+ActionSchedulerのテスト
+"""
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.http.server import HTTPServer
+from src.scheduler.scheduler import ActionScheduler, ScheduleEntry
+
+# 2026-10-19は月曜日
+MONDAY = datetime(2026, 10, 19, 12, 0)
+
+
+class _FakeController:
+    """実行した操作を記録するPlaylistController"""
+
+    def __init__(self):
+        self.program_commands = {"01": "00", "02": "00"}
+        self.calls = []
+
+    def switch_program(self, program_id, deadline=None):
+        self.calls.append(("switch", program_id))
+        return True
+
+    def set_volume(self, volume):
+        self.calls.append(("volume", volume))
+        return True
+
+    def pause(self):
+        self.calls.append(("pause",))
+        return True
+
+    def resume(self):
+        self.calls.append(("resume",))
+        return True
+
+    def stop(self):
+        self.calls.append(("stop",))
+        return False
+
+
+class _Clock:
+    """テスト用の時計"""
+
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def __call__(self) -> datetime:
+        return self.now
+
+    def advance(self, **kwargs) -> None:
+        self.now += timedelta(**kwargs)
+
+
+@pytest.fixture
+def clock():
+    return _Clock(MONDAY)
+
+
+@pytest.fixture
+def controller():
+    return _FakeController()
+
+
+class TestScheduleEntry:
+    """ScheduleEntryのテスト"""
+
+    def test_from_dict_defaults(self):
+        entry = ScheduleEntry.from_dict({"action": "pause", "time": "7:05"})
+
+        assert entry.time == "07:05"
+        assert len(entry.days) == 7
+        assert entry.value is None
+        assert entry.enabled
+
+    @pytest.mark.parametrize("data", [
+        {"action": "jump", "time": "22:00"},
+        {"action": "volume", "time": "22:00"},
+        {"action": "volume", "value": 150, "time": "22:00"},
+        {"action": "switch", "time": "22:00"},
+        {"action": "pause", "time": "24:00"},
+        {"action": "pause", "time": "22:00", "days": ["xyz"]},
+        {"action": "pause", "time": "22:00", "days": "mon"},
+    ])
+    def test_invalid(self, data):
+        with pytest.raises(ValueError):
+            ScheduleEntry.from_dict(data)
+
+    def test_next_run(self):
+        entry = ScheduleEntry.from_dict({"action": "stop", "time": "22:00", "days": ["mon", "wed"]})
+
+        assert entry.next_run(MONDAY) == MONDAY.replace(hour=22)
+        assert entry.next_run(MONDAY.replace(hour=22)) == datetime(2026, 10, 21, 22, 0)
+        # 水曜日の次は翌週月曜日
+        assert entry.next_run(datetime(2026, 10, 21, 23, 0)) == datetime(2026, 10, 26, 22, 0)
+
+    def test_disabled_entry_has_no_next_run(self):
+        entry = ScheduleEntry.from_dict({"action": "stop", "time": "22:00", "enabled": False})
+        assert entry.next_run(MONDAY) is None
+
+
+class TestActionScheduler:
+    """ActionSchedulerのテスト"""
+
+    def test_runs_due_entries_in_order(self, controller, clock):
+        scheduler = ActionScheduler(controller, clock=clock)
+        scheduler.add({"action": "volume", "value": 30, "time": "22:00"})
+        scheduler.add({"action": "switch", "value": "02", "time": "21:00"})
+
+        clock.advance(hours=9, minutes=30)
+        assert scheduler.run_pending() == 1
+        assert controller.calls == [("switch", "02")]
+
+        clock.advance(hours=1)
+        assert scheduler.run_pending() == 1
+        assert controller.calls[-1] == ("volume", 30)
+
+        # 同じ日に再実行されない
+        assert scheduler.run_pending() == 0
+
+    def test_next_run_is_rescheduled(self, controller, clock):
+        scheduler = ActionScheduler(controller, clock=clock)
+        entry = scheduler.add({"action": "pause", "time": "13:00"})
+
+        clock.advance(hours=1)
+        scheduler.run_pending()
+
+        described = scheduler.get(entry["id"])
+        assert described["runs"] == 1
+        assert described["last_result"] is True
+        assert described["next_run"] == "2026-10-20T13:00:00"
+
+    def test_missed_runs_are_coalesced_after_clock_jump(self, controller, clock):
+        """時計が進んだ場合に過ぎた実行時刻が1回にまとめられることのテスト"""
+        scheduler = ActionScheduler(controller, clock=clock)
+        entry = scheduler.add({"action": "volume", "value": 30, "time": "13:00"})
+
+        clock.advance(days=14)
+        assert scheduler.run_pending() == 1
+        assert controller.calls == [("volume", 30)]
+        assert scheduler.get(entry["id"])["next_run"] == "2026-11-02T13:00:00"
+
+    def test_wait_is_capped(self, controller, clock):
+        """時計の補正を検出できるよう、待機が上限で打ち切られることのテスト"""
+        scheduler = ActionScheduler(controller, clock=clock)
+        scheduler.MAX_WAIT = 0.01
+        scheduler.add({"action": "pause", "time": "13:00"})
+        scheduler.start()
+        try:
+            # 通知せずに時計だけを進める
+            clock.advance(hours=2)
+            for _ in range(100):
+                if controller.calls:
+                    break
+                time.sleep(0.01)
+        finally:
+            scheduler.stop()
+
+        assert controller.calls == [("pause",)]
+
+    def test_update_and_remove(self, controller, clock):
+        scheduler = ActionScheduler(controller, clock=clock)
+        entry = scheduler.add({"action": "pause", "time": "13:00"})
+
+        updated = scheduler.update(entry["id"], {"action": "resume", "time": "14:00"})
+        assert updated["action"] == "resume"
+
+        # 変更前の実行時刻では実行されない
+        clock.advance(hours=1, minutes=30)
+        assert scheduler.run_pending() == 0
+        clock.advance(hours=1)
+        assert scheduler.run_pending() == 1
+        assert controller.calls == [("resume",)]
+
+        assert scheduler.remove(entry["id"])
+        assert not scheduler.remove(entry["id"])
+        assert scheduler.update(entry["id"], {"action": "pause", "time": "13:00"}) is None
+        clock.advance(days=1)
+        assert scheduler.run_pending() == 0
+
+    def test_rejects_unknown_program(self, controller, clock):
+        scheduler = ActionScheduler(controller, clock=clock)
+        with pytest.raises(ValueError):
+            scheduler.add({"action": "switch", "value": "99", "time": "13:00"})
+
+    def test_failure_is_recorded(self, controller, clock):
+        scheduler = ActionScheduler(controller, clock=clock)
+        entry = scheduler.add({"action": "stop", "time": "12:30"})
+
+        clock.advance(hours=1)
+        scheduler.run_pending()
+
+        assert scheduler.get(entry["id"])["last_result"] is False
+
+    def test_persistence(self, controller, clock, tmp_path):
+        path = tmp_path / "schedules.json"
+        scheduler = ActionScheduler(controller, path=path, clock=clock)
+        entry = scheduler.add({"action": "volume", "value": 20, "time": "22:00", "name": "夜間"})
+
+        saved = json.loads(path.read_text(encoding="utf-8"))
+        assert saved["items"][0]["id"] == entry["id"]
+
+        reloaded = ActionScheduler(controller, path=path, clock=clock)
+        assert [e["id"] for e in reloaded.entries()] == [entry["id"]]
+        assert reloaded.get(entry["id"])["name"] == "夜間"
+
+    def test_thread_wakes_at_deadline(self, controller):
+        """スケジューラスレッドが実行時刻に起きて実行することのテスト"""
+        scheduler = ActionScheduler(controller)
+        scheduler.start()
+        try:
+            run_at = datetime.now() + timedelta(minutes=1)
+            scheduler.add({"action": "pause", "time": run_at.strftime("%H:%M")})
+            # 時計を進める代わりに実行時刻を過ぎたことにする
+            scheduler.clock = lambda: datetime.now() + timedelta(minutes=2)
+            with scheduler._cond:
+                scheduler._cond.notify()
+            for _ in range(100):
+                if controller.calls:
+                    break
+                time.sleep(0.01)
+        finally:
+            scheduler.stop()
+
+        assert controller.calls == [("pause",)]
+
+
+class TestScheduleEndpoints:
+    """/api/schedulesのテスト"""
+
+    @pytest.fixture
+    def client(self, controller, clock):
+        server = HTTPServer(scheduler=ActionScheduler(controller, clock=clock))
+        return TestClient(server.get_app())
+
+    def test_crud(self, client):
+        response = client.post("/api/schedules", json={"action": "volume", "value": 30, "time": "22:00"})
+        assert response.status_code == 201
+        entry_id = response.json()["id"]
+        assert response.json()["next_run"] == "2026-10-19T22:00:00"
+
+        response = client.get("/api/schedules")
+        assert [e["id"] for e in response.json()["items"]] == [entry_id]
+
+        response = client.put(f"/api/schedules/{entry_id}", json={"action": "stop", "time": "23:00"})
+        assert response.status_code == 200
+        assert response.json()["action"] == "stop"
+
+        assert client.get(f"/api/schedules/{entry_id}").json()["time"] == "23:00"
+        assert client.delete(f"/api/schedules/{entry_id}").status_code == 204
+        assert client.get(f"/api/schedules/{entry_id}").status_code == 404
+        assert client.delete(f"/api/schedules/{entry_id}").status_code == 404
+
+    def test_invalid_schedule(self, client):
+        response = client.post("/api/schedules", json={"action": "volume", "time": "22:00"})
+        assert response.status_code == 400
+        assert response.json()["detail"].startswith("Invalid_schedule")
+
+    def test_disabled(self):
+        client = TestClient(HTTPServer().get_app())
+        response = client.get("/api/schedules")
+        assert response.status_code == 503
+        assert response.json()["detail"] == "Scheduler_disabled"
@@ -0,0 +1,108 @@
+"""
+ShardRouter（デバイスごとの処理のプロセス分散）のテスト
+"""
+import os
+from pathlib import Path
+
+import pytest
+
+from src.broker.shard import ShardFailure, ShardRouter, shard_for
+
+
+def _pid_job(job):
+    """実行したプロセスのPIDを返すジョブ"""
+    return os.getpid()
+
+
+def _crash_once_job(marker):
+    """初回は印のファイルを作成してプロセスを異常終了させ、2回目以降はPIDを返すジョブ"""
+    path = Path(marker)
+    if not path.exists():
+        path.touch()
+        os._exit(1)
+    return os.getpid()
+
+
+def _always_crash_job(job):
+    """常にプロセスを異常終了させるジョブ"""
+    os._exit(1)
+
+
+def _failing_job(job):
+    """例外を送出するジョブ"""
+    raise RuntimeError(f"失敗: {job}")
+
+
+class TestShardFor:
+    """ランデブーハッシュのテスト"""
+
+    def test_is_stable_and_spreads_keys(self):
+        keys = [f"192.168.0.{n}:16603" for n in range(200)]
+        owners = [shard_for(key, range(4)) for key in keys]
+
+        assert owners == [shard_for(key, [3, 2, 1, 0]) for key in keys]
+        counts = [owners.count(shard) for shard in range(4)]
+        assert min(counts) > 20
+
+    def test_only_keys_of_removed_shard_move(self):
+        keys = [f"device-{n}" for n in range(200)]
+        before = {key: shard_for(key, range(4)) for key in keys}
+        after = {key: shard_for(key, [0, 1, 3]) for key in keys}
+
+        moved = [key for key in keys if before[key] != after[key]]
+        assert moved
+        assert all(before[key] == 2 for key in moved)
+
+    def test_requires_candidates(self):
+        with pytest.raises(ValueError):
+            shard_for("device", [])
+
+
+class TestShardRouter:
+    """ShardRouterのテスト"""
+
+    def test_same_key_runs_on_same_worker(self):
+        keys = [f"device-{n}" for n in range(12)]
+        with ShardRouter(_pid_job, 3, threads=2) as router:
+            first = router.run({key: None for key in keys})
+            second = router.run({key: None for key in keys})
+            pids = {worker.pid for worker in router.workers}
+
+        assert list(first) == keys
+        assert first == second
+        assert set(first.values()) <= pids
+        assert os.getpid() not in pids
+        assert len(set(first.values())) > 1
+
+    def test_exception_is_reported_as_failure(self):
+        with ShardRouter(_failing_job, 2) as router:
+            results = router.run({"a": "x"})
+
+        assert isinstance(results["a"], ShardFailure)
+        assert "RuntimeError" in results["a"].reason
+
+    def test_rebalances_jobs_of_crashed_worker(self, tmp_path):
+        (tmp_path / "other").touch()
+        with ShardRouter(_crash_once_job, 2, threads=1, poll_interval=0.05) as router:
+            owner = router.owner("victim")
+            results = router.run({
+                "victim": str(tmp_path / "crashed"),
+                "other": str(tmp_path / "other"),
+            })
+            survivor = router.workers[1 - owner].pid
+
+            assert router.crashes >= 1
+            assert results["victim"] == survivor
+            assert router.alive() == {1 - owner}
+
+            # 終了したワーカーは次の実行時に再起動し、元の担当に戻る
+            again = router.run({"victim": str(tmp_path / "crashed")})
+            assert router.alive() == {0, 1}
+            assert again["victim"] == router.workers[owner].pid
+
+    def test_gives_up_after_max_attempts(self):
+        with ShardRouter(_always_crash_job, 2, max_attempts=2, poll_interval=0.05) as router:
+            results = router.run({"a": None})
+
+        assert results["a"] == ShardFailure("a", "worker_crashed")
+        assert router.crashes == 2
@@ -0,0 +1,211 @@
+"""
+終了処理（処理中のコマンドの完了待ち・状態の保存）とsystemd連携のテスト
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from config import settings
+from main import TBBOXPlaylistSwitcher
+from src.broker import WorkerPool
+from src.tbbox.client import TBBOXClient
+from src.tbbox.playlist import PlaylistController
+from src.tbbox.simulator import TBBOXSimulator
+from src.tbbox.state import DeviceStateSnapshot
+from src.utils import systemd
+
+
+@pytest.fixture
+def simulator():
+    return TBBOXSimulator(latency=0.2)
+
+
+@pytest.fixture
+def tbbox(simulator):
+    client = TBBOXClient(transport=simulator.transport())
+    yield client
+    client.close()
+
+
+class TestDrain:
+    """TBBOXClient.drain() のテスト"""
+
+    def test_waits_for_in_flight_and_queued_commands(self, simulator, tbbox):
+        threads = [
+            threading.Thread(target=tbbox.send_command, args=(settings.PROGRAM_COMMANDS[program],))
+            for program in ("03", "05")
+        ]
+        for thread in threads:
+            thread.start()
+        while tbbox.pending_commands < 2:
+            time.sleep(0.01)
+
+        assert tbbox.drain(5.0) is True
+        assert tbbox.pending_commands == 0
+        assert simulator.commands == 2
+        for thread in threads:
+            thread.join()
+
+    def test_times_out(self, tbbox):
+        thread = threading.Thread(target=tbbox.send_command, args=(settings.STOP_COMMAND,))
+        thread.start()
+        while not tbbox.pending_commands:
+            time.sleep(0.01)
+
+        assert tbbox.drain(0.01) is False
+        thread.join()
+        assert tbbox.drain(0) is True
+
+
+class TestStatePersistence:
+    """デバイス状態の保存・復元のテスト"""
+
+    def test_round_trip(self, tmp_path):
+        path = tmp_path / "data" / "state.json"
+        state = DeviceStateSnapshot()
+        state.set_connected(True)
+        state.record_switch("11", timestamp=1000.0)
+        state.record_playback(source="device", timestamp=1001.0, volume=30)
+        state.save(path)
+
+        restored = DeviceStateSnapshot()
+        assert restored.load(path) is True
+
+        assert restored.get() == dict(state.get(), connected=False)
+        assert not path.with_name("state.json.tmp").exists()
+
+    @pytest.mark.parametrize("content", [None, "{broken", "[]"])
+    def test_missing_or_invalid_file(self, tmp_path, content):
+        path = tmp_path / "state.json"
+        if content is not None:
+            path.write_text(content)
+
+        state = DeviceStateSnapshot()
+        assert state.load(path) is False
+        assert state.get()["program"] is None
+
+
+class TestSwitcherShutdown:
+    """TBBOXPlaylistSwitcherの終了処理のテスト"""
+
+    def test_cleanup_drains_and_saves_state(self, simulator, tbbox, tmp_path, monkeypatch):
+        path = tmp_path / "state.json"
+        monkeypatch.setattr(settings, "STATE_FILE", str(path))
+        app = TBBOXPlaylistSwitcher()
+        app.tbbox_client = tbbox
+        app.playlist_controller = PlaylistController(tbbox, state=app.device_state, status_command="")
+        thread = threading.Thread(target=app.playlist_controller.switch_program, args=("07",))
+        thread.start()
+        while not tbbox.pending_commands:
+            time.sleep(0.01)
+
+        app.request_shutdown()
+        app.cleanup()
+        thread.join()
+
+        # 送信中の切り替えは打ち切られずに完了し、その結果が保存される
+        assert simulator.program == "07"
+        assert json.loads(path.read_text())["program"] == "07"
+
+    def test_cleanup_waits_for_switch_to_be_recorded(self, simulator, tbbox, tmp_path, monkeypatch):
+        path = tmp_path / "state.json"
+        monkeypatch.setattr(settings, "STATE_FILE", str(path))
+        app = TBBOXPlaylistSwitcher()
+        app.tbbox_client = tbbox
+        app.playlist_controller = PlaylistController(tbbox, state=app.device_state, status_command="")
+        record_switch = app.device_state.record_switch
+
+        def slow_record_switch(*args, **kwargs):
+            # コマンドの応答後、状態の記録までに時間がかかる場合
+            time.sleep(0.3)
+            record_switch(*args, **kwargs)
+
+        monkeypatch.setattr(app.device_state, "record_switch", slow_record_switch)
+        thread = threading.Thread(target=app.playlist_controller.switch_program, args=("07",))
+        thread.start()
+        while not tbbox.pending_commands:
+            time.sleep(0.01)
+
+        app.request_shutdown()
+        app.cleanup()
+        thread.join()
+
+        assert json.loads(path.read_text())["program"] == "07"
+
+    def test_signal_handler_only_requests_shutdown(self):
+        app = TBBOXPlaylistSwitcher()
+        app.worker_pool = WorkerPool(lambda index, sock: None, 1, "127.0.0.1", 0)
+
+        app.signal_handler(15, None)
+        app.worker_pool.watch(interval=0.01)
+
+        assert app._stopping.is_set()
+
+
+_CHILD = """
+import os, sys
+sys.path.insert(0, {root!r})
+os.environ["LISTEN_PID"] = str(os.getpid())
+from src.utils import systemd
+sockets = systemd.listen_sockets()
+conn, _ = sockets[0].accept()
+conn.sendall(b"%d:%s" % (len(sockets), os.environ.get("LISTEN_FDS", "-").encode()))
+"""
+
+
+class TestSystemd:
+    """systemd連携のテスト"""
+
+    def test_listen_sockets_from_socket_activation(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        port = listener.getsockname()[1]
+
+        child = subprocess.Popen(
+            [sys.executable, "-c", _CHILD.format(root=str(Path(__file__).parent.parent))],
+            env=dict(os.environ, LISTEN_FDS="1"),
+            preexec_fn=lambda: os.dup2(listener.fileno(), systemd.LISTEN_FDS_START),
+            pass_fds=(systemd.LISTEN_FDS_START,)
+        )
+        listener.close()
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=10) as conn:
+                conn.settimeout(10)
+                assert conn.recv(64) == b"1:-"
+        finally:
+            child.wait(timeout=10)
+
+    def test_listen_sockets_for_other_process(self, monkeypatch):
+        monkeypatch.setenv("LISTEN_PID", str(os.getpid() + 1))
+        monkeypatch.setenv("LISTEN_FDS", "1")
+
+        assert systemd.listen_sockets() == []
+        assert "LISTEN_FDS" not in os.environ
+
+    def test_listen_sockets_without_activation(self, monkeypatch):
+        monkeypatch.delenv("LISTEN_PID", raising=False)
+        monkeypatch.delenv("LISTEN_FDS", raising=False)
+
+        assert systemd.listen_sockets() == []
+
+    def test_notify(self, tmp_path, monkeypatch):
+        path = tmp_path / "notify.sock"
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(str(path))
+        monkeypatch.setenv("NOTIFY_SOCKET", str(path))
+        try:
+            assert systemd.notify("READY=1") is True
+            assert receiver.recv(64) == b"READY=1"
+        finally:
+            receiver.close()
+
+        monkeypatch.delenv("NOTIFY_SOCKET")
+        assert systemd.notify("READY=1") is False
@@ -0,0 +1,335 @@
+"""
+並行処理のストレステスト
+
+実際のアプリケーション（HTTPServer → TBBOXPlaylistSwitcher → PlaylistController →
+TBBOXClient）に数百件のalertを同時に送り、シミュレータ（メモリ内接続）との通信を検査する
+"""
+import asyncio
+import gc
+import json
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+from benchmarks.bench_control_endpoint import make_scope
+from main import TBBOXPlaylistSwitcher
+from src.http.server import HTTPServer
+from src.mapper.switch_mapper import SwitchMapper
+from src.tbbox.client import TBBOXClient
+from src.tbbox.playlist import PlaylistController
+from src.tbbox.protocol import HEADER, frame_length
+from src.tbbox.rtt import RTTEstimator
+from src.tbbox.simulator import TBBOXSimulator
+from src.tbbox.state import DeviceStateSnapshot
+from src.tbbox.transport import MemoryConnection, MemoryTransport
+from src.utils.logger import logger
+from src.utils.stats import percentile
+
+# 同時に送るalertの件数
+CONCURRENT_ALERTS = 300
+
+# シミュレータの応答遅延（秒）
+LATENCY = 0.001
+
+# 16通りのスイッチパターン（"0000"～"1111"）
+ALERTS = [f"{i:04b}9999" for i in range(16)]
+
+
+class _CheckedConnection(MemoryConnection):
+    """
+    送受信の順序を検査するメモリ内接続
+
+    次のいずれかを検出するとviolationsに記録する
+    - 複数のスレッドが同時に送信した
+    - 前のコマンドの応答を受信する前に次のコマンドを送信した
+    - 応答のヘッダ（コマンド種別・アクション・シーケンス番号）が送信したコマンドと一致しない
+    """
+
+    def __init__(self, handler, latency: float, violations: List[str]):
+        super().__init__(handler, latency)
+        self.violations = violations
+        self._sending = threading.Lock()
+        self._awaiting: Optional[bytes] = None
+
+    def send(self, data: bytes) -> int:
+        if not self._sending.acquire(blocking=False):
+            self.violations.append("複数のスレッドが同時に送信しました")
+            return super().send(data)
+        try:
+            if self._awaiting is not None:
+                self.violations.append("応答を受信する前に次のコマンドを送信しました")
+            self._awaiting = bytes(data)
+            return super().send(data)
+        finally:
+            self._sending.release()
+
+    def recv(self, bufsize: int) -> bytes:
+        data = super().recv(bufsize)
+        if data and self._awaiting is not None:
+            request, self._awaiting = self._awaiting, None
+            if frame_length(request) is not None and frame_length(data) is not None:
+                sent = HEADER.unpack_from(request)
+                received = HEADER.unpack_from(data)
+                # (シーケンス番号, コマンド種別, アクション) を比較する
+                if (sent[1], sent[3], sent[4]) != (received[1], received[3], received[4]):
+                    self.violations.append(f"応答が送信したコマンドと一致しません: {received}")
+        return data
+
+
+class _CheckedTransport(MemoryTransport):
+    """_CheckedConnectionで接続するメモリ内トランスポート"""
+
+    def __init__(self, simulator: TBBOXSimulator):
+        super().__init__(simulator.session, latency=simulator.latency)
+        self.violations: List[str] = []
+
+    def open(self, timeout: Optional[float]) -> MemoryConnection:
+        connection = _CheckedConnection(self.handler_factory(), self.latency, self.violations)
+        connection.settimeout(timeout)
+        self.connections += 1
+        self.connection = connection
+        return connection
+
+
+class _Stack:
+    """シミュレータに接続したアプリケーション一式"""
+
+    def __init__(self):
+        self.simulator = TBBOXSimulator(latency=LATENCY)
+        self.transport = _CheckedTransport(self.simulator)
+
+        self.switcher = TBBOXPlaylistSwitcher()
+        self.switcher.switch_mapper = SwitchMapper()
+        client = TBBOXClient(transport=self.transport)
+        # 切断からの復旧を待つ時間を短くし、タイムアウトは発生させない
+        client.retry_delay = 0.01
+        client.resend_delay = 0.01
+        client.rtt = RTTEstimator(initial_timeout=2.0, min_timeout=2.0, max_timeout=2.0)
+        self.switcher.tbbox_client = client
+        self.switcher.playlist_controller = PlaylistController(
+            client, state=self.switcher.device_state, status_command=""
+        )
+
+        self.server = HTTPServer(
+            callback=self.switcher.on_alert_received,
+            status_snapshot=self.switcher.device_state
+        )
+        self.app = self.server.get_app()
+
+    def close(self) -> None:
+        self.switcher.tbbox_client.close()
+
+    async def request(self, alert: str, sim_id: str) -> Tuple[int, Dict[str, Any], float]:
+        """/api/control を呼び出して (ステータス, ボディ, 所要時間) を返す"""
+        status = 0
+        body = b""
+
+        async def receive() -> Dict[str, Any]:
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message: Dict[str, Any]) -> None:
+            nonlocal status, body
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                body += message.get("body", b"")
+
+        started = time.perf_counter()
+        query = f"alert={alert}&id={sim_id}".encode()
+        await self.app(make_scope(query), receive, send)
+        return status, json.loads(body), time.perf_counter() - started
+
+    async def storm(
+        self,
+        count: int,
+        disconnects: int = 0,
+        sim_ids: Optional[int] = None
+    ) -> List[Tuple[int, Dict[str, Any], float]]:
+        """
+        count件のalertを同時に送信
+
+        disconnects > 0 の場合は、送信中にcount/(disconnects+1)件ごとにシミュレータ側から切断させる
+        sim_idsを指定した場合は、その数のSIM IDに順番にalertを割り当てる（省略時は1件ごとに別のSIM ID）
+        """
+        start = self.simulator.commands
+        step = count // (disconnects + 1)
+
+        async def inject() -> None:
+            for n in range(1, disconnects + 1):
+                while self.simulator.commands < start + n * step:
+                    await asyncio.sleep(LATENCY)
+                self.simulator.inject("disconnect")
+
+        requests = [
+            self.request(ALERTS[i % len(ALERTS)], f"sim{i % (sim_ids or count)}") for i in range(count)
+        ]
+        results, _ = await asyncio.gather(asyncio.gather(*requests), inject())
+        return results
+
+    def assert_consistent(self) -> None:
+        """アプリケーションが記録した状態とシミュレータの状態が一致すること"""
+        state = self.switcher.device_state.get()
+        assert self.transport.violations == []
+        assert state["program"] is not None
+        assert state["program"] == self.simulator.program
+
+
+@pytest.fixture
+def stack():
+    stack = _Stack()
+    yield stack
+    stack.close()
+
+
+@pytest.fixture
+def quiet_logger():
+    level = logger.level
+    logger.setLevel("CRITICAL")
+    yield
+    logger.setLevel(level)
+
+
+class TestConcurrentAlerts:
+    """同時に受信したalertの処理のテスト"""
+
+    def test_commands_are_serialized(self, stack, quiet_logger, record_property):
+        started = time.perf_counter()
+        results = asyncio.run(stack.storm(CONCURRENT_ALERTS))
+        elapsed = time.perf_counter() - started
+
+        statuses = [status for status, _, _ in results]
+        assert statuses == [200] * CONCURRENT_ALERTS
+        # 各レスポンスは自身のalertのプログラムを返す
+        for i, (_, body, _) in enumerate(results):
+            assert body["program"] == f"{i % len(ALERTS) + 1:02d}"
+        assert stack.simulator.commands == CONCURRENT_ALERTS
+        assert stack.simulator.connections == 1
+        stack.assert_consistent()
+
+        throughput = CONCURRENT_ALERTS / elapsed
+        record_property("throughput_rps", round(throughput, 1))
+        print(f"\n{CONCURRENT_ALERTS}件: {elapsed:.2f}秒 ({throughput:.0f}件/秒)")
+
+    def test_disconnects_mid_stream(self, stack, quiet_logger):
+        disconnects = 5
+
+        results = asyncio.run(stack.storm(CONCURRENT_ALERTS, disconnects=disconnects))
+
+        # 切断されたコマンドは再接続して再送されるため、すべて成功する
+        assert [status for status, _, _ in results] == [200] * CONCURRENT_ALERTS
+        assert stack.simulator.connections == 1 + disconnects
+        assert stack.simulator.commands == CONCURRENT_ALERTS + disconnects
+        stack.assert_consistent()
+
+    def test_final_state_after_storm(self, stack, quiet_logger):
+        asyncio.run(stack.storm(CONCURRENT_ALERTS, disconnects=3))
+        stack.assert_consistent()
+
+        # 同時送信の後に単独で送ったalertが最終状態になる
+        status, body, _ = asyncio.run(stack.request("01019999", "last"))
+
+        assert status == 200
+        assert body["program"] == "06"
+        assert stack.simulator.program == "06"
+        assert stack.switcher.device_state.get()["program"] == "06"
+
+    @pytest.mark.parametrize("disconnects", [0, 3])
+    def test_last_alert_wins_for_same_sim_id(self, stack, quiet_logger, disconnects):
+        # 同じSIM IDに同時に届いたalertは受信順に切り替えられ、最後に送ったalertが最終状態になる
+        results = asyncio.run(stack.storm(CONCURRENT_ALERTS, disconnects=disconnects, sim_ids=1))
+
+        assert [status for status, _, _ in results] == [200] * CONCURRENT_ALERTS
+        last = f"{(CONCURRENT_ALERTS - 1) % len(ALERTS) + 1:02d}"
+        assert stack.simulator.program == last
+        stack.assert_consistent()
+
+    def test_slow_callbacks_do_not_reorder_same_sim_id(self, stack, quiet_logger):
+        # 先に受信したalertのコールバックが遅くても、後から受信したalertが追い越さない
+        callback = stack.server.callback
+
+        def slow_callback(alert: str):
+            if alert != ALERTS[-1]:
+                time.sleep(0.02)
+            return callback(alert)
+
+        stack.server.callback = slow_callback
+        results = asyncio.run(stack.storm(len(ALERTS), sim_ids=1))
+
+        assert [status for status, _, _ in results] == [200] * len(ALERTS)
+        assert stack.simulator.program == f"{len(ALERTS):02d}"
+        stack.assert_consistent()
+
+    def test_tail_latency_is_bounded(self, stack, quiet_logger, record_property):
+        results = asyncio.run(stack.storm(CONCURRENT_ALERTS, disconnects=3))
+        latencies = [latency for _, _, latency in results]
+
+        p50 = percentile(latencies, 50)
+        p99 = percentile(latencies, 99)
+        record_property("p50_ms", round(p50 * 1000, 1))
+        record_property("p99_ms", round(p99 * 1000, 1))
+
+        # コマンドは1件ずつ送信されるため、最後のalertは全件の送信を待つ
+        # 1件あたり応答遅延の20倍を上限とし、切断からの再接続・再送で止まり続けないことを確認する
+        assert p99 < CONCURRENT_ALERTS * LATENCY * 20
+        assert max(latencies) < CONCURRENT_ALERTS * LATENCY * 20
+
+
+class _SlowRecordState(DeviceStateSnapshot):
+    """切り替えの記録が遅れる状態スナップショット（記録順の入れ替わりを再現する）"""
+
+    def record_switch(self, program_id: str, timestamp: Optional[float] = None) -> None:
+        if program_id == "01":
+            time.sleep(0.05)
+        super().record_switch(program_id, timestamp)
+
+
+class TestStateOrdering:
+    """送信順と状態の記録順のテスト"""
+
+    def test_state_is_recorded_in_send_order(self, quiet_logger):
+        simulator = TBBOXSimulator()
+        client = TBBOXClient(transport=simulator.transport())
+        controller = PlaylistController(client, state=_SlowRecordState(), status_command="")
+        try:
+            first = threading.Thread(target=controller.switch_program, args=("01",))
+            first.start()
+            # 1件目の送信が終わり、記録を待っている間に2件目を送る
+            while simulator.commands < 1:
+                time.sleep(0.001)
+            controller.switch_program("02")
+            first.join()
+        finally:
+            controller.close()
+
+        assert simulator.program == "02"
+        assert controller.state.get()["program"] == "02"
+
+
+class TestMemory:
+    """メモリ使用量のテスト"""
+
+    def test_memory_is_bounded(self, stack, quiet_logger):
+        # 初回の送信でのみ確保されるもの（スレッドプール・キャッシュなど）を除外する
+        asyncio.run(stack.storm(CONCURRENT_ALERTS))
+        gc.collect()
+
+        tracemalloc.start()
+        try:
+            asyncio.run(stack.storm(CONCURRENT_ALERTS, disconnects=3))
+            gc.collect()
+            after_first, peak = tracemalloc.get_traced_memory()
+            asyncio.run(stack.storm(CONCURRENT_ALERTS, disconnects=3))
+            gc.collect()
+            after_second, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        # シミュレータは受信したコマンドをすべて保持するため、その分は増加を許容する
+        received = sum(len(data) + 64 for data in stack.simulator.received)
+        growth = after_second - after_first
+        assert peak < 20 * 1024 * 1024
+        assert growth < received + 256 * 1024
+        stack.assert_consistent()
@@ -6,6 +6,7 @@ from pathlib import Path
 import tempfile
 import json
 
+from src.mapper.layout import AlertLayout
 from src.mapper.switch_mapper import SwitchMapper
 
 
@@ -180,3 +181,85 @@ class TestSwitchMapperEdgeCases:
         # 変更しても元のマッピングに影響しない
         mapping1["0000"] = "XX"
         assert mapper.get_mapping()["0000"] == "01"
+
+
+class TestSwitchMapperLayout:
+    """スイッチ数・桁数を変更した場合のテスト"""
+
+    def test_eight_switches(self, tmp_path):
+        """8スイッチ・12桁のalertのテスト"""
+        mapper = SwitchMapper(
+            mapping_file=tmp_path / "none.json",
+            layout=AlertLayout(switch_count=8, alert_length=12)
+        )
+
+        assert len(mapper.get_mapping()) == 256
+        assert mapper.parse_alert("000000009999") == "01"
+        assert mapper.parse_alert("000000019999") == "02"
+        assert mapper.parse_alert("111111119999") == "256"
+        assert mapper.parse_alert("100000099999") == "129"  # 末尾の9はOFF
+        assert mapper.parse_alert("999999999999") is None
+        assert mapper.parse_alert("10109999") is None  # 桁数が異なる
+
+    def test_get_program_id_for_switches_variable_count(self):
+        mapper = SwitchMapper(layout=AlertLayout(switch_count=6, alert_length=8))
+
+        assert mapper.get_program_id_for_switches(0, 0, 0, 0, 1, 1) == "04"
+        assert mapper.get_program_id_for_switches(1, 0, 1, 0) is None
+
+    def test_dont_care_patterns(self, tmp_path):
+        """"x"を含むパターンが展開され、具体的なパターンが優先されることのテスト"""
+        path = tmp_path / "mapping.json"
+        path.write_text(json.dumps({"1xxx": "17", "11xx": "18", "1111": "19"}), encoding="utf-8")
+        mapper = SwitchMapper(mapping_file=path)
+
+        assert mapper.parse_alert("10009999") == "17"
+        assert mapper.parse_alert("10119999") == "17"
+        assert mapper.parse_alert("11009999") == "18"
+        assert mapper.parse_alert("11119999") == "19"
+        assert mapper.parse_alert("01119999") == "08"  # マッピングに無いパターン
+
+    def test_invalid_mapping_keys_are_ignored(self, tmp_path):
+        path = tmp_path / "mapping.json"
+        path.write_text(json.dumps({"101": "20", "1a10": "20", "1010": "05"}), encoding="utf-8")
+        mapper = SwitchMapper(mapping_file=path)
+
+        assert mapper.parse_alert("10109999") == "05"
+        assert mapper.parse_alert("01019999") == "06"
+
+
+class TestAlertLayout:
+    """AlertLayoutのテスト"""
+
+    def test_encode(self):
+        layout = AlertLayout()
+
+        assert layout.encode("1010") == (0b1010, 0b1111)
+        assert layout.encode("1091") == (0b1001, 0b1101)
+        assert layout.encode("9999") == (0, 0)
+        assert layout.encode("1xx0") == (0b1000, 0b1001)
+
+    def test_encode_invalid(self):
+        layout = AlertLayout()
+
+        with pytest.raises(ValueError):
+            layout.encode("101")
+        with pytest.raises(ValueError):
+            layout.encode("1021")
+
+    def test_validate(self):
+        layout = AlertLayout(switch_count=6, alert_length=10)
+
+        assert layout.validate("1010109999") is None
+        assert layout.validate(None) == "Parameter_not_found"
+        assert layout.validate("10109999") == "Invalid_parameter_length"
+        assert layout.validate("10101a9999") == "Parameter_contains_invalid_value"
+        assert layout.suffix == "9999"
+
+    def test_invalid_layout(self):
+        with pytest.raises(ValueError):
+            AlertLayout(switch_count=0)
+        with pytest.raises(ValueError):
+            AlertLayout(switch_count=17, alert_length=20)
+        with pytest.raises(ValueError):
+            AlertLayout(switch_count=8, alert_length=6)
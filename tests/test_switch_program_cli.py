@@ -0,0 +1,205 @@
+"""
+switch_program.py（TBBOX操作コマンドラインツール）のテスト
+"""
+import json
+import socket
+import threading
+
+import pytest
+
+import switch_program
+from config import settings
+from switch_program import Device, Operation
+
+
+class _RecordingServer:
+    """すべてのコマンドにOKを返し、受信したコマンドを記録するTCPサーバ"""
+
+    def __init__(self):
+        self.received = []
+        self.connections = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            with conn:
+                while True:
+                    data = conn.recv(1024)
+                    if not data:
+                        break
+                    self.received.append(data.hex())
+                    conn.send(b"OK")
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def servers():
+    started = [_RecordingServer() for _ in range(3)]
+    yield started
+    for server in started:
+        server.close()
+
+
+class TestParsing:
+    """引数・ファイルの解析のテスト"""
+
+    def test_parse_device(self):
+        assert switch_program.parse_device("10.0.0.5:16603") == Device("10.0.0.5", 16603)
+        assert switch_program.parse_device("10.0.0.5").port == settings.TBBOX_PORT
+        with pytest.raises(ValueError):
+            switch_program.parse_device("10.0.0.5:abc")
+
+    def test_build_plan_shared_value(self):
+        devices = [Device("a", 1), Device("b", 2)]
+        plan = switch_program.build_plan("switch", ["05"], devices)
+
+        assert plan == {
+            Device("a", 1): [Operation("switch", "05")],
+            Device("b", 2): [Operation("switch", "05")],
+        }
+
+    def test_build_plan_per_device_values(self):
+        devices = [Device("a", 1), Device("b", 2)]
+        plan = switch_program.build_plan("volume", ["30", "50"], devices)
+
+        assert plan[Device("b", 2)] == [Operation("volume", "50")]
+        with pytest.raises(ValueError):
+            switch_program.build_plan("volume", ["30", "50", "70"], devices)
+
+    @pytest.mark.parametrize("operation", [
+        Operation("switch", "99"),
+        Operation("volume", "150"),
+        Operation("volume", "loud"),
+        Operation("switch"),
+        Operation("jump"),
+    ])
+    def test_invalid_operation(self, operation):
+        with pytest.raises(ValueError):
+            switch_program.validate_operation(operation)
+
+    def test_load_batch(self, tmp_path):
+        path = tmp_path / "site.txt"
+        path.write_text(
+            "# サイトA\n"
+            "10.0.0.5 switch 05\n"
+            "10.0.0.5 volume 30  # 夜間\n"
+            "\n"
+            "10.0.0.6:16603 stop\n",
+            encoding="utf-8"
+        )
+
+        plan = switch_program.load_batch(str(path))
+
+        assert list(plan) == [Device("10.0.0.5", settings.TBBOX_PORT), Device("10.0.0.6", 16603)]
+        assert plan[Device("10.0.0.5", settings.TBBOX_PORT)] == [
+            Operation("switch", "05"), Operation("volume", "30")
+        ]
+
+    def test_load_batch_invalid_line(self, tmp_path):
+        path = tmp_path / "site.txt"
+        path.write_text("10.0.0.5 switch 05\n10.0.0.5 volume\n", encoding="utf-8")
+
+        with pytest.raises(ValueError, match="2行目"):
+            switch_program.load_batch(str(path))
+
+    def test_load_devices_with_login_command(self, tmp_path):
+        path = tmp_path / "devices.txt"
+        path.write_text("10.0.0.5\n10.0.0.6:16603 41564f4e\n", encoding="utf-8")
+
+        devices = switch_program.load_devices(str(path), login_command="default")
+
+        assert devices == [
+            Device("10.0.0.5", settings.TBBOX_PORT, "default"),
+            Device("10.0.0.6", 16603, "41564f4e"),
+        ]
+
+
+class TestRun:
+    """複数台への並行実行のテスト"""
+
+    def test_runs_each_device_over_one_connection(self, servers):
+        plan = {
+            Device("127.0.0.1", server.port): [
+                Operation("switch", "05"),
+                Operation("volume", "30"),
+                Operation("pause"),
+            ]
+            for server in servers
+        }
+
+        reports = switch_program.run_all(plan)
+
+        assert [r.device.port for r in reports] == [s.port for s in servers]
+        assert all(r.ok for r in reports)
+        for server, report in zip(servers, reports):
+            # ログイン + 3操作を1接続で送信
+            assert server.connections == 1
+            assert server.received == [
+                settings.LOGIN_COMMAND.lower(),
+                settings.PROGRAM_COMMANDS["05"].lower(),
+                settings.VOLUME_30_COMMAND.lower(),
+                settings.PAUSE_COMMAND.lower(),
+            ]
+            assert report.connect_ms is not None
+            assert [step["operation"] for step in report.steps] == ["switch 05", "volume 30", "pause"]
+
+    def test_runs_in_multiple_processes(self, servers):
+        plan = {
+            Device("127.0.0.1", server.port): [Operation("switch", "05"), Operation("stop")]
+            for server in servers
+        }
+
+        reports = switch_program.run_all(plan, processes=2)
+
+        assert [r.device.port for r in reports] == [s.port for s in servers]
+        assert all(r.ok for r in reports)
+        for server in servers:
+            assert server.connections == 1
+            assert server.received[1:] == [
+                settings.PROGRAM_COMMANDS["05"].lower(),
+                settings.STOP_COMMAND.lower(),
+            ]
+
+    def test_connect_failure_is_reported(self):
+        # 接続を受け付けないポート
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        report = switch_program.run_device(
+            Device("127.0.0.1", port), [Operation("stop")], retries=1
+        )
+
+        assert not report.ok
+        assert report.error == "connect_failed"
+        assert "connect_failed" in switch_program.format_report([report], 0.1)
+
+    def test_main_json_output(self, servers, capsys):
+        exit_code = switch_program.main([
+            "switch", "03",
+            "--device", f"127.0.0.1:{servers[0].port}",
+            "--device", f"127.0.0.1:{servers[1].port}",
+            "--json",
+        ])
+
+        assert exit_code == 0
+        output = json.loads(capsys.readouterr().out)
+        assert [d["ok"] for d in output["devices"]] == [True, True]
+        assert output["devices"][0]["steps"][0]["operation"] == "switch 03"
+
+    def test_main_rejects_invalid_program(self, capsys):
+        with pytest.raises(SystemExit) as exc_info:
+            switch_program.main(["switch", "99", "--device", "127.0.0.1:1"])
+        assert exc_info.value.code == 2
@@ -0,0 +1,207 @@
+"""
+時間帯ルールのテスト
+"""
+import json
+from datetime import datetime
+
+import pytest
+
+from main import TBBOXPlaylistSwitcher
+from src.mapper.switch_mapper import SwitchMapper
+from src.mapper.time_rules import RuleScheduler, TimeRule, TimeRuleTable
+
+# 2026-10-19は月曜日
+MONDAY = datetime(2026, 10, 19)
+
+
+def at(day: int, hour: int, minute: int = 0) -> datetime:
+    """月曜日からday日後の指定時刻"""
+    return MONDAY.replace(day=19 + day, hour=hour, minute=minute)
+
+
+def make_table(*entries) -> TimeRuleTable:
+    return TimeRuleTable([TimeRule.from_dict(entry) for entry in entries])
+
+
+NIGHT = {"pattern": "1111", "days": ["mon", "tue", "wed", "thu", "fri"],
+         "start": "22:00", "end": "06:00", "program": "17"}
+WEEKEND = {"pattern": "1111", "days": ["sat", "sun"], "start": "00:00", "end": "24:00", "program": "18"}
+
+
+class TestTimeRule:
+    """TimeRuleのテスト"""
+
+    def test_invalid_pattern(self):
+        with pytest.raises(ValueError):
+            TimeRule.from_dict({"pattern": "12", "start": "00:00", "end": "01:00", "program": "01"})
+
+    def test_invalid_day(self):
+        with pytest.raises(ValueError):
+            TimeRule.from_dict({**NIGHT, "days": ["xyz"]})
+
+    def test_invalid_time(self):
+        with pytest.raises(ValueError):
+            TimeRule.from_dict({**NIGHT, "start": "25:00"})
+
+    def test_overnight_interval_wraps_week(self):
+        """日曜日の夜から月曜日の朝にまたがる区間が分割されることのテスト"""
+        rule = TimeRule.from_dict({**NIGHT, "days": ["sun"]})
+        assert list(rule.intervals()) == [(6 * 1440 + 1320, 7 * 1440), (0, 360)]
+
+
+class TestTimeRuleTable:
+    """TimeRuleTableのテスト"""
+
+    def test_lookup_overnight(self):
+        table = make_table(NIGHT)
+
+        assert table.lookup("1111", at(0, 23)) == "17"
+        assert table.lookup("1111", at(1, 5, 59)) == "17"   # 月曜22時から続く
+        assert table.lookup("1111", at(1, 6)) is None
+        assert table.lookup("1111", at(0, 21, 59)) is None
+        assert table.lookup("0000", at(0, 23)) is None
+
+    def test_earlier_rule_has_priority(self):
+        """重なる区間では先に書かれたルールが優先されることのテスト"""
+        table = make_table(NIGHT, WEEKEND)
+
+        # 金曜22時からのルールが土曜6時まで優先される
+        assert table.lookup("1111", at(5, 3)) == "17"
+        assert table.lookup("1111", at(5, 7)) == "18"
+
+    def test_any_pattern(self):
+        table = make_table(
+            NIGHT,
+            {"pattern": "*", "start": "02:00", "end": "05:00", "program": "20"}
+        )
+
+        assert table.lookup("0000", at(2, 3)) == "20"
+        # パターン指定のルールが優先される
+        assert table.lookup("1111", at(2, 3)) == "17"
+        assert table.lookup("0000", at(2, 6)) is None
+
+    def test_next_boundary(self):
+        table = make_table(NIGHT)
+
+        assert table.next_boundary(at(0, 12, 30)) == at(0, 22)
+        assert table.next_boundary(at(0, 22)) == at(1, 6)
+        # 金曜22時の次は土曜6時、その次は翌週月曜22時
+        assert table.next_boundary(at(4, 23)) == at(5, 6)
+        assert table.next_boundary(at(5, 7)) == datetime(2026, 10, 26, 22, 0)
+
+    def test_empty_table(self):
+        table = make_table()
+        assert table.lookup("1111", at(0, 0)) is None
+        assert table.next_boundary(at(0, 0)) is None
+
+    def test_from_file(self, tmp_path):
+        path = tmp_path / "rules.json"
+        path.write_text(json.dumps({"rules": [NIGHT, WEEKEND]}), encoding="utf-8")
+
+        table = TimeRuleTable.from_file(path)
+        assert len(table) == 2
+        assert table.lookup("1111", at(6, 12)) == "18"
+
+
+class TestSwitchMapperTimeRules:
+    """SwitchMapperと時間帯ルールの連携テスト"""
+
+    @pytest.fixture
+    def mapper(self, tmp_path):
+        path = tmp_path / "rules.json"
+        path.write_text(json.dumps({"rules": [NIGHT]}), encoding="utf-8")
+        return SwitchMapper(rules_file=path)
+
+    def test_rule_overrides_mapping(self, mapper):
+        assert mapper.parse_alert("11119999", now=at(0, 23)) == "17"
+        assert mapper.parse_alert("11119999", now=at(0, 12)) == "16"
+        assert mapper.parse_alert("10109999", now=at(0, 23)) == "11"
+
+    def test_invalid_rules_file_is_ignored(self, tmp_path):
+        path = tmp_path / "rules.json"
+        path.write_text("{invalid", encoding="utf-8")
+
+        mapper = SwitchMapper(rules_file=path)
+        assert mapper.time_rules is None
+        assert mapper.parse_alert("11119999", now=at(0, 23)) == "16"
+
+    def test_reevaluate_at_boundary(self, mapper):
+        """境界時刻にプログラムが変わる場合のみ再評価結果を返すことのテスト"""
+        mapper.parse_alert("11119999", now=at(0, 12))
+        mapper.record_switch("16")
+
+        assert mapper.reevaluate(at(0, 22)) == "17"
+        mapper.record_switch("17")
+        assert mapper.reevaluate(at(0, 22)) is None
+        assert mapper.reevaluate(at(1, 6)) == "16"
+
+    def test_scheduler_triggers_switch(self, mapper):
+        switched = []
+
+        def switch(program):
+            switched.append(program)
+            return True
+
+        scheduler = RuleScheduler(
+            mapper.time_rules, mapper.reevaluate, switch, on_switched=mapper.record_switch
+        )
+        mapper.parse_alert("11119999", now=at(0, 12))
+        mapper.record_switch("16")
+
+        assert scheduler.evaluate(at(0, 22)) == "17"
+        assert scheduler.evaluate(at(0, 22)) is None
+        assert switched == ["17"]
+        assert scheduler.triggered == 1
+
+    def test_failed_switch_is_retried(self, mapper):
+        """切り替えに失敗したプログラムは記録せず、次の再評価で再度切り替えることのテスト"""
+        results = [False, True]
+        switched = []
+
+        def switch(program):
+            switched.append(program)
+            return results.pop(0)
+
+        scheduler = RuleScheduler(
+            mapper.time_rules, mapper.reevaluate, switch, on_switched=mapper.record_switch
+        )
+        # alertによる切り替えも失敗した場合はlast_programを更新しない
+        assert mapper.parse_alert("11119999", now=at(0, 12)) == "16"
+        assert mapper.last_program is None
+
+        assert scheduler.evaluate(at(0, 22)) == "17"
+        assert mapper.last_program is None
+        assert scheduler.evaluate(at(0, 23)) == "17"
+        assert mapper.last_program == "17"
+        assert scheduler.evaluate(at(0, 23)) is None
+        assert switched == ["17", "17"]
+
+    def test_alert_records_program_only_on_success(self, mapper):
+        """alertによる切り替えが成功した場合のみlast_programを更新することのテスト"""
+        results = [False, True]
+
+        class _Controller:
+            def switch_program(self, program_id, deadline=None):
+                return results.pop(0)
+
+        switcher = TBBOXPlaylistSwitcher()
+        switcher.switch_mapper = mapper
+        switcher.playlist_controller = _Controller()
+
+        assert not switcher.on_alert_received("11119999")
+        assert mapper.last_pattern == "1111"
+        assert mapper.last_program is None
+
+        assert switcher.on_alert_received("11119999")
+        assert mapper.last_program in ("16", "17")
+
+    def test_scheduler_waits_for_boundary(self, mapper):
+        """スケジューラスレッドが境界時刻まで待機して停止できることのテスト"""
+        scheduler = RuleScheduler(
+            mapper.time_rules, mapper.reevaluate, lambda program: None,
+            clock=lambda: at(0, 12)
+        )
+        scheduler.start()
+        scheduler.stop()
+
+        assert scheduler.triggered == 0
@@ -0,0 +1,259 @@
+"""
+リクエストトレース（Server-Timing・X-Request-ID・ログへのリクエストID付与）のテスト
+"""
+import io
+import logging
+import re
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from main import TBBOXPlaylistSwitcher
+from src.http.idempotency import IdempotencyCache
+from src.http.lean import LeanControlApp
+from src.http.rate_limit import TokenBucketLimiter
+from src.http.server import HTTPServer
+from src.mapper.switch_mapper import SwitchMapper
+from src.tbbox.client import TBBOXClient
+from src.tbbox.playlist import PlaylistController
+from src.tbbox.rtt import RTTEstimator
+from src.tbbox.simulator import TBBOXSimulator
+from src.utils.logger import logger
+from src.utils.trace import RequestIdFilter, RequestTrace, current_trace, trace_scope, traced
+
+
+def _timings(header: str) -> dict:
+    """Server-Timingヘッダを {名前: (ミリ秒, desc)} に変換"""
+    timings = {}
+    for entry in header.split(", "):
+        name, *params = entry.split(";")
+        values = dict(param.split("=", 1) for param in params)
+        timings[name] = (float(values["dur"]), values.get("desc", "").strip('"'))
+    return timings
+
+
+class TestRequestTrace:
+    """RequestTraceクラスのテスト"""
+
+    def test_request_id_is_generated(self):
+        first = RequestTrace()
+        second = RequestTrace()
+
+        assert re.fullmatch(r"[0-9a-f]{32}", first.request_id)
+        assert first.request_id != second.request_id
+
+    def test_supplied_request_id_is_kept(self):
+        assert RequestTrace("linkbase-42:a.b").request_id == "linkbase-42:a.b"
+
+    @pytest.mark.parametrize("request_id", ["", "has space", "a\r\nInjected: 1", "x" * 65, "日本語"])
+    def test_invalid_request_id_is_replaced(self, request_id):
+        assert RequestTrace(request_id).request_id != request_id
+
+    def test_stages_are_accumulated(self):
+        trace = RequestTrace()
+        trace.add("tbbox", 0.010)
+        trace.add("tbbox", 0.005)
+        trace.add("validate", 0.0001)
+
+        timings = _timings(trace.server_timing())
+
+        assert list(timings) == ["validate", "tbbox", "total"]
+        assert timings["tbbox"][0] == pytest.approx(15.0)
+        assert timings["validate"][0] == pytest.approx(0.1)
+
+    def test_retry_count(self):
+        trace = RequestTrace()
+        trace.retries = 2
+        trace.add("retry", 0.002)
+
+        assert _timings(trace.server_timing())["retry"] == (2.0, "2")
+
+    def test_headers(self):
+        trace = RequestTrace("req-1")
+
+        headers = dict(trace.headers())
+
+        assert headers["X-Request-ID"] == "req-1"
+        assert headers["Server-Timing"].startswith("total;dur=")
+
+
+class TestTraceScope:
+    """トレースの伝播のテスト"""
+
+    def test_traced_outside_request_is_noop(self):
+        with traced("tbbox"):
+            pass
+
+        assert current_trace() is None
+
+    def test_scope(self):
+        trace = RequestTrace()
+
+        with trace_scope(trace):
+            assert current_trace() is trace
+            with traced("map"):
+                pass
+
+        assert current_trace() is None
+        assert "map" in trace.durations
+
+    def test_log_filter(self):
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.addFilter(RequestIdFilter())
+        handler.setFormatter(logging.Formatter("%(request_tag)s%(message)s"))
+        test_logger = logging.getLogger("test_trace")
+        test_logger.addHandler(handler)
+        test_logger.propagate = False
+        try:
+            test_logger.warning("outside")
+            with trace_scope(RequestTrace("req-9")):
+                test_logger.warning("inside")
+        finally:
+            test_logger.removeHandler(handler)
+
+        assert stream.getvalue().splitlines() == ["outside", "[req-9] inside"]
+
+
+@pytest.fixture
+def app_log():
+    """アプリケーションのロガーの出力（アプリケーションのフォーマット）"""
+    stream = io.StringIO()
+    handler = logger.handlers[0]
+    saved = handler.setStream(stream)
+    yield stream
+    handler.setStream(saved)
+
+
+@pytest.fixture
+def simulator():
+    return TBBOXSimulator()
+
+
+@pytest.fixture
+def server(simulator):
+    switcher = TBBOXPlaylistSwitcher()
+    switcher.switch_mapper = SwitchMapper()
+    client = TBBOXClient(transport=simulator.transport())
+    client.resend_delay = 0.01
+    client.rtt = RTTEstimator(initial_timeout=0.2, min_timeout=0.2, max_timeout=0.2)
+    switcher.tbbox_client = client
+    switcher.playlist_controller = PlaylistController(
+        client, state=switcher.device_state, status_command=""
+    )
+    yield HTTPServer(callback=switcher.on_alert_received, idempotency=IdempotencyCache())
+    client.close()
+
+
+class TestControlEndpoint:
+    """/api/control のServer-Timing・X-Request-IDヘッダのテスト"""
+
+    def test_stages(self, server):
+        client = TestClient(server.get_app())
+
+        response = client.get("/api/control?alert=10109999&id=sim")
+
+        assert response.status_code == 200
+        timings = _timings(response.headers["Server-Timing"])
+        # 初回は接続・ログインしてから送信する
+        assert list(timings) == ["validate", "map", "queue", "connect", "tbbox", "total"]
+        assert timings["total"][0] >= timings["tbbox"][0] + timings["connect"][0]
+
+        response = client.get("/api/control?alert=01109999&id=sim")
+
+        assert list(_timings(response.headers["Server-Timing"])) == [
+            "validate", "map", "queue", "tbbox", "total"
+        ]
+
+    def test_retries(self, server, simulator):
+        client = TestClient(server.get_app())
+        client.get("/api/control?alert=10109999")
+        simulator.inject("drop")
+
+        response = client.get("/api/control?alert=01109999")
+
+        assert response.status_code == 200
+        timings = _timings(response.headers["Server-Timing"])
+        assert timings["retry"][1] == "1"
+        # 応答が無かった1回目の待ち時間（200ms）を含む
+        assert timings["tbbox"][0] >= 200
+
+    def test_invalid_alert_has_headers(self, server):
+        response = TestClient(server.get_app()).get("/api/control?alert=123")
+
+        assert response.status_code == 400
+        assert list(_timings(response.headers["Server-Timing"])) == ["validate", "total"]
+        assert response.headers["X-Request-ID"]
+
+    def test_rate_limit_has_own_stage(self, server):
+        """レート制限の確認はvalidateに含めず、ratelimitとして出力することのテスト"""
+
+        class _SlowLimiter(TokenBucketLimiter):
+            def acquire(self, *keys):
+                time.sleep(0.05)
+                return super().acquire(*keys)
+
+        server.rate_limiter = _SlowLimiter(rate=0.5, burst=1)
+        client = TestClient(server.get_app())
+
+        response = client.get("/api/control?alert=10109999&id=sim")
+
+        timings = _timings(response.headers["Server-Timing"])
+        assert list(timings)[:3] == ["validate", "ratelimit", "map"]
+        assert timings["ratelimit"][0] >= 50
+        assert timings["validate"][0] < 50
+
+        response = client.get("/api/control?alert=01109999&id=sim")
+
+        assert response.status_code == 429
+        assert list(_timings(response.headers["Server-Timing"])) == ["validate", "ratelimit", "total"]
+
+    def test_request_id_in_logs(self, server, app_log):
+        client = TestClient(server.get_app())
+
+        response = client.get("/api/control?alert=10109999", headers={"X-Request-ID": "lb-0001"})
+
+        assert response.headers["X-Request-ID"] == "lb-0001"
+        lines = [line for line in app_log.getvalue().splitlines() if line]
+        assert lines
+        assert all(" - [lb-0001] " in line for line in lines)
+
+    def test_request_id_in_thread_pool_logs(self, server, app_log):
+        """スレッドプールで実行されるTBBOXとの通信のログにもリクエストIDが付くことのテスト"""
+        client = TestClient(server.get_app())
+
+        response = client.get("/api/control?alert=10109999")
+
+        request_id = response.headers["X-Request-ID"]
+        assert f"[{request_id}] TBBOXへのログインに成功しました" in app_log.getvalue()
+
+    def test_background_logs_have_no_request_id(self, app_log):
+        thread = threading.Thread(target=logger.info, args=("background",))
+        thread.start()
+        thread.join()
+
+        assert " - INFO - background" in app_log.getvalue()
+
+    def test_duplicate_request(self, server, simulator):
+        """再送リクエストは自身のリクエストIDを返し、TBBOXとの通信時間を含まないことのテスト"""
+        client = TestClient(server.get_app())
+        headers = {"Idempotency-Key": "k1"}
+        first = client.get("/api/control?alert=10109999", headers=headers)
+
+        second = client.get("/api/control?alert=10109999", headers=headers)
+
+        assert second.json() == first.json()
+        assert second.headers["X-Request-ID"] != first.headers["X-Request-ID"]
+        assert "tbbox" not in _timings(second.headers["Server-Timing"])
+        assert simulator.commands == 1
+
+    def test_lean_control(self, server):
+        client = TestClient(LeanControlApp(server))
+
+        response = client.get("/api/control?alert=10109999", headers={"X-Request-ID": "lean-1"})
+
+        assert response.status_code == 200
+        assert response.headers["X-Request-ID"] == "lean-1"
+        assert "tbbox" in _timings(response.headers["Server-Timing"])
@@ -0,0 +1,259 @@
+"""
+トランスポート（TCP・Unixドメインソケット・メモリ内）とシミュレータのテスト
+"""
+import socket
+import time
+
+import pytest
+
+from config import settings
+from src.tbbox.client import TBBOXClient
+from src.tbbox.playlist import PlaylistController
+from src.tbbox.protocol import decode_response, encode_command
+from src.tbbox.simulator import TBBOXSimulator
+from src.tbbox.transport import (
+    MemoryConnection,
+    MemoryTransport,
+    TCPTransport,
+    UnixTransport,
+    create_transport,
+)
+
+
+class TestMemoryConnection:
+    """メモリ内接続のソケット互換動作のテスト"""
+
+    def test_reply_is_received(self):
+        connection = MemoryConnection(lambda data: data.upper())
+        connection.settimeout(1)
+
+        assert connection.send(b"abc") == 3
+        assert connection.recv(1024) == b"ABC"
+
+    def test_recv_respects_bufsize(self):
+        connection = MemoryConnection(lambda data: data)
+        connection.send(b"abcdef")
+
+        assert connection.recv(4) == b"abcd"
+        assert connection.recv(4) == b"ef"
+
+    def test_no_reply_times_out(self):
+        connection = MemoryConnection(lambda data: None)
+        connection.settimeout(0.05)
+        connection.send(b"abc")
+
+        with pytest.raises(socket.timeout):
+            connection.recv(1024)
+
+    def test_nonblocking_recv(self):
+        connection = MemoryConnection(lambda data: None)
+        connection.setblocking(False)
+
+        with pytest.raises(BlockingIOError):
+            connection.recv(1024)
+
+    def test_latency_longer_than_timeout_arrives_late(self):
+        connection = MemoryConnection(lambda data: b"late", latency=0.1)
+        connection.settimeout(0.02)
+        connection.send(b"abc")
+
+        with pytest.raises(socket.timeout):
+            connection.recv(1024)
+        time.sleep(0.1)
+        assert connection.recv(1024) == b"late"
+
+    def test_peer_disconnect(self):
+        def handler(data):
+            raise ConnectionResetError("bye")
+
+        connection = MemoryConnection(handler)
+        with pytest.raises(ConnectionResetError):
+            connection.send(b"abc")
+        assert connection.recv(1024) == b""
+        with pytest.raises(BrokenPipeError):
+            connection.send(b"abc")
+
+
+class TestTransports:
+    """トランスポートの作成と接続のテスト"""
+
+    def test_tcp_options_are_applied(self):
+        simulator = TBBOXSimulator()
+        host, port = simulator.serve_tcp()
+        try:
+            sock = TCPTransport(host, port, nodelay=True, keepalive=True, keepalive_idle=30).open(1)
+            try:
+                assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+                assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+                if hasattr(socket, "TCP_KEEPIDLE"):
+                    assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE) == 30
+            finally:
+                sock.close()
+        finally:
+            simulator.stop()
+
+    def test_create_transport_from_settings(self, monkeypatch):
+        monkeypatch.setattr(settings, "TBBOX_UNIX_SOCKET", "")
+        transport = create_transport("10.0.0.5", 16603)
+        assert isinstance(transport, TCPTransport)
+        assert transport.label == "10.0.0.5:16603"
+
+        monkeypatch.setattr(settings, "TBBOX_UNIX_SOCKET", "/tmp/tbbox.sock")
+        transport = create_transport("10.0.0.5", 16603)
+        assert isinstance(transport, UnixTransport)
+        assert transport.label == "unix:/tmp/tbbox.sock"
+
+    def test_memory_transport_creates_handler_per_connection(self):
+        transport = MemoryTransport(lambda: (lambda data: data))
+
+        first = transport.open(1)
+        second = transport.open(1)
+
+        assert transport.connections == 2
+        assert transport.connection is second
+        assert first is not second
+
+
+class TestClientOverTransports:
+    """TBBOXClientを各トランスポートでシミュレータに接続するテスト"""
+
+    def _switch_and_query(self, client, simulator):
+        controller = PlaylistController(client, status_command="")
+        try:
+            assert client.connect()
+            assert controller.switch_program("05")
+            assert simulator.program == "05"
+            assert controller.set_volume(30)
+            assert simulator.volume == 30
+            assert controller.pause()
+            assert simulator.playing is False
+        finally:
+            client.close()
+
+    def test_memory_transport(self):
+        simulator = TBBOXSimulator()
+        client = TBBOXClient(transport=simulator.transport())
+
+        self._switch_and_query(client, simulator)
+        assert simulator.logins == 1
+
+    def test_unix_transport(self, tmp_path):
+        simulator = TBBOXSimulator()
+        path = simulator.serve_unix(tmp_path / "tbbox.sock")
+        try:
+            self._switch_and_query(TBBOXClient(transport=UnixTransport(path)), simulator)
+        finally:
+            simulator.stop()
+        assert not path.exists()
+
+    def test_tcp_transport(self):
+        simulator = TBBOXSimulator()
+        host, port = simulator.serve_tcp()
+        try:
+            self._switch_and_query(TBBOXClient(host, port), simulator)
+        finally:
+            simulator.stop()
+
+    def test_status_query_returns_state(self):
+        simulator = TBBOXSimulator()
+        client = TBBOXClient(transport=simulator.transport())
+        simulator.program = "03"
+        simulator.playing = True
+        try:
+            result = client.execute(
+                "41564f4e0200000051521e00010400000000000000000000", max_retry=1
+            )
+        finally:
+            client.close()
+
+        assert result.ok
+        assert result.payload["program"] == "03"
+        assert result.payload["playing"] is True
+
+    def test_wrong_login_is_rejected(self):
+        simulator = TBBOXSimulator(login_command="42424242")
+        client = TBBOXClient(transport=simulator.transport())
+        client.max_retry = 1
+
+        assert not client.connect()
+        assert simulator.logins == 0
+
+
+class TestSimulatorFaults:
+    """シミュレータの故障注入のテスト"""
+
+    def _client(self, simulator):
+        client = TBBOXClient(transport=simulator.transport())
+        client.rtt.min_timeout = client.rtt.rto = 0.05
+        return client
+
+    def test_reject(self):
+        simulator = TBBOXSimulator()
+        simulator.inject("reject")
+        client = self._client(simulator)
+        try:
+            result = client.execute(settings.PROGRAM_COMMANDS["01"], max_retry=3)
+        finally:
+            client.close()
+
+        assert result.error == "rejected"
+        assert simulator.commands == 1
+
+    def test_drop_is_retried(self, monkeypatch):
+        monkeypatch.setattr("src.tbbox.client.time.sleep", lambda seconds: None)
+        simulator = TBBOXSimulator()
+        simulator.inject("drop")
+        client = self._client(simulator)
+        try:
+            assert client.execute(settings.PROGRAM_COMMANDS["02"], max_retry=3)
+        finally:
+            client.close()
+
+        assert simulator.commands == 2
+        assert simulator.program == "02"
+
+    def test_disconnect_reconnects(self, monkeypatch):
+        monkeypatch.setattr("src.tbbox.client.time.sleep", lambda seconds: None)
+        simulator = TBBOXSimulator()
+        simulator.inject("disconnect")
+        transport = simulator.transport()
+        client = TBBOXClient(transport=transport)
+        try:
+            assert client.execute(settings.PROGRAM_COMMANDS["04"], max_retry=3)
+        finally:
+            client.close()
+
+        assert transport.connections == 2
+        assert simulator.logins == 2
+        assert simulator.program == "04"
+
+    def test_disconnect_is_notified_once(self, monkeypatch):
+        monkeypatch.setattr("src.tbbox.client.time.sleep", lambda seconds: None)
+        simulator = TBBOXSimulator()
+        simulator.inject("disconnect")
+        client = TBBOXClient(transport=simulator.transport())
+        events = []
+        client.add_connection_listener(events.append)
+        try:
+            assert client.execute(settings.PROGRAM_COMMANDS["04"], max_retry=3)
+        finally:
+            client.close()
+            client.close()
+
+        # 送受信エラー後の再接続・二重のclose()で切断を重複して通知しない
+        assert events == [True, False, True, False]
+
+    def test_unknown_fault(self):
+        with pytest.raises(ValueError):
+            TBBOXSimulator().inject("explode")
+
+    def test_response_frames_decode(self):
+        simulator = TBBOXSimulator()
+        handle = simulator.session()
+        handle(encode_command(settings.LOGIN_COMMAND))
+
+        result = decode_response(handle(encode_command(settings.PROGRAM_COMMANDS["07"])))
+
+        assert result.ok
+        assert result.command == 0x001E
+        assert result.action == 0x0409